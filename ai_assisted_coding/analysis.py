@@ -1,8 +1,11 @@
 from __future__ import annotations
 
 from dataclasses import dataclass
+from itertools import islice
 from statistics import mean
-from typing import Any, Dict, List, Optional, Tuple
+from typing import Any, Dict, Iterable, List, Optional, Sequence, Tuple, Union
+
+from record import METRICS, VESSELS, PatientRecord
 
 
 @dataclass(frozen=True)
@@ -42,10 +45,56 @@ def _stats(values: List[float]) -> Optional[StatTriple]:
     return StatTriple(min=min(values), max=max(values), mean=mean(values))
 
 
-def analyze(data: Dict[str, Any]) -> Dict[str, Any]:
+def _notes(highest_psv_vessel: Optional[str], ratio_val: Optional[float], has_imt: bool) -> List[str]:
+    notes: List[str] = []
+    if highest_psv_vessel:
+        notes.append(f"Highest PSV observed in: {highest_psv_vessel}.")
+    if ratio_val is not None:
+        notes.append(f"ICA/CCA PSV ratio (echoed): {ratio_val:.2f}.")
+    if has_imt:
+        notes.append("IMT values summarized descriptively (no thresholds applied).")
+    return notes
+
+
+def _exact_mean(values: List[float]) -> float:
+    """``statistics.mean`` of floats (exact sum, one rounding) without going through ``Fraction``."""
+    ratios = [v.as_integer_ratio() for v in values]
+    den = max(d for _, d in ratios)  # all powers of two
+    return sum(n * (den // d) for n, d in ratios) / (den * len(values))
+
+
+def _analyze_record(rec: PatientRecord) -> Dict[str, Any]:
+    """``analyze`` of a compact record, read straight from its value array."""
+    m = rec.metrics
+    n_metrics = len(METRICS)
+    triples: List[Optional[Dict[str, float]]] = []
+    for mi in range(n_metrics):
+        vals = [v for v in m[mi::n_metrics] if v == v]
+        triples.append({"min": min(vals), "max": max(vals), "mean": _exact_mean(vals)} if vals else None)
+    highest_psv_vessel = None
+    best = None
+    for vessel, v in zip(VESSELS, m[::n_metrics]):
+        if v == v and (best is None or v > best):
+            highest_psv_vessel, best = vessel, v
+    ratio = rec.ratio
+    ratio_val = None if ratio != ratio else ratio
+    return {
+        "psv": triples[0],
+        "edv": triples[1],
+        "imt": triples[2],
+        "highest_psv_vessel": highest_psv_vessel,
+        "ica_cca_ratio": ratio_val,
+        "notes": _notes(highest_psv_vessel, ratio_val, triples[2] is not None),
+    }
+
+
+def analyze(data: Union[Dict[str, Any], PatientRecord]) -> Dict[str, Any]:
     """
     Produce a purely descriptive analysis of PSV/EDV/IMT across available vessels.
 
+    ``data`` is one input record or its ``record.PatientRecord``; compact
+    records are analyzed from their value array without building dicts.
+
     Returns:
         Dict containing:
         - 'psv': StatTriple as dict or None
@@ -55,6 +104,10 @@ def analyze(data: Dict[str, Any]) -> Dict[str, Any]:
         - 'ica_cca_ratio': float or None
         - 'notes': short descriptive bullet points
     """
+    if type(data) is PatientRecord:
+        if data.compact:
+            return _analyze_record(data)
+        data = data.to_dict()
     vitals = data.get("vitals", {})
     psv_pairs = _collect_metric(vitals, "psv_cm_s")
     edv_pairs = _collect_metric(vitals, "edv_cm_s")
@@ -78,13 +131,7 @@ def analyze(data: Dict[str, Any]) -> Dict[str, Any]:
     def triple_to_dict(t: Optional[StatTriple]) -> Optional[Dict[str, float]]:
         return None if t is None else {"min": t.min, "max": t.max, "mean": t.mean}
 
-    notes: List[str] = []
-    if highest_psv_vessel:
-        notes.append(f"Highest PSV observed in: {highest_psv_vessel}.")
-    if ratio_val is not None:
-        notes.append(f"ICA/CCA PSV ratio (echoed): {ratio_val:.2f}.")
-    if imt_stats is not None:
-        notes.append("IMT values summarized descriptively (no thresholds applied).")
+    notes = _notes(highest_psv_vessel, ratio_val, imt_stats is not None)
 
     return {
         "psv": triple_to_dict(psv_stats),
@@ -94,3 +141,90 @@ def analyze(data: Dict[str, Any]) -> Dict[str, Any]:
         "ica_cca_ratio": ratio_val,
         "notes": notes,
     }
+
+
+class BatchAnalysis(Sequence[Dict[str, Any]]):
+    """
+    Result of ``analyze_batch``: a sequence whose item ``i`` equals ``analyze(records[i])``.
+
+    The numbers live in NumPy arrays (``stats``, see ``columnar.CohortStats``);
+    the per-patient dict is only built when an item is accessed, so vectorized
+    consumers never pay for millions of small dicts.
+    """
+
+    def __init__(self, stats: Any, scalar: Dict[int, Dict[str, Any]]) -> None:
+        self.stats = stats
+        self._scalar = scalar
+
+    def __len__(self) -> int:
+        return len(self.stats.ratio)
+
+    def __getitem__(self, i):  # type: ignore[override]
+        if isinstance(i, slice):
+            return [self[j] for j in range(*i.indices(len(self)))]
+        if i < 0:
+            i += len(self)
+        if not 0 <= i < len(self):
+            raise IndexError(i)
+        if i in self._scalar:
+            return self._scalar[i]
+        st = self.stats
+        count = st.count[i].tolist()
+        lo, hi, mu = st.minimum[i].tolist(), st.maximum[i].tolist(), st.mean[i].tolist()
+        triples = [
+            {"min": lo[m], "max": hi[m], "mean": mu[m]} if count[m] else None for m in range(3)
+        ]
+        vessel_idx = int(st.highest_psv[i])
+        highest_psv_vessel = VESSELS[vessel_idx] if vessel_idx >= 0 else None
+        ratio = float(st.ratio[i])
+        ratio_val = None if ratio != ratio else ratio
+
+        notes = _notes(highest_psv_vessel, ratio_val, triples[2] is not None)
+
+        return {
+            "psv": triples[0],
+            "edv": triples[1],
+            "imt": triples[2],
+            "highest_psv_vessel": highest_psv_vessel,
+            "ica_cca_ratio": ratio_val,
+            "notes": notes,
+        }
+
+    def __eq__(self, other: object) -> bool:
+        if isinstance(other, (list, tuple, BatchAnalysis)):
+            return len(self) == len(other) and all(a == b for a, b in zip(self, other))
+        return NotImplemented
+
+
+def analyze_batch(records: Iterable[Union[Dict[str, Any], PatientRecord]]) -> BatchAnalysis:
+    """
+    Analyze many records at once; ``analyze_batch(rs)[i] == analyze(rs[i])`` for every record.
+
+    Records are converted into columnar NumPy arrays (patient x vessel x
+    metric, NaN for missing values such as ECA IMT) and min/max/mean and the
+    highest-PSV vessel are computed with vectorized reductions. Means are
+    correctly rounded exactly like ``statistics.mean``. The rare records the
+    columnar layout cannot represent exactly (unknown vessels, non-finite values,
+    PSV ties) are analyzed with ``analyze`` up front.
+
+    ``records`` may be any iterable of dicts or ``PatientRecord``, e.g.
+    ``ingest.iter_records`` output; it is consumed in fixed-size chunks, so only the compact per-patient arrays are
+    kept, never the records themselves.
+
+    Requires NumPy.
+    """
+    from columnar import CHUNK, concat_stats, reduce_columns, to_columns
+
+    parts = []
+    scalar: Dict[int, Dict[str, Any]] = {}
+    offset = 0
+    it = iter(records)
+    while chunk := list(islice(it, CHUNK)):
+        stats = reduce_columns(to_columns(chunk))
+        for i in stats.fallback.nonzero()[0]:
+            scalar[offset + int(i)] = analyze(chunk[int(i)])
+        parts.append(stats)
+        offset += len(chunk)
+    if not parts:
+        parts.append(reduce_columns(to_columns([])))
+    return BatchAnalysis(concat_stats(parts), scalar)
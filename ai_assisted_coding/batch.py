@@ -0,0 +1,453 @@
+from __future__ import annotations
+
+import itertools
+import multiprocessing
+import os
+import re
+import sys
+import time
+from dataclasses import asdict, dataclass, field, replace
+from multiprocessing.connection import Connection, wait
+from multiprocessing.context import BaseContext
+from pathlib import Path
+from typing import TYPE_CHECKING, Any, Dict, Iterable, Iterator, List, Optional, TextIO, Tuple, Union
+
+import instrument
+from instrument import current_rss_bytes
+from ingest import Record, iter_records
+from main import TEMPLATE_NAME, _write_json, render_artifacts, write_report
+from pdf_engine import PdfEngine, create_engine
+from render_cache import RenderCache
+from renderer import default_renderer
+from sinks import ReportSink
+from validate import Quarantine, default_validator, rejection
+
+if TYPE_CHECKING:  # history imports store, which imports this module
+    from history import ExamHistory
+
+# Per-worker PDF engine and render cache, created when a worker process starts.
+_worker_engine: Optional[PdfEngine] = None
+_worker_cache: Optional[RenderCache] = None
+
+
+@dataclass(frozen=True)
+class BatchRecord:
+    """One input record (or a record that failed to load) of a batch run."""
+    index: int
+    source: str
+    data: Optional[Dict[str, Any]]
+    error: Optional[str] = None
+    # The patient's trend up to this exam (``history.PatientTrend.to_dict()``), set with a history.
+    trend: Optional[Dict[str, Any]] = None
+
+
+@dataclass(frozen=True)
+class BatchResult:
+    """Outcome of rendering a single record."""
+    index: int
+    source: str
+    patient_id: Optional[str]
+    out_dir: Optional[str]
+    error: Optional[str] = None
+    cached: bool = False
+    # Rendered in memory for an output sink; the parent writes them and drops them.
+    artifacts: Optional[Dict[str, bytes]] = field(default=None, repr=False, compare=False)
+
+    @property
+    def ok(self) -> bool:
+        return self.error is None
+
+
+@dataclass
+class BatchSummary:
+    """Totals and failures of a batch run."""
+    total: int = 0
+    succeeded: int = 0
+    failures: List[BatchResult] = field(default_factory=list)
+    elapsed_s: float = 0.0
+    worker_recycles: int = 0
+    worker_crashes: int = 0
+    cache_hits: int = 0
+    cache_misses: int = 0
+    quarantined: int = 0
+
+    @property
+    def failed(self) -> int:
+        return len(self.failures)
+
+    def add(self, result: BatchResult) -> None:
+        self.total += 1
+        if result.ok:
+            self.succeeded += 1
+            if result.cached:
+                self.cache_hits += 1
+            else:
+                self.cache_misses += 1
+        else:
+            self.failures.append(result)
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "total": self.total,
+            "succeeded": self.succeeded,
+            "failed": self.failed,
+            "elapsed_s": round(self.elapsed_s, 3),
+            "records_per_s": round(self.total / self.elapsed_s, 2) if self.elapsed_s else None,
+            "worker_recycles": self.worker_recycles,
+            "worker_crashes": self.worker_crashes,
+            "cache_hits": self.cache_hits,
+            "cache_misses": self.cache_misses,
+            "quarantined": self.quarantined,
+            "failures": [{k: v for k, v in asdict(f).items() if k != "artifacts"} for f in self.failures],
+        }
+
+
+_UNSAFE_CHARS = re.compile(r"[^A-Za-z0-9_.-]+")
+
+
+def _record_dir_name(index: int, data: Dict[str, Any]) -> str:
+    """Per-patient output folder name: zero-padded index plus a filesystem-safe patient id."""
+    pid = _UNSAFE_CHARS.sub("_", str(data.get("patient_id", "unknown"))) or "unknown"
+    return f"{index:06d}_{pid}"
+
+
+def iter_batch_records(path: Path) -> Iterator[BatchRecord]:
+    """
+    Yield records from a directory of ``*.json`` files or from one cohort file
+    (JSON lines, JSON array, optionally gzip-compressed; see ``ingest``).
+
+    Records are streamed one at a time. Records that cannot be parsed are
+    yielded with ``data=None`` and an error message so that a single bad
+    record does not abort the batch.
+    """
+    index = 0
+    if path.is_dir():
+        for file in sorted(path.glob("*.json")):
+            try:
+                records = iter_records(file)
+                first = next(records, None)
+                second = next(records, None)
+            except (OSError, ValueError) as e:
+                first, second = Record(1, None, f"{type(e).__name__}: {e}"), None
+            if first is None:
+                continue
+            if second is None:
+                # The usual one-record-per-file layout keeps the bare file name as source.
+                yield BatchRecord(index, file.name, first.data, first.error)
+                index += 1
+                continue
+            for record in itertools.chain((first, second), records):
+                yield BatchRecord(index, f"{file.name}:{record.line}", record.data, record.error)
+                index += 1
+        return
+
+    for record in iter_records(path):
+        yield BatchRecord(index, f"{path.name}:{record.line}", record.data, record.error)
+        index += 1
+
+
+def render_record(
+    record: BatchRecord,
+    out_root: Path,
+    template_dir: Path,
+    output_format: str = "pdf",
+    in_memory: bool = False,
+) -> BatchResult:
+    """
+    Run the single-record pipeline (normalized JSON, HTML, PDF unless
+    ``output_format`` is "html") for one batch record. Exceptions are captured
+    in the result instead of being raised.
+
+    Inside a batch worker the per-worker ``PdfEngine`` is used for the PDF, and
+    unchanged records are served from the worker's ``RenderCache`` if one is set.
+    With ``in_memory`` nothing is written; the artifacts are returned in the
+    result for the parent's output sink.
+    """
+    data = record.data
+    if data is None:
+        return BatchResult(record.index, record.source, None, None, record.error)
+
+    patient_id = str(data.get("patient_id")) if "patient_id" in data else None
+    out_dir = out_root / _record_dir_name(record.index, data)
+    try:
+        if in_memory:
+            artifacts, cached = render_artifacts(
+                data, template_dir, engine=_worker_engine, cache=_worker_cache, output_format=output_format,
+                trend=record.trend,
+            )
+            return BatchResult(record.index, record.source, patient_id, None, cached=cached, artifacts=artifacts)
+        cached = write_report(
+            data, out_dir, template_dir, engine=_worker_engine, cache=_worker_cache, output_format=output_format,
+            trend=record.trend,
+        )
+    except Exception as e:  # noqa: BLE001 - a failing record must not stop the batch
+        return BatchResult(record.index, record.source, patient_id, str(out_dir), f"{type(e).__name__}: {e}")
+    return BatchResult(record.index, record.source, patient_id, str(out_dir), cached=cached)
+
+
+def _worker_main(
+    conn: Connection,
+    out_root: Path,
+    template_dir: Path,
+    max_documents: Optional[int],
+    max_rss_bytes: Optional[int],
+    cache_dir: Optional[Path] = None,
+    cache_max_bytes: int = 1 << 30,
+    output_format: str = "pdf",
+    in_memory: bool = False,
+) -> None:
+    """
+    Worker process loop: set up the renderer, PDF engine and cache once, then render
+    records received over ``conn`` until told to stop or until the engine's
+    document/RSS budget is spent. Each reply is ``(result, retiring)``.
+
+    HTML-only workers create no PDF engine and count their documents themselves.
+    """
+    global _worker_engine, _worker_cache
+    instrument.reset()
+    template_path = template_dir / TEMPLATE_NAME
+    default_renderer().get_template(template_path)
+    if output_format == "pdf":
+        _worker_engine = create_engine(template_path, max_documents=max_documents, max_rss_bytes=max_rss_bytes)
+    if cache_dir is not None:
+        _worker_cache = RenderCache(cache_dir, cache_max_bytes)
+    documents = 0
+    while True:
+        record = conn.recv()
+        if record is None:
+            break
+        result = render_record(record, out_root, template_dir, output_format, in_memory)
+        documents += 1
+        if _worker_engine is not None:
+            retiring = _worker_engine.should_recycle()
+        else:
+            rss = current_rss_bytes() if max_rss_bytes is not None else None
+            retiring = (max_documents is not None and documents >= max_documents) or (
+                rss is not None and rss > max_rss_bytes)
+        conn.send((result, retiring))
+        if retiring:
+            break
+    if _worker_cache is not None:
+        _worker_cache.close()
+    instrument.metrics().close()
+    conn.close()
+
+
+def _store(sink: ReportSink, record: BatchRecord, result: BatchResult) -> BatchResult:
+    """Write a worker's in-memory artifacts to ``sink``; the result keeps only their location."""
+    data = record.data or {}
+    try:
+        with instrument.span("sink"):
+            location = sink.write(
+                _record_dir_name(record.index, data), result.patient_id, data.get("timestamp"), result.artifacts
+            )
+    except Exception as e:  # noqa: BLE001 - a failing write must not stop the batch
+        return replace(result, artifacts=None, error=f"{type(e).__name__}: {e}")
+    return replace(result, out_dir=location, artifacts=None)
+
+
+class _Worker:
+    """Parent-side handle of one worker process holding at most one record."""
+
+    def __init__(self, ctx: BaseContext, args: Tuple[Any, ...]) -> None:
+        self.conn, child_conn = ctx.Pipe()
+        self.proc = ctx.Process(target=_worker_main, args=(child_conn, *args), daemon=True)
+        self.proc.start()
+        child_conn.close()
+        self.record: Optional[BatchRecord] = None
+
+    def submit(self, record: BatchRecord) -> None:
+        self.record = record
+        self.conn.send(record)
+
+    def stop(self) -> None:
+        try:
+            self.conn.send(None)
+        except OSError:
+            pass
+        self.proc.join(timeout=5)
+        if self.proc.is_alive():
+            self.proc.kill()
+            self.proc.join()
+        self.conn.close()
+
+
+class _Progress:
+    """Throttled single-line progress reporter."""
+
+    def __init__(self, stream: Optional[TextIO], total: Optional[int], interval_s: float = 0.5) -> None:
+        self.stream = stream
+        self.total = total
+        self.interval_s = interval_s
+        self._last = 0.0
+
+    def update(self, summary: BatchSummary, final: bool = False) -> None:
+        if self.stream is None:
+            return
+        now = time.monotonic()
+        if not final and now - self._last < self.interval_s:
+            return
+        self._last = now
+        done = f"{summary.total}/{self.total}" if self.total is not None else str(summary.total)
+        quarantined = f", {summary.quarantined} quarantined" if summary.quarantined else ""
+        self.stream.write(f"\r[batch] {done} processed, {summary.failed} failed{quarantined}")
+        if final:
+            self.stream.write("\n")
+        self.stream.flush()
+
+
+def run_batch(
+    source: Union[Path, Iterable[BatchRecord]],
+    out_root: Path,
+    template_dir: Path,
+    workers: Optional[int] = None,
+    progress: Optional[TextIO] = sys.stderr,
+    recycle_after: Optional[int] = None,
+    max_rss_bytes: Optional[int] = None,
+    mp_context: Optional[BaseContext] = None,
+    cache_dir: Optional[Path] = None,
+    cache_max_bytes: int = 1 << 30,
+    output_format: str = "pdf",
+    sink: Optional[ReportSink] = None,
+    quarantine: Optional[Quarantine] = None,
+    history: Optional[ExamHistory] = None,
+) -> BatchSummary:
+    """
+    Render every record of ``source`` (directory of JSON files or JSONL file) into
+    ``out_root/<index>_<patient_id>/`` using a pool of worker processes.
+
+    Each worker holds one record at a time, so memory stays bounded regardless
+    of cohort size. A ``batch_summary.json`` with all failures is written to
+    ``out_root``.
+
+    Worker memory is bounded by the worker's ``PdfEngine``: once it has rendered
+    ``recycle_after`` documents or its RSS exceeds ``max_rss_bytes``, that one
+    worker exits after returning its result and is replaced; the other workers
+    keep running. A worker that dies unexpectedly (e.g. OOM-killed) fails only
+    the record it was holding and is replaced as well.
+
+    Workers are started with ``mp_context`` (default: the platform's default
+    start method). The start method does not depend on the recycle settings, so
+    a replacement costs the same as the initial start-up.
+
+    With ``cache_dir`` set, records whose input, template and code are unchanged
+    since an earlier run reuse that run's artifacts (see ``RenderCache``); hits
+    and misses are counted in the summary. ``output_format="html"`` writes the
+    JSON and HTML artifacts only; its workers never load WeasyPrint.
+
+    With a ``sink`` (see ``sinks``: zip, tar, SQLite or another directory)
+    workers render into memory and send the artifacts back; this process is
+    the sink's only writer and records its location for each report in place
+    of the output directory. ``out_root`` then only receives the summary.
+
+    ``source`` may also be an iterable of ``BatchRecord`` objects, e.g. a
+    ``store.PatientStore.select`` query.
+
+    With a ``quarantine``, every record is checked by the compiled
+    ``validate.RECORD_SCHEMA`` validator in this process before it is handed
+    to a worker; records that fail to load or validate are written to the
+    quarantine file with their reasons and counted as ``quarantined`` instead
+    of failing.
+
+    With a ``history`` (see ``history.ExamHistory``), this process adds each
+    record to the patient's exam history before handing it to a worker, and
+    the report gets the patient's trend up to that exam.
+
+    Args:
+        source: Directory of ``*.json`` records, a ``.jsonl`` file or the records themselves.
+        out_root: Root output directory.
+        template_dir: Directory containing ``report_template.html``.
+        workers: Number of worker processes (default: ``os.cpu_count()``).
+        progress: Stream for progress output, or None to disable it.
+        recycle_after: Replace a worker after this many documents (None: never).
+        max_rss_bytes: Replace a worker once its RSS exceeds this (None: never).
+        mp_context: Multiprocessing context used to start workers.
+        cache_dir: Render cache directory shared by all workers (None: no cache).
+        cache_max_bytes: Size limit of the render cache.
+        output_format: "pdf" (default) or "html".
+        sink: Output sink for the artifacts (None: ``out_root/<index>_<patient_id>/``).
+        quarantine: Destination of invalid records (None: no validation; unreadable records fail).
+        history: Exam history the records are added to (None: reports without a trend section).
+
+    Returns:
+        BatchSummary with totals and per-record failures.
+    """
+    workers = max(1, workers or os.cpu_count() or 1)
+    ctx = mp_context or multiprocessing.get_context()
+    worker_args = (
+        out_root, template_dir, recycle_after, max_rss_bytes, cache_dir, cache_max_bytes, output_format,
+        sink is not None,
+    )
+    if isinstance(source, Path):
+        total = len(list(source.glob("*.json"))) if source.is_dir() else None
+        records = iter_batch_records(source)
+    else:
+        total, records = None, iter(source)
+    summary = BatchSummary()
+    validator = default_validator() if quarantine is not None else None
+    bar = _Progress(progress, total)
+    started = time.perf_counter()
+
+    out_root.mkdir(parents=True, exist_ok=True)
+    pool = [_Worker(ctx, worker_args) for _ in range(workers)]
+    try:
+        exhausted = False
+        while True:
+            for w in pool:
+                while w.record is None and not exhausted:
+                    with instrument.span("load"):
+                        record = next(records, None)
+                    if record is None:
+                        exhausted = True
+                    elif quarantine is not None and (reasons := rejection(record, validator)):
+                        quarantine.add(record, reasons)
+                        summary.total += 1
+                        summary.quarantined += 1
+                    elif record.data is None:
+                        summary.add(render_record(record, out_root, template_dir))
+                    else:
+                        if history is not None:
+                            with instrument.span("history"):
+                                trend = history.append(record.data)
+                            if trend is not None:
+                                record = replace(record, trend=trend.to_dict())
+                        w.submit(record)
+            busy = [w for w in pool if w.record is not None]
+            if not busy:
+                break
+
+            ready = wait([w.conn for w in busy] + [w.proc.sentinel for w in busy])
+            for i, w in enumerate(pool):
+                if w.record is None or (w.conn not in ready and w.proc.sentinel not in ready):
+                    continue
+                record, w.record = w.record, None
+                try:
+                    result, retiring = w.conn.recv()
+                except (EOFError, OSError):
+                    w.proc.join(timeout=5)
+                    summary.add(BatchResult(
+                        record.index, record.source,
+                        str(record.data.get("patient_id")) if "patient_id" in record.data else None,
+                        None, f"WorkerCrashed: worker exited with code {w.proc.exitcode}",
+                    ))
+                    summary.worker_crashes += 1
+                    retiring = True
+                else:
+                    if result.artifacts is not None and sink is not None:
+                        result = _store(sink, record, result)
+                    summary.add(result)
+                    if retiring:
+                        summary.worker_recycles += 1
+                if retiring:
+                    w.stop()
+                    pool[i] = _Worker(ctx, worker_args)
+            bar.update(summary)
+    finally:
+        for w in pool:
+            w.stop()
+
+    summary.failures.sort(key=lambda r: r.index)
+    summary.elapsed_s = time.perf_counter() - started
+    bar.update(summary, final=True)
+    _write_json(out_root / "batch_summary.json", summary.to_dict())
+    return summary
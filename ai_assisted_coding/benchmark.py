@@ -0,0 +1,274 @@
+"""
+Benchmark every pipeline stage at several cohort sizes.
+
+    python benchmark.py --sizes 1 1000 100000 --out bench.json
+    python benchmark.py --baseline bench.json --threshold 0.2   # exit 1 on regressions
+
+Stages: ``load`` (``ingest.iter_records``), ``analyze``, ``analyze_batch``, ``analyze_columnar``
+(opening a ``cohort_file.CohortFile`` converted beforehand and analyzing it),
+``render_html``, ``pdf`` (``PdfEngine``) and ``pdf_native`` (``native_pdf.draw_report``), and whole reports
+written to disk with ``report_sequential`` (one step after another, ``pipeline.run_sequential``) and
+``report_pipelined`` (``pipeline.run_pipeline``) with the run's PDF backend. Every (stage, size) case runs in
+a fresh process so that its peak RSS is its own. Cohorts come from
+``data_gen.write_mock_shard`` with a fixed seed, so runs are comparable.
+"""
+from __future__ import annotations
+
+import argparse
+import json
+import multiprocessing
+import os
+import platform
+import resource
+import sys
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+from typing import Any, Callable, Dict, Iterable, List, Optional
+
+from data_gen import write_mock_shard
+from ingest import iter_records
+
+STAGES = ("load", "analyze", "analyze_batch", "analyze_columnar", "render_html", "pdf", "pdf_native", "report_sequential",
+          "report_pipelined")
+PDF_STAGES = ("pdf", "pdf_native", "report_sequential", "report_pipelined")
+DEFAULT_SIZES = (1, 1000, 100_000)
+SEED = 20240601
+TIMESTAMP = "2025-01-01"
+
+
+def percentile(sorted_values: List[float], q: float) -> float:
+    """Nearest-rank percentile (``q`` in 0..100) of an already sorted list."""
+    if not sorted_values:
+        return float("nan")
+    rank = max(1, -(-len(sorted_values) * q // 100))
+    return sorted_values[int(min(rank, len(sorted_values))) - 1]
+
+
+def peak_rss_mb() -> float:
+    """Peak resident set size of this process so far, in MiB."""
+    # VmHWM belongs to this address space; ru_maxrss may carry the parent's peak across exec.
+    try:
+        with open("/proc/self/status", "r", encoding="ascii") as f:
+            for line in f:
+                if line.startswith("VmHWM:"):
+                    return int(line.split()[1]) / 1024
+    except OSError:
+        pass
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak / 1024 if sys.platform != "darwin" else peak / (1024 * 1024)
+
+
+def _time_each(items: Iterable[Any], fn: Callable[[Any], Any]) -> List[float]:
+    latencies = []
+    clock = time.perf_counter
+    for item in items:
+        t0 = clock()
+        fn(item)
+        latencies.append(clock() - t0)
+    return latencies
+
+
+def _time_iterator(it: Iterable[Any]) -> List[float]:
+    latencies = []
+    clock = time.perf_counter
+    it = iter(it)
+    while True:
+        t0 = clock()
+        if next(it, None) is None:
+            break
+        latencies.append(clock() - t0)
+    return latencies
+
+
+def run_case(stage: str, cohort: Path, size: int, pdf_limit: Optional[int] = None) -> Dict[str, Any]:
+    """
+    Time one stage over the cohort file and return its result row.
+
+    Only the stage itself is timed; loading the records it needs is not.
+    ``pdf_limit`` caps the number of documents rendered in the ``pdf`` stage
+    (throughput and latencies are then from that sample).
+    """
+    template_dir = Path(__file__).parent
+    records = [] if stage == "load" else [r.data for r in iter_records(cohort) if r.data is not None]
+    total_t0 = time.perf_counter()
+    if stage == "load":
+        latencies = _time_iterator(iter_records(cohort))
+    elif stage == "analyze":
+        from analysis import analyze
+
+        latencies = _time_each(records, analyze)
+    elif stage == "analyze_batch":
+        from analysis import analyze_batch
+
+        latencies = _time_each([records], analyze_batch)
+    elif stage == "analyze_columnar":
+        from cohort_file import CohortFile, write_cohort_file
+
+        path = cohort.parent / f"{cohort.name}.cols"  # removed with the suite's directory
+        write_cohort_file(records, path)
+        records = []
+        total_t0 = time.perf_counter()
+
+        def open_and_analyze(p: Path) -> None:
+            with CohortFile(p) as columns:
+                columns.analyze()
+
+        latencies = _time_each([path], open_and_analyze)
+    elif stage == "render_html":
+        from main import render_html
+
+        latencies = _time_each(records, lambda d: render_html(d, template_dir))
+    elif stage == "pdf":
+        from main import TEMPLATE_NAME, render_html
+        from pdf_engine import PdfEngine
+
+        engine = PdfEngine(template_dir / TEMPLATE_NAME)
+        htmls = [render_html(d, template_dir) for d in records[:pdf_limit]]
+        total_t0 = time.perf_counter()
+        latencies = _time_each(htmls, engine.write_pdf)
+    elif stage == "pdf_native":
+        from main import report_payload
+        from native_pdf import draw_report
+
+        payloads = [report_payload(d) for d in records[:pdf_limit]]
+        total_t0 = time.perf_counter()
+        latencies = _time_each(payloads, draw_report)
+    elif stage in ("report_sequential", "report_pipelined"):
+        from batch import BatchRecord
+        from pipeline import run_pipeline, run_sequential
+
+        run = run_pipeline if stage == "report_pipelined" else run_sequential
+        batch = [BatchRecord(i, "bench", d) for i, d in enumerate(records[:pdf_limit])]
+        total_t0 = time.perf_counter()
+        run(batch, cohort.parent / f"{stage}-{size}", template_dir)  # removed with the suite's directory
+        latencies = [time.perf_counter() - total_t0]
+    else:
+        raise ValueError(f"unknown stage {stage!r}")
+    total = time.perf_counter() - total_t0
+
+    processed = len(records[:pdf_limit]) if stage in PDF_STAGES else size
+    lat = sorted(latencies)
+    per_record = len(lat) == processed
+    return {
+        "stage": stage,
+        "records": size,
+        "processed": processed,
+        "total_s": round(total, 6),
+        "throughput_per_s": round(processed / total, 2) if total > 0 else None,
+        "p50_ms": round(percentile(lat, 50) * 1000, 4) if per_record else None,
+        "p99_ms": round(percentile(lat, 99) * 1000, 4) if per_record else None,
+        "peak_rss_mb": round(peak_rss_mb(), 1),
+    }
+
+
+def _case_worker(args: tuple) -> Dict[str, Any]:
+    stage, cohort, size, pdf_limit = args
+    try:
+        return run_case(stage, cohort, size, pdf_limit)
+    except ImportError as e:
+        return {"stage": stage, "records": size, "skipped": f"{type(e).__name__}: {e}"}
+
+
+def run_suite(
+    sizes: Iterable[int] = DEFAULT_SIZES,
+    stages: Iterable[str] = STAGES,
+    pdf_limit: Optional[int] = 200,
+    work_dir: Optional[Path] = None,
+    isolate: bool = True,
+) -> Dict[str, Any]:
+    """
+    Run every (stage, size) case and return ``{"meta": ..., "results": [...]}``.
+
+    With ``isolate`` each case runs in its own spawned process, which makes
+    ``peak_rss_mb`` meaningful per case; without it everything runs in this
+    process (used by the tests). Stages whose dependencies are missing are
+    reported with a ``skipped`` reason.
+    """
+    results = []
+    with tempfile.TemporaryDirectory(dir=work_dir) as tmp:
+        ctx = multiprocessing.get_context("spawn")
+        for size in sizes:
+            cohort = Path(tmp) / f"cohort-{size}.jsonl"
+            write_mock_shard(cohort, 0, size, seed=SEED, timestamp=TIMESTAMP)
+            for stage in stages:
+                args = (stage, cohort, size, pdf_limit)
+                if isolate:
+                    # not a multiprocessing.Pool: its daemonic workers could not start pipeline process stages
+                    with ProcessPoolExecutor(1, mp_context=ctx) as pool:
+                        results.append(pool.submit(_case_worker, args).result())
+                else:
+                    results.append(_case_worker(args))
+    return {
+        "meta": {
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "cpu_count": os.cpu_count(),
+            "seed": SEED,
+            "pdf_limit": pdf_limit,
+            "created": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        },
+        "results": results,
+    }
+
+
+def compare(current: Dict[str, Any], baseline: Dict[str, Any], threshold: float) -> List[str]:
+    """
+    Regressions of ``current`` against ``baseline``: cases whose throughput
+    dropped, or whose p99 latency grew, by more than ``threshold`` (0.2 = 20%).
+    """
+    base = {(r["stage"], r["records"]): r for r in baseline.get("results", []) if "skipped" not in r}
+    problems = []
+    for row in current.get("results", []):
+        old = base.get((row["stage"], row["records"]))
+        if old is None or "skipped" in row:
+            continue
+        name = f"{row['stage']}@{row['records']}"
+        if old.get("throughput_per_s") and row.get("throughput_per_s") is not None:
+            if row["throughput_per_s"] < old["throughput_per_s"] * (1 - threshold):
+                problems.append(f"{name}: throughput {row['throughput_per_s']}/s < baseline {old['throughput_per_s']}/s")
+        # p99 of fewer than 100 samples is just the slowest sample; too noisy to gate on.
+        if old.get("p99_ms") and row.get("p99_ms") is not None and row.get("processed", 0) >= 100:
+            if row["p99_ms"] > old["p99_ms"] * (1 + threshold):
+                problems.append(f"{name}: p99 {row['p99_ms']} ms > baseline {old['p99_ms']} ms")
+    return problems
+
+
+def _format_row(r: Dict[str, Any]) -> str:
+    if "skipped" in r:
+        return f"{r['stage']:<18}{r['records']:>9}  skipped ({r['skipped']})"
+    p50 = "-" if r["p50_ms"] is None else f"{r['p50_ms']:.3f}"
+    p99 = "-" if r["p99_ms"] is None else f"{r['p99_ms']:.3f}"
+    return (f"{r['stage']:<18}{r['records']:>9}{r['throughput_per_s'] or 0:>14.1f}"
+            f"{p50:>11}{p99:>11}{r['peak_rss_mb']:>10.1f}")
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Benchmark the report pipeline stages.")
+    parser.add_argument("--sizes", type=int, nargs="+", default=list(DEFAULT_SIZES), help="Cohort sizes.")
+    parser.add_argument("--stages", nargs="+", choices=STAGES, default=list(STAGES), help="Stages to run.")
+    parser.add_argument("--pdf-limit", type=int, default=200, help="Documents rendered per size in the pdf stage.")
+    parser.add_argument("--out", type=str, default="bench.json", help="Results file (default: bench.json).")
+    parser.add_argument("--baseline", type=str, default=None, help="Earlier results to compare against.")
+    parser.add_argument("--threshold", type=float, default=0.2, help="Allowed relative regression (default: 0.2).")
+    args = parser.parse_args()
+
+    report = run_suite(args.sizes, args.stages, args.pdf_limit)
+    Path(args.out).write_text(json.dumps(report, indent=2), encoding="utf-8")
+
+    print(f"{'stage':<18}{'records':>9}{'records/s':>14}{'p50 ms':>11}{'p99 ms':>11}{'RSS MB':>10}")
+    for row in report["results"]:
+        print(_format_row(row))
+    print(f"Wrote: {args.out}")
+
+    if args.baseline:
+        problems = compare(report, json.loads(Path(args.baseline).read_text(encoding="utf-8")), args.threshold)
+        for p in problems:
+            print(f"REGRESSION {p}")
+        if problems:
+            raise SystemExit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,396 @@
+from __future__ import annotations
+
+import hashlib
+import json
+import mmap
+import os
+import shutil
+import struct
+import tempfile
+from datetime import datetime, timezone
+from functools import lru_cache
+from itertools import islice
+from pathlib import Path
+from typing import Any, BinaryIO, Dict, Iterable, List, Optional, Tuple
+
+import numpy as np
+
+from analysis import BatchAnalysis, analyze
+from columnar import CHUNK, METRICS, VESSELS, CohortColumns, _convert_chunk, concat_stats, reduce_columns
+
+MAGIC = b"CRDCOLS1"
+VERSION = 1
+# Float columns in file order: every vessel metric, then the ICA/CCA ratio.
+COLUMNS: Tuple[str, ...] = tuple(f"{v}.{m}" for v in VESSELS for m in METRICS) + ("ica_cca_ratio",)
+NO_TIME = np.iinfo(np.int64).min
+NO_NAME = np.iinfo(np.uint32).max
+_ALIGN = 64
+_HEAD = struct.Struct("<8sQ")
+_EPOCH = datetime(1970, 1, 1, tzinfo=timezone.utc)
+_MICROSECOND = datetime.resolution
+# Rows reduced at a time by ``CohortFile.analyze``.
+ANALYZE_ROWS = 1 << 16
+
+
+def _align(n: int) -> int:
+    return -(-n // _ALIGN) * _ALIGN
+
+
+@lru_cache(maxsize=4096)
+def parse_time(value: Any) -> int:
+    """
+    Microseconds since the epoch of an ISO 8601 date or date-time (naive ones
+    are taken as UTC), or ``NO_TIME`` if ``value`` is missing or not one.
+    """
+    if not isinstance(value, str):
+        return int(NO_TIME)
+    try:
+        dt = datetime.fromisoformat(value)
+    except ValueError:
+        return int(NO_TIME)
+    if dt.tzinfo is None:
+        dt = dt.replace(tzinfo=timezone.utc)
+    return (dt - _EPOCH) // _MICROSECOND
+
+
+def id_hash(patient_id: str) -> int:
+    """Stable 64-bit hash of a patient ID, the key of the ID index."""
+    return _hash(patient_id.encode("utf-8"))
+
+
+def _hash(raw: bytes) -> int:
+    return int.from_bytes(hashlib.blake2b(raw, digest_size=8).digest(), "little")
+
+
+def _patient_id(data: Any) -> str:
+    pid = data.get("patient_id")
+    return "" if pid is None else str(pid)
+
+
+def is_cohort_file(path: Path) -> bool:
+    """True if ``path`` is a columnar cohort file written by ``write_cohort_file``."""
+    try:
+        with Path(path).open("rb") as f:
+            return f.read(len(MAGIC)) == MAGIC
+    except OSError:
+        return False
+
+
+class _Spool:
+    """Append-only temporary files, one per section, while the record count is unknown."""
+
+    def __init__(self, folder: Path) -> None:
+        self.folder = folder
+        self.files: Dict[str, BinaryIO] = {}
+
+    def write(self, name: str, array: np.ndarray) -> None:
+        f = self.files.get(name)
+        if f is None:
+            f = self.files[name] = (self.folder / name).open("wb")
+        f.write(np.ascontiguousarray(array).tobytes())
+
+    def path(self, name: str) -> Path:
+        f = self.files.pop(name, None)
+        if f is not None:
+            f.close()
+        path = self.folder / name
+        path.touch()
+        return path
+
+    def close(self) -> None:
+        for f in self.files.values():
+            f.close()
+        self.files.clear()
+
+
+def write_cohort_file(records: Iterable[Any], path: Path) -> int:
+    """
+    Convert records (input JSON schema) once into a columnar cohort file that
+    ``CohortFile`` memory-maps for repeated analysis.
+
+    Layout after a small JSON header, every section 64-byte aligned:
+
+    - one float64 column per vessel metric and the ICA/CCA ratio (``COLUMNS``),
+      NaN where a value is missing, as ``columnar.to_columns`` converts them;
+    - ``fallback`` flags and the original JSON of those rows, whose analysis
+      the columns cannot reproduce exactly (unknown vessels, non-finite
+      values, PSV ties; see ``columnar.reduce_columns``);
+    - the patient IDs (UTF-8 with offsets) with an index sorted by ID hash;
+    - timestamps (int64 microseconds, ``NO_TIME`` if missing) with an index
+      sorted by time;
+    - names as codes into a string table of the distinct names.
+
+    Records are read in chunks and spooled to temporary files next to
+    ``path``, so memory stays bounded by the string table and the indexes
+    built at the end (16 bytes per record each).
+
+    Returns:
+        The number of records written.
+    """
+    path = Path(path)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    names: Dict[str, int] = {}
+    raw_rows: List[int] = []
+    raw_lengths: List[int] = []
+    n = 0
+    with tempfile.TemporaryDirectory(prefix=".cohort-", dir=path.parent) as tmp:
+        spool = _Spool(Path(tmp))
+        raw = (Path(tmp) / "raw_bytes").open("wb")
+        try:
+            it = iter(records)
+            while chunk := list(islice(it, CHUNK)):
+                values, ratio, fallback = _convert_chunk(chunk)
+                # Also keep the rows whose statistics need the whole record (PSV ties, ...).
+                fallback = reduce_columns(CohortColumns(
+                    values.reshape(len(chunk), len(VESSELS), len(METRICS)), ratio, fallback)).fallback
+                for i in range(len(COLUMNS) - 1):
+                    spool.write(f"column{i}", values[:, i])
+                spool.write(f"column{len(COLUMNS) - 1}", ratio)
+                spool.write("fallback", fallback.astype(np.uint8))
+                ids = [_patient_id(d).encode("utf-8") for d in chunk]
+                spool.write("id_lengths", np.fromiter(map(len, ids), dtype=np.uint64, count=len(ids)))
+                spool.write("id_bytes", np.frombuffer(b"".join(ids), dtype=np.uint8))
+                spool.write("id_hash", np.fromiter(map(_hash, ids), dtype=np.uint64, count=len(ids)))
+                spool.write("timestamp", np.fromiter(
+                    (parse_time(d.get("timestamp")) for d in chunk), dtype=np.int64, count=len(chunk)))
+                codes = np.fromiter((
+                    names.setdefault(name, len(names)) if isinstance(name := d.get("name"), str) else NO_NAME
+                    for d in chunk), dtype=np.uint32, count=len(chunk))
+                spool.write("name", codes)
+                for i in fallback.nonzero()[0].tolist():
+                    data = chunk[i]
+                    text = json.dumps(data if type(data) is dict else data.to_dict(), ensure_ascii=False,
+                                      separators=(",", ":")).encode("utf-8")
+                    raw.write(text)
+                    raw_rows.append(n + i)
+                    raw_lengths.append(len(text))
+                n += len(chunk)
+        finally:
+            raw.close()
+            spool.close()
+
+        id_offsets = np.zeros(n + 1, dtype=np.uint64)
+        np.cumsum(np.fromfile(spool.path("id_lengths"), dtype=np.uint64), out=id_offsets[1:])
+        hashes = np.fromfile(spool.path("id_hash"), dtype=np.uint64)
+        by_id = np.argsort(hashes, kind="stable")
+        times = np.fromfile(spool.path("timestamp"), dtype=np.int64)
+        by_time = np.argsort(times, kind="stable")
+        strings = [s.encode("utf-8") for s in names]
+        string_offsets = np.zeros(len(strings) + 1, dtype=np.uint64)
+        np.cumsum([len(s) for s in strings], out=string_offsets[1:])
+        raw_offsets = np.zeros(len(raw_lengths) + 1, dtype=np.uint64)
+        np.cumsum(raw_lengths, out=raw_offsets[1:])
+
+        sections: List[Tuple[str, str, Tuple[int, ...], Any]] = [
+            ("columns", "<f8", (len(COLUMNS), n), [spool.path(f"column{i}") for i in range(len(COLUMNS))]),
+            ("fallback", "|u1", (n,), spool.path("fallback")),
+            ("raw_rows", "<i8", (len(raw_rows),), np.array(raw_rows, dtype=np.int64)),
+            ("raw_offsets", "<u8", raw_offsets.shape, raw_offsets),
+            ("raw_bytes", "|u1", (int(raw_offsets[-1]),), Path(tmp) / "raw_bytes"),
+            ("id_offsets", "<u8", id_offsets.shape, id_offsets),
+            ("id_bytes", "|u1", (int(id_offsets[-1]),), spool.path("id_bytes")),
+            ("id_hash", "<u8", (n,), hashes[by_id]),
+            ("by_id", "<i8", (n,), by_id),
+            ("timestamp", "<i8", (n,), times),
+            ("time_sorted", "<i8", (n,), times[by_time]),
+            ("by_time", "<i8", (n,), by_time),
+            ("name", "<u4", (n,), spool.path("name")),
+            ("string_offsets", "<u8", string_offsets.shape, string_offsets),
+            ("string_bytes", "|u1", (int(string_offsets[-1]),), b"".join(strings)),
+        ]
+        layout: Dict[str, Dict[str, Any]] = {}
+        offset = 0
+        for name, dtype, shape, _ in sections:
+            layout[name] = {"offset": offset, "dtype": dtype, "shape": list(shape)}
+            offset = _align(offset + int(np.prod(shape, dtype=np.int64)) * np.dtype(dtype).itemsize)
+        header = json.dumps({"version": VERSION, "records": n, "columns": list(COLUMNS),
+                             "sections": layout}).encode("utf-8")
+
+        partial = path.with_name(path.name + ".tmp")
+        with partial.open("wb") as f:
+            f.write(_HEAD.pack(MAGIC, len(header)) + header)
+            start = _align(f.tell())
+            for name, _, _, source in sections:
+                f.write(b"\0" * (start + layout[name]["offset"] - f.tell()))
+                if isinstance(source, (Path, list)):
+                    for part_path in source if isinstance(source, list) else [source]:
+                        with part_path.open("rb") as src:
+                            shutil.copyfileobj(src, f, 1 << 20)
+                elif isinstance(source, bytes):
+                    f.write(source)
+                else:
+                    f.write(np.ascontiguousarray(source).tobytes())
+            f.write(b"\0" * (start + offset - f.tell()))
+        os.replace(partial, path)
+    return n
+
+
+class CohortFile:
+    """
+    Read-only memory map of a file written by ``write_cohort_file``.
+
+    Opening reads only the header; columns are NumPy views of the mapped
+    pages, so there are no per-record Python objects and processes that open
+    the same file share its pages through the OS page cache. Use as a context
+    manager, or call ``close`` once no views are in use.
+
+    Attributes:
+        columns: ``COLUMNS`` name -> float64 array (records,).
+        timestamp: int64 microseconds since the epoch, ``NO_TIME`` if missing.
+        fallback: Rows whose statistics come from ``analysis.analyze``.
+    """
+
+    def __init__(self, path: Path) -> None:
+        self.path = Path(path)
+        with self.path.open("rb") as f:
+            magic, header_len = _HEAD.unpack(f.read(_HEAD.size))
+            if magic != MAGIC:
+                raise ValueError(f"{path} is not a columnar cohort file")
+            header = json.loads(f.read(header_len))
+            if header["version"] != VERSION:
+                raise ValueError(f"{path}: unsupported cohort file version {header['version']}")
+            self._mmap = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        start = _align(_HEAD.size + header_len)
+        data = np.frombuffer(self._mmap, dtype=np.uint8)
+        self._sections: Dict[str, np.ndarray] = {}
+        for name, s in header["sections"].items():
+            dtype = np.dtype(s["dtype"])
+            count = int(np.prod(s["shape"], dtype=np.int64))
+            begin = start + s["offset"]
+            self._sections[name] = data[begin:begin + count * dtype.itemsize].view(dtype).reshape(s["shape"])
+        self.records: int = header["records"]
+        block = self._sections["columns"]
+        self.columns: Dict[str, np.ndarray] = dict(zip(COLUMNS, block))
+        # (patient x vessel x metric) view of the metric columns, strided over the column block.
+        self._values = block[:-1].T.reshape(self.records, len(VESSELS), len(METRICS))
+        self.timestamp = self._sections["timestamp"]
+        self.fallback = self._sections["fallback"].view(bool)
+
+    def __len__(self) -> int:
+        return self.records
+
+    def __enter__(self) -> "CohortFile":
+        return self
+
+    def __exit__(self, *exc: Any) -> None:
+        self.close()
+
+    def close(self) -> None:
+        """Drop the views and unmap the file (it stays mapped while views handed out are alive)."""
+        self._sections.clear()
+        self.columns = {}
+        self.timestamp = self.fallback = self._values = None  # type: ignore[assignment]
+        try:
+            self._mmap.close()
+        except BufferError:
+            pass
+
+    def cohort_columns(self, start: int = 0, stop: Optional[int] = None) -> CohortColumns:
+        """Rows ``start:stop`` as ``columnar.CohortColumns``, views of the mapped columns (no copy)."""
+        return CohortColumns(values=self._values[start:stop], ratio=self.columns["ica_cca_ratio"][start:stop],
+                             fallback=self.fallback[start:stop])
+
+    def analyze(self, rows: Optional[np.ndarray] = None) -> BatchAnalysis:
+        """
+        ``analysis.analyze_batch`` of the whole cohort, or of ``rows`` (e.g. from
+        ``rows_for``/``rows_between``), reduced straight from the mapped columns.
+
+        Item ``i`` equals ``analyze`` of the ``i``-th record; only the fallback
+        rows are parsed from their stored JSON and analyzed one by one.
+        """
+        parts = []
+        scalar: Dict[int, Dict[str, Any]] = {}
+        total = self.records if rows is None else len(rows)
+        for start in range(0, total, ANALYZE_ROWS):
+            stop = min(start + ANALYZE_ROWS, total)
+            if rows is None:
+                cols = self.cohort_columns(start, stop)
+            else:
+                picked = rows[start:stop]
+                cols = CohortColumns(self._values[picked], self.columns["ica_cca_ratio"][picked],
+                                     self.fallback[picked])
+            stats = reduce_columns(cols)
+            for i in stats.fallback.nonzero()[0].tolist():
+                scalar[start + i] = analyze(self.raw_record(start + i if rows is None else int(rows[start + i])))
+            parts.append(stats)
+        if not parts:
+            parts.append(reduce_columns(self.cohort_columns(0, 0)))
+        return BatchAnalysis(concat_stats(parts), scalar)
+
+    def raw_record(self, row: int) -> Dict[str, Any]:
+        """
+        The record of a fallback row as it was converted; other rows keep only
+        their columns (see ``record``).
+        """
+        s = self._sections
+        i = int(np.searchsorted(s["raw_rows"], row))
+        if i == len(s["raw_rows"]) or s["raw_rows"][i] != row:
+            raise KeyError(f"row {row} is not a fallback row")
+        begin, end = s["raw_offsets"][i:i + 2].tolist()
+        return json.loads(s["raw_bytes"][begin:end].tobytes())
+
+    def record(self, row: int) -> Dict[str, Any]:
+        """
+        Rebuild row ``row`` in the input schema from the columns: patient ID,
+        name, timestamp (ISO, UTC) and vitals; fallback rows as stored. Context
+        and other fields are not kept in the file.
+        """
+        if self.fallback[row]:
+            return self.raw_record(row)
+        vitals: Dict[str, Any] = {}
+        values = self._values[row].tolist()
+        for vi, vessel in enumerate(VESSELS):
+            present = {m: v for m, v in zip(METRICS, values[vi]) if v == v}
+            if present:
+                vitals[vessel] = {m: present.get(m) for m in METRICS}
+        ratio = float(self.columns["ica_cca_ratio"][row])
+        if ratio == ratio:
+            vitals["ica_cca_ratio"] = ratio
+        stamp = int(self.timestamp[row])
+        return {
+            "patient_id": self.patient_id(row),
+            "name": self.name(row),
+            "timestamp": None if stamp == NO_TIME else (_EPOCH + stamp * _MICROSECOND).isoformat(),
+            "vitals": vitals,
+        }
+
+    def patient_id(self, row: int) -> str:
+        """Patient ID of ``row`` ("" where the record had none)."""
+        begin, end = self._sections["id_offsets"][row:row + 2].tolist()
+        return self._sections["id_bytes"][begin:end].tobytes().decode("utf-8")
+
+    def name(self, row: int) -> Optional[str]:
+        code = int(self._sections["name"][row])
+        if code == NO_NAME:
+            return None
+        begin, end = self._sections["string_offsets"][code:code + 2].tolist()
+        return self._sections["string_bytes"][begin:end].tobytes().decode("utf-8")
+
+    def rows_for(self, patient_id: str) -> np.ndarray:
+        """Rows of ``patient_id`` in file order, found by binary search of the ID index."""
+        s = self._sections
+        key = np.uint64(id_hash(patient_id))
+        lo, hi = np.searchsorted(s["id_hash"], key, "left"), np.searchsorted(s["id_hash"], key, "right")
+        # Rows sharing a hash with another ID are told apart by the ID itself.
+        return np.array([r for r in s["by_id"][lo:hi].tolist() if self.patient_id(r) == patient_id],
+                        dtype=np.int64)
+
+    def rows_between(self, since: Optional[str] = None, until: Optional[str] = None) -> np.ndarray:
+        """
+        Rows with a timestamp in ``[since, until]`` (inclusive ISO dates or
+        date-times, naive as UTC) in time order, by binary search of the time
+        index. Rows without a parseable timestamp are never selected.
+        """
+        sorted_times = self._sections["time_sorted"]
+        lo = np.searchsorted(sorted_times, self._bound(since, NO_TIME + 1), "left")
+        hi = np.searchsorted(sorted_times, self._bound(until, np.iinfo(np.int64).max), "right")
+        return self._sections["by_time"][lo:hi]
+
+    @staticmethod
+    def _bound(value: Optional[str], default: int) -> np.int64:
+        if value is None:
+            return np.int64(default)
+        stamp = parse_time(value)
+        if stamp == NO_TIME:
+            raise ValueError(f"invalid ISO date or date-time {value!r}")
+        return np.int64(stamp)
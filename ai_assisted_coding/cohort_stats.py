@@ -0,0 +1,419 @@
+from __future__ import annotations
+
+import json
+import math
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+from dataclasses import dataclass, field
+from itertools import islice
+from pathlib import Path
+from typing import Any, Dict, Iterable, Iterator, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+from columnar import CHUNK, METRICS, VESSELS, _convert_chunk
+
+SUMMARY_TEMPLATE_NAME = "cohort_summary_template.html"
+DEFAULT_QUANTILES: Tuple[float, ...] = (0.05, 0.25, 0.5, 0.75, 0.95, 0.99)
+RATIO_KEY = "ica_cca_ratio"
+
+
+@dataclass
+class RunningStats:
+    """
+    Count, min, max, mean and sum of squared deviations of a stream of numbers.
+
+    Single values are added with Welford's update, arrays and partial states
+    from other workers are combined with Chan et al.'s pairwise formula, so
+    the result does not depend on how the stream was split.
+    """
+    count: int = 0
+    mean: float = 0.0
+    m2: float = 0.0
+    min: float = math.inf
+    max: float = -math.inf
+
+    def add(self, x: float) -> None:
+        self.count += 1
+        delta = x - self.mean
+        self.mean += delta / self.count
+        self.m2 += delta * (x - self.mean)
+        if x < self.min:
+            self.min = x
+        if x > self.max:
+            self.max = x
+
+    def add_array(self, values: np.ndarray) -> None:
+        """Add a 1-D float array of finite values."""
+        if values.size:
+            mean = float(values.mean())
+            self.merge(RunningStats(
+                int(values.size), mean, float(np.square(values - mean).sum()),
+                float(values.min()), float(values.max()),
+            ))
+
+    def merge(self, other: "RunningStats") -> None:
+        if other.count == 0:
+            return
+        if self.count == 0:
+            self.count, self.mean, self.m2, self.min, self.max = (
+                other.count, other.mean, other.m2, other.min, other.max,
+            )
+            return
+        n = self.count + other.count
+        delta = other.mean - self.mean
+        self.mean += delta * other.count / n
+        self.m2 += other.m2 + delta * delta * self.count * other.count / n
+        self.count = n
+        self.min = min(self.min, other.min)
+        self.max = max(self.max, other.max)
+
+    @property
+    def variance(self) -> Optional[float]:
+        """Sample variance (n - 1 denominator), None below two values."""
+        return self.m2 / (self.count - 1) if self.count > 1 else None
+
+    @property
+    def std(self) -> Optional[float]:
+        var = self.variance
+        return None if var is None else math.sqrt(var)
+
+
+@dataclass
+class QuantileSketch:
+    """
+    Mergeable quantile sketch with relative accuracy (DDSketch-style).
+
+    A value ``x > 0`` is counted in the logarithmic bucket
+    ``ceil(log_gamma(x))`` with ``gamma = (1 + a) / (1 - a)``; every value of a
+    bucket is within a relative error ``a`` of the bucket's representative, so
+    any quantile estimate is too. Negative values use a mirrored set of buckets
+    and zeros a plain counter. Merging adds bucket counts, which gives exactly
+    the sketch of the concatenated streams.
+
+    Memory depends on the value range, not the count: values spanning
+    ``[lo, hi]`` need about ``log(hi / lo) / (2 a)`` buckets. Beyond
+    ``max_buckets`` the lowest buckets are folded together, which only coarsens
+    the smallest quantiles.
+    """
+    relative_accuracy: float = 0.01
+    max_buckets: int = 2048
+    positive: Dict[int, int] = field(default_factory=dict)
+    negative: Dict[int, int] = field(default_factory=dict)
+    zeros: int = 0
+    count: int = 0
+
+    def __post_init__(self) -> None:
+        if not 0 < self.relative_accuracy < 1:
+            raise ValueError("relative_accuracy must be in (0, 1)")
+        self._gamma = (1 + self.relative_accuracy) / (1 - self.relative_accuracy)
+        self._inv_log_gamma = 1.0 / math.log(self._gamma)
+
+    def add(self, x: float) -> None:
+        self.count += 1
+        if x > 0:
+            key = math.ceil(math.log(x) * self._inv_log_gamma)
+            self.positive[key] = self.positive.get(key, 0) + 1
+        elif x < 0:
+            key = math.ceil(math.log(-x) * self._inv_log_gamma)
+            self.negative[key] = self.negative.get(key, 0) + 1
+        else:
+            self.zeros += 1
+        self._collapse()
+
+    def add_array(self, values: np.ndarray) -> None:
+        """Add a 1-D float array of finite values."""
+        if not values.size:
+            return
+        self.count += int(values.size)
+        self.zeros += int(np.count_nonzero(values == 0))
+        for store, part in ((self.positive, values[values > 0]), (self.negative, -values[values < 0])):
+            if part.size:
+                keys, counts = np.unique(np.ceil(np.log(part) * self._inv_log_gamma), return_counts=True)
+                for key, n in zip(keys.astype(np.int64).tolist(), counts.tolist()):
+                    store[key] = store.get(key, 0) + n
+        self._collapse()
+
+    def merge(self, other: "QuantileSketch") -> None:
+        if other.relative_accuracy != self.relative_accuracy:
+            raise ValueError("cannot merge sketches with different relative accuracy")
+        for store, theirs in ((self.positive, other.positive), (self.negative, other.negative)):
+            for key, n in theirs.items():
+                store[key] = store.get(key, 0) + n
+        self.zeros += other.zeros
+        self.count += other.count
+        self._collapse()
+
+    def _collapse(self) -> None:
+        # Fold the buckets of the smallest magnitudes (positive side first) into one.
+        for store in (self.positive, self.negative):
+            excess = len(self.positive) + len(self.negative) - self.max_buckets
+            if excess <= 0:
+                return
+            keys = sorted(store)[: excess + 1]
+            if len(keys) < 2:
+                continue
+            store[keys[-1]] += sum(store.pop(k) for k in keys[:-1])
+
+    def _value(self, key: int) -> float:
+        return 2.0 * self._gamma ** key / (self._gamma + 1)
+
+    def quantile(self, q: float) -> Optional[float]:
+        """Estimate of the ``q``-quantile (0 <= q <= 1), None if the sketch is empty."""
+        if not 0 <= q <= 1:
+            raise ValueError("q must be in [0, 1]")
+        if self.count == 0:
+            return None
+        rank = q * (self.count - 1)
+        seen = 0
+        for key in sorted(self.negative, reverse=True):
+            seen += self.negative[key]
+            if seen > rank:
+                return -self._value(key)
+        seen += self.zeros
+        if seen > rank:
+            return 0.0
+        for key in sorted(self.positive):
+            seen += self.positive[key]
+            if seen > rank:
+                return self._value(key)
+        return self._value(max(self.positive)) if self.positive else 0.0
+
+    def to_state(self) -> Dict[str, Any]:
+        return {
+            "relative_accuracy": self.relative_accuracy,
+            "max_buckets": self.max_buckets,
+            "positive": [[k, n] for k, n in sorted(self.positive.items())],
+            "negative": [[k, n] for k, n in sorted(self.negative.items())],
+            "zeros": self.zeros,
+            "count": self.count,
+        }
+
+    @classmethod
+    def from_state(cls, state: Dict[str, Any]) -> "QuantileSketch":
+        return cls(
+            state["relative_accuracy"], state["max_buckets"],
+            {int(k): int(n) for k, n in state["positive"]},
+            {int(k): int(n) for k, n in state["negative"]},
+            state["zeros"], state["count"],
+        )
+
+
+@dataclass
+class MetricAggregate:
+    """Running moments plus quantile sketch of one metric."""
+    stats: RunningStats = field(default_factory=RunningStats)
+    sketch: QuantileSketch = field(default_factory=QuantileSketch)
+
+    def add_array(self, values: np.ndarray) -> None:
+        values = values[np.isfinite(values)]
+        self.stats.add_array(values)
+        self.sketch.add_array(values)
+
+    def merge(self, other: "MetricAggregate") -> None:
+        self.stats.merge(other.stats)
+        self.sketch.merge(other.sketch)
+
+    def summary(self, quantiles: Sequence[float]) -> Dict[str, Any]:
+        s = self.stats
+        if s.count == 0:
+            return {"count": 0, "min": None, "max": None, "mean": None, "std": None, "quantiles": {}}
+        # Clamp to the exact extremes; a bucket representative may lie just outside them.
+        qs = {f"p{q * 100:g}": min(s.max, max(s.min, self.sketch.quantile(q))) for q in quantiles}
+        return {"count": s.count, "min": s.min, "max": s.max, "mean": s.mean, "std": s.std, "quantiles": qs}
+
+
+class CohortAggregator:
+    """
+    One-pass cohort statistics per vessel and metric (plus the ICA/CCA ratio).
+
+    Memory per metric is constant in the number of records: running moments
+    and a ``QuantileSketch``. Records are consumed in chunks through the same
+    columnar conversion as ``analysis.analyze_batch``; non-numeric and
+    non-finite values and unknown vessels are ignored. Aggregators of
+    disjoint parts of a cohort (e.g. one per worker or shard) ``merge`` into
+    exact count/min/max/mean/variance and approximate quantiles.
+    """
+
+    def __init__(self, relative_accuracy: float = 0.01) -> None:
+        self.relative_accuracy = relative_accuracy
+        self.records = 0
+        self.metrics: Dict[str, MetricAggregate] = {
+            key: MetricAggregate(sketch=QuantileSketch(relative_accuracy)) for key in self.keys()
+        }
+
+    @staticmethod
+    def keys() -> List[str]:
+        """Metric keys in report order: ``<vessel>.<metric>`` then ``ica_cca_ratio``."""
+        return [f"{v}.{m}" for v in VESSELS for m in METRICS] + [RATIO_KEY]
+
+    def add_many(self, records: Iterable[Dict[str, Any]]) -> "CohortAggregator":
+        it = iter(records)
+        while chunk := list(islice(it, CHUNK)):
+            values, ratio, _ = _convert_chunk(chunk)
+            self.add_columns(list(values.T) + [ratio])
+        return self
+
+    def add_columns(self, columns: Sequence[np.ndarray]) -> "CohortAggregator":
+        """
+        Add records given as one float array per ``keys()`` entry (NaN where
+        missing), e.g. the mapped columns of a ``cohort_file.CohortFile``.
+        Adding them in ``CHUNK``-sized slices gives the same result as
+        ``add_many`` of the records.
+        """
+        self.records += len(columns[-1])
+        for key, column in zip(self.keys(), columns):
+            self.metrics[key].add_array(column)
+        return self
+
+    def merge(self, other: "CohortAggregator") -> "CohortAggregator":
+        self.records += other.records
+        for key, agg in other.metrics.items():
+            self.metrics[key].merge(agg)
+        return self
+
+    def to_state(self) -> Dict[str, Any]:
+        """JSON-serializable partial state, e.g. to merge the results of separate runs."""
+        return {
+            "relative_accuracy": self.relative_accuracy,
+            "records": self.records,
+            "metrics": {
+                key: {"stats": vars(agg.stats), "sketch": agg.sketch.to_state()}
+                for key, agg in self.metrics.items()
+            },
+        }
+
+    @classmethod
+    def from_state(cls, state: Dict[str, Any]) -> "CohortAggregator":
+        agg = cls(state["relative_accuracy"])
+        agg.records = state["records"]
+        for key, m in state["metrics"].items():
+            agg.metrics[key] = MetricAggregate(RunningStats(**m["stats"]), QuantileSketch.from_state(m["sketch"]))
+        return agg
+
+    def summary(self, quantiles: Sequence[float] = DEFAULT_QUANTILES) -> Dict[str, Any]:
+        """Per-metric count/min/max/mean/std and quantile estimates."""
+        return {
+            "records": self.records,
+            "relative_accuracy": self.relative_accuracy,
+            "metrics": {key: agg.summary(quantiles) for key, agg in self.metrics.items()},
+        }
+
+
+def _aggregate_source(
+    source: Path, relative_accuracy: float, validate: bool = False
+) -> Tuple[CohortAggregator, List[Tuple[Any, List[str]]]]:
+    """Aggregate one input; with ``validate``, also return its rejected records with their reasons."""
+    from batch import iter_batch_records
+    from cohort_file import CohortFile, is_cohort_file
+
+    rejected: List[Tuple[Any, List[str]]] = []
+    if is_cohort_file(source):
+        # Converted (and validated) once by --columnar: aggregate the mapped columns directly.
+        aggregator = CohortAggregator(relative_accuracy)
+        with CohortFile(source) as cohort:
+            columns = [cohort.columns[key] for key in CohortAggregator.keys()]
+            for start in range(0, len(cohort), CHUNK):
+                aggregator.add_columns([c[start:start + CHUNK] for c in columns])
+            del columns
+        return aggregator, rejected
+    if validate:
+        from validate import default_validator, rejection
+
+        validator = default_validator()
+
+        def accepted() -> Iterator[Dict[str, Any]]:
+            for r in iter_batch_records(source):
+                # Valid records cost one validator call; rejection() only runs for the bad ones.
+                if r.data is not None and not validator(r.data):
+                    yield r.data
+                else:
+                    rejected.append((r, rejection(r, validator)))
+
+        records: Iterable[Dict[str, Any]] = accepted()
+    else:
+        records = (r.data for r in iter_batch_records(source) if r.data is not None)
+    return CohortAggregator(relative_accuracy).add_many(records), rejected
+
+
+def aggregate_sources(
+    sources: Sequence[Path],
+    workers: Optional[int] = None,
+    relative_accuracy: float = 0.01,
+    quarantine: Any = None,
+) -> CohortAggregator:
+    """
+    Aggregate several inputs (e.g. the shards of ``data_gen.generate_bulk``),
+    one worker process per input at a time, and merge the partial states.
+    Malformed records are skipped; with a ``validate.Quarantine`` records are
+    validated in the workers and the rejected ones written to it by this process.
+    """
+    workers = max(1, min(workers or os.cpu_count() or 1, len(sources) or 1))
+    validate = quarantine is not None
+    total = CohortAggregator(relative_accuracy)
+    if workers == 1:
+        parts: Iterable[Tuple[CohortAggregator, List[Tuple[Any, List[str]]]]] = (
+            _aggregate_source(Path(source), relative_accuracy, validate) for source in sources)
+        pool = None
+    else:
+        pool = ProcessPoolExecutor(max_workers=workers)
+        parts = pool.map(_aggregate_source, [Path(s) for s in sources], [relative_accuracy] * len(sources),
+                         [validate] * len(sources))
+    try:
+        for part, rejected in parts:
+            total.merge(part)
+            for record, reasons in rejected:
+                quarantine.add(record, reasons)
+    finally:
+        if pool is not None:
+            pool.shutdown()
+    return total
+
+
+def summary_rows(summary: Dict[str, Any]) -> List[Dict[str, Any]]:
+    """Table rows of a ``CohortAggregator.summary`` for the summary template."""
+    rows = []
+    for key, m in summary["metrics"].items():
+        vessel, _, metric = key.partition(".")
+        rows.append({"vessel": vessel if metric else "", "metric": metric or key, **m})
+    return rows
+
+
+def write_summary(
+    aggregator: CohortAggregator,
+    out_dir: Path,
+    template_dir: Path,
+    output_format: str = "pdf",
+    quantiles: Sequence[float] = DEFAULT_QUANTILES,
+    renderer: Any = None,
+    elapsed_s: Optional[float] = None,
+) -> Dict[str, Any]:
+    """
+    Write ``cohort_summary.json``, ``cohort_summary.html`` (from
+    ``cohort_summary_template.html``) and, for ``output_format="pdf"``,
+    ``cohort_summary.pdf``. Returns the summary.
+    """
+    from main import write_pdf_from_html
+
+    if renderer is None:
+        from renderer import default_renderer
+
+        renderer = default_renderer()
+
+    summary = aggregator.summary(quantiles)
+    if elapsed_s is not None:
+        summary["elapsed_s"] = round(elapsed_s, 3)
+    out_dir.mkdir(parents=True, exist_ok=True)
+    (out_dir / "cohort_summary.json").write_text(json.dumps(summary, indent=2), encoding="utf-8")
+    html = renderer.render(Path(template_dir) / SUMMARY_TEMPLATE_NAME, {
+        "records": summary["records"],
+        "relative_accuracy": summary["relative_accuracy"],
+        "quantile_names": [f"p{q * 100:g}" for q in quantiles],
+        "rows": summary_rows(summary),
+        "generated": time.strftime("%Y-%m-%d %H:%M"),
+    })
+    (out_dir / "cohort_summary.html").write_text(html, encoding="utf-8")
+    if output_format == "pdf":
+        write_pdf_from_html(html, out_dir / "cohort_summary.pdf")
+    return summary
@@ -0,0 +1,279 @@
+from __future__ import annotations
+
+import math
+from dataclasses import dataclass, fields
+from itertools import islice
+from typing import Any, Dict, Iterable, List, Tuple
+
+import numpy as np
+
+from record import METRICS, VESSELS, PatientRecord
+
+_VESSEL_INDEX = {v: i for i, v in enumerate(VESSELS)}
+_METRIC_INDEX = {m: i for i, m in enumerate(METRICS)}
+# Exact-mean integer arithmetic needs per-row exponents within this spread (see _exact_nanmean).
+_MAX_EXPONENT_SPREAD = 7
+
+
+@dataclass(frozen=True)
+class CohortColumns:
+    """
+    Columnar view of many patient records.
+
+    Attributes:
+        values: float64 array (patient x vessel x metric); NaN where a metric is missing.
+        ratio: float64 array (patient,); NaN where ``ica_cca_ratio`` is missing.
+        fallback: bool array; True for records the columnar layout cannot represent
+            faithfully (unknown vessels, non-finite numbers, ...). These must be
+            analyzed one by one with ``analysis.analyze``.
+    """
+    values: np.ndarray
+    ratio: np.ndarray
+    fallback: np.ndarray
+
+    def __len__(self) -> int:
+        return int(self.ratio.shape[0])
+
+
+_KNOWN_KEYS = frozenset(VESSELS) | {"ica_cca_ratio"}
+_NO_METRICS = (None,) * len(METRICS)
+CHUNK = 8192
+
+
+def _as_finite(val: Any) -> float:
+    """float(val) for a finite int/float in the exact-mean range, else raise ValueError."""
+    f = float(val)
+    if not math.isfinite(f) or (f != 0.0 and not 1e-300 < abs(f) < 1e300):
+        raise ValueError(val)
+    return f
+
+
+def _record_row(data: Any) -> Tuple[List[float], float, bool]:
+    """Careful per-record conversion: (flat vessel x metric row, ratio, representable)."""
+    nan = math.nan
+    row = [nan] * (len(VESSELS) * len(METRICS))
+    ratio = nan
+    vitals = data.get("vitals", {}) if isinstance(data, dict) else None
+    if not isinstance(vitals, dict):
+        return row, ratio, False
+    try:
+        for vessel, payload in vitals.items():
+            if vessel == "ica_cca_ratio":
+                if isinstance(payload, (int, float)):
+                    ratio = _as_finite(payload)
+                continue
+            if not isinstance(payload, dict):
+                continue
+            vi = _VESSEL_INDEX.get(vessel)
+            if vi is None:
+                raise ValueError(vessel)
+            for metric, mi in _METRIC_INDEX.items():
+                val = payload.get(metric)
+                if isinstance(val, (int, float)):
+                    row[vi * len(METRICS) + mi] = _as_finite(val)
+    except (ValueError, OverflowError):
+        return row, ratio, False
+    return row, ratio, True
+
+
+def _convert_chunk(records: List[Any]) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """
+    Fast conversion of a chunk: gather raw values with plain dict lookups and let
+    NumPy do the float conversion; anything unusual sends the chunk (or the
+    record) through ``_record_row``. A chunk of compact ``PatientRecord`` is
+    copied from their arrays; records in a mixed chunk are converted to dicts.
+    """
+    if records and all(type(r) is PatientRecord and r.compact for r in records):
+        return _convert_records(records)
+    records = [r.to_dict() if type(r) is PatientRecord else r for r in records]
+    rows: List[Any] = []
+    ratios: List[Any] = []
+    nones: List[int] = []
+    fallback: List[bool] = []
+    empty: Dict[str, Any] = {}
+    for data in records:
+        vitals = data.get("vitals", empty) if type(data) is dict else None
+        if type(vitals) is not dict or not vitals.keys() <= _KNOWN_KEYS:
+            rows.append(_NO_METRICS * len(VESSELS))
+            ratios.append(None)
+            nones.append(-1)
+            fallback.append(True)
+            continue
+        row: List[Any] = []
+        for vessel in VESSELS:
+            payload = vitals.get(vessel)
+            if type(payload) is dict:
+                row += [payload.get(m) for m in METRICS]
+            else:
+                row += _NO_METRICS
+        rows.append(row)
+        ratios.append(vitals.get("ica_cca_ratio"))
+        nones.append(row.count(None))
+        fallback.append(False)
+
+    try:
+        values = np.array(rows, dtype=np.float64)
+        ratio = np.array(ratios, dtype=np.float64)
+    except (TypeError, ValueError, OverflowError):
+        converted = [_record_row(d) for d in records]
+        return (
+            np.array([c[0] for c in converted], dtype=np.float64),
+            np.array([c[1] for c in converted], dtype=np.float64),
+            np.array([not c[2] for c in converted], dtype=bool),
+        )
+
+    fb = np.array(fallback, dtype=bool)
+    # NaN in the input would be indistinguishable from "missing"; such records,
+    # and values outside the exact-mean range, take the scalar path.
+    fb |= np.isnan(values).sum(axis=1) != np.array(nones)
+    fb |= np.isnan(ratio) != np.array([r is None for r in ratios])
+    return values, ratio, fb | _out_of_range(values, ratio)
+
+
+def _convert_records(records: List[PatientRecord]) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """Compact records already hold float64 rows with NaN for missing values: copy them in one go."""
+    values = np.frombuffer(b"".join([r.metrics.tobytes() for r in records]), dtype=np.float64)
+    values = values.reshape(len(records), len(VESSELS) * len(METRICS))
+    ratio = np.fromiter((r.ratio for r in records), dtype=np.float64, count=len(records))
+    return values, ratio, _out_of_range(values, ratio)
+
+
+def _out_of_range(values: np.ndarray, ratio: np.ndarray) -> np.ndarray:
+    """Rows with a value outside the exact-mean range."""
+    magnitude = np.abs(np.concatenate([values, ratio[:, None]], axis=1))
+    with np.errstate(invalid="ignore"):
+        out_of_range = (magnitude != 0) & ~np.isnan(magnitude) & ((magnitude <= 1e-300) | (magnitude >= 1e300))
+    return out_of_range.any(axis=1)
+
+
+def to_columns(records: Iterable[Any]) -> CohortColumns:
+    """
+    Convert records (input JSON schema) into a ``CohortColumns`` in one pass,
+    processing them in fixed-size chunks.
+    """
+    values: List[np.ndarray] = []
+    ratios: List[np.ndarray] = []
+    fallback: List[np.ndarray] = []
+    it = iter(records)
+    while True:
+        chunk = list(islice(it, CHUNK))
+        if not chunk:
+            break
+        v, r, f = _convert_chunk(chunk)
+        values.append(v)
+        ratios.append(r)
+        fallback.append(f)
+    if not values:
+        values, ratios, fallback = [np.empty((0, len(VESSELS) * len(METRICS)))], [np.empty(0)], [np.empty(0, dtype=bool)]
+    n = sum(len(r) for r in ratios)
+    return CohortColumns(
+        values=np.concatenate(values).reshape(n, len(VESSELS), len(METRICS)),
+        ratio=np.concatenate(ratios),
+        fallback=np.concatenate(fallback),
+    )
+
+
+def _exact_nanmean(x: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Row-wise mean of ``x`` (rows x k) ignoring NaN, correctly rounded like
+    ``statistics.mean`` (exact sum, one final rounding).
+
+    Every float is split into a 53-bit integer mantissa and an exponent; per row
+    the mantissas are aligned to the smallest exponent and summed exactly in
+    int64. The integer quotient is rounded to odd and then converted to float64,
+    which gives the correctly rounded result. Rows whose exponents are too far
+    apart for int64 are reported in the second return value.
+
+    Returns:
+        (means, inexact) where ``inexact`` marks rows that need the scalar path.
+    """
+    valid = ~np.isnan(x)
+    count = valid.sum(axis=1)
+    xs = np.where(valid, x, 0.0)
+    mant, exp = np.frexp(xs)
+    nonzero = xs != 0.0
+    big = np.iinfo(np.int32).max
+    e_min = np.where(nonzero, exp, big).min(axis=1)
+    e_max = np.where(nonzero, exp, -big).max(axis=1)
+    all_zero = ~nonzero.any(axis=1)
+    e_min = np.where(all_zero, 0, e_min)
+    inexact = ~all_zero & (e_max - e_min > _MAX_EXPONENT_SPREAD)
+
+    shift = np.where(nonzero & ~inexact[:, None], exp - e_min[:, None], 0).astype(np.int64)
+    m_int = np.ldexp(mant, 53).astype(np.int64)
+    total = (m_int << shift).sum(axis=1)
+
+    sign = np.sign(total)
+    a = np.abs(total)
+    safe_a = np.where(a == 0, 1, a)
+    lg = np.frexp(safe_a.astype(np.float64))[1].astype(np.int64) - 1
+    k = np.maximum(0, 60 - lg)
+    scaled = safe_a << k
+    n = np.maximum(count, 1).astype(np.int64)
+    q = scaled // n
+    q |= (scaled % n != 0).astype(np.int64)
+    means = sign * np.ldexp(q.astype(np.float64), (e_min - 53 - k).astype(np.int32))
+    means = np.where(count == 0, np.nan, means)
+    return means, inexact
+
+
+@dataclass(frozen=True)
+class CohortStats:
+    """
+    Vectorized per-patient statistics (row i belongs to patient i).
+
+    ``minimum``/``maximum``/``mean``/``count`` are (patient x metric) arrays with
+    NaN/0 where a metric has no values. ``highest_psv`` is the ``VESSELS`` index
+    of the highest PSV or -1. ``fallback`` marks rows whose results must come
+    from the scalar ``analysis.analyze`` instead.
+    """
+    minimum: np.ndarray
+    maximum: np.ndarray
+    mean: np.ndarray
+    count: np.ndarray
+    highest_psv: np.ndarray
+    ratio: np.ndarray
+    fallback: np.ndarray
+
+
+def reduce_columns(cols: CohortColumns) -> CohortStats:
+    """Compute per-patient min/max/mean and highest-PSV vessel with vectorized reductions."""
+    values = cols.values
+    n = len(cols)
+    valid = ~np.isnan(values)
+    count = valid.sum(axis=1)
+    minimum = np.where(valid, values, np.inf).min(axis=1)
+    maximum = np.where(valid, values, -np.inf).max(axis=1)
+    minimum = np.where(count == 0, np.nan, minimum)
+    maximum = np.where(count == 0, np.nan, maximum)
+
+    mean = np.empty((n, len(METRICS)), dtype=np.float64)
+    fallback = cols.fallback.copy()
+    for mi in range(len(METRICS)):
+        mean[:, mi], inexact = _exact_nanmean(values[:, :, mi])
+        fallback |= inexact
+
+    psv = values[:, :, _METRIC_INDEX["psv_cm_s"]]
+    psv_valid = ~np.isnan(psv)
+    psv_filled = np.where(psv_valid, psv, -np.inf)
+    highest = np.where(psv_valid.any(axis=1), psv_filled.argmax(axis=1), -1)
+    # With ties, analyze() picks the first vessel in the record's own key order.
+    ties = (psv_filled == psv_filled.max(axis=1, keepdims=True)).sum(axis=1) > 1
+    fallback |= ties & psv_valid.any(axis=1)
+
+    return CohortStats(
+        minimum=minimum,
+        maximum=maximum,
+        mean=mean,
+        count=count,
+        highest_psv=highest,
+        ratio=cols.ratio,
+        fallback=fallback,
+    )
+
+
+def concat_stats(parts: List[CohortStats]) -> CohortStats:
+    """Join the ``CohortStats`` of consecutive chunks into one."""
+    if len(parts) == 1:
+        return parts[0]
+    return CohortStats(**{f.name: np.concatenate([getattr(p, f.name) for p in parts]) for f in fields(CohortStats)})
@@ -0,0 +1,120 @@
+from __future__ import annotations
+
+import json
+import time
+from dataclasses import asdict, dataclass, field
+from pathlib import Path
+from typing import Any, Dict, Iterable, Iterator, List, Optional, Union
+
+from batch import BatchRecord, iter_batch_records
+from instrument import span
+from main import report_payload
+
+COHORT_TEMPLATE_NAME = "cohort_template.html"
+_ANCHOR_PREFIX = "patient-"
+
+
+@dataclass
+class ConsolidatedSummary:
+    """Outcome of a consolidated run; ``reports`` is the per-patient page index."""
+    patients: int = 0
+    pages: Optional[int] = None
+    reports: List[Dict[str, Any]] = field(default_factory=list)
+    skipped: List[Dict[str, Any]] = field(default_factory=list)
+    elapsed_s: float = 0.0
+
+    def to_dict(self) -> Dict[str, Any]:
+        return asdict(self)
+
+
+def _payloads(records: Iterable[BatchRecord], summary: ConsolidatedSummary) -> Iterator[Dict[str, Any]]:
+    """Template payloads of the valid records; the rest are listed in ``summary.skipped``."""
+    for record in records:
+        if record.data is None:
+            summary.skipped.append({"source": record.source, "error": record.error})
+            continue
+        try:
+            payload = report_payload(record.data)
+        except Exception as e:  # noqa: BLE001 - one bad record must not stop the document
+            summary.skipped.append({"source": record.source, "error": f"{type(e).__name__}: {e}"})
+            continue
+        payload["index"] = summary.patients
+        summary.reports.append({
+            "index": summary.patients,
+            "source": record.source,
+            "patient_id": payload["patient_id"],
+        })
+        summary.patients += 1
+        yield payload
+
+
+def _page_ranges(pages: List[Any], count: int) -> List[Optional[List[int]]]:
+    """1-based ``[first, last]`` page of each of ``count`` patients, from the section anchors."""
+    first: List[Optional[int]] = [None] * count
+    for number, page in enumerate(pages, start=1):
+        for anchor in page.anchors:
+            if anchor.startswith(_ANCHOR_PREFIX):
+                i = int(anchor[len(_ANCHOR_PREFIX):])
+                if 0 <= i < count and first[i] is None:
+                    first[i] = number
+    ranges: List[Optional[List[int]]] = [None] * count
+    next_start = len(pages) + 1
+    for i in range(count - 1, -1, -1):
+        start = first[i]
+        if start is not None:
+            ranges[i] = [start, max(start, next_start - 1)]
+            next_start = start
+    return ranges
+
+
+def write_consolidated(
+    source: Union[Path, Iterable[BatchRecord]],
+    out_dir: Path,
+    template_dir: Path,
+    output_format: str = "pdf",
+    renderer: Any = None,
+) -> ConsolidatedSummary:
+    """
+    Render every record of ``source`` into one document: ``cohort.html`` and,
+    for ``output_format="pdf"``, ``cohort.pdf``, plus ``cohort_index.json``.
+
+    Each patient is a ``<section>`` of ``cohort_template.html`` that starts on a
+    new page, so WeasyPrint lays out, embeds fonts and parses styles once for
+    the whole cohort. The HTML is streamed to disk with Jinja2's ``generate()``
+    while the records are read, so no cohort-sized string is ever built.
+    WeasyPrint itself still holds the layout of the whole document; split very
+    large cohorts into several runs.
+
+    The index lists every patient with its source, patient id and (PDF only)
+    the 1-based ``[first, last]`` page range found from the section anchors,
+    e.g. for ``qpdf cohort.pdf --pages . 3-4 -- one.pdf``. Malformed records
+    are listed under ``skipped``. ``source`` is an input path or an iterable of
+    ``BatchRecord`` objects (e.g. a ``store.PatientStore.select`` query).
+    """
+    if renderer is None:
+        from renderer import default_renderer
+
+        renderer = default_renderer()
+
+    started = time.perf_counter()
+    out_dir.mkdir(parents=True, exist_ok=True)
+    summary = ConsolidatedSummary()
+    records = iter_batch_records(source) if isinstance(source, Path) else source
+    template = renderer.get_template(Path(template_dir) / COHORT_TEMPLATE_NAME)
+    html_path = out_dir / "cohort.html"
+    with span("template"), html_path.open("w", encoding="utf-8") as f:
+        f.writelines(template.generate(reports=_payloads(records, summary)))
+
+    if output_format == "pdf":
+        from weasyprint import HTML
+
+        with span("pdf", patients=summary.patients):
+            document = HTML(filename=str(html_path)).render()
+            summary.pages = len(document.pages)
+            for entry, pages in zip(summary.reports, _page_ranges(document.pages, summary.patients)):
+                entry["pages"] = pages
+            document.write_pdf(str(out_dir / "cohort.pdf"))
+
+    summary.elapsed_s = round(time.perf_counter() - started, 3)
+    (out_dir / "cohort_index.json").write_text(json.dumps(summary.to_dict(), indent=2), encoding="utf-8")
+    return summary
@@ -1,8 +1,12 @@
 from __future__ import annotations
 
+import gzip
+import os
 import random
+from concurrent.futures import ProcessPoolExecutor
 from datetime import date
-from typing import Any, Dict, Optional
+from pathlib import Path
+from typing import Any, Dict, Iterator, List, Optional, Tuple
 
 
 def _rand_range(rng: random.Random, low: float, high: float, nd: int = 1) -> float:
@@ -57,3 +61,151 @@ def generate_mock(seed: Optional[int] = None) -> Dict[str, Any]:
         },
     }
     return record
+
+
+# --- Bulk generation ---------------------------------------------------------
+
+# Records are drawn in blocks of this size; record ``i`` comes from block
+# ``i // BULK_BLOCK`` whose generator is seeded from ``(seed, block)`` only, so
+# every record is deterministic regardless of sharding or worker count.
+BULK_BLOCK = 65536
+_NAMES = ("alex martin", "casey lee", "jordan taylor", "morgan kim")
+_SEXES = ("unknown", "female", "male")
+# Field order of _LINE; must match _row_to_dict.
+_LINE = (
+    '{"patient_id": "%s", "name": "%s", "timestamp": "%s", '
+    '"context": {"age_years": %d, "sex": "%s", "notes": "Mock record"}, '
+    '"vitals": {"CCA": {"psv_cm_s": %r, "edv_cm_s": %r, "imt_mm": %r}, '
+    '"ICA": {"psv_cm_s": %r, "edv_cm_s": %r, "imt_mm": %r}, '
+    '"ECA": {"psv_cm_s": %r, "edv_cm_s": %r}, "ica_cca_ratio": %r}}\n'
+)
+
+
+def _block_rows(seed: int, block: int, lo: int, hi: int, timestamp: str) -> List[Tuple[Any, ...]]:
+    """Rows ``lo:hi`` (offsets within the block) of block ``block``, drawn vectorized with NumPy."""
+    import numpy as np
+
+    rng = np.random.default_rng(np.random.SeedSequence(seed, spawn_key=(block,)))
+    n = BULK_BLOCK
+
+    def uniform(low: float, high: float, nd: int) -> List[float]:
+        return np.round(rng.uniform(low, high, n), nd)[lo:hi].tolist()
+
+    # Same broad, non-medical ranges as generate_mock.
+    cca_psv = np.round(rng.uniform(50, 200, n), 1)
+    ica_psv = np.round(rng.uniform(70, 250, n), 1)
+    cols = [
+        uniform(10, 40, 1), uniform(0.4, 1.2, 2),
+        uniform(15, 60, 1), uniform(0.4, 1.2, 2),
+        uniform(40, 180, 1), uniform(5, 35, 1),
+    ]
+    ratio = np.round(ica_psv / cca_psv, 2)[lo:hi].tolist()
+    names = np.array(_NAMES)[rng.integers(0, len(_NAMES), n)][lo:hi].tolist()
+    ages = rng.integers(20, 86, n)[lo:hi].tolist()
+    sexes = np.array(_SEXES)[rng.integers(0, len(_SEXES), n)][lo:hi].tolist()
+    first = block * BULK_BLOCK + lo
+    ids = [f"M{i:09d}" for i in range(first, first + hi - lo)]
+    return list(zip(
+        ids, names, [timestamp] * (hi - lo), ages, sexes,
+        cca_psv[lo:hi].tolist(), cols[0], cols[1],
+        ica_psv[lo:hi].tolist(), cols[2], cols[3],
+        cols[4], cols[5], ratio,
+    ))
+
+
+def _row_to_dict(row: Tuple[Any, ...]) -> Dict[str, Any]:
+    pid, name, ts, age, sex, c_psv, c_edv, c_imt, i_psv, i_edv, i_imt, e_psv, e_edv, ratio = row
+    return {
+        "patient_id": pid,
+        "name": name,
+        "timestamp": ts,
+        "context": {"age_years": age, "sex": sex, "notes": "Mock record"},
+        "vitals": {
+            "CCA": {"psv_cm_s": c_psv, "edv_cm_s": c_edv, "imt_mm": c_imt},
+            "ICA": {"psv_cm_s": i_psv, "edv_cm_s": i_edv, "imt_mm": i_imt},
+            "ECA": {"psv_cm_s": e_psv, "edv_cm_s": e_edv},
+            "ica_cca_ratio": ratio,
+        },
+    }
+
+
+def _iter_rows(start: int, stop: int, seed: int, timestamp: str) -> Iterator[List[Tuple[Any, ...]]]:
+    """Rows of records ``start:stop``, one block (or part of one) at a time."""
+    i = start
+    while i < stop:
+        block, lo = divmod(i, BULK_BLOCK)
+        hi = min(BULK_BLOCK, lo + stop - i)
+        yield _block_rows(seed, block, lo, hi, timestamp)
+        i += hi - lo
+
+
+def iter_mock_records(
+    count: int, seed: int = 0, start: int = 0, timestamp: Optional[str] = None
+) -> Iterator[Dict[str, Any]]:
+    """
+    Yield mock records ``start .. start + count - 1`` with unique ids (``M000000000``, ...).
+
+    Record ``i`` depends only on ``seed`` and ``i``. Values are drawn with
+    NumPy a block at a time, so memory stays bounded for any ``count``.
+    """
+    ts = timestamp or str(date.today())
+    for rows in _iter_rows(start, start + count, seed, ts):
+        yield from map(_row_to_dict, rows)
+
+
+def write_mock_shard(
+    path: Path, start: int, stop: int, seed: int = 0, timestamp: Optional[str] = None
+) -> int:
+    """Write records ``start:stop`` to a JSONL file (gzip-compressed if ``path`` ends in ``.gz``)."""
+    ts = timestamp or str(date.today())
+    path.parent.mkdir(parents=True, exist_ok=True)
+    opener = gzip.open if path.suffix == ".gz" else open
+    with opener(path, "wt", encoding="utf-8") as f:
+        for rows in _iter_rows(start, stop, seed, ts):
+            f.write("".join([_LINE % row for row in rows]))
+    return stop - start
+
+
+def generate_bulk(
+    count: int,
+    out_dir: Path,
+    shards: Optional[int] = None,
+    workers: Optional[int] = None,
+    seed: int = 0,
+    compress: bool = False,
+    timestamp: Optional[str] = None,
+) -> List[Path]:
+    """
+    Write ``count`` mock records as sharded JSONL files using parallel worker processes.
+
+    Shard ``k`` holds a contiguous range of record indices and is written to
+    ``out_dir/mock-<k>-of-<shards>.jsonl[.gz]``. The output is identical for any
+    ``workers`` value, and each worker holds one block of records at a time.
+
+    Args:
+        count: Number of records.
+        out_dir: Output directory.
+        shards: Number of files (default: ``workers``).
+        workers: Worker processes (default: ``os.cpu_count()``).
+        seed: Base seed; record ``i`` is a function of ``(seed, i)``.
+        compress: Write ``.jsonl.gz`` instead of ``.jsonl``.
+        timestamp: ``timestamp`` field of every record (default: today).
+
+    Returns:
+        Paths of the written shards.
+    """
+    workers = max(1, workers or os.cpu_count() or 1)
+    shards = max(1, min(shards or workers, count or 1))
+    ts = timestamp or str(date.today())
+    suffix = ".jsonl.gz" if compress else ".jsonl"
+    bounds = [count * k // shards for k in range(shards + 1)]
+    paths = [Path(out_dir) / f"mock-{k:05d}-of-{shards:05d}{suffix}" for k in range(shards)]
+    jobs = [(p, bounds[k], bounds[k + 1], seed, ts) for k, p in enumerate(paths)]
+    if workers == 1 or shards == 1:
+        for job in jobs:
+            write_mock_shard(*job)
+        return paths
+    with ProcessPoolExecutor(max_workers=min(workers, shards)) as pool:
+        for _ in pool.map(write_mock_shard, *zip(*jobs)):
+            pass
+    return paths
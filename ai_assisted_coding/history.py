@@ -0,0 +1,207 @@
+from __future__ import annotations
+
+import json
+import sqlite3
+from dataclasses import asdict, dataclass, field
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+
+from store import _METRIC_COLUMNS, _number
+
+# Exams a rolling mean covers.
+TREND_WINDOW = 5
+_METRIC_LABELS: Dict[str, str] = {
+    column: ("ICA/CCA PSV ratio" if vessel is None else
+             f"{vessel} {metric.split('_')[0].upper()} ({'mm' if metric == 'imt_mm' else 'cm/s'})")
+    for column, vessel, metric in _METRIC_COLUMNS
+}
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS exams (
+    patient_id TEXT NOT NULL, timestamp TEXT NOT NULL, metrics TEXT NOT NULL,
+    PRIMARY KEY (patient_id, timestamp)) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS trends (
+    patient_id TEXT PRIMARY KEY, exams INTEGER NOT NULL, first_timestamp TEXT NOT NULL,
+    last_timestamp TEXT NOT NULL, window INTEGER NOT NULL, state TEXT NOT NULL);
+"""
+# Per metric: [latest, previous, [last ``window`` values]]; exams without the metric are skipped.
+_State = List[List[Any]]
+
+
+def exam_metrics(data: Dict[str, Any]) -> List[Optional[float]]:
+    """The exam's values of the ``store`` metric columns (None where missing or not a number)."""
+    vitals = data.get("vitals")
+    vitals = vitals if isinstance(vitals, dict) else {}
+    values: List[Optional[float]] = []
+    for _, vessel, metric in _METRIC_COLUMNS:
+        source = vitals if vessel is None else vitals.get(vessel)
+        values.append(_number(source.get(metric)) if isinstance(source, dict) else None)
+    return values
+
+
+def _empty_state() -> _State:
+    return [[None, None, []] for _ in _METRIC_COLUMNS]
+
+
+def _advance(state: _State, values: Sequence[Optional[float]], window: int) -> None:
+    """Fold one exam into ``state``: a fixed amount of work, whatever the length of the history."""
+    for metric, value in zip(state, values):
+        if value is None:
+            continue
+        metric[1], metric[0] = metric[0], value
+        recent = metric[2]
+        recent.append(value)
+        if len(recent) > window:
+            del recent[0]
+
+
+@dataclass(frozen=True)
+class MetricTrend:
+    """One metric of a patient's history: latest value, change from the previous one, rolling mean."""
+    metric: str
+    label: str
+    latest: float
+    previous: Optional[float]
+    delta: Optional[float]
+    mean: float
+    n: int
+
+
+@dataclass(frozen=True)
+class PatientTrend:
+    """Running aggregates of a patient's exams up to ``last_timestamp``."""
+    patient_id: str
+    exams: int
+    first_timestamp: str
+    last_timestamp: str
+    window: int
+    metrics: List[MetricTrend] = field(default_factory=list)
+
+    @classmethod
+    def from_state(cls, patient_id: str, exams: int, first: str, last: str, window: int,
+                   state: _State) -> "PatientTrend":
+        metrics = []
+        for (column, _, _), (latest, previous, recent) in zip(_METRIC_COLUMNS, state):
+            if latest is None:
+                continue
+            delta = None if previous is None else round(latest - previous, 4)
+            metrics.append(MetricTrend(column, _METRIC_LABELS[column], latest, previous, delta,
+                                       round(sum(recent) / len(recent), 4), len(recent)))
+        return cls(patient_id, exams, first, last, window, metrics)
+
+    def to_dict(self) -> Dict[str, Any]:
+        """Template variables of the report's trend section."""
+        return asdict(self)
+
+
+class ExamHistory:
+    """
+    Exams per patient (patient id, timestamp and the ``store`` metric columns)
+    with running aggregates kept next to them: for each metric the latest value,
+    its change from the previous exam and the mean of the last ``window`` exams.
+
+    ``append`` updates a patient's aggregates from their stored state, without
+    reading the earlier exams, so an exam costs the same however long the
+    history is. An exam older than the patient's latest one, or a second exam
+    at the same timestamp (which replaces the first), is folded in by replaying
+    that patient's exams in timestamp order; its trend is then the one as of
+    its own timestamp.
+
+    Writes are committed every ``commit_every`` appends and on ``close``.
+
+    Args:
+        path: SQLite file (created if missing).
+        window: Exams covered by the rolling mean, fixed when the file is created.
+        commit_every: Appends per transaction.
+    """
+
+    def __init__(self, path: Path, window: int = TREND_WINDOW, commit_every: int = 1000) -> None:
+        self.path = Path(path)
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self.window = window
+        self.commit_every = max(1, commit_every)
+        self._pending = 0
+        self._db = sqlite3.connect(str(self.path), timeout=30)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("PRAGMA synchronous=NORMAL")
+        self._db.executescript(_SCHEMA)
+
+    def close(self) -> None:
+        self._db.commit()
+        self._db.close()
+
+    def __enter__(self) -> "ExamHistory":
+        return self
+
+    def __exit__(self, *exc: Any) -> None:
+        self.close()
+
+    def __len__(self) -> int:
+        return self._db.execute("SELECT COUNT(*) FROM exams").fetchone()[0]
+
+    def append(self, data: Dict[str, Any]) -> Optional[PatientTrend]:
+        """Add one exam and return the patient's trend including it (None without a ``patient_id``)."""
+        pid = data.get("patient_id")
+        if pid is None or pid == "":
+            return None
+        pid = str(pid)
+        timestamp = data.get("timestamp")
+        timestamp = "" if timestamp is None else str(timestamp)
+        values = exam_metrics(data)
+        row = self._db.execute(
+            "SELECT exams, first_timestamp, last_timestamp, window, state FROM trends WHERE patient_id = ?", (pid,)
+        ).fetchone()
+        self._db.execute("INSERT OR REPLACE INTO exams VALUES (?, ?, ?)", (pid, timestamp, json.dumps(values)))
+        if row is None:
+            exams, first, window, state = 0, timestamp, self.window, _empty_state()
+        else:
+            exams, first, last, window, state = row
+            state = json.loads(state)
+        if row is None or timestamp > last:
+            _advance(state, values, window)
+            trend = PatientTrend.from_state(pid, exams + 1, first, timestamp, window, state)
+            self._save(trend, state)
+        else:  # back-filled, or replacing the exam at this timestamp: replay this patient's exams
+            trend, _ = self._replay(pid, window, until=timestamp)
+            self._save(*self._replay(pid, window))
+        self._pending += 1
+        if self._pending >= self.commit_every:
+            self.commit()
+        return trend
+
+    def _save(self, trend: PatientTrend, state: _State) -> None:
+        self._db.execute("INSERT OR REPLACE INTO trends VALUES (?, ?, ?, ?, ?, ?)", (
+            trend.patient_id, trend.exams, trend.first_timestamp, trend.last_timestamp, trend.window,
+            json.dumps(state)))
+
+    def _replay(self, pid: str, window: int, until: Optional[str] = None) -> Tuple[PatientTrend, _State]:
+        sql, params = "SELECT timestamp, metrics FROM exams WHERE patient_id = ?", [pid]
+        if until is not None:
+            sql += " AND timestamp <= ?"
+            params.append(until)
+        state, exams, first, last = _empty_state(), 0, "", ""
+        for timestamp, metrics in self._db.execute(sql + " ORDER BY timestamp", params):
+            _advance(state, json.loads(metrics), window)
+            first = timestamp if exams == 0 else first
+            exams, last = exams + 1, timestamp
+        return PatientTrend.from_state(pid, exams, first, last, window, state), state
+
+    def commit(self) -> None:
+        self._db.commit()
+        self._pending = 0
+
+    def trend(self, patient_id: str) -> Optional[PatientTrend]:
+        """The patient's current trend, None for an unknown patient."""
+        row = self._db.execute(
+            "SELECT exams, first_timestamp, last_timestamp, window, state FROM trends WHERE patient_id = ?",
+            (str(patient_id),),
+        ).fetchone()
+        if row is None:
+            return None
+        exams, first, last, window, state = row
+        return PatientTrend.from_state(str(patient_id), exams, first, last, window, json.loads(state))
+
+    def exams(self, patient_id: str) -> List[Tuple[str, List[Optional[float]]]]:
+        """``(timestamp, metric values)`` of the patient's exams, oldest first."""
+        rows = self._db.execute("SELECT timestamp, metrics FROM exams WHERE patient_id = ? ORDER BY timestamp",
+                                (str(patient_id),))
+        return [(timestamp, json.loads(metrics)) for timestamp, metrics in rows]
@@ -0,0 +1,195 @@
+from __future__ import annotations
+
+import gzip
+import io
+import json
+import re
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Any, Dict, Iterator, Optional, TextIO
+
+from serialization import is_packed, iter_packed, loads
+
+_GZIP_MAGIC = b"\x1f\x8b"
+_READ_CHARS = 1 << 20
+# Records larger than this are reported as malformed instead of buffered further.
+MAX_RECORD_CHARS = 64 << 20
+# A JSON string (group 1 is its closing quote, missing if the buffer cuts it
+# off) or a structural character.
+_TOKEN = re.compile(r'"(?:[^"\\]|\\.)*(?:(")|\\?\Z)|[\[\]{},]', re.DOTALL)
+_WHITESPACE = re.compile(r"[ \t\n\r]*")
+_decode = json.JSONDecoder().raw_decode
+
+
+@dataclass(frozen=True)
+class Record:
+    """One input record, or a malformed one (``data`` None and ``error`` set)."""
+    line: int
+    data: Optional[Dict[str, Any]]
+    error: Optional[str] = None
+
+
+def open_text(path: Path) -> TextIO:
+    """Open ``path`` for reading text, decompressing gzip input transparently."""
+    with Path(path).open("rb") as f:
+        magic = f.read(2)
+    if magic == _GZIP_MAGIC:
+        return io.TextIOWrapper(gzip.open(path, "rb"), encoding="utf-8")
+    return Path(path).open("r", encoding="utf-8")
+
+
+def _record(line: int, text: str) -> Record:
+    try:
+        data = loads(text)
+    except ValueError as e:
+        return Record(line, None, f"{type(e).__name__}: {e}")
+    if not isinstance(data, dict):
+        return Record(line, None, "record is not a JSON object")
+    return Record(line, data)
+
+
+def _iter_lines(head: str, f: TextIO) -> Iterator[Record]:
+    """JSON lines: one record per non-empty line."""
+    lines = head.splitlines(keepends=True)
+    if lines and not lines[-1].endswith("\n"):
+        lines[-1] += f.readline()
+    for lineno, line in enumerate(_chain(lines, f), start=1):
+        if line.strip():
+            yield _record(lineno, line)
+
+
+def _chain(lines: list, f: TextIO) -> Iterator[str]:
+    yield from lines
+    yield from f
+
+
+def _scan_end(buf: str, start: int, in_array: bool) -> Optional[int]:
+    """
+    End offset of the record starting at ``start``, found from the JSON
+    structure alone (so it works for malformed records), or None if the buffer
+    ends before the record does.
+    """
+    depth = 0
+    for m in _TOKEN.finditer(buf, start):
+        tok = m.group(0)
+        if tok[0] == '"':
+            if m.group(1) is None:
+                return None
+            continue
+        if tok in "[{":
+            depth += 1
+        elif tok in "]}":
+            depth -= 1
+            if in_array and depth < 0:
+                return m.start()
+            if not in_array and depth <= 0:
+                return m.end()
+        elif in_array and depth == 0:
+            return m.start()
+    return None
+
+
+def _iter_values(head: str, f: TextIO) -> Iterator[Record]:
+    """
+    Top-level JSON values, or the elements of top-level arrays, decoded one at
+    a time so that only the current record is buffered. Records are decoded
+    with ``raw_decode``; when that fails, the record's extent is found from the
+    JSON structure so a malformed record is reported without losing the rest.
+    """
+    buf = head
+    line, counted = 1, 0  # ``line`` is the line number at buffer offset ``counted``
+    pos = 0
+    in_array = False
+    eof = False
+    while True:
+        pos = _WHITESPACE.match(buf, pos).end()
+        complete = None
+        if pos < len(buf):
+            c = buf[pos]
+            if c == "[" and not in_array:
+                in_array, pos = True, pos + 1
+                continue
+            if in_array and c in ",]":
+                in_array, pos = c == ",", pos + 1
+                continue
+            line += buf.count("\n", counted, pos)
+            counted = pos
+            try:
+                value, end = _decode(buf, pos)
+            except ValueError:
+                end = _scan_end(buf, pos, in_array)
+                if end is None and eof:
+                    end = len(buf)
+                if end is not None:
+                    yield _record(line, buf[pos:end])
+                    pos = end
+                    continue
+            else:
+                # A value ending right at the buffer end may be a cut-off number.
+                if end < len(buf) or eof:
+                    yield Record(line, value) if isinstance(value, dict) else Record(
+                        line, None, "record is not a JSON object")
+                    pos = end
+                    continue
+            complete = False
+        elif eof:
+            return
+
+        # Need more input: drop what has been consumed and read the next chunk.
+        line += buf.count("\n", counted, pos)
+        buf, counted = buf[pos:], 0
+        pos = 0
+        if complete is False and len(buf) > MAX_RECORD_CHARS:
+            yield Record(line, None, f"record exceeds {MAX_RECORD_CHARS} characters")
+            return
+        chunk = f.read(_READ_CHARS)
+        eof = not chunk
+        buf += chunk
+
+
+def iter_records(path: Path) -> Iterator[Record]:
+    """
+    Yield the patient records of ``path`` one at a time with bounded memory.
+
+    Accepts JSON lines, a JSON array of records, or one or more (pretty-printed)
+    JSON objects, optionally gzip-compressed, or a packed cohort (see
+    ``serialization.pack_records``); the format is detected from the content.
+    Malformed records are yielded with ``data=None``, an error message and the
+    line they start on (the record number for packed cohorts), and reading
+    continues with the next record.
+    """
+    if is_packed(path):
+        for number, data, error in iter_packed(path):
+            yield Record(number, data, error)
+        return
+    with open_text(path) as f:
+        head = f.read(_READ_CHARS)
+        body = head.lstrip()
+        if body[:1] == "{" and "\n" not in body:
+            # Decide on the whole first line; it holds at most the first record.
+            head += f.readline()
+            body = head.lstrip()
+        # JSON lines start with a complete object on the first line.
+        if body[:1] == "{" and body.split("\n", 1)[0].rstrip().endswith("}"):
+            yield from _iter_lines(head, f)
+        else:
+            yield from _iter_values(head, f)
+
+
+def load_record(path: Path) -> Dict[str, Any]:
+    """
+    Load the single patient record of ``path``.
+
+    Raises:
+        ValueError: If the file holds no record, a malformed record or more than one record.
+    """
+    found: Optional[Dict[str, Any]] = None
+    for record in iter_records(path):
+        if record.data is None:
+            raise ValueError(f"{path}:{record.line}: {record.error}")
+        if found is not None:
+            raise ValueError(f"{path} holds more than one record")
+        found = record.data
+    if found is None:
+        raise ValueError(f"{path} holds no record")
+    return found
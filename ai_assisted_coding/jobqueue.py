@@ -0,0 +1,373 @@
+"""
+Durable, resumable job queue for batch runs on one or several hosts.
+
+    python main.py --queue jobs.sqlite --batch cohort.jsonl --out out/batch --workers 8
+    python main.py --queue jobs.sqlite --workers 8     # join (e.g. on another host), or resume
+
+The first command splits the cohort into shards and renders them with
+``--workers`` local processes. Any number of further processes, on this or
+other hosts that see the same filesystem, can join the same queue. Killing
+any of them, or all, loses at most the patient each one was rendering:
+running the command again continues where the run stopped.
+"""
+from __future__ import annotations
+
+import json
+import multiprocessing
+import os
+import shutil
+import socket
+import sqlite3
+import time
+from dataclasses import dataclass
+from multiprocessing.connection import wait
+from pathlib import Path
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+from batch import BatchRecord, _record_dir_name
+from main import TEMPLATE_NAME, write_report
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT NOT NULL);
+CREATE TABLE IF NOT EXISTS shards (
+    id INTEGER PRIMARY KEY,
+    path TEXT NOT NULL,
+    records INTEGER NOT NULL,
+    state TEXT NOT NULL DEFAULT 'pending',  -- pending, leased, done or failed
+    owner TEXT,
+    lease_until REAL,
+    attempts INTEGER NOT NULL DEFAULT 0,
+    error TEXT
+);
+CREATE TABLE IF NOT EXISTS checkpoints (
+    shard INTEGER NOT NULL,
+    idx INTEGER NOT NULL,
+    patient_id TEXT,
+    out_dir TEXT,
+    error TEXT,
+    PRIMARY KEY (shard, idx)
+);
+"""
+
+# Per-process PDF engine of a queue worker, created on its first PDF.
+_worker_engine: Any = None
+
+
+@dataclass(frozen=True)
+class Lease:
+    """A shard claimed by one worker until ``until`` (epoch seconds) unless renewed."""
+    shard: int
+    path: str
+    owner: str
+    until: float
+
+
+@dataclass(frozen=True)
+class QueueStatus:
+    """Progress of a queue: shards per state and records checkpointed."""
+    shards: Dict[str, int]
+    records: int
+    done: int
+    failed: int
+
+    @property
+    def finished(self) -> bool:
+        return self.shards.get("pending", 0) == 0 and self.shards.get("leased", 0) == 0
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {"shards": self.shards, "records": self.records, "done": self.done, "failed": self.failed}
+
+
+def worker_id() -> str:
+    """Owner name of this process's leases: ``host:pid``."""
+    return f"{socket.gethostname()}:{os.getpid()}"
+
+
+class JobQueue:
+    """
+    SQLite queue of cohort shards with leases and per-patient checkpoints.
+
+    ``create`` streams a cohort once into JSON lines shard files of
+    ``shard_size`` records in ``<queue>.shards/``, so every input that
+    ``--batch`` reads works and a worker reads only its own shard. Records
+    keep their index and source, hence their ``run_batch`` output folder.
+
+    A worker ``claim``s the first pending shard, or one whose lease expired
+    (its worker died), in one ``BEGIN IMMEDIATE`` transaction. Every rendered
+    patient is checkpointed in a transaction that also extends the lease, so
+    a live worker keeps its shard and a restarted claim skips the patients
+    already done. A worker that finds its lease taken over stops working on
+    that shard. A shard claimed more than ``max_attempts`` times (e.g. it
+    keeps crashing its workers) is marked failed; per-patient errors are
+    checkpointed, not retried.
+
+    The database uses a rollback journal, not WAL: WAL relies on shared
+    memory, which processes on other hosts do not share. Leases compare
+    wall-clock times, so hosts' clocks must agree to well within the lease.
+
+    Args:
+        path: The queue database; must exist unless created with ``create``.
+        lease_s: Seconds a claim lasts without a checkpoint.
+        max_attempts: Claims of a shard before it is given up.
+    """
+
+    def __init__(self, path: Path, lease_s: float = 300.0, max_attempts: int = 3) -> None:
+        self.path = Path(path)
+        self.lease_s = lease_s
+        self.max_attempts = max_attempts
+        self._db = sqlite3.connect(str(self.path), timeout=60, isolation_level=None)
+        # PERSIST reuses one journal file instead of creating and deleting it per checkpoint.
+        self._db.execute("PRAGMA journal_mode=PERSIST")
+        self._db.execute("PRAGMA synchronous=NORMAL")
+        self._db.executescript(SCHEMA)
+
+    @classmethod
+    def create(
+        cls,
+        path: Path,
+        records: Iterable[BatchRecord],
+        out_root: Path,
+        output_format: str = "pdf",
+        shard_size: int = 1000,
+        source: str = "",
+        **kwargs: Any,
+    ) -> "JobQueue":
+        """
+        Split ``records`` into shards and return the queue. If a complete queue
+        already exists at ``path`` it is returned unchanged (``records`` is not
+        read), which is how a stopped run is resumed; a queue whose creation
+        was interrupted is built again.
+        """
+        queue = cls(path, **kwargs)
+        if queue.meta().get("ready") == "1":
+            return queue
+        shard_dir = queue.shard_dir
+        if shard_dir.exists():
+            shutil.rmtree(shard_dir)
+        shard_dir.mkdir(parents=True)
+        buffer: List[str] = []
+        shards = 0
+
+        def flush() -> None:
+            nonlocal shards
+            shard = shard_dir / f"{shards:06d}.jsonl"
+            shard.write_text("".join(buffer), encoding="utf-8")
+            queue._db.execute("INSERT INTO shards (path, records) VALUES (?, ?)", (shard.name, len(buffer)))
+            shards += 1
+            buffer.clear()
+
+        queue._db.execute("BEGIN IMMEDIATE")
+        try:
+            queue._db.execute("DELETE FROM shards")
+            queue._db.execute("DELETE FROM checkpoints")
+            for r in records:
+                line = {"index": r.index, "source": r.source, "data": r.data, "error": r.error}
+                buffer.append(json.dumps(line, ensure_ascii=False) + "\n")
+                if len(buffer) >= shard_size:
+                    flush()
+            if buffer:
+                flush()
+            meta = {"out_root": str(Path(out_root).resolve()), "output_format": output_format,
+                    "source": source, "shard_size": str(shard_size), "ready": "1"}
+            queue._db.executemany("INSERT OR REPLACE INTO meta VALUES (?, ?)", meta.items())
+        except BaseException:
+            queue._db.execute("ROLLBACK")
+            queue.close()
+            raise
+        queue._db.execute("COMMIT")
+        return queue
+
+    @property
+    def shard_dir(self) -> Path:
+        return self.path.with_name(self.path.name + ".shards")
+
+    def close(self) -> None:
+        self._db.close()
+
+    def __enter__(self) -> "JobQueue":
+        return self
+
+    def __exit__(self, *exc: Any) -> None:
+        self.close()
+
+    def meta(self) -> Dict[str, str]:
+        return dict(self._db.execute("SELECT key, value FROM meta"))
+
+    def claim(self, owner: str, now: Optional[float] = None) -> Optional[Lease]:
+        """Lease the next shard that is pending or whose lease expired; None if there is none."""
+        now = time.time() if now is None else now
+        self._db.execute("BEGIN IMMEDIATE")
+        try:
+            while True:
+                row = self._db.execute(
+                    "SELECT id, path, attempts FROM shards WHERE state = 'pending'"
+                    " OR (state = 'leased' AND lease_until < ?) ORDER BY id LIMIT 1", (now,)).fetchone()
+                if row is None:
+                    return None
+                shard, path, attempts = row
+                if attempts >= self.max_attempts:
+                    self._db.execute("UPDATE shards SET state = 'failed', owner = NULL, error = ? WHERE id = ?",
+                                     (f"given up after {attempts} attempts", shard))
+                    continue
+                until = now + self.lease_s
+                self._db.execute("UPDATE shards SET state = 'leased', owner = ?, lease_until = ?,"
+                                 " attempts = attempts + 1 WHERE id = ?", (owner, until, shard))
+                return Lease(shard, path, owner, until)
+        finally:
+            self._db.execute("COMMIT")
+
+    def checkpointed(self, shard: int) -> Dict[int, Optional[str]]:
+        """Indices of the shard's patients already done, with their error (None if rendered)."""
+        return dict(self._db.execute("SELECT idx, error FROM checkpoints WHERE shard = ?", (shard,)))
+
+    def checkpoint(self, lease: Lease, index: int, patient_id: Optional[str], out_dir: Optional[str],
+                   error: Optional[str] = None, now: Optional[float] = None) -> bool:
+        """
+        Record one patient as done and extend the lease; False (and nothing
+        recorded) if the lease was lost to another worker.
+        """
+        now = time.time() if now is None else now
+        self._db.execute("BEGIN IMMEDIATE")
+        try:
+            renewed = self._db.execute(
+                "UPDATE shards SET lease_until = ? WHERE id = ? AND owner = ? AND state = 'leased'",
+                (now + self.lease_s, lease.shard, lease.owner)).rowcount
+            if renewed:
+                self._db.execute("INSERT OR REPLACE INTO checkpoints VALUES (?, ?, ?, ?, ?)",
+                                 (lease.shard, index, patient_id, out_dir, error))
+        finally:
+            self._db.execute("COMMIT")
+        return bool(renewed)
+
+    def complete(self, lease: Lease) -> bool:
+        """Mark the shard done; False if the lease was lost."""
+        return bool(self._db.execute(
+            "UPDATE shards SET state = 'done', owner = NULL, lease_until = NULL WHERE id = ? AND owner = ?",
+            (lease.shard, lease.owner)).rowcount)
+
+    def release(self, owner: str) -> int:
+        """Return the shards leased by ``owner`` (known to be dead) to the pending ones at once."""
+        return self._db.execute("UPDATE shards SET state = 'pending', owner = NULL, lease_until = NULL"
+                                " WHERE owner = ? AND state = 'leased'", (owner,)).rowcount
+
+    def next_expiry(self) -> Optional[float]:
+        """When the earliest current lease runs out, None if no shard is leased."""
+        return self._db.execute("SELECT MIN(lease_until) FROM shards WHERE state = 'leased'").fetchone()[0]
+
+    def status(self) -> QueueStatus:
+        shards = dict(self._db.execute("SELECT state, COUNT(*) FROM shards GROUP BY state"))
+        records = self._db.execute("SELECT COALESCE(SUM(records), 0) FROM shards").fetchone()[0]
+        done, failed = self._db.execute(
+            "SELECT COUNT(*), COALESCE(SUM(error IS NOT NULL), 0) FROM checkpoints").fetchone()
+        return QueueStatus(shards, records, done, failed)
+
+    def failures(self) -> List[Dict[str, Any]]:
+        rows = self._db.execute("SELECT shard, idx, patient_id, error FROM checkpoints WHERE error IS NOT NULL"
+                                " ORDER BY shard, idx")
+        shard_errors = self._db.execute("SELECT id, NULL, NULL, error FROM shards WHERE state = 'failed'")
+        return [{"shard": s, "index": i, "patient_id": p, "error": e} for s, i, p, e in [*rows, *shard_errors]]
+
+
+def _render(data: Dict[str, Any], out_dir: Path, template_dir: Path, output_format: str) -> None:
+    global _worker_engine
+    engine = None
+    if output_format == "pdf":
+        if _worker_engine is None:
+            from pdf_engine import create_engine
+
+            _worker_engine = create_engine(template_dir / TEMPLATE_NAME)
+        engine = _worker_engine
+    write_report(data, out_dir, template_dir, engine=engine, output_format=output_format)
+
+
+def process_shard(queue: JobQueue, lease: Lease, template_dir: Path) -> Tuple[int, bool]:
+    """
+    Render the patients of a leased shard that are not checkpointed yet,
+    checkpointing each one. Returns the number rendered now and whether the
+    shard was completed (False if the lease was lost meanwhile).
+    """
+    meta = queue.meta()
+    out_root, output_format = Path(meta["out_root"]), meta["output_format"]
+    done = queue.checkpointed(lease.shard)
+    rendered = 0
+    with (queue.shard_dir / lease.path).open(encoding="utf-8") as f:
+        for line in f:
+            item = json.loads(line)
+            index, data = item["index"], item["data"]
+            if index in done:
+                continue
+            patient_id = out_dir = None
+            error = item["error"]
+            if data is not None:
+                patient_id = str(data["patient_id"]) if "patient_id" in data else None
+                out_dir = str(out_root / _record_dir_name(index, data))
+                try:
+                    _render(data, Path(out_dir), template_dir, output_format)
+                except Exception as e:  # noqa: BLE001 - checkpointed as failed, the shard goes on
+                    error = f"{type(e).__name__}: {e}"
+            if not queue.checkpoint(lease, index, patient_id, out_dir, error or None):
+                return rendered, False
+            rendered += 1
+    return rendered, queue.complete(lease)
+
+
+def work(
+    queue_path: Path,
+    template_dir: Path,
+    lease_s: float = 300.0,
+    max_attempts: int = 3,
+    wait: bool = True,
+    poll_s: float = 1.0,
+) -> int:
+    """
+    Worker loop: claim and process shards until none is left. With ``wait``,
+    a worker that finds only shards leased by others waits for them to finish
+    or for their leases to expire (their worker died) and takes them over.
+    Returns the number of patients this worker rendered.
+    """
+    owner = worker_id()
+    rendered = 0
+    with JobQueue(queue_path, lease_s=lease_s, max_attempts=max_attempts) as queue:
+        if queue.meta().get("ready") != "1":
+            raise ValueError(f"{queue_path} is not a complete job queue")
+        while True:
+            lease = queue.claim(owner)
+            if lease is not None:
+                rendered += process_shard(queue, lease, Path(template_dir))[0]
+                continue
+            expiry = queue.next_expiry()
+            if not wait or expiry is None:
+                return rendered
+            time.sleep(min(poll_s, max(0.05, expiry - time.time())))
+
+
+def run_workers(
+    queue_path: Path,
+    template_dir: Path,
+    workers: Optional[int] = None,
+    lease_s: float = 300.0,
+    max_attempts: int = 3,
+) -> QueueStatus:
+    """
+    Run ``workers`` local worker processes on the queue until it is finished
+    and return its status. The lease of a worker that dies is released at
+    once, so the others take its shard over without waiting for it to expire.
+    """
+    workers = max(1, workers or os.cpu_count() or 1)
+    args = (Path(queue_path), Path(template_dir), lease_s, max_attempts)
+    if workers == 1:
+        work(*args)
+    else:
+        procs = [multiprocessing.Process(target=work, args=args, daemon=True) for _ in range(workers)]
+        for p in procs:
+            p.start()
+        host = socket.gethostname()
+        with JobQueue(queue_path) as queue:
+            while procs:
+                wait([p.sentinel for p in procs])
+                for p in [p for p in procs if not p.is_alive()]:
+                    procs.remove(p)
+                    if p.exitcode:
+                        queue.release(f"{host}:{p.pid}")
+    with JobQueue(queue_path) as queue:
+        return queue.status()
@@ -2,14 +2,28 @@ from __future__ import annotations
 
 import argparse
 import json
+import os
+import time
 from pathlib import Path
-from typing import Any, Dict, List, Optional
-
-from jinja2 import Environment, FileSystemLoader, select_autoescape
-from weasyprint import HTML
+from typing import TYPE_CHECKING, Any, Dict, Iterator, List, Optional, Tuple
 
 from analysis import analyze
-from data_gen import generate_mock
+from ingest import load_record
+from instrument import Metrics, configure, metrics, span
+from record import PatientRecord, RecordLike, as_dict
+from serialization import compact_json, dumps, write_json
+
+# WeasyPrint, Jinja2, NumPy and SQLite are imported where they are first used,
+# so --help, analysis and HTML-only runs do not pay for the PDF stack.
+if TYPE_CHECKING:
+    from pdf_engine import PdfEngine
+    from render_cache import RenderCache
+    from renderer import ReportRenderer
+
+TEMPLATE_NAME = "report_template.html"
+ARTIFACTS = ("normalized_input.json", "report.html", "report.pdf")
+# Artifacts written per ``--format``.
+FORMATS = {"pdf": ARTIFACTS, "html": ARTIFACTS[:2]}
 
 
 def _title_case_name(name: str) -> str:
@@ -36,84 +50,684 @@ def _vitals_rows(vitals: Dict[str, Any]) -> List[Dict[str, Optional[float]]]:
     return rows
 
 
-def render_html(data: Dict[str, Any], template_dir: Path) -> str:
+def render_html(data: RecordLike, template_dir: Path, renderer: Optional[ReportRenderer] = None) -> str:
     """
     Render HTML string using Jinja2 template and analysis output.
+
+    The compiled template is cached by ``renderer`` (default: the shared
+    process-wide renderer), so repeated calls do not recompile it.
     """
-    env = Environment(
-        loader=FileSystemLoader(str(template_dir)),
-        autoescape=select_autoescape(["html"])
-    )
-    tmpl = env.get_template("report_template.html")
+    return _render_payload(report_payload(data), template_dir, renderer)
+
+
+def _render_payload(payload: Dict[str, Any], template_dir: Path, renderer: Optional[ReportRenderer] = None) -> str:
+    if renderer is None:
+        from renderer import default_renderer
 
-    a = analyze(data)
-    vitals = data.get("vitals", {})
+        renderer = default_renderer()
+    with span("template"):
+        return renderer.render(Path(template_dir) / TEMPLATE_NAME, payload)
+
+
+def report_payload(data: RecordLike, trend: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
+    """
+    Template variables of one patient's report (analysis included); ``data`` may be a ``PatientRecord``.
+
+    ``trend`` is the patient's ``history.PatientTrend.to_dict()``; the report
+    gets a trend section when it is given.
+    """
+    with span("analyze"):
+        a = analyze(data)
+    if type(data) is PatientRecord and data.compact:
+        rows = data.vessel_rows()
+    else:
+        rows = _vitals_rows(data.get("vitals", {}))
 
-    payload = {
+    return {
         "patient_name": _title_case_name(data.get("name", "unknown")),
         "patient_id": data.get("patient_id", "n/a"),
         "timestamp": data.get("timestamp", "n/a"),
         "context": data.get("context", {}),
-        "vitals_rows": _vitals_rows(vitals),
+        "vitals_rows": rows,
         "stats": a,
         "highest_psv_vessel": a.get("highest_psv_vessel"),
         "ica_cca_ratio": a.get("ica_cca_ratio"),
         "notes": a.get("notes", []),
+        "trend": trend,
     }
-    return tmpl.render(**payload)
 
 
-def write_pdf_from_html(html: str, out_pdf: Path) -> None:
+def write_pdf_from_html(
+    html: str, out_pdf: Path, engine: Optional[PdfEngine] = None, payload: Optional[Dict[str, Any]] = None
+) -> None:
     """
     Generate a PDF from an HTML string using WeasyPrint.
+
+    Pass a long-lived ``engine`` to reuse fonts and pre-parsed stylesheets
+    across many documents. With the native backend (``--pdf-backend native``)
+    the report is drawn from ``payload`` instead and ``html`` is not laid out.
+    """
+    with span("pdf"):
+        if engine is None and payload is not None and _pdf_backend(None) == "native":
+            from pdf_engine import create_engine
+
+            engine = create_engine(backend="native")
+        if engine is not None:
+            engine.write_pdf(html, out_pdf, payload=payload)
+            return
+        from weasyprint import HTML
+
+        out_pdf.parent.mkdir(parents=True, exist_ok=True)
+        HTML(string=html, base_url=str(out_pdf.parent)).write_pdf(str(out_pdf))
+
+
+def _pdf_backend(engine: Optional[PdfEngine]) -> str:
+    """Backend that renders PDFs with ``engine`` (None: the run's default, see ``pdf_engine.pdf_backend``)."""
+    if engine is not None:
+        return engine.backend
+    from pdf_engine import pdf_backend
+
+    return pdf_backend()
+
+
+def _cache_variant(engine: Optional[PdfEngine], output_format: str, trend: Optional[Dict[str, Any]] = None) -> str:
     """
-    out_pdf.parent.mkdir(parents=True, exist_ok=True)
-    HTML(string=html, base_url=str(out_pdf.parent)).write_pdf(str(out_pdf))
+    Render cache variant: PDFs drawn natively are not interchangeable with
+    WeasyPrint's, compact JSON is not the indented one, and a report with a
+    trend section depends on the trend too.
+    """
+    variant = "native-pdf" if output_format == "pdf" and _pdf_backend(engine) == "native" else ""
+    if compact_json():
+        variant += "\0compact-json"
+    if trend:
+        variant += "\0trend:" + json.dumps(trend, sort_keys=True)
+    return variant
 
 
 def _load_json(path: Path) -> Dict[str, Any]:
-    with path.open("r", encoding="utf-8") as f:
-        return json.load(f)
+    """Load one record (JSON, JSONL or gzip-compressed); cohorts go through ``--batch``."""
+    try:
+        return load_record(path)
+    except ValueError as e:
+        raise SystemExit(f"{e} (use --batch for cohort files)") from e
 
 
 def _write_json(path: Path, obj: Dict[str, Any]) -> None:
-    path.parent.mkdir(parents=True, exist_ok=True)
-    with path.open("w", encoding="utf-8") as f:
-        json.dump(obj, f, indent=2, ensure_ascii=False)
+    write_json(path, obj)
+
+
+def render_artifacts(
+    data: RecordLike,
+    template_dir: Path,
+    engine: Optional[PdfEngine] = None,
+    cache: Optional[RenderCache] = None,
+    output_format: str = "pdf",
+    trend: Optional[Dict[str, Any]] = None,
+) -> Tuple[Dict[str, bytes], bool]:
+    """
+    Render the artifacts of ``write_report`` in memory, as ``{file name: bytes}``,
+    for output sinks other than a directory (see ``sinks``).
+
+    Returns:
+        The artifacts and whether they came from the cache.
+    """
+    names = FORMATS[output_format]
+    with span("report", patient_id=data.get("patient_id")):
+        key = None
+        if cache is not None:
+            with span("cache_lookup"):
+                key = cache.key_for(as_dict(data), Path(template_dir) / TEMPLATE_NAME,
+                                    _cache_variant(engine, output_format, trend))
+                artifacts = cache.load(key, names)
+            if artifacts is not None:
+                return artifacts, True
+
+        artifacts = {"normalized_input.json": dumps(as_dict(data))}
+        payload = report_payload(data, trend)
+        html = _render_payload(payload, template_dir)
+        artifacts["report.html"] = html.encode("utf-8")
+        if output_format == "pdf":
+            with span("pdf"):
+                if engine is None and _pdf_backend(None) == "native":
+                    from pdf_engine import create_engine
+
+                    engine = create_engine(backend="native")
+                if engine is not None:
+                    artifacts["report.pdf"] = engine.write_pdf(html, base_url=str(template_dir), payload=payload)
+                else:
+                    from weasyprint import HTML
+
+                    artifacts["report.pdf"] = HTML(string=html, base_url=str(template_dir)).write_pdf()
+
+        if cache is not None:
+            with span("cache_store"):
+                cache.store(key, artifacts)
+        return artifacts, False
+
+
+def write_report(
+    data: RecordLike,
+    out_dir: Path,
+    template_dir: Path,
+    engine: Optional[PdfEngine] = None,
+    cache: Optional[RenderCache] = None,
+    output_format: str = "pdf",
+    trend: Optional[Dict[str, Any]] = None,
+) -> bool:
+    """
+    Write ``normalized_input.json``, ``report.html`` and ``report.pdf`` for one record.
+
+    With a ``cache``, unchanged inputs reuse the artifacts of an earlier run
+    instead of being rendered again. ``output_format="html"`` skips the PDF
+    (and never imports WeasyPrint). ``trend`` adds the patient's trend section
+    (see ``report_payload``).
+
+    Returns:
+        True if the artifacts came from the cache.
+    """
+    artifacts = FORMATS[output_format]
+    with span("report", patient_id=data.get("patient_id")):
+        key = None
+        if cache is not None:
+            with span("cache_lookup"):
+                key = cache.key_for(as_dict(data), Path(template_dir) / TEMPLATE_NAME,
+                                    _cache_variant(engine, output_format, trend))
+                hit = cache.get(key, out_dir, artifacts)
+            if hit:
+                return True
+
+        with span("write_json"):
+            _write_json(out_dir / "normalized_input.json", as_dict(data))
+        payload = report_payload(data, trend)
+        html = _render_payload(payload, template_dir)
+        with span("write_html"):
+            (out_dir / "report.html").write_text(html, encoding="utf-8")
+        if output_format == "pdf":
+            write_pdf_from_html(html, out_pdf=out_dir / "report.pdf", engine=engine, payload=payload)
+
+        if cache is not None:
+            with span("cache_store"):
+                cache.put(key, out_dir, artifacts)
+        return False
 
 
 def main() -> None:
     parser = argparse.ArgumentParser(
-        description="Generate a non-medical, descriptive cardio report (HTML + PDF)."
+        description="Generate a non-medical, descriptive cardio report (HTML + PDF, or HTML only)."
     )
     parser.add_argument("--in", dest="in_path", type=str, help="Path to input JSON.")
     parser.add_argument("--generate-mock", action="store_true", help="Generate mock JSON instead of reading input.")
     parser.add_argument("--out", dest="out_dir", type=str, default="out", help="Output directory (default: out)")
     parser.add_argument("--seed", dest="seed", type=int, default=None, help="Optional RNG seed for mock generation.")
+    parser.add_argument("--format", dest="output_format", choices=sorted(FORMATS), default="pdf",
+                        help="pdf: JSON, HTML and PDF (default); html: skip the PDF and never load WeasyPrint.")
+    parser.add_argument("--pdf-backend", dest="pdf_backend", choices=("weasyprint", "native"), default=None,
+                        help="weasyprint: lay out the HTML report (default, needed for custom templates); native: "
+                             "draw the bundled layout directly, ~1 ms per report (or set REPORT_PDF_BACKEND).")
+    parser.add_argument("--batch", dest="batch_path", type=str, default=None,
+                        help="Render every record of a directory of JSON files or a JSONL / JSON array file "
+                             "(optionally gzip-compressed).")
+    parser.add_argument("--consolidate", action="store_true",
+                        help="With --batch: render all records into one cohort.html/cohort.pdf with a page index "
+                             "(cohort_index.json) instead of one report per record.")
+    parser.add_argument("--summarize", action="store_true",
+                        help="With --batch or --db: one pass of cohort statistics per vessel and metric "
+                             "(cohort_summary.json/.html/.pdf) instead of per-record reports; a directory of "
+                             "JSONL shards is aggregated by --workers processes.")
+    parser.add_argument("--pack", dest="pack_path", type=str, default=None,
+                        help="With --batch: write its records (validated unless --no-validate) to this file as "
+                             "packed MessagePack and exit; --batch reads the packed file faster than JSON "
+                             "(needs msgpack).")
+    parser.add_argument("--columnar", dest="columnar_path", type=str, default=None,
+                        help="With --batch: convert its records (validated unless --no-validate) once into a "
+                             "memory-mapped columnar cohort file for repeated analysis (cohort_file.CohortFile) "
+                             "and exit; --summarize --batch reads it without parsing records.")
+    parser.add_argument("--compact-json", action="store_true",
+                        help="Write normalized_input.json and summaries without indentation "
+                             "(or set REPORT_JSON_STYLE=compact).")
+    parser.add_argument("--sink", dest="sink", type=str, default=None,
+                        help="With --batch: write the reports into one archive or database instead of one folder "
+                             "per record, chosen by suffix: .zip, .tar (with .index.json) or .sqlite/.db.")
+    parser.add_argument("--pipeline", action="store_true",
+                        help="With --batch or --db: run the report steps (analyze, render, write, pdf) as stages "
+                             "connected by bounded queues, so different records' steps overlap.")
+    parser.add_argument("--stage", dest="stages", action="append", default=[],
+                        help="With --pipeline: executor of a stage as <stage>=<inline|thread|process>[:<workers>], "
+                             "e.g. pdf=process:4 (default: analyze and render inline, write=thread:2, "
+                             "pdf=process:--workers).")
+    parser.add_argument("--unordered", action="store_true",
+                        help="With --pipeline: finish records in completion order instead of input order.")
+    parser.add_argument("--db", dest="db_path", type=str, default=None,
+                        help="SQLite patient store: the target of --ingest, or render the exams it selects "
+                             "(--since/--until/--patient-id/--where) like --batch.")
+    parser.add_argument("--history", dest="history_path", type=str, default=None,
+                        help="SQLite exam history: add each rendered exam under its patient ID and give the "
+                             "report a trend section (latest value, change, rolling mean per metric). "
+                             "Single reports, --batch and --db.")
+    parser.add_argument("--ingest", dest="ingest_path", type=str, default=None,
+                        help="Store every record of a file or directory (as read by --batch) in --db and exit.")
+    parser.add_argument("--since", dest="since", type=str, default=None,
+                        help="With --db: exams at or after this ISO date/time.")
+    parser.add_argument("--until", dest="until", type=str, default=None,
+                        help="With --db: exams at or before this ISO date/time.")
+    parser.add_argument("--patient-id", dest="patient_id", type=str, default=None,
+                        help="With --db: exams of this patient only.")
+    parser.add_argument("--where", dest="where", action="append", default=[],
+                        help="With --db: numeric condition such as 'ica_psv>125' or 'ica_cca_ratio>=2' "
+                             "(repeatable, all must hold).")
+    parser.add_argument("--watch", dest="watch_dir", type=str, default=None,
+                        help="Keep rendering new or modified *.json exam files dropped into this folder into "
+                             "--out/<name>/ (index in --out/.watch_index.sqlite; unchanged files are skipped, "
+                             "also after a restart).")
+    parser.add_argument("--watch-interval", dest="watch_interval", type=float, default=1.0,
+                        help="Seconds between --watch scans (default: 1).")
+    parser.add_argument("--debounce", dest="debounce", type=float, default=2.0,
+                        help="Render a --watch file once it has been unchanged this many seconds (default: 2).")
+    parser.add_argument("--watch-once", action="store_true",
+                        help="With --watch: process the folder's current contents and exit.")
+    parser.add_argument("--queue", dest="queue_path", type=str, default=None,
+                        help="Durable job queue (SQLite) for --batch: split the cohort into shards and render them "
+                             "with --workers processes, checkpointing every patient. Run again to resume; without "
+                             "--batch, join an existing queue (e.g. from another host sharing the filesystem).")
+    parser.add_argument("--shard-size", dest="shard_size", type=int, default=1000,
+                        help="With --queue: records per shard (default: 1000).")
+    parser.add_argument("--lease-s", dest="lease_s", type=float, default=300.0,
+                        help="With --queue: seconds before the shard of a worker that stopped checkpointing "
+                             "is taken over (default: 300).")
+    parser.add_argument("--serve", action="store_true",
+                        help="Run the HTTP report service until interrupted: POST a record to "
+                             "/report?format=html|pdf, GET /health and /metrics (see service.py).")
+    parser.add_argument("--host", dest="host", type=str, default="127.0.0.1",
+                        help="With --serve: address to listen on (default: 127.0.0.1).")
+    parser.add_argument("--port", dest="port", type=int, default=8080,
+                        help="With --serve: port to listen on (default: 8080).")
+    parser.add_argument("--max-pending", dest="max_pending", type=int, default=None,
+                        help="With --serve: PDF renders queued or running before requests are answered 429 "
+                             "(default: 4 per worker).")
+    parser.add_argument("--quarantine", dest="quarantine", type=str, default=None,
+                        help="Where --batch and --ingest write records that fail to load or validate, one JSON "
+                             "line each with the reasons (default: --out/quarantine.jsonl).")
+    parser.add_argument("--no-validate", dest="validate", action="store_false",
+                        help="Do not validate --batch/--ingest/--serve records; unreadable records are reported as failures.")
+    parser.add_argument("--workers", dest="workers", type=int, default=None,
+                        help="Worker processes for --batch, --serve and --generate-cohort (default: CPU count).")
+    parser.add_argument("--recycle-after", dest="recycle_after", type=int, default=None,
+                        help="Replace a --batch worker after this many documents.")
+    parser.add_argument("--max-rss-mb", dest="max_rss_mb", type=int, default=None,
+                        help="Replace a --batch worker once its resident memory exceeds this (MiB).")
+    parser.add_argument("--generate-cohort", dest="cohort_size", type=int, default=None,
+                        help="Write this many mock records as sharded JSONL files into --out and exit.")
+    parser.add_argument("--shards", dest="shards", type=int, default=None,
+                        help="Number of JSONL files for --generate-cohort (default: --workers).")
+    parser.add_argument("--compress", action="store_true", help="Gzip the --generate-cohort shards.")
+    parser.add_argument("--cache-dir", dest="cache_dir", type=str, default=None,
+                        help="Reuse reports of unchanged inputs from this render cache directory.")
+    parser.add_argument("--cache-max-mb", dest="cache_max_mb", type=int, default=1024,
+                        help="Evict least recently used cache entries beyond this size (MiB, default: 1024).")
+    parser.add_argument("--metrics", dest="metrics_path", type=str, default=None,
+                        help="Append per-stage timing/memory metrics as JSON lines to this file "
+                             "(or set REPORT_METRICS).")
+    parser.add_argument("--trace-malloc", action="store_true",
+                        help="Add tracemalloc peaks to --metrics (slow; or set REPORT_METRICS_TRACEMALLOC=1).")
+    parser.add_argument("--profile-dir", dest="profile_dir", type=str, default=None,
+                        help="Write one cProfile dump per stage to this directory (or set REPORT_PROFILE_DIR).")
     args = parser.parse_args()
 
+    if args.pdf_backend:
+        from pdf_engine import PDF_BACKEND_ENV
+
+        # Through the environment, so every worker process uses the same backend.
+        os.environ[PDF_BACKEND_ENV] = args.pdf_backend
+    if args.compact_json:
+        from serialization import JSON_STYLE_ENV
+
+        os.environ[JSON_STYLE_ENV] = "compact"
+    if args.metrics_path or args.trace_malloc or args.profile_dir:
+        env = Metrics.from_env()
+        configure(
+            args.metrics_path or env.path,
+            trace_malloc=args.trace_malloc or env.trace_malloc,
+            profile_dir=args.profile_dir or env.profile_dir,
+        )
+    try:
+        _run(args)
+    finally:
+        metrics().close()
+
+
+def _run(args: argparse.Namespace) -> None:
     out_dir = Path(args.out_dir)
     template_dir = Path(__file__).parent
 
+    if args.cohort_size is not None:
+        from data_gen import generate_bulk
+
+        paths = generate_bulk(
+            args.cohort_size, out_dir, shards=args.shards, workers=args.workers,
+            seed=args.seed or 0, compress=args.compress,
+        )
+        print(f"Wrote {args.cohort_size} records to {len(paths)} shard(s) in {out_dir}")
+        return
+
+    if args.watch_dir:
+        from watch import Watcher
+
+        with Watcher(Path(args.watch_dir), out_dir, template_dir, workers=args.workers,
+                     output_format=args.output_format, debounce_s=args.debounce) as watcher:
+            if not args.watch_once:
+                print(f"Watching {args.watch_dir} (Ctrl-C to stop)")
+            watcher.run(interval_s=args.watch_interval, once=args.watch_once)
+        print(f"Rendered {watcher.rendered}, failed {watcher.failed}, unchanged {watcher.unchanged}")
+        return
+
+    if args.serve:
+        from service import serve
+
+        serve(template_dir, args.host, args.port, workers=args.workers, max_pending=args.max_pending,
+              validate=args.validate)
+        return
+
+    quarantine = None
+    if args.validate and (args.batch_path or args.ingest_path):
+        from validate import Quarantine
+
+        quarantine = Quarantine(Path(args.quarantine) if args.quarantine else out_dir / "quarantine.jsonl")
+    try:
+        _run_inputs(args, out_dir, template_dir, quarantine)
+    finally:
+        if quarantine is not None:
+            quarantine.close()
+            if quarantine.count:
+                print(f"Quarantined {quarantine.count} invalid records: {quarantine.path}")
+
+
+def _run_inputs(args: argparse.Namespace, out_dir: Path, template_dir: Path, quarantine: Any) -> None:
+    if args.queue_path:
+        _run_queue(args, out_dir, template_dir, quarantine)
+        return
+    if args.ingest_path:
+        if not args.db_path:
+            raise SystemExit("--ingest needs --db <path>.")
+        from batch import iter_batch_records
+        from store import PatientStore
+
+        records = iter_batch_records(Path(args.ingest_path))
+        if quarantine is not None:
+            from validate import screen
+
+            records = screen(records, quarantine)
+        with PatientStore(Path(args.db_path)) as store:
+            result = store.ingest(records)
+            stored = len(store)
+        print(f"Stored {result.inserted} records ({len(result.skipped)} skipped) in {result.elapsed_s:.1f}s "
+              f"({result.rate:.0f} records/s); {stored} exams in {args.db_path}")
+        for skipped in result.skipped:
+            print(f"  SKIPPED {skipped['source']}: {skipped['error']}")
+        return
+
+    if args.db_path:
+        if args.batch_path:
+            raise SystemExit("Use either --batch or --db, not both.")
+        if not Path(args.db_path).exists():
+            raise SystemExit(f"No patient store at {args.db_path}; create it with --ingest.")
+        from store import PatientStore, selection_from_args
+
+        try:
+            selection = selection_from_args(args.since, args.until, args.patient_id, args.where)
+        except ValueError as e:
+            raise SystemExit(str(e))
+        with PatientStore(Path(args.db_path)) as store:
+            if args.summarize:
+                _summarize(args, (r.data for r in store.select(selection)), out_dir, template_dir)
+            else:
+                _render_cohort(args, store.select(selection), out_dir, template_dir)
+        return
+
+
+    if (args.consolidate or args.summarize) and not args.batch_path:
+        raise SystemExit("--consolidate and --summarize need --batch <path> or --db <path>.")
+    if args.pack_path or args.columnar_path:
+        if not args.batch_path:
+            raise SystemExit("--pack and --columnar need --batch <path>.")
+        if args.pack_path and args.columnar_path:
+            raise SystemExit("Use either --pack or --columnar, not both.")
+        _convert(Path(args.batch_path), Path(args.pack_path or args.columnar_path), quarantine,
+                 columnar=bool(args.columnar_path))
+        return
+    if args.batch_path and args.summarize:
+        _summarize(args, None, out_dir, template_dir, quarantine)
+        return
+    if args.batch_path:
+        _render_cohort(args, Path(args.batch_path), out_dir, template_dir, quarantine)
+        return
+
     if args.generate_mock:
+        from data_gen import generate_mock
+
         data = generate_mock(seed=args.seed)
     else:
         if not args.in_path:
             raise SystemExit("Please provide --in <path> or use --generate-mock.")
-        data = _load_json(Path(args.in_path))
+        with span("load"):
+            data = _load_json(Path(args.in_path))
+
+    trend = None
+    if args.history_path:
+        from history import ExamHistory
+
+        with ExamHistory(Path(args.history_path)) as history:
+            exam_trend = history.append(as_dict(data))
+        trend = exam_trend.to_dict() if exam_trend is not None else None
+
+    cache = None
+    if args.cache_dir:
+        from render_cache import RenderCache
+
+        cache = RenderCache(Path(args.cache_dir), args.cache_max_mb * 1024 * 1024)
+    try:
+        hit = write_report(data, out_dir, template_dir, cache=cache, output_format=args.output_format, trend=trend)
+    finally:
+        if cache is not None:
+            cache.close()
+
+    verb = "Up to date (cached)" if hit else "Wrote"
+    for name in FORMATS[args.output_format][1:]:
+        print(f"{verb}: {out_dir / name}")
+
+
+def _summarize(
+    args: argparse.Namespace, records: Any, out_dir: Path, template_dir: Path, quarantine: Any = None
+) -> None:
+    """Cohort statistics of ``records`` (an iterable of record dicts) or, if None, of ``--batch``."""
+    from cohort_stats import CohortAggregator, aggregate_sources, write_summary
+
+    started = time.perf_counter()
+    with span("summarize"):
+        if records is not None:
+            aggregator = CohortAggregator().add_many(records)
+        else:
+            source = Path(args.batch_path)
+            shards = sorted(source.glob("*.jsonl")) + sorted(source.glob("*.jsonl.gz")) if source.is_dir() else []
+            aggregator = aggregate_sources(shards or [source], workers=args.workers, quarantine=quarantine)
+    summary = write_summary(aggregator, out_dir, template_dir, output_format=args.output_format,
+                            elapsed_s=time.perf_counter() - started)
+    print(f"Summarized {summary['records']} records in {summary['elapsed_s']:.1f}s")
+    for name in ("cohort_summary.json", "cohort_summary.html", "cohort_summary.pdf"):
+        if name != "cohort_summary.pdf" or args.output_format == "pdf":
+            print(f"Wrote: {out_dir / name}")
+
+
+def _render_cohort(
+    args: argparse.Namespace, source: Any, out_dir: Path, template_dir: Path, quarantine: Any = None
+) -> None:
+    """Render ``source`` (input path or records) as one report per record or, with --consolidate, one document."""
+    if args.consolidate:
+        from consolidated import write_consolidated
+
+        if quarantine is not None:
+            from batch import iter_batch_records
+            from validate import screen
+
+            source = screen(iter_batch_records(source), quarantine)
+
+        result = write_consolidated(source, out_dir, template_dir, output_format=args.output_format)
+        pages = f", {result.pages} pages" if result.pages is not None else ""
+        print(f"Consolidated {result.patients} records{pages} ({len(result.skipped)} skipped) "
+              f"in {result.elapsed_s:.1f}s")
+        for skipped in result.skipped:
+            print(f"  SKIPPED {skipped['source']}: {skipped['error']}")
+        for name in ("cohort.html", "cohort.pdf", "cohort_index.json"):
+            if name != "cohort.pdf" or args.output_format == "pdf":
+                print(f"Wrote: {out_dir / name}")
+        return
+
+    if args.pipeline:
+        summary = _run_pipeline(args, source, out_dir, template_dir, quarantine)
+    else:
+        summary = _run_batch(args, source, out_dir, template_dir, quarantine)
+    rate = summary.total / summary.elapsed_s if summary.elapsed_s else 0.0
+    quarantined = f", {summary.quarantined} quarantined" if summary.quarantined else ""
+    print(f"Processed {summary.total} records: {summary.succeeded} ok, {summary.failed} failed{quarantined} "
+          f"in {summary.elapsed_s:.1f}s ({rate:.1f} records/s)")
+    if args.cache_dir:
+        print(f"Render cache: {summary.cache_hits} hits, {summary.cache_misses} misses")
+    for failure in summary.failures:
+        print(f"  FAILED {failure.source}: {failure.error}")
+    if args.sink:
+        print(f"Wrote: {args.sink}")
+    print(f"Wrote: {out_dir / 'batch_summary.json'}")
+    if summary.failed:
+        raise SystemExit(1)
+
+
+def _run_batch(args: argparse.Namespace, source: Any, out_dir: Path, template_dir: Path, quarantine: Any) -> Any:
+    from batch import run_batch
+    from sinks import open_sink
+
+    sink = open_sink(Path(args.sink)) if args.sink else None
+    history = None
+    if args.history_path:
+        from history import ExamHistory
+
+        history = ExamHistory(Path(args.history_path))
+    try:
+        return run_batch(
+            source, out_dir, template_dir,
+            workers=args.workers,
+            recycle_after=args.recycle_after,
+            max_rss_bytes=args.max_rss_mb * 1024 * 1024 if args.max_rss_mb else None,
+            cache_dir=Path(args.cache_dir) if args.cache_dir else None,
+            cache_max_bytes=args.cache_max_mb * 1024 * 1024,
+            output_format=args.output_format,
+            sink=sink,
+            quarantine=quarantine,
+            history=history,
+        )
+    finally:
+        if sink is not None:
+            sink.close()
+        if history is not None:
+            history.close()
+
+
+def _run_pipeline(args: argparse.Namespace, source: Any, out_dir: Path, template_dir: Path, quarantine: Any) -> Any:
+    """One report per record with the report steps as overlapping stages (``--pipeline``, see ``pipeline``)."""
+    if args.sink or args.cache_dir or args.history_path:
+        raise SystemExit("--pipeline writes one folder per record; it does not take --sink, --cache-dir or --history.")
+    from functools import partial
+
+    from pipeline import parse_stage, run_pipeline
+
+    executors = {}
+    if args.workers:
+        executors["pdf"] = ("process", args.workers)
+    for spec in args.stages:
+        try:
+            name, executor, workers = parse_stage(spec)
+        except ValueError as e:
+            raise SystemExit(str(e))
+        pooled = args.workers or os.cpu_count() or 1
+        executors[name] = (executor, 1 if executor == "inline" else workers or pooled)
+    screen = None
+    if quarantine is not None:
+        from validate import screen as screen_records
+
+        screen = partial(screen_records, quarantine=quarantine)
+    return run_pipeline(source, out_dir, template_dir, output_format=args.output_format, executors=executors,
+                        ordered=not args.unordered, records=screen)
+
+
+def _convert(source: Path, out_path: Path, quarantine: Any, columnar: bool = False) -> None:
+    """
+    Write the loadable (and valid) records of ``source`` once as a packed
+    cohort (``--pack``) or a columnar cohort file (``--columnar``).
+    """
+    from batch import iter_batch_records
+
+    records = iter_batch_records(source)
+    if quarantine is not None:
+        from validate import screen
+
+        records = screen(records, quarantine)
+    failed: List[str] = []
+
+    def loaded() -> Iterator[Dict[str, Any]]:
+        for record in records:
+            if record.data is None:
+                failed.append(f"{record.source}: {record.error}")
+            else:
+                yield as_dict(record.data)
+
+    started = time.perf_counter()
+    if columnar:
+        from cohort_file import write_cohort_file
+
+        with span("columnar"):
+            count = write_cohort_file(loaded(), out_path)
+    else:
+        from serialization import pack_records
+
+        with span("pack"):
+            try:
+                count = pack_records(loaded(), out_path, on_error=lambda data, error: failed.append(
+                    f"{data.get('patient_id')}: {error}"))
+            except ImportError as e:
+                raise SystemExit(str(e))
+    print(f"{'Converted' if columnar else 'Packed'} {count} records into {out_path} ({len(failed)} failed) "
+          f"in {time.perf_counter() - started:.1f}s")
+    for failure in failed:
+        print(f"  FAILED {failure}")
+
+
+def _run_queue(args: argparse.Namespace, out_dir: Path, template_dir: Path, quarantine: Any) -> None:
+    """Create (from ``--batch``) or resume the ``--queue`` job queue and work on it with ``--workers`` processes."""
+    from jobqueue import JobQueue, run_workers
 
-    _write_json(out_dir / "normalized_input.json", data)
+    queue_path = Path(args.queue_path)
+    if args.batch_path:
+        from batch import iter_batch_records
 
-    html = render_html(data, template_dir=template_dir)
-    out_html = out_dir / "report.html"
-    out_html.parent.mkdir(parents=True, exist_ok=True)
-    out_html.write_text(html, encoding="utf-8")
+        records = iter_batch_records(Path(args.batch_path))
+        if quarantine is not None:
+            from validate import screen
 
-    out_pdf = out_dir / "report.pdf"
-    write_pdf_from_html(html, out_pdf=out_pdf)
+            records = screen(records, quarantine)
+        JobQueue.create(queue_path, records, out_dir, output_format=args.output_format,
+                        shard_size=args.shard_size, source=args.batch_path).close()
+    elif not queue_path.exists():
+        raise SystemExit(f"No job queue at {queue_path}; create it with --queue {queue_path} --batch <path>.")
 
-    print(f"Wrote: {out_html}")
-    print(f"Wrote: {out_pdf}")
+    started = time.perf_counter()
+    status = run_workers(queue_path, template_dir, workers=args.workers, lease_s=args.lease_s)
+    elapsed = time.perf_counter() - started
+    shards = ", ".join(f"{n} {state}" for state, n in sorted(status.shards.items()))
+    print(f"Queue {queue_path}: {status.done}/{status.records} records done ({status.failed} failed), "
+          f"shards: {shards}; {elapsed:.1f}s this run")
+    with JobQueue(queue_path) as queue:
+        for failure in queue.failures():
+            print(f"  FAILED shard {failure['shard']} record {failure['index']}: {failure['error']}")
+    if status.failed or status.shards.get("failed"):
+        raise SystemExit(1)
 
 
 if __name__ == "__main__":
@@ -0,0 +1,335 @@
+from __future__ import annotations
+
+import zlib
+from functools import lru_cache
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+
+# A4 in points; CSS px are 0.75 pt. The margins are WeasyPrint's default
+# @page margin (75px) plus the template's body margin (24px).
+PAGE_W, PAGE_H = 595.28, 841.89
+MARGIN = (75 + 24) * 0.75
+CONTENT_W = PAGE_W - 2 * MARGIN
+PX = 0.75
+
+# Advance widths (1/1000 em) of ASCII 32..126 from the Adobe core font metrics.
+_HELVETICA = (
+    278, 278, 355, 556, 556, 889, 667, 191, 333, 333, 389, 584, 278, 333, 278, 278,
+    556, 556, 556, 556, 556, 556, 556, 556, 556, 556, 278, 278, 584, 584, 584, 556,
+    1015, 667, 667, 722, 722, 667, 611, 778, 722, 278, 500, 667, 556, 833, 722, 778,
+    667, 778, 722, 667, 611, 722, 667, 944, 667, 667, 611, 278, 278, 278, 469, 556,
+    333, 556, 556, 500, 556, 556, 278, 556, 556, 222, 222, 500, 222, 833, 556, 556,
+    556, 556, 333, 500, 278, 556, 500, 722, 500, 500, 500, 334, 260, 334, 584,
+)
+_HELVETICA_BOLD = (
+    278, 333, 474, 556, 556, 889, 722, 238, 333, 333, 389, 584, 278, 333, 278, 278,
+    556, 556, 556, 556, 556, 556, 556, 556, 556, 556, 333, 333, 584, 584, 584, 611,
+    975, 722, 722, 722, 722, 667, 611, 778, 722, 278, 556, 722, 611, 833, 722, 778,
+    667, 778, 722, 667, 611, 722, 667, 944, 667, 667, 611, 333, 278, 333, 584, 556,
+    333, 556, 611, 556, 611, 556, 333, 611, 611, 278, 278, 556, 278, 889, 611, 611,
+    611, 611, 389, 556, 333, 611, 556, 778, 556, 556, 500, 389, 280, 389, 584,
+)
+# Resource name -> (base font, widths).
+FONTS = {"F1": ("Helvetica", _HELVETICA), "F2": ("Helvetica-Bold", _HELVETICA_BOLD)}
+# Widths by WinAnsi byte; bytes outside ASCII count as a digit.
+_WIDTHS = {name: (556,) * 32 + widths + (556,) * 129 for name, (_, widths) in FONTS.items()}
+REGULAR, BOLD = "F1", "F2"
+
+TEXT, MUTED, FAINT = (0x22, 0x22, 0x22), (0x55, 0x55, 0x55), (0x66, 0x66, 0x66)
+BORDER, HEADER_BG = (0xDD, 0xDD, 0xDD), (0xF5, 0xF5, 0xF5)
+
+Run = Tuple[str, str]  # (text, font)
+
+
+def text_width(text: str, font: str, size: float) -> float:
+    """Width of ``text`` in points; characters outside ASCII count as a digit."""
+    return sum(map(_WIDTHS[font].__getitem__, text.encode("cp1252", errors="replace"))) * size / 1000
+
+
+@lru_cache(maxsize=None)
+def _color(rgb: Tuple[int, int, int]) -> str:
+    return " ".join(f"{c / 255:.3f}" for c in rgb)
+
+
+def _pdf_string(text: str) -> bytes:
+    raw = text.encode("cp1252", errors="replace")
+    return b"(" + raw.replace(b"\\", b"\\\\").replace(b"(", b"\\(").replace(b")", b"\\)") + b")"
+
+
+class Canvas:
+    """
+    Pages of PDF drawing operators with a top-down cursor ``y`` (points from
+    the top edge of the page), starting a new page when content would run
+    past the bottom margin.
+    """
+
+    def __init__(self) -> None:
+        self.pages: List[List[bytes]] = []
+        self.y = 0.0
+        self.new_page()
+
+    def new_page(self) -> None:
+        self.pages.append([])
+        self.y = MARGIN
+
+    def ensure(self, height: float) -> None:
+        """Start a new page unless ``height`` points still fit on this one."""
+        if self.y + height > PAGE_H - MARGIN and self.y > MARGIN:
+            self.new_page()
+
+    def _op(self, op: str) -> None:
+        self.pages[-1].append(op.encode("ascii"))
+
+    def text(self, x: float, baseline: float, text: str, font: str, size: float,
+             color: Tuple[int, int, int] = TEXT) -> None:
+        self.pages[-1].append(
+            f"BT /{font} {size:g} Tf {_color(color)} rg {x:.2f} {PAGE_H - baseline:.2f} Td ".encode("ascii")
+            + _pdf_string(text) + b" Tj ET"
+        )
+
+    def rect(self, x: float, top: float, w: float, h: float, fill: Optional[Tuple[int, int, int]] = None,
+             stroke: Optional[Tuple[int, int, int]] = None, radius: float = 0.0) -> None:
+        ops = []
+        if fill is not None:
+            ops.append(f"{_color(fill)} rg")
+        if stroke is not None:
+            ops.append(f"{_color(stroke)} RG {PX:g} w")
+        if radius:
+            ops.append(_rounded_path(x, PAGE_H - top - h, w, h, min(radius, h / 2, w / 2)))
+        else:
+            ops.append(f"{x:.2f} {PAGE_H - top - h:.2f} {w:.2f} {h:.2f} re")
+        ops.append("B" if fill is not None and stroke is not None else "f" if fill is not None else "S")
+        self._op(" ".join(ops))
+
+    def paragraph(self, runs: Sequence[Run], x: float, width: float, size: float,
+                  color: Tuple[int, int, int] = TEXT, leading: float = 1.2) -> None:
+        """Word-wrap ``runs`` into ``width`` from the cursor down, moving the cursor below them."""
+        line_h = size * leading
+        for line in _wrap(runs, width, size):
+            self.ensure(line_h)
+            baseline = self.y + (line_h + size * 0.7) / 2
+            cx = x
+            for text, font in line:
+                self.text(cx, baseline, text, font, size, color)
+                cx += text_width(text, font, size)
+            self.y += line_h
+
+
+def _rounded_path(x: float, y: float, w: float, h: float, r: float) -> str:
+    k = r * 0.5523  # control point offset of a quarter circle
+    return (
+        f"{x + r:.2f} {y:.2f} m {x + w - r:.2f} {y:.2f} l "
+        f"{x + w - r + k:.2f} {y:.2f} {x + w:.2f} {y + r - k:.2f} {x + w:.2f} {y + r:.2f} c "
+        f"{x + w:.2f} {y + h - r:.2f} l "
+        f"{x + w:.2f} {y + h - r + k:.2f} {x + w - r + k:.2f} {y + h:.2f} {x + w - r:.2f} {y + h:.2f} c "
+        f"{x + r:.2f} {y + h:.2f} l "
+        f"{x + r - k:.2f} {y + h:.2f} {x:.2f} {y + h - r + k:.2f} {x:.2f} {y + h - r:.2f} c "
+        f"{x:.2f} {y + r:.2f} l "
+        f"{x:.2f} {y + r - k:.2f} {x + r - k:.2f} {y:.2f} {x + r:.2f} {y:.2f} c h"
+    )
+
+
+def _wrap(runs: Sequence[Run], width: float, size: float) -> List[List[Run]]:
+    """Lines of runs no wider than ``width``, broken at spaces (a longer word gets a line of its own)."""
+    lines: List[List[Run]] = [[]]
+    used = 0.0
+    for text, font in runs:
+        for i, word in enumerate(text.split(" ")):
+            piece = word if i == 0 else " " + word
+            w = text_width(piece, font, size)
+            if used + w > width and used > 0 and i > 0:
+                lines.append([])
+                piece, used = word, 0.0
+                w = text_width(piece, font, size)
+            line = lines[-1]
+            if line and line[-1][1] == font:
+                line[-1] = (line[-1][0] + piece, font)
+            else:
+                line.append((piece, font))
+            used += w
+    return lines
+
+
+def _cell(value: Any) -> str:
+    """A value as Jinja2 prints it in the template."""
+    return "" if value is ... else str(value)
+
+
+def _stat(stats: Dict[str, Any], metric: str, key: str) -> str:
+    block = stats.get(metric)
+    if not block:
+        return "n/a"
+    return f"{block[key]:.2f}" if key == "mean" else _cell(block[key])
+
+
+def _table(canvas: Canvas, header: Sequence[str], rows: Sequence[Sequence[str]]) -> None:
+    size, pad = 12 * PX, 8 * PX
+    row_h = size * 1.2 + 2 * pad
+    col_w = CONTENT_W / len(header)
+    for r, cells in enumerate([header, *rows]):
+        if r > 0:
+            canvas.ensure(row_h)
+        top = canvas.y
+        for c, value in enumerate(cells):
+            x = MARGIN + c * col_w
+            canvas.rect(x, top, col_w, row_h, fill=HEADER_BG if r == 0 else None, stroke=BORDER)
+            canvas.text(x + pad, top + pad + size * 0.95, value, BOLD if r == 0 else REGULAR, size)
+        canvas.y += row_h
+
+
+def _heading(canvas: Canvas, text: str) -> None:
+    size = 16 * PX
+    canvas.y += 24 * PX
+    canvas.ensure(size * 1.2 + 8 * PX + 60)  # keep the heading with the start of its section
+    canvas.paragraph([(text, BOLD)], MARGIN, CONTENT_W, size)
+    canvas.y += 8 * PX
+
+
+def draw_report(payload: Dict[str, Any]) -> bytes:
+    """
+    Draw the bundled report layout (``report_body.html``) for a ``report_payload``
+    straight into PDF operators and return the document.
+
+    The page size, margins, font sizes, colours and table borders follow the
+    template's CSS; text uses the standard Helvetica fonts, so nothing is embedded.
+    """
+    canvas = Canvas()
+    context = payload.get("context") or {}
+    canvas.paragraph([("Cardio Report (Descriptive Only)", BOLD)], MARGIN, CONTENT_W, 22 * PX)
+    canvas.y += 4 * PX
+    canvas.paragraph([
+        ("Patient:", BOLD), (f" {payload['patient_name']}  |  ", REGULAR),
+        ("ID:", BOLD), (f" {payload['patient_id']}  |  ", REGULAR),
+        ("Date:", BOLD), (f" {payload['timestamp']}", REGULAR),
+    ], MARGIN, CONTENT_W, 12 * PX, MUTED)
+    canvas.paragraph([
+        ("Context:", BOLD),
+        (f" age {_cell(context.get('age_years', ...))}, sex {_cell(context.get('sex', ...))}, "
+         f"note: {_cell(context.get('notes', ...))}", REGULAR),
+    ], MARGIN, CONTENT_W, 12 * PX, MUTED)
+    canvas.y += 16 * PX
+
+    _heading(canvas, "Vitals (as provided)")
+    _table(canvas, ("Vessel", "PSV (cm/s)", "EDV (cm/s)", "IMT (mm)"),
+           [(_cell(r["vessel"]), _cell(r["psv"]), _cell(r["edv"]), _cell(r["imt"])) for r in payload["vitals_rows"]])
+
+    _heading(canvas, "Summary (Descriptive)")
+    ratio = payload.get("ica_cca_ratio")
+    size, pad_x, pad_y = 11 * PX, 8 * PX, 4 * PX
+    x = MARGIN
+    for label in (f"Highest PSV: {payload.get('highest_psv_vessel') or 'n/a'}",
+                  f"ICA/CCA PSV ratio: {'n/a' if ratio is None else ratio}"):
+        w = text_width(label, REGULAR, size) + 2 * pad_x
+        canvas.rect(x, canvas.y, w, size * 1.2 + 2 * pad_y, stroke=BORDER, radius=12 * PX)
+        canvas.text(x + pad_x, canvas.y + pad_y + size * 0.95, label, REGULAR, size)
+        x += w + 6 * PX
+    canvas.y += size * 1.2 + 2 * pad_y
+
+    _heading(canvas, "Aggregate Statistics")
+    stats = payload.get("stats") or {}
+    _table(canvas, ("Metric", "Min", "Max", "Mean"),
+           [(label, _stat(stats, m, "min"), _stat(stats, m, "max"), _stat(stats, m, "mean"))
+            for label, m in (("PSV (cm/s)", "psv"), ("EDV (cm/s)", "edv"), ("IMT (mm)", "imt"))])
+
+    trend = payload.get("trend")
+    if trend:
+        _heading(canvas, f"Trend ({trend['exams']} exams since {trend['first_timestamp']})")
+        _table(canvas, ("Metric", "Latest", "Change", f"Mean (last {trend['window']})"),
+               [(m["label"], _cell(m["latest"]), "n/a" if m["delta"] is None else f"{m['delta']:+.2f}",
+                 f"{m['mean']:.2f}") for m in trend["metrics"]])
+
+    _heading(canvas, "Findings (Descriptive Only)")
+    size = 16 * PX
+    indent = 40 * PX
+    for note in payload.get("notes") or ["No additional descriptive notes."]:
+        canvas.ensure(size * 1.2)
+        canvas.text(MARGIN + indent - 12 * PX, canvas.y + size * 0.95, "•", REGULAR, size)
+        # whitespace collapses as in HTML
+        canvas.paragraph([(" ".join(str(note).split()), REGULAR)], MARGIN + indent, CONTENT_W - indent, size)
+    canvas.y += 24 * PX
+    canvas.paragraph([
+        ("This report is automatically generated from provided data and mock computations. It is ", REGULAR),
+        ("not", BOLD), (" a clinical or diagnostic assessment.", REGULAR),
+    ], MARGIN, CONTENT_W, 10 * PX, FAINT)
+    return _document(canvas.pages, title="Cardio Report (Descriptive Only)")
+
+
+def _document(pages: Sequence[Sequence[bytes]], title: str) -> bytes:
+    """Assemble a PDF 1.4 file: catalog, page tree, the two core fonts, then each page and its stream."""
+    objects: List[bytes] = [b"", b""]  # catalog and page tree, filled in below
+    font_refs = []
+    for name, (base, _) in FONTS.items():
+        objects.append(f"<< /Type /Font /Subtype /Type1 /BaseFont /{base} /Encoding /WinAnsiEncoding >>".encode())
+        font_refs.append(f"/{name} {len(objects)} 0 R")
+    objects.append(b"<< /Title " + _pdf_string(title) + b" /Producer (native_pdf) >>")
+    info = len(objects)
+    kids = []
+    for ops in pages:
+        stream = zlib.compress(b"\n".join(ops), 6)
+        objects.append(b"<< /Length %d /Filter /FlateDecode >>\nstream\n" % len(stream) + stream + b"\nendstream")
+        objects.append(
+            f"<< /Type /Page /Parent 2 0 R /MediaBox [0 0 {PAGE_W:g} {PAGE_H:g}] "
+            f"/Resources << /Font << {' '.join(font_refs)} >> >> /Contents {len(objects)} 0 R >>".encode()
+        )
+        kids.append(f"{len(objects)} 0 R")
+    objects[0] = b"<< /Type /Catalog /Pages 2 0 R >>"
+    objects[1] = f"<< /Type /Pages /Kids [{' '.join(kids)}] /Count {len(kids)} >>".encode()
+
+    out = bytearray(b"%PDF-1.4\n%\xe2\xe3\xcf\xd3\n")
+    offsets = []
+    for number, body in enumerate(objects, 1):
+        offsets.append(len(out))
+        out += b"%d 0 obj\n" % number + body + b"\nendobj\n"
+    xref = len(out)
+    out += b"xref\n0 %d\n0000000000 65535 f \n" % (len(objects) + 1)
+    out += b"".join(b"%010d 00000 n \n" % offset for offset in offsets)
+    out += b"trailer\n<< /Size %d /Root 1 0 R /Info %d 0 R >>\nstartxref\n%d\n%%%%EOF\n" % (
+        len(objects) + 1, info, xref)
+    return bytes(out)
+
+
+class NativePdfEngine:
+    """
+    Drop-in for ``PdfEngine`` that draws the fixed report layout directly
+    (``draw_report``) instead of laying out the HTML, a few milliseconds per
+    report and no WeasyPrint import. It needs the ``report_payload`` the HTML
+    was rendered from; the HTML itself is ignored, so edits to the template do
+    not show up in its PDFs (use WeasyPrint for custom templates).
+
+    Args:
+        template_path: Unused; accepted for the ``PdfEngine`` signature.
+        max_documents: Recycle hint after this many documents (None: never).
+        max_rss_bytes: Unused; drawing does not accumulate memory.
+    """
+
+    backend = "native"
+
+    def __init__(
+        self,
+        template_path: Optional[Path] = None,
+        max_documents: Optional[int] = None,
+        max_rss_bytes: Optional[int] = None,
+    ) -> None:
+        self.max_documents = max_documents
+        self.documents = 0
+
+    def write_pdf(
+        self,
+        html: Optional[str],
+        out_pdf: Optional[Path] = None,
+        base_url: Optional[str] = None,
+        payload: Optional[Dict[str, Any]] = None,
+    ) -> Optional[bytes]:
+        """Draw ``payload`` to ``out_pdf`` (or return the PDF bytes when ``out_pdf`` is None)."""
+        if payload is None:
+            raise ValueError("the native PDF backend draws the report payload, not HTML; pass payload=")
+        pdf = draw_report(payload)
+        self.documents += 1
+        if out_pdf is None:
+            return pdf
+        out_pdf.parent.mkdir(parents=True, exist_ok=True)
+        out_pdf.write_bytes(pdf)
+        return None
+
+    def should_recycle(self) -> bool:
+        return self.max_documents is not None and self.documents >= self.max_documents
@@ -0,0 +1,140 @@
+from __future__ import annotations
+
+import os
+import re
+from pathlib import Path
+from typing import TYPE_CHECKING, Any, Dict, List, Optional, Set
+
+from instrument import current_rss_bytes
+
+if TYPE_CHECKING:
+    from weasyprint import CSS
+    from weasyprint.document import Document
+
+_STYLE_BLOCK = re.compile(r"<style[^>]*>(.*?)</style>", re.IGNORECASE | re.DOTALL)
+
+# "weasyprint" lays out the rendered HTML (any template); "native" draws the
+# bundled layout straight from the report payload (see native_pdf.py).
+PDF_BACKENDS = ("weasyprint", "native")
+# Set by ``--pdf-backend`` so worker processes pick the same backend.
+PDF_BACKEND_ENV = "REPORT_PDF_BACKEND"
+
+
+class PdfEngine:
+    """
+    Long-lived WeasyPrint engine for rendering many reports from one template.
+
+    One ``FontConfiguration`` is shared by every document, and the template's
+    inline ``<style>`` blocks are parsed once into ``CSS`` objects. Rendered
+    HTML that still carries an identical ``<style>`` block has it stripped and
+    the pre-parsed stylesheet is applied instead, so CSS parsing and font
+    discovery are not repeated per document.
+
+    WeasyPrint applies ``stylesheets=`` with *user* origin rather than the
+    *author* origin of an inline block. The result is the same as long as the
+    stripped block was the document's only author CSS (true for the bundled
+    templates, which have no ``style=`` attributes or other ``<style>``/``<link>``
+    sheets); ``tests/test_pdf_engine.py`` checks layout parity.
+
+    WeasyPrint is imported when the first engine is created, not with this
+    module, so importing it stays cheap for HTML-only callers.
+
+    The engine also tracks how much work it has done. ``should_recycle`` is the
+    single recycle signal used by batch workers: it turns true after
+    ``max_documents`` documents or once RSS exceeds ``max_rss_bytes``.
+
+    Args:
+        template_path: Template whose ``<style>`` blocks are pre-parsed (optional).
+        max_documents: Recycle hint after this many documents (None: never).
+        max_rss_bytes: Recycle hint once process RSS exceeds this (None: never).
+    """
+
+    backend = "weasyprint"
+
+    def __init__(
+        self,
+        template_path: Optional[Path] = None,
+        max_documents: Optional[int] = None,
+        max_rss_bytes: Optional[int] = None,
+    ) -> None:
+        from weasyprint import CSS
+        from weasyprint.text.fonts import FontConfiguration
+
+        self.font_config = FontConfiguration()
+        self.max_documents = max_documents
+        self.max_rss_bytes = max_rss_bytes
+        self.documents = 0
+        self._style_sources: Set[str] = set()
+        self._stylesheets: List[CSS] = []
+        if template_path is not None:
+            base_url = str(Path(template_path).parent)
+            for block in _STYLE_BLOCK.findall(Path(template_path).read_text(encoding="utf-8")):
+                if block in self._style_sources:
+                    continue
+                self._style_sources.add(block)
+                self._stylesheets.append(CSS(string=block, base_url=base_url, font_config=self.font_config))
+
+    def _strip_known_styles(self, html: str) -> str:
+        if not self._style_sources:
+            return html
+        return _STYLE_BLOCK.sub(
+            lambda m: "" if m.group(1) in self._style_sources else m.group(0), html
+        )
+
+    def render(self, html: str, base_url: Optional[str] = None) -> "Document":
+        """Lay out ``html`` with the shared fonts and stylesheets and return the WeasyPrint document."""
+        from weasyprint import HTML
+
+        doc = HTML(string=self._strip_known_styles(html), base_url=base_url)
+        return doc.render(stylesheets=self._stylesheets, font_config=self.font_config)
+
+    def write_pdf(
+        self,
+        html: str,
+        out_pdf: Optional[Path] = None,
+        base_url: Optional[str] = None,
+        payload: Optional[Dict[str, Any]] = None,
+    ) -> Optional[bytes]:
+        """
+        Render ``html`` to ``out_pdf`` (or return the PDF bytes when ``out_pdf`` is None).
+
+        ``payload`` is ignored; it is accepted so engines are interchangeable
+        (see ``create_engine``).
+        """
+        if out_pdf is not None:
+            out_pdf.parent.mkdir(parents=True, exist_ok=True)
+            base_url = base_url or str(out_pdf.parent)
+        result = self.render(html, base_url).write_pdf(None if out_pdf is None else str(out_pdf))
+        self.documents += 1
+        return result
+
+    def should_recycle(self) -> bool:
+        """True once the document or RSS budget is exhausted."""
+        if self.max_documents is not None and self.documents >= self.max_documents:
+            return True
+        if self.max_rss_bytes is not None:
+            rss = current_rss_bytes()
+            return rss is not None and rss > self.max_rss_bytes
+        return False
+
+
+def pdf_backend(backend: Optional[str] = None) -> str:
+    """``backend`` or, if None, the one named by ``REPORT_PDF_BACKEND`` (default: weasyprint)."""
+    backend = backend or os.environ.get(PDF_BACKEND_ENV) or "weasyprint"
+    if backend not in PDF_BACKENDS:
+        raise ValueError(f"unknown PDF backend {backend!r}; expected one of {', '.join(PDF_BACKENDS)}")
+    return backend
+
+
+def create_engine(
+    template_path: Optional[Path] = None,
+    max_documents: Optional[int] = None,
+    max_rss_bytes: Optional[int] = None,
+    backend: Optional[str] = None,
+) -> Any:
+    """A ``PdfEngine`` or, for the native backend, a ``NativePdfEngine`` (see ``pdf_backend``)."""
+    if pdf_backend(backend) == "native":
+        from native_pdf import NativePdfEngine
+
+        return NativePdfEngine(template_path, max_documents=max_documents, max_rss_bytes=max_rss_bytes)
+    return PdfEngine(template_path, max_documents=max_documents, max_rss_bytes=max_rss_bytes)
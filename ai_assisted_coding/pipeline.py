@@ -0,0 +1,401 @@
+"""
+Pipelined batch rendering: each step of a report runs as its own stage, so
+loading, analysis, HTML rendering, file writes and PDF layout of different
+records overlap instead of running strictly one after another.
+
+    python main.py --batch cohort.jsonl --pipeline --stage pdf=process:4 --stage write=thread:2
+
+Stages are connected by bounded queues: a stage that falls behind fills its
+input queue and the stages before it block, so memory stays bounded however
+large the cohort is. Each stage runs its function inline (in the stage's own
+thread), on a thread pool (I/O: file writes) or on a process pool (CPU:
+analysis, layout). Output keeps the input order unless ``ordered=False``.
+"""
+from __future__ import annotations
+
+import collections
+import itertools
+import multiprocessing
+import queue
+import threading
+import time
+from concurrent.futures import FIRST_COMPLETED, Executor, Future, ProcessPoolExecutor, ThreadPoolExecutor
+from concurrent.futures import wait as wait_futures
+from dataclasses import dataclass, replace
+from functools import partial
+from multiprocessing.context import BaseContext
+from pathlib import Path
+from typing import Any, Callable, Deque, Dict, Iterable, Iterator, List, Optional, Sequence, Tuple, Union
+
+import instrument
+from batch import BatchRecord, BatchResult, BatchSummary, _record_dir_name, iter_batch_records
+from main import TEMPLATE_NAME, _render_payload, _write_json, report_payload
+
+EXECUTORS = ("inline", "thread", "process")
+REPORT_STAGES = ("analyze", "render", "write", "pdf")
+
+_DONE = object()
+
+
+@dataclass(frozen=True)
+class Stage:
+    """
+    One step of a ``Pipeline``: ``fn`` maps an item to the next stage's item.
+
+    ``executor`` is "inline" (run in the stage's thread), "thread" or "process"
+    with ``workers`` workers; a process stage needs a picklable ``fn`` (a
+    module-level function or a ``functools.partial`` of one). ``initializer``
+    runs once in each process of a process stage.
+    """
+    name: str
+    fn: Callable[[Any], Any]
+    executor: str = "inline"
+    workers: int = 1
+    initializer: Optional[Callable[[], None]] = None
+
+    def __post_init__(self) -> None:
+        if self.executor not in EXECUTORS:
+            raise ValueError(f"Unknown executor {self.executor!r} for stage {self.name!r}; one of {EXECUTORS}")
+        if self.workers < 1:
+            raise ValueError(f"Stage {self.name!r} needs at least one worker")
+
+
+class _Failed:
+    """An exception raised by a stage, passed down the queues to the consumer."""
+
+    def __init__(self, stage: str, error: BaseException) -> None:
+        self.stage = stage
+        self.error = error
+
+
+class Pipeline:
+    """
+    Run items through ``stages`` connected by queues of at most ``maxsize`` items.
+
+    Items travel in chunks of ``chunk_size``: each queue entry, and each task
+    of a pooled stage, is a chunk, which keeps the hand-off cost per item low.
+    Each stage has a thread that takes chunks from its input queue and runs
+    them (inline or on its executor); pooled stages keep at most twice their
+    worker count in flight. With ``ordered`` the results come out in input
+    order, otherwise as soon as their chunk is done.
+
+    An exception raised by a stage function stops the pipeline and is raised
+    by ``run`` in the consumer; functions that should not stop a run (e.g.
+    one failing record of a batch) return their errors as values instead.
+
+    Args:
+        stages: The steps, in order.
+        maxsize: Capacity of each queue between stages, in chunks.
+        ordered: Emit results in input order.
+        chunk_size: Items per queue entry and per pooled task.
+        mp_context: Multiprocessing context of process stages (default: the platform's).
+    """
+
+    def __init__(
+        self,
+        stages: Sequence[Stage],
+        maxsize: int = 64,
+        ordered: bool = True,
+        chunk_size: int = 1,
+        mp_context: Optional[BaseContext] = None,
+    ) -> None:
+        if not stages:
+            raise ValueError("A pipeline needs at least one stage")
+        self.stages = list(stages)
+        self.maxsize = max(1, maxsize)
+        self.ordered = ordered
+        self.chunk_size = max(1, chunk_size)
+        self.mp_context = mp_context
+
+    def run(self, items: Iterable[Any]) -> Iterator[Any]:
+        """Yield the last stage's result for every item of ``items`` (read in a thread of its own)."""
+        stop = threading.Event()
+        queues: List["queue.Queue[Any]"] = [queue.Queue(self.maxsize) for _ in range(len(self.stages) + 1)]
+        executors = [self._executor(stage) for stage in self.stages]
+        threads = [threading.Thread(target=self._feed, args=(items, queues[0], stop), name="pipeline-source",
+                                    daemon=True)]
+        for i, (stage, executor) in enumerate(zip(self.stages, executors)):
+            threads.append(threading.Thread(
+                target=self._drive, args=(stage, executor, queues[i], queues[i + 1], stop),
+                name=f"pipeline-{stage.name}", daemon=True,
+            ))
+        for t in threads:
+            t.start()
+        try:
+            while True:
+                item = _get(queues[-1], stop)
+                if item is _DONE:
+                    return
+                if isinstance(item, _Failed):
+                    raise item.error
+                yield from item[1]
+        finally:
+            stop.set()
+            for t in threads:
+                t.join()
+            for executor in executors:
+                if executor is not None:
+                    executor.shutdown(wait=True, cancel_futures=True)
+
+    def _executor(self, stage: Stage) -> Optional[Executor]:
+        if stage.executor == "thread":
+            return ThreadPoolExecutor(stage.workers, thread_name_prefix=f"pipeline-{stage.name}",
+                                      initializer=stage.initializer)
+        if stage.executor == "process":
+            return ProcessPoolExecutor(stage.workers, mp_context=self.mp_context or multiprocessing.get_context(),
+                                       initializer=stage.initializer)
+        return None
+
+    def _feed(self, items: Iterable[Any], out: "queue.Queue[Any]", stop: threading.Event) -> None:
+        it = iter(items)
+        try:
+            for seq in itertools.count():
+                chunk = list(itertools.islice(it, self.chunk_size))
+                if not chunk:
+                    break
+                if not _put(out, (seq, chunk), stop):
+                    return
+        except BaseException as e:  # noqa: BLE001 - reading the input failed; the consumer raises it
+            _put(out, _Failed("source", e), stop)
+            return
+        _put(out, _DONE, stop)
+
+    def _drive(
+        self, stage: Stage, executor: Optional[Executor], inbox: "queue.Queue[Any]", out: "queue.Queue[Any]",
+        stop: threading.Event,
+    ) -> None:
+        try:
+            self._run_stage(stage, executor, inbox, out, stop)
+        except BaseException as e:  # noqa: BLE001 - e.g. a pool that cannot start; the consumer raises it
+            _put(out, _Failed(stage.name, e), stop)
+
+    def _run_stage(
+        self, stage: Stage, executor: Optional[Executor], inbox: "queue.Queue[Any]", out: "queue.Queue[Any]",
+        stop: threading.Event,
+    ) -> None:
+        """Move chunks from ``inbox`` through ``stage`` to ``out`` until the input ends or the run stops."""
+        window = 2 * stage.workers
+        in_order: Deque[Tuple[int, Future]] = collections.deque()
+        pending: Dict[Future, int] = {}
+
+        def emit(seq: int, future: Future) -> bool:
+            try:
+                return _put(out, (seq, future.result()), stop)
+            except BaseException as e:  # noqa: BLE001 - passed on to the consumer
+                _put(out, _Failed(stage.name, e), stop)
+                return False
+
+        def drain(keep: int) -> bool:
+            """Emit finished items until at most ``keep`` are in flight."""
+            if self.ordered:
+                while len(in_order) > keep:
+                    if not emit(*in_order.popleft()):
+                        return False
+                return True
+            while len(pending) > keep:
+                done, _ = wait_futures(pending, return_when=FIRST_COMPLETED)
+                for future in done:
+                    if not emit(pending.pop(future), future):
+                        return False
+            return True
+
+        while True:
+            item = _get(inbox, stop)
+            if item is _DONE or isinstance(item, _Failed):
+                if item is _DONE and not drain(0):
+                    return
+                _put(out, item, stop)
+                return
+            seq, chunk = item
+            if executor is None:
+                with instrument.span(stage.name):
+                    try:
+                        results = _apply(stage.fn, chunk)
+                    except BaseException as e:  # noqa: BLE001 - passed on to the consumer
+                        _put(out, _Failed(stage.name, e), stop)
+                        return
+                if not _put(out, (seq, results), stop):
+                    return
+                continue
+            future = executor.submit(_apply, stage.fn, chunk)
+            if self.ordered:
+                in_order.append((seq, future))
+            else:
+                pending[future] = seq
+            if not drain(window - 1):
+                return
+
+
+def _apply(fn: Callable[[Any], Any], chunk: List[Any]) -> List[Any]:
+    return [fn(item) for item in chunk]
+
+
+def _put(q: "queue.Queue[Any]", item: Any, stop: threading.Event) -> bool:
+    """Put ``item`` on the bounded queue ``q``, waiting for room; False if the run stopped first."""
+    while not stop.is_set():
+        try:
+            q.put(item, timeout=0.1)
+            return True
+        except queue.Full:
+            continue
+    return False
+
+
+def _get(q: "queue.Queue[Any]", stop: threading.Event) -> Any:
+    while not stop.is_set():
+        try:
+            return q.get(timeout=0.1)
+        except queue.Empty:
+            continue
+    return _DONE
+
+
+def parse_stage(spec: str) -> Tuple[str, str, Optional[int]]:
+    """``"pdf=process:4"`` -> ``("pdf", "process", 4)``; the worker count is optional."""
+    name, sep, rest = spec.partition("=")
+    executor, _, workers = rest.partition(":")
+    if not sep or name not in REPORT_STAGES or executor not in EXECUTORS:
+        raise ValueError(f"Invalid stage {spec!r}: expected <stage>=<executor>[:<workers>] with a stage of "
+                         f"{', '.join(REPORT_STAGES)} and an executor of {', '.join(EXECUTORS)}")
+    try:
+        count = int(workers) if workers else None
+    except ValueError:
+        raise ValueError(f"Invalid worker count in stage {spec!r}") from None
+    if count is not None and count < 1:
+        raise ValueError(f"Invalid worker count in stage {spec!r}")
+    return name, executor, count
+
+
+# ---- report stages -----------------------------------------------------------------------------------------
+
+@dataclass(frozen=True)
+class _Job:
+    """One record on its way through the report stages; a failed step sets ``error`` and skips the rest."""
+    record: BatchRecord
+    out_dir: Path
+    payload: Optional[Dict[str, Any]] = None
+    html: Optional[str] = None
+    error: Optional[str] = None
+
+
+def _step(fn: Callable[..., _Job], job: _Job, **kwargs: Any) -> _Job:
+    if job.error is not None:
+        return job
+    try:
+        return fn(job, **kwargs)
+    except Exception as e:  # noqa: BLE001 - a failing record must not stop the batch
+        return replace(job, error=f"{type(e).__name__}: {e}")
+
+
+def _analyze(job: _Job) -> _Job:
+    return replace(job, payload=report_payload(job.record.data, job.record.trend))
+
+
+def _render(job: _Job, template_dir: Path) -> _Job:
+    return replace(job, html=_render_payload(job.payload, template_dir))
+
+
+def _write(job: _Job) -> _Job:
+    _write_json(job.out_dir / "normalized_input.json", job.record.data)
+    (job.out_dir / "report.html").write_text(job.html, encoding="utf-8")
+    return job
+
+
+# PDF engine of each thread or process of the pdf stage, created on its first document.
+_engines = threading.local()
+
+
+def _pdf(job: _Job, template_dir: Path) -> _Job:
+    engine = getattr(_engines, "engine", None)
+    if engine is None:
+        from pdf_engine import create_engine
+
+        engine = _engines.engine = create_engine(template_dir / TEMPLATE_NAME)
+    engine.write_pdf(job.html, job.out_dir / "report.pdf", base_url=str(template_dir), payload=job.payload)
+    return replace(job, payload=None, html=None)  # nothing left to send back
+
+
+def report_stages(
+    template_dir: Path, output_format: str = "pdf", executors: Optional[Dict[str, Tuple[str, int]]] = None
+) -> List[Stage]:
+    """
+    The stages of one report: ``analyze`` (``report_payload``), ``render``
+    (HTML), ``write`` (``normalized_input.json`` and ``report.html``) and,
+    for PDFs, ``pdf``.
+
+    ``executors`` maps stage names to ``(executor, workers)``; by default
+    analysis and rendering run inline, writes on 2 threads and PDF layout on
+    a process per CPU (inline on a single CPU, where a process only adds the
+    cost of sending each document to it).
+    """
+    cpus = multiprocessing.cpu_count()
+    chosen = {"analyze": ("inline", 1), "render": ("inline", 1), "write": ("thread", 2),
+              "pdf": ("process", cpus) if cpus > 1 else ("inline", 1)}
+    chosen.update(executors or {})
+    steps = {
+        "analyze": partial(_step, _analyze),
+        "render": partial(_step, _render, template_dir=template_dir),
+        "write": partial(_step, _write),
+        "pdf": partial(_step, _pdf, template_dir=template_dir),
+    }
+    names = REPORT_STAGES if output_format == "pdf" else REPORT_STAGES[:3]
+    return [Stage(name, steps[name], *chosen[name]) for name in names]
+
+
+def run_pipeline(
+    source: Union[Path, Iterable[BatchRecord]],
+    out_root: Path,
+    template_dir: Path,
+    output_format: str = "pdf",
+    executors: Optional[Dict[str, Tuple[str, int]]] = None,
+    ordered: bool = True,
+    maxsize: int = 8,
+    chunk_size: int = 16,
+    records: Optional[Callable[[Iterable[BatchRecord]], Iterable[BatchRecord]]] = None,
+) -> BatchSummary:
+    """
+    Render every record of ``source`` like ``batch.run_batch`` (same output
+    folders and ``batch_summary.json``), with the report steps pipelined
+    (see ``report_stages``) instead of run one after another per record.
+
+    ``records``, if given, filters the record stream before the first stage
+    (e.g. ``validate.screen`` with a quarantine).
+    """
+    stream = iter_batch_records(source) if isinstance(source, Path) else iter(source)
+    if records is not None:
+        stream = iter(records(stream))
+    jobs = (_Job(r, out_root / _record_dir_name(r.index, r.data or {}), error=r.error if r.data is None else None)
+            for r in stream)
+    summary = BatchSummary()
+    started = time.perf_counter()
+    out_root.mkdir(parents=True, exist_ok=True)
+    pipeline = Pipeline(report_stages(template_dir, output_format, executors), maxsize=maxsize, ordered=ordered,
+                        chunk_size=chunk_size)
+    for job in pipeline.run(jobs):
+        data = job.record.data or {}
+        patient_id = str(data["patient_id"]) if "patient_id" in data else None
+        out_dir = str(job.out_dir) if job.record.data is not None else None
+        summary.add(BatchResult(job.record.index, job.record.source, patient_id, out_dir, job.error))
+    summary.failures.sort(key=lambda r: r.index)
+    summary.elapsed_s = time.perf_counter() - started
+    _write_json(out_root / "batch_summary.json", summary.to_dict())
+    return summary
+
+
+def run_sequential(
+    source: Union[Path, Iterable[BatchRecord]], out_root: Path, template_dir: Path, output_format: str = "pdf"
+) -> BatchSummary:
+    """The same steps as ``run_pipeline``, one record after another in this thread: its baseline."""
+    stages = report_stages(template_dir, output_format)
+    stream = iter_batch_records(source) if isinstance(source, Path) else iter(source)
+    summary = BatchSummary()
+    started = time.perf_counter()
+    for r in stream:
+        job = _Job(r, out_root / _record_dir_name(r.index, r.data or {}), error=r.error if r.data is None else None)
+        for stage in stages:
+            job = stage.fn(job)
+        data = r.data or {}
+        summary.add(BatchResult(r.index, r.source, str(data["patient_id"]) if "patient_id" in data else None,
+                                str(job.out_dir) if r.data is not None else None, job.error))
+    summary.elapsed_s = time.perf_counter() - started
+    return summary
@@ -0,0 +1,275 @@
+from __future__ import annotations
+
+import math
+import sys
+from array import array
+from typing import Any, Dict, Iterator, List, Optional, Tuple, Union
+
+from serialization import loads
+
+VESSELS: Tuple[str, ...] = ("CCA", "ICA", "ECA")
+METRICS: Tuple[str, ...] = ("psv_cm_s", "edv_cm_s", "imt_mm")
+FIELDS: Tuple[str, ...] = ("patient_id", "name", "timestamp", "context", "vitals")
+
+_VESSEL_INDEX = {v: i for i, v in enumerate(VESSELS)}
+_METRIC_INDEX = {m: i for i, m in enumerate(METRICS)}
+_N_VALUES = len(VESSELS) * len(METRICS)
+_EMPTY = array("d", [math.nan] * _N_VALUES)
+
+# Bits of PatientRecord._layout: which keys the input had, and which numbers were JSON integers.
+_FIELD_BIT = {name: 1 << i for i, name in enumerate(FIELDS)}
+_VESSEL_SHIFT = len(FIELDS)                   # vessel key present
+_KEY_SHIFT = _VESSEL_SHIFT + len(VESSELS)     # metric key present (its value may be null)
+_INT_SHIFT = _KEY_SHIFT + _N_VALUES           # value was an integer; position _N_VALUES is the ratio
+_RATIO_KEY = 1 << (_INT_SHIFT + _N_VALUES + 1)
+
+# Context key tuples are shared between records with the same keys.
+_CONTEXT_SHAPES: Dict[Tuple[str, ...], Tuple[str, ...]] = {}
+
+
+class _NotCompact(Exception):
+    pass
+
+
+def _number(value: Any) -> Tuple[float, bool]:
+    """(value as float, was an int) for a finite JSON number that converts exactly."""
+    t = type(value)
+    if t is float:
+        if math.isfinite(value):
+            return value, False
+    elif t is int:
+        try:
+            f = float(value)
+        except OverflowError:
+            raise _NotCompact from None
+        if f == value:
+            return f, True
+    raise _NotCompact
+
+
+def _parse_vitals(vitals: Dict[str, Any]) -> Tuple[array, float, int]:
+    metrics = array("d", _EMPTY)
+    ratio = math.nan
+    layout = 0
+    last = -1
+    for key, payload in vitals.items():
+        if key == "ica_cca_ratio":
+            layout |= _RATIO_KEY
+            if payload is not None:
+                ratio, is_int = _number(payload)
+                if is_int:
+                    layout |= 1 << (_INT_SHIFT + _N_VALUES)
+            continue
+        vi = _VESSEL_INDEX.get(key)
+        # Vessels must come in VESSELS order, which is then also the order ties are broken in.
+        if vi is None or vi <= last or type(payload) is not dict:
+            raise _NotCompact
+        last = vi
+        layout |= 1 << (_VESSEL_SHIFT + vi)
+        for metric, value in payload.items():
+            mi = _METRIC_INDEX.get(metric)
+            if mi is None:
+                raise _NotCompact
+            pos = vi * len(METRICS) + mi
+            layout |= 1 << (_KEY_SHIFT + pos)
+            if value is not None:
+                metrics[pos], is_int = _number(value)
+                if is_int:
+                    layout |= 1 << (_INT_SHIFT + pos)
+    return metrics, ratio, layout
+
+
+class PatientRecord:
+    """
+    Compact in-memory form of one input record.
+
+    The nine vessel x metric values (``VESSELS`` x ``METRICS``, row-major) live
+    in one ``array('d')`` with NaN for missing or null values, the ICA/CCA ratio
+    in a float (NaN if missing), and which keys were present, and which numbers
+    were integers, in one int, so ``to_dict()`` gives back the input (keys in
+    schema order). Context key tuples are shared between records. A record
+    uses under a quarter of the memory of the equivalent dicts.
+
+    ``analysis.analyze``, ``analysis.analyze_batch``, ``main.report_payload``,
+    ``main.render_html``, ``main.write_report`` and ``main.render_artifacts``
+    accept records wherever they accept dicts, and read the values straight
+    from the array. Vitals outside this layout (unknown vessels or metric keys,
+    non-numeric or non-finite values, vessels out of ``VESSELS`` order) are
+    kept as the original dict (``compact`` is False) and handled like dict input.
+    """
+
+    __slots__ = ("patient_id", "name", "timestamp", "metrics", "ratio",
+                 "_layout", "_context_keys", "_context_values", "_raw_vitals", "_extra")
+
+    patient_id: Any
+    name: Any
+    timestamp: Any
+    metrics: array
+    ratio: float
+
+    @classmethod
+    def from_dict(cls, data: Dict[str, Any]) -> "PatientRecord":
+        """Convert one record of the input JSON schema."""
+        rec = cls.__new__(cls)
+        layout = 0
+        for key, bit in _FIELD_BIT.items():
+            if key in data:
+                layout |= bit
+        rec.patient_id = data.get("patient_id")
+        rec.name = data.get("name")
+        timestamp = data.get("timestamp")
+        # Dates and context values such as "female" repeat across a cohort; keep one copy.
+        rec.timestamp = sys.intern(timestamp) if type(timestamp) is str else timestamp
+
+        context = data.get("context")
+        if type(context) is dict:
+            keys = tuple(context)
+            rec._context_keys = _CONTEXT_SHAPES.setdefault(keys, keys)
+            rec._context_values = tuple(sys.intern(v) if type(v) is str else v for v in context.values())
+        else:
+            rec._context_keys = None
+            rec._context_values = context
+
+        vitals = data.get("vitals")
+        rec._raw_vitals = None
+        if vitals is None:
+            rec.metrics, rec.ratio = array("d", _EMPTY), math.nan
+        else:
+            try:
+                if type(vitals) is not dict:
+                    raise _NotCompact
+                rec.metrics, rec.ratio, vitals_layout = _parse_vitals(vitals)
+                layout |= vitals_layout
+            except _NotCompact:
+                rec.metrics, rec.ratio = array("d", _EMPTY), math.nan
+                rec._raw_vitals = vitals
+        rec._extra = None
+        if len(data) != bin(layout).count("1"):
+            rec._extra = {k: v for k, v in data.items() if k not in _FIELD_BIT}
+        rec._layout = layout
+        return rec
+
+    @classmethod
+    def from_json(cls, raw: Union[str, bytes]) -> "PatientRecord":
+        """Parse one JSON object of the input schema."""
+        data = loads(raw)
+        if not isinstance(data, dict):
+            raise ValueError(f"expected a JSON object, got {type(data).__name__}")
+        return cls.from_dict(data)
+
+    @property
+    def compact(self) -> bool:
+        """True if the vitals live in ``metrics``/``ratio`` (False: kept as the original dict)."""
+        return self._raw_vitals is None
+
+    def has(self, field: str) -> bool:
+        """Whether the input had the top-level key ``field``."""
+        bit = _FIELD_BIT.get(field)
+        if bit is not None:
+            return bool(self._layout & bit)
+        return self._extra is not None and field in self._extra
+
+    __contains__ = has
+
+    def _value(self, pos: int) -> Optional[float]:
+        """Value at ``metrics`` position ``pos`` (``_N_VALUES`` for the ratio) as it was in the input."""
+        v = self.ratio if pos == _N_VALUES else self.metrics[pos]
+        if v != v:
+            return None
+        return int(v) if self._layout >> (_INT_SHIFT + pos) & 1 else v
+
+    @property
+    def context(self) -> Any:
+        if self._context_keys is None:
+            return self._context_values
+        return dict(zip(self._context_keys, self._context_values))
+
+    @property
+    def vitals(self) -> Any:
+        """The vitals dict of the input (rebuilt; prefer ``metrics`` / ``vessel_rows``)."""
+        if self._raw_vitals is not None:
+            return self._raw_vitals
+        layout = self._layout
+        if not layout & _FIELD_BIT["vitals"]:
+            return None
+        out: Dict[str, Any] = {}
+        for vi, vessel in enumerate(VESSELS):
+            if layout >> (_VESSEL_SHIFT + vi) & 1:
+                base = vi * len(METRICS)
+                out[vessel] = {
+                    metric: self._value(base + mi)
+                    for mi, metric in enumerate(METRICS)
+                    if layout >> (_KEY_SHIFT + base + mi) & 1
+                }
+        if layout & _RATIO_KEY:
+            out["ica_cca_ratio"] = self._value(_N_VALUES)
+        return out
+
+    def vessel_rows(self) -> List[Dict[str, Any]]:
+        """One ``{"vessel", "psv", "edv", "imt"}`` row per vessel present (compact records only)."""
+        rows = []
+        layout = self._layout
+        for vi, vessel in enumerate(VESSELS):
+            if layout >> (_VESSEL_SHIFT + vi) & 1:
+                base = vi * len(METRICS)
+                rows.append({"vessel": vessel, "psv": self._value(base), "edv": self._value(base + 1),
+                             "imt": self._value(base + 2)})
+        return rows
+
+    def get(self, key: str, default: Any = None) -> Any:
+        """``dict.get`` over the input's top-level keys."""
+        if not self.has(key):
+            return default
+        if key in ("patient_id", "name", "timestamp"):
+            return getattr(self, key)
+        if key == "context":
+            return self.context
+        if key == "vitals":
+            return self.vitals
+        return self._extra[key]  # type: ignore[index]
+
+    def to_dict(self) -> Dict[str, Any]:
+        """The record in the input JSON schema."""
+        out = {key: self.get(key) for key in FIELDS if self._layout & _FIELD_BIT[key]}
+        if self._extra:
+            out.update(self._extra)
+        return out
+
+    def __eq__(self, other: object) -> bool:
+        if not isinstance(other, PatientRecord):
+            return NotImplemented
+        return self.to_dict() == other.to_dict()
+
+    __hash__ = None  # type: ignore[assignment]
+
+    def __repr__(self) -> str:
+        return f"PatientRecord(patient_id={self.patient_id!r}, timestamp={self.timestamp!r})"
+
+    def __getstate__(self) -> Tuple[Any, ...]:
+        return tuple(getattr(self, s) for s in self.__slots__)
+
+    def __setstate__(self, state: Tuple[Any, ...]) -> None:
+        for slot, value in zip(self.__slots__, state):
+            object.__setattr__(self, slot, value)
+        if self._context_keys is not None:
+            keys = self._context_keys
+            self._context_keys = _CONTEXT_SHAPES.setdefault(keys, keys)
+
+
+def as_dict(data: "RecordLike") -> Dict[str, Any]:
+    """``data`` in the input JSON schema (records are converted, dicts returned as they are)."""
+    return data.to_dict() if isinstance(data, PatientRecord) else data
+
+
+def iter_patient_records(path: Any) -> Iterator[PatientRecord]:
+    """``PatientRecord`` for every valid record of a file or directory (as read by ``--batch``)."""
+    from batch import iter_batch_records
+
+    for record in iter_batch_records(path):
+        if record.data is not None:
+            yield PatientRecord.from_dict(record.data)
+
+
+
+# What the analysis and rendering functions accept.
+RecordLike = Union[Dict[str, Any], PatientRecord]
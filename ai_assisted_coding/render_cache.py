@@ -0,0 +1,231 @@
+from __future__ import annotations
+
+import hashlib
+import json
+import os
+import shutil
+import sqlite3
+import time
+from pathlib import Path
+from typing import Any, Dict, Optional, Sequence, Tuple, Union
+
+# Modules whose source takes part in every cache key: editing any of them
+# invalidates all cached artifacts.
+_CODE_MODULES = ("analysis.py", "main.py", "renderer.py", "pdf_engine.py", "render_cache.py")
+_MARKER = ".render_key"
+
+_code_version: Optional[str] = None
+
+
+def code_version() -> str:
+    """Hash of the report pipeline's source code (computed once per process)."""
+    global _code_version
+    if _code_version is None:
+        h = hashlib.sha256()
+        here = Path(__file__).parent
+        for name in _CODE_MODULES:
+            path = here / name
+            if path.exists():
+                h.update(name.encode())
+                h.update(path.read_bytes())
+        _code_version = h.hexdigest()
+    return _code_version
+
+
+def canonical_json(data: Dict[str, Any]) -> bytes:
+    """Stable serialization of a record used for hashing."""
+    return json.dumps(data, sort_keys=True, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+
+
+class RenderCache:
+    """
+    Content-addressed on-disk cache of rendered report artifacts.
+
+    The key is a SHA-256 over the normalized input, the template contents and
+    the pipeline's code version, so any change to one of them is a miss.
+    Artifacts live in ``root/objects/<key[:2]>/<key>/``; a SQLite index keeps
+    their size and last access time for size-based LRU eviction and persists
+    hit/miss counters across runs. The index is safe to share between batch
+    worker processes.
+
+    On a hit the artifacts are copied into the output directory, unless that
+    directory already holds the same artifacts (recorded in a small
+    ``.render_key`` marker), in which case nothing is written at all.
+
+    Args:
+        root: Cache directory.
+        max_bytes: Evict least recently used entries beyond this total size.
+    """
+
+    def __init__(self, root: Path, max_bytes: int = 1 << 30) -> None:
+        self.root = Path(root)
+        self.max_bytes = max_bytes
+        self.root.mkdir(parents=True, exist_ok=True)
+        self._db = sqlite3.connect(str(self.root / "index.sqlite"), timeout=30, isolation_level=None)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        # losing the last few index updates on power loss only costs a re-render
+        self._db.execute("PRAGMA synchronous=NORMAL")
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS entries ("
+            " key TEXT PRIMARY KEY, size INTEGER NOT NULL, last_access REAL NOT NULL)"
+        )
+        self._db.execute("CREATE INDEX IF NOT EXISTS entries_lru ON entries(last_access)")
+        self._db.execute("CREATE TABLE IF NOT EXISTS counters (name TEXT PRIMARY KEY, value INTEGER NOT NULL)")
+        self._templates: Dict[Tuple[Tuple[Path, int], ...], bytes] = {}
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def close(self) -> None:
+        self._db.close()
+
+    def __enter__(self) -> "RenderCache":
+        return self
+
+    def __exit__(self, *exc: Any) -> None:
+        self.close()
+
+    def _template_digest(self, template_path: Path) -> bytes:
+        # Templates include and extend their siblings, so all of them are part of the key.
+        path = Path(template_path).resolve()
+        files = [path] + sorted(p for p in path.parent.glob("*.html") if p != path)
+        key = tuple((p, p.stat().st_mtime_ns) for p in files)
+        digest = self._templates.get(key)
+        if digest is None:
+            h = hashlib.sha256()
+            for p in files:
+                h.update(p.name.encode())
+                h.update(p.read_bytes())
+            digest = h.digest()
+            self._templates = {key: digest}
+        return digest
+
+    def key_for(self, data: Dict[str, Any], template_path: Path, variant: str = "") -> str:
+        """
+        Cache key for rendering ``data`` with ``template_path`` under the current code.
+
+        A non-empty ``variant`` (e.g. another PDF backend) keys artifacts that
+        differ for the same input apart from the default ones.
+        """
+        h = hashlib.sha256()
+        h.update(code_version().encode())
+        h.update(self._template_digest(template_path))
+        h.update(canonical_json(data))
+        if variant:
+            h.update(b"\0" + variant.encode())
+        return h.hexdigest()
+
+    def _entry_dir(self, key: str) -> Path:
+        return self.root / "objects" / key[:2] / key
+
+    def _count(self, name: str) -> None:
+        self._db.execute(
+            "INSERT INTO counters(name, value) VALUES (?, 1)"
+            " ON CONFLICT(name) DO UPDATE SET value = value + 1",
+            (name,),
+        )
+
+    def _lookup(self, key: str, names: Sequence[str]) -> Optional[Path]:
+        """Entry directory of ``key`` if it holds all ``names`` (counted as hit), else None (miss)."""
+        row = self._db.execute("SELECT size FROM entries WHERE key = ?", (key,)).fetchone()
+        entry = self._entry_dir(key)
+        if row is None or not all((entry / n).exists() for n in names):
+            self.misses += 1
+            self._count("misses")
+            return None
+        self._db.execute("UPDATE entries SET last_access = ? WHERE key = ?", (time.time(), key))
+        self.hits += 1
+        self._count("hits")
+        return entry
+
+    def get(self, key: str, out_dir: Path, names: Sequence[str]) -> bool:
+        """
+        Materialize cached artifacts ``names`` for ``key`` in ``out_dir``.
+
+        Returns:
+            True on a hit, False on a miss (nothing is written then).
+        """
+        entry = self._lookup(key, names)
+        if entry is None:
+            return False
+
+        marker = out_dir / _MARKER
+        up_to_date = (
+            marker.exists()
+            and marker.read_text(encoding="ascii") == key
+            and all((out_dir / n).exists() for n in names)
+        )
+        if not up_to_date:
+            out_dir.mkdir(parents=True, exist_ok=True)
+            for n in names:
+                shutil.copyfile(entry / n, out_dir / n)
+            marker.write_text(key, encoding="ascii")
+        return True
+
+    def load(self, key: str, names: Sequence[str]) -> Optional[Dict[str, bytes]]:
+        """Cached artifacts ``names`` of ``key`` as bytes (for output sinks), or None on a miss."""
+        entry = self._lookup(key, names)
+        if entry is None:
+            return None
+        return {n: (entry / n).read_bytes() for n in names}
+
+    def put(self, key: str, out_dir: Path, names: Sequence[str]) -> None:
+        """Store the freshly rendered artifacts ``names`` from ``out_dir`` under ``key``."""
+        self._store(key, {n: out_dir / n for n in names})
+        (out_dir / _MARKER).write_text(key, encoding="ascii")
+
+    def store(self, key: str, artifacts: Dict[str, bytes]) -> None:
+        """Store freshly rendered in-memory ``artifacts`` (name to content) under ``key``."""
+        self._store(key, artifacts)
+
+    def _store(self, key: str, sources: Dict[str, Union[Path, bytes]]) -> None:
+        entry = self._entry_dir(key)
+        tmp = entry.with_name(f"{key}.tmp{os.getpid()}")
+        tmp.mkdir(parents=True, exist_ok=True)
+        for n, src in sources.items():
+            if isinstance(src, bytes):
+                (tmp / n).write_bytes(src)
+            else:
+                shutil.copyfile(src, tmp / n)
+        if entry.exists():
+            # An entry written with fewer artifacts (e.g. ``--format html``) gains the new ones.
+            for n in sources:
+                if not (entry / n).exists():
+                    os.replace(tmp / n, entry / n)
+            shutil.rmtree(tmp, ignore_errors=True)
+        else:
+            os.replace(tmp, entry)
+        size = sum(f.stat().st_size for f in entry.iterdir())
+        self._db.execute(
+            "INSERT OR REPLACE INTO entries(key, size, last_access) VALUES (?, ?, ?)",
+            (key, size, time.time()),
+        )
+        self._evict()
+
+    def _evict(self) -> None:
+        total = self._db.execute("SELECT COALESCE(SUM(size), 0) FROM entries").fetchone()[0]
+        if total <= self.max_bytes:
+            return
+        for key, size in self._db.execute("SELECT key, size FROM entries ORDER BY last_access").fetchall():
+            if total <= self.max_bytes:
+                break
+            self._db.execute("DELETE FROM entries WHERE key = ?", (key,))
+            shutil.rmtree(self._entry_dir(key), ignore_errors=True)
+            total -= size
+            self.evictions += 1
+            self._count("evictions")
+
+    def stats(self) -> Dict[str, int]:
+        """Counters of this instance plus the persisted totals and current size."""
+        persisted = dict(self._db.execute("SELECT name, value FROM counters").fetchall())
+        entries, size = self._db.execute("SELECT COUNT(*), COALESCE(SUM(size), 0) FROM entries").fetchone()
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "total_hits": persisted.get("hits", 0),
+            "total_misses": persisted.get("misses", 0),
+            "total_evictions": persisted.get("evictions", 0),
+            "entries": entries,
+            "bytes": size,
+        }
@@ -0,0 +1,107 @@
+from __future__ import annotations
+
+import threading
+from collections import OrderedDict
+from pathlib import Path
+from typing import Any, Dict, Mapping, Optional, Tuple
+
+from jinja2 import Environment, FileSystemBytecodeCache, FileSystemLoader, Template, select_autoescape
+
+
+class ReportRenderer:
+    """
+    Long-lived Jinja2 renderer that compiles each template once.
+
+    Compiled templates are kept in a bounded LRU cache keyed by (absolute path,
+    mtime), so an edited template is recompiled on its next use while unchanged
+    templates are never parsed twice. One Jinja2 environment is kept per template
+    directory that still has a cached template, so both caches stay bounded.
+    With ``bytecode_cache_dir`` set, compiled bytecode is also persisted to disk
+    so fresh processes (e.g. batch workers) skip the Jinja2 compile step entirely.
+
+    Args:
+        cache_size: Maximum number of compiled templates kept in memory.
+        bytecode_cache_dir: Optional directory for Jinja2's on-disk bytecode cache.
+        **env_options: Extra ``jinja2.Environment`` options (e.g. ``trim_blocks``).
+    """
+
+    def __init__(
+        self,
+        cache_size: int = 32,
+        bytecode_cache_dir: Optional[Path] = None,
+        **env_options: Any,
+    ) -> None:
+        if cache_size < 1:
+            raise ValueError("cache_size must be >= 1")
+        self.cache_size = cache_size
+        self._bytecode_cache = None
+        if bytecode_cache_dir is not None:
+            Path(bytecode_cache_dir).mkdir(parents=True, exist_ok=True)
+            self._bytecode_cache = FileSystemBytecodeCache(str(bytecode_cache_dir))
+        env_options.setdefault("autoescape", select_autoescape(["html"]))
+        self._env_options = env_options
+        self._envs: Dict[Path, Environment] = {}
+        self._templates: "OrderedDict[Tuple[Path, int], Template]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def _environment(self, template_dir: Path) -> Environment:
+        env = self._envs.get(template_dir)
+        if env is None:
+            # Top-level templates are cached by this class; Jinja2's own (auto-reloading)
+            # cache serves the templates they include or extend, e.g. report_body.html.
+            env = Environment(
+                loader=FileSystemLoader(str(template_dir)),
+                bytecode_cache=self._bytecode_cache,
+                cache_size=self.cache_size,
+                auto_reload=True,
+                **self._env_options,
+            )
+            self._envs[template_dir] = env
+        return env
+
+    def get_template(self, template_path: Path) -> Template:
+        """Return the compiled template for ``template_path``, compiling it only when new or modified."""
+        path = Path(template_path).resolve()
+        key = (path, path.stat().st_mtime_ns)
+        with self._lock:
+            tmpl = self._templates.get(key)
+            if tmpl is not None:
+                self._templates.move_to_end(key)
+                self.hits += 1
+                return tmpl
+            self.misses += 1
+            tmpl = self._environment(path.parent).get_template(path.name)
+            # Drop older revisions of the same file before inserting the new one.
+            for stale in [k for k in self._templates if k[0] == path]:
+                del self._templates[stale]
+            self._templates[key] = tmpl
+            while len(self._templates) > self.cache_size:
+                self._templates.popitem(last=False)
+            # Keep environments only for directories that still have cached templates.
+            live_dirs = {k[0].parent for k in self._templates}
+            for template_dir in [d for d in self._envs if d not in live_dirs]:
+                del self._envs[template_dir]
+            return tmpl
+
+    def render(self, template_path: Path, context: Mapping[str, Any]) -> str:
+        """Render ``template_path`` with ``context``."""
+        return self.get_template(template_path).render(context)
+
+    def clear(self) -> None:
+        """Forget all compiled templates (the on-disk bytecode cache is kept)."""
+        with self._lock:
+            self._templates.clear()
+            self._envs.clear()
+
+
+_default_renderer: Optional[ReportRenderer] = None
+
+
+def default_renderer() -> ReportRenderer:
+    """Process-wide shared renderer used when callers do not pass their own."""
+    global _default_renderer
+    if _default_renderer is None:
+        _default_renderer = ReportRenderer()
+    return _default_renderer
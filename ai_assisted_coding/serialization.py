@@ -0,0 +1,163 @@
+from __future__ import annotations
+
+import json
+import os
+from pathlib import Path
+from typing import Any, Callable, Dict, Iterable, Iterator, Optional, Tuple
+
+try:
+    import orjson
+except ImportError:  # optional: the standard library is the fallback
+    orjson = None
+
+# "json" forces the standard library even when orjson is installed.
+JSON_BACKEND_ENV = "REPORT_JSON_BACKEND"
+# "compact" drops the indentation of written JSON (normalized_input.json, summaries).
+JSON_STYLE_ENV = "REPORT_JSON_STYLE"
+# First byte of a MessagePack map (fixmap, map 16, map 32): a packed cohort
+# starts with one, a JSON or gzip file never does.
+_PACKED_FIRST = frozenset(range(0x80, 0x90)) | {0xDE, 0xDF}
+_READ_BYTES = 1 << 20
+
+
+def json_backend() -> str:
+    """The JSON library in use: orjson when installed (unless ``REPORT_JSON_BACKEND=json``)."""
+    if orjson is not None and os.environ.get(JSON_BACKEND_ENV, "orjson") != "json":
+        return "orjson"
+    return "json"
+
+
+def compact_json() -> bool:
+    """Whether written JSON is compact (``REPORT_JSON_STYLE=compact``) instead of indented."""
+    return os.environ.get(JSON_STYLE_ENV) == "compact"
+
+
+def loads(raw: str | bytes) -> Any:
+    """
+    Parse JSON with the faster library when available.
+
+    Input orjson rejects (NaN/Infinity literals, integers beyond 64 bits,
+    malformed text) is parsed again by the standard library, so accepted
+    input and error messages are the same with either backend.
+    """
+    if json_backend() == "orjson":
+        try:
+            return orjson.loads(raw)
+        except orjson.JSONDecodeError:
+            pass
+    return json.loads(raw)
+
+
+def dumps(obj: Any, compact: Optional[bool] = None) -> bytes:
+    """
+    Serialize ``obj`` as UTF-8 JSON: indented by two spaces like before, or
+    compact (default: ``compact_json()``).
+
+    Objects orjson cannot write (integers beyond 64 bits, non-string keys) go
+    through the standard library. orjson writes NaN and infinities as ``null``
+    where the standard library writes the non-standard ``NaN`` literal; the
+    input schema has neither once records are validated.
+    """
+    if compact is None:
+        compact = compact_json()
+    if json_backend() == "orjson":
+        try:
+            return orjson.dumps(obj, option=0 if compact else orjson.OPT_INDENT_2)
+        except orjson.JSONEncodeError:
+            pass
+    if compact:
+        return json.dumps(obj, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+    return json.dumps(obj, indent=2, ensure_ascii=False).encode("utf-8")
+
+
+def write_json(path: Path, obj: Any, compact: Optional[bool] = None) -> None:
+    """Write ``obj`` to ``path`` with ``dumps``, creating the parent directory."""
+    path.parent.mkdir(parents=True, exist_ok=True)
+    path.write_bytes(dumps(obj, compact))
+
+
+def _msgpack() -> Any:
+    try:
+        import msgpack
+    except ImportError as e:
+        raise ImportError("packed cohorts need the msgpack package (pip install msgpack)") from e
+    return msgpack
+
+
+def is_packed(path: Path) -> bool:
+    """True if ``path`` is a MessagePack cohort written by ``pack_records``."""
+    with Path(path).open("rb") as f:
+        first = f.read(1)
+    return bool(first) and first[0] in _PACKED_FIRST
+
+
+def pack_records(
+    records: Iterable[Dict[str, Any]],
+    path: Path,
+    on_error: Optional[Callable[[Dict[str, Any], str], None]] = None,
+) -> int:
+    """
+    Write records as a stream of MessagePack maps, a binary intermediate that
+    re-runs of ``--batch`` read faster than JSON.
+
+    Values keep their types (ints stay ints, floats stay floats, strings
+    UTF-8), so a record reads back equal to the one written. A record
+    MessagePack cannot hold (integers beyond 64 bits) is passed to
+    ``on_error`` with the reason and left out.
+
+    Returns:
+        The number of records written.
+
+    Raises:
+        ValueError: For a record that cannot be packed, without ``on_error``.
+    """
+    packer = _msgpack().Packer(use_bin_type=True)
+    path = Path(path)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    tmp = path.with_name(path.name + ".tmp")
+    count = 0
+    with tmp.open("wb") as f:
+        for data in records:
+            try:
+                f.write(packer.pack(data))
+            except (OverflowError, TypeError, ValueError) as e:
+                if on_error is None:
+                    tmp.unlink()
+                    raise ValueError(f"record {count + 1} cannot be packed: {e}") from e
+                on_error(data, f"{type(e).__name__}: {e}")
+                continue
+            count += 1
+    os.replace(tmp, path)
+    return count
+
+
+def iter_packed(path: Path) -> Iterator[Tuple[int, Optional[Dict[str, Any]], Optional[str]]]:
+    """
+    Yield ``(number, record, error)`` for the records of a packed cohort,
+    numbered from 1, reading a bounded buffer at a time.
+
+    A value that is not a map is reported with an error and reading goes on;
+    a corrupt or truncated stream ends with one error.
+    """
+    msgpack = _msgpack()
+    unpacker = msgpack.Unpacker(raw=False, strict_map_key=False, max_buffer_size=64 << 20)
+    number = 0
+    with Path(path).open("rb") as f:
+        while True:
+            chunk = f.read(_READ_BYTES)
+            if chunk:
+                unpacker.feed(chunk)
+            try:
+                for value in unpacker:
+                    number += 1
+                    if isinstance(value, dict):
+                        yield number, value, None
+                    else:
+                        yield number, None, "record is not a map"
+            except (ValueError, msgpack.UnpackException) as e:
+                yield number + 1, None, f"{type(e).__name__}: {e}"
+                return
+            if not chunk:
+                if unpacker.tell() < f.tell():
+                    yield number + 1, None, "truncated record at the end of the file"
+                return
@@ -0,0 +1,387 @@
+"""
+Local HTTP report service.
+
+    python main.py --serve --port 8080 --workers 4
+    curl -s --data-binary @sample_data.json 'http://127.0.0.1:8080/report?format=pdf' -o report.pdf
+
+Endpoints:
+
+- ``POST /report?format=html|pdf`` with one patient record as the JSON body
+  returns the rendered report (``format`` defaults to ``pdf``).
+- ``GET /health`` returns the service state as JSON.
+- ``GET /metrics`` returns request counts and latency percentiles as JSON.
+
+The server is plain ``asyncio`` streams speaking HTTP/1.1 with keep-alive
+(``Content-Length`` bodies only). Validation, analysis and the HTML template
+run inline on the event loop; the WeasyPrint layout, which dominates a PDF
+request, runs in a process pool whose workers each set up a ``PdfEngine``
+before the first request arrives.
+"""
+from __future__ import annotations
+
+import asyncio
+import hashlib
+import json
+import os
+import time
+from collections import Counter, deque
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Any, Deque, Dict, Optional, Tuple
+from urllib.parse import parse_qs, urlsplit
+
+from benchmark import percentile
+from main import TEMPLATE_NAME, _render_payload, render_html, report_payload
+from pdf_engine import pdf_backend
+from validate import default_validator
+
+MAX_BODY_BYTES = 1 << 20
+LATENCY_WINDOW = 4096  # latencies kept for the /metrics percentiles
+CONTENT_TYPES = {"html": "text/html; charset=utf-8", "pdf": "application/pdf"}
+_JSON = "application/json"
+_STATUS = {
+    200: "OK", 400: "Bad Request", 404: "Not Found", 405: "Method Not Allowed", 411: "Length Required",
+    413: "Payload Too Large", 422: "Unprocessable Entity", 429: "Too Many Requests",
+    500: "Internal Server Error", 503: "Service Unavailable",
+}
+
+# Per-process PDF engine of a pool worker, created when the worker starts.
+_worker_engine: Any = None
+
+
+def _warm_worker(template_dir: str) -> Optional[str]:
+    """Set up this worker's PDF engine (imports WeasyPrint); returns why it could not, if so."""
+    global _worker_engine
+    if _worker_engine is None:
+        try:
+            from pdf_engine import create_engine
+
+            _worker_engine = create_engine(Path(template_dir) / TEMPLATE_NAME)
+        except Exception as e:  # noqa: BLE001 - reported by /health; PDF requests then get 503
+            return f"{type(e).__name__}: {e}"
+    return None
+
+
+def _render_pdf(html: str, template_dir: str, payload: Optional[Dict[str, Any]] = None) -> bytes:
+    error = _warm_worker(template_dir)
+    if error:
+        raise RuntimeError(error)
+    return _worker_engine.write_pdf(html, base_url=template_dir, payload=payload)
+
+
+@dataclass
+class Request:
+    method: str
+    path: str
+    query: Dict[str, str]
+    headers: Dict[str, str]
+    body: bytes
+    keep_alive: bool
+
+
+@dataclass
+class Response:
+    status: int
+    body: bytes
+    content_type: str = _JSON
+    headers: Optional[Dict[str, str]] = None
+
+
+class HttpError(Exception):
+    """A request that cannot be parsed; answered with ``status`` and the connection is closed."""
+
+    def __init__(self, status: int, message: str) -> None:
+        super().__init__(message)
+        self.status = status
+
+
+def _json_response(status: int, obj: Any, headers: Optional[Dict[str, str]] = None) -> Response:
+    return Response(status, json.dumps(obj).encode("utf-8"), _JSON, headers)
+
+
+def _error(status: int, message: str, headers: Optional[Dict[str, str]] = None, **extra: Any) -> Response:
+    return _json_response(status, {"error": message, **extra}, headers)
+
+
+async def read_request(reader: asyncio.StreamReader, max_body_bytes: int = MAX_BODY_BYTES) -> Optional[Request]:
+    """Read one HTTP/1.x request; None when the client closed the connection between requests."""
+    try:
+        head = await reader.readuntil(b"\r\n\r\n")
+    except asyncio.IncompleteReadError as e:
+        if not e.partial.strip():
+            return None
+        raise HttpError(400, "incomplete request") from e
+    except asyncio.LimitOverrunError as e:
+        raise HttpError(400, "request head too large") from e
+    lines = head.decode("latin-1").split("\r\n")
+    try:
+        method, target, version = lines[0].split(" ", 2)
+    except ValueError as e:
+        raise HttpError(400, "malformed request line") from e
+    headers: Dict[str, str] = {}
+    for line in lines[1:]:
+        if line:
+            name, _, value = line.partition(":")
+            headers[name.strip().lower()] = value.strip()
+    if "chunked" in headers.get("transfer-encoding", "").lower():
+        raise HttpError(411, "chunked request bodies are not supported, send Content-Length")
+    try:
+        length = int(headers.get("content-length", "0"))
+    except ValueError as e:
+        raise HttpError(400, "invalid Content-Length") from e
+    if length < 0:
+        raise HttpError(400, "invalid Content-Length")
+    if length > max_body_bytes:
+        raise HttpError(413, f"body larger than {max_body_bytes} bytes")
+    body = await reader.readexactly(length) if length else b""
+    url = urlsplit(target)
+    connection = headers.get("connection", "").lower()
+    keep_alive = connection != "close" if version == "HTTP/1.1" else connection == "keep-alive"
+    query = {key: values[-1] for key, values in parse_qs(url.query).items()}
+    return Request(method.upper(), url.path, query, headers, body, keep_alive)
+
+
+def encode_response(response: Response, keep_alive: bool) -> bytes:
+    head = [
+        f"HTTP/1.1 {response.status} {_STATUS.get(response.status, 'Unknown')}",
+        f"Content-Type: {response.content_type}",
+        f"Content-Length: {len(response.body)}",
+        f"Connection: {'keep-alive' if keep_alive else 'close'}",
+    ]
+    head.extend(f"{name}: {value}" for name, value in (response.headers or {}).items())
+    return ("\r\n".join(head) + "\r\n\r\n").encode("latin-1") + response.body
+
+
+class ReportService:
+    """
+    asyncio HTTP server rendering reports, with a pre-warmed PDF process pool.
+
+    Backpressure: at most ``max_pending`` PDF renders are queued or running in
+    the pool; a PDF request beyond that is answered ``429`` with a
+    ``Retry-After`` header at once instead of waiting in an unbounded queue, so
+    latency stays bounded under overload. HTML requests are rendered inline
+    (about a millisecond each) and are not queued.
+
+    Coalescing: a PDF request whose body is byte-identical to one already
+    being rendered waits for that render instead of starting another, and
+    does not count against ``max_pending``.
+
+    Invalid records (``validate.RECORD_SCHEMA``) get ``422`` with the reasons.
+    If WeasyPrint cannot be loaded, ``/health`` says so and PDF requests get
+    ``503``; HTML keeps working. A crashed pool is replaced.
+
+    Args:
+        template_dir: Directory containing ``report_template.html``.
+        workers: PDF processes (default: ``os.cpu_count()``).
+        max_pending: PDF renders queued or running before ``429`` (default: 4 per worker).
+        max_body_bytes: Largest accepted request body.
+        validate: Validate records before rendering them.
+    """
+
+    def __init__(
+        self,
+        template_dir: Path,
+        workers: Optional[int] = None,
+        max_pending: Optional[int] = None,
+        max_body_bytes: int = MAX_BODY_BYTES,
+        validate: bool = True,
+    ) -> None:
+        self.template_dir = Path(template_dir)
+        self.workers = max(1, workers or os.cpu_count() or 1)
+        self.max_pending = max(1, max_pending or 4 * self.workers)
+        self.max_body_bytes = max_body_bytes
+        self.validate = validate
+        self.pdf_error: Optional[str] = None
+        self.pending = 0
+        self.counts: Counter = Counter()
+        self._latencies: Deque[float] = deque(maxlen=LATENCY_WINDOW)
+        # sha256 of a request body -> its PDF render in flight
+        self._inflight: Dict[bytes, "asyncio.Future[bytes]"] = {}
+        self._pool: Optional[ProcessPoolExecutor] = None
+        self._server: Optional[asyncio.base_events.Server] = None
+        self._started = time.monotonic()
+
+    async def _start_pool(self) -> None:
+        template_dir = str(self.template_dir)
+        self._pool = ProcessPoolExecutor(max_workers=self.workers, initializer=_warm_worker, initargs=(template_dir,))
+        loop = asyncio.get_running_loop()
+        warmed = [loop.run_in_executor(self._pool, _warm_worker, template_dir) for _ in range(self.workers)]
+        self.pdf_error = next((e for e in await asyncio.gather(*warmed) if e), None)
+
+    async def start(self, host: str = "127.0.0.1", port: int = 0) -> Tuple[str, int]:
+        """Start the pool (warmed) and the server; returns the address, e.g. with ``port=0``."""
+        await self._start_pool()
+        # Compile the template before the first request too.
+        from renderer import default_renderer
+
+        default_renderer().get_template(self.template_dir / TEMPLATE_NAME)
+        self._started = time.monotonic()
+        self._server = await asyncio.start_server(self._handle, host, port)
+        return self._server.sockets[0].getsockname()[:2]
+
+    async def serve_forever(self) -> None:
+        assert self._server is not None, "call start() first"
+        await self._server.serve_forever()
+
+    async def close(self) -> None:
+        if self._server is not None:
+            self._server.close()
+            await self._server.wait_closed()
+            self._server = None
+        if self._pool is not None:
+            self._pool.shutdown(wait=True, cancel_futures=True)
+            self._pool = None
+
+    async def __aenter__(self) -> "ReportService":
+        return self
+
+    async def __aexit__(self, *exc: Any) -> None:
+        await self.close()
+
+    async def _handle(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+        try:
+            while True:
+                try:
+                    request = await read_request(reader, self.max_body_bytes)
+                except HttpError as e:
+                    self.counts[e.status] += 1
+                    writer.write(encode_response(_error(e.status, str(e)), keep_alive=False))
+                    await writer.drain()
+                    return
+                if request is None:
+                    return
+                start = time.perf_counter()
+                try:
+                    response = await self.dispatch(request)
+                except Exception as e:  # noqa: BLE001 - one failed request must not stop the server
+                    response = _error(500, f"{type(e).__name__}: {e}")
+                writer.write(encode_response(response, request.keep_alive))
+                await writer.drain()
+                self.counts[response.status] += 1
+                self._latencies.append(time.perf_counter() - start)
+                if not request.keep_alive:
+                    return
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        finally:
+            writer.close()
+
+    async def dispatch(self, request: Request) -> Response:
+        if request.path == "/report":
+            if request.method != "POST":
+                return _error(405, "use POST")
+            return await self.report(request)
+        if request.path in ("/health", "/metrics"):
+            if request.method != "GET":
+                return _error(405, "use GET")
+            return _json_response(200, self.health() if request.path == "/health" else self.metrics())
+        return _error(404, f"no such endpoint: {request.path}")
+
+    async def report(self, request: Request) -> Response:
+        output_format = request.query.get("format", "pdf")
+        if output_format not in CONTENT_TYPES:
+            return _error(400, f"format must be one of {sorted(CONTENT_TYPES)}")
+        try:
+            data = json.loads(request.body)
+        except ValueError as e:
+            return _error(400, f"invalid JSON: {e}")
+        if self.validate:
+            reasons = default_validator()(data)
+            if reasons:
+                return _error(422, "invalid record", reasons=reasons)
+        elif not isinstance(data, dict):
+            return _error(400, "the body must be a JSON object")
+        if output_format == "html":
+            return Response(200, render_html(data, self.template_dir).encode("utf-8"), CONTENT_TYPES["html"])
+
+        if self.pdf_error is not None:
+            return _error(503, f"PDF rendering unavailable: {self.pdf_error}")
+        key = hashlib.sha256(request.body).digest()
+        render = self._inflight.get(key)
+        if render is not None:
+            self.counts["coalesced"] += 1
+        else:
+            if self.pending >= self.max_pending:
+                self.counts["rejected"] += 1
+                return _error(429, "too many PDF renders pending", headers={"Retry-After": "1"}, pending=self.pending)
+            if self._pool is None:
+                return _error(503, "PDF worker pool restarting", headers={"Retry-After": "1"})
+            payload = report_payload(data)
+            render = self._submit(key, _render_payload(payload, self.template_dir), payload)
+        try:
+            # shield: a client that disconnects does not cancel the render others may be waiting for
+            pdf = await asyncio.shield(render)
+        except BrokenProcessPool:
+            return _error(503, "PDF worker pool crashed, retry")
+        return Response(200, pdf, CONTENT_TYPES["pdf"])
+
+    def _submit(self, key: bytes, html: str, payload: Dict[str, Any]) -> "asyncio.Future[bytes]":
+        loop = asyncio.get_running_loop()
+        render = loop.run_in_executor(self._pool, _render_pdf, html, str(self.template_dir), payload)
+        self._inflight[key] = render
+        self.pending += 1
+        render.add_done_callback(lambda f: self._finished(key, f))
+        return render
+
+    def _finished(self, key: bytes, render: "asyncio.Future[bytes]") -> None:
+        self.pending -= 1
+        self._inflight.pop(key, None)
+        self.counts["pdf_renders"] += 1
+        if not render.cancelled() and isinstance(render.exception(), BrokenProcessPool):
+            self.counts["pool_restarts"] += 1
+            broken, self._pool = self._pool, None
+            if broken is not None:
+                broken.shutdown(wait=False, cancel_futures=True)
+            asyncio.get_running_loop().create_task(self._start_pool())
+
+    def health(self) -> Dict[str, Any]:
+        return {
+            "status": "ok" if self._pool is not None else "starting",
+            "workers": self.workers,
+            "pdf": self.pdf_error is None,
+            "pdf_error": self.pdf_error,
+            "pdf_backend": pdf_backend(),
+            "pending": self.pending,
+            "max_pending": self.max_pending,
+        }
+
+    def metrics(self) -> Dict[str, Any]:
+        latencies = sorted(self._latencies)
+        return {
+            "uptime_s": round(time.monotonic() - self._started, 3),
+            "responses": {str(k): v for k, v in self.counts.items() if isinstance(k, int)},
+            "coalesced": self.counts["coalesced"],
+            "rejected": self.counts["rejected"],
+            "pdf_renders": self.counts["pdf_renders"],
+            "pool_restarts": self.counts["pool_restarts"],
+            "pending": self.pending,
+            "latency_ms": {
+                f"p{q}": round(percentile(latencies, q) * 1000, 3) if latencies else None for q in (50, 90, 99)
+            },
+            "latency_window": len(latencies),
+        }
+
+
+def serve(
+    template_dir: Path,
+    host: str = "127.0.0.1",
+    port: int = 8080,
+    workers: Optional[int] = None,
+    max_pending: Optional[int] = None,
+    validate: bool = True,
+) -> None:
+    """Run a ``ReportService`` until interrupted (``main.py --serve``)."""
+
+    async def run() -> None:
+        async with ReportService(template_dir, workers=workers, max_pending=max_pending, validate=validate) as service:
+            address = await service.start(host, port)
+            pdf = "PDF and HTML" if service.pdf_error is None else f"HTML only ({service.pdf_error})"
+            print(f"Serving reports on http://{address[0]}:{address[1]} ({service.workers} PDF workers, {pdf})")
+            await service.serve_forever()
+
+    try:
+        asyncio.run(run())
+    except KeyboardInterrupt:
+        pass
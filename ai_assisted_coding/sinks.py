@@ -0,0 +1,272 @@
+from __future__ import annotations
+
+import io
+import json
+import os
+import sqlite3
+import tarfile
+import time
+import zipfile
+from pathlib import Path
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+
+
+class ReportSink:
+    """
+    Destination for the artifacts of rendered reports.
+
+    ``write`` receives one report at a time: its per-record ``name`` (the
+    ``<index>_<patient_id>`` folder name of the directory layout), the patient
+    id and exam timestamp, and the artifacts as ``{file name: bytes}``. It
+    returns a location string for the batch summary. Sinks are used from a
+    single process; ``close`` flushes everything still buffered.
+    """
+
+    def write(self, name: str, patient_id: Optional[str], timestamp: Optional[str],
+              artifacts: Dict[str, bytes]) -> str:
+        raise NotImplementedError
+
+    def close(self) -> None:
+        pass
+
+    def __enter__(self) -> "ReportSink":
+        return self
+
+    def __exit__(self, *exc: Any) -> None:
+        self.close()
+
+
+class DirectorySink(ReportSink):
+    """The default layout: ``root/<name>/<artifact>``, one file per artifact."""
+
+    def __init__(self, root: Path) -> None:
+        self.root = Path(root)
+
+    def write(self, name: str, patient_id: Optional[str], timestamp: Optional[str],
+              artifacts: Dict[str, bytes]) -> str:
+        out_dir = self.root / name
+        out_dir.mkdir(parents=True, exist_ok=True)
+        for artifact, data in artifacts.items():
+            (out_dir / artifact).write_bytes(data)
+        return str(out_dir)
+
+
+class ZipSink(ReportSink):
+    """
+    Streaming zip archive with members ``<name>/<artifact>``.
+
+    Members are written as they arrive; the zip central directory written by
+    ``close`` is the index used by ``ArchiveReader``. PDFs are stored (they
+    are compressed already), text artifacts deflated.
+    """
+
+    def __init__(self, path: Path) -> None:
+        self.path = Path(path)
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self._zip = zipfile.ZipFile(self.path, "w", compression=zipfile.ZIP_DEFLATED, compresslevel=6)
+
+    def write(self, name: str, patient_id: Optional[str], timestamp: Optional[str],
+              artifacts: Dict[str, bytes]) -> str:
+        for artifact, data in artifacts.items():
+            method = zipfile.ZIP_STORED if artifact.endswith(".pdf") else zipfile.ZIP_DEFLATED
+            info = zipfile.ZipInfo(f"{name}/{artifact}", date_time=time.localtime()[:6])
+            info.compress_type = method
+            self._zip.writestr(info, data)
+        return f"{self.path}!{name}/"
+
+    def close(self) -> None:
+        self._zip.close()
+
+
+class TarSink(ReportSink):
+    """
+    Streaming, uncompressed tar archive with members ``<name>/<artifact>``.
+
+    Tar has no index of its own, so ``close`` writes ``<archive>.index.json``
+    mapping every member to the offset and size of its data; ``ArchiveReader``
+    then reads a member with one seek. The archive stays a plain tar file.
+    """
+
+    def __init__(self, path: Path) -> None:
+        self.path = Path(path)
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self._tar = tarfile.open(self.path, "w", format=tarfile.PAX_FORMAT)
+        self._index: Dict[str, Tuple[int, int]] = {}
+
+    def write(self, name: str, patient_id: Optional[str], timestamp: Optional[str],
+              artifacts: Dict[str, bytes]) -> str:
+        now = int(time.time())  # a float mtime would add a PAX header to every member
+        for artifact, data in artifacts.items():
+            info = tarfile.TarInfo(f"{name}/{artifact}")
+            info.size = len(data)
+            info.mtime = now
+            self._tar.addfile(info, io.BytesIO(data))
+            # The archive offset now points past the member data padded to whole blocks.
+            padded = -(-info.size // tarfile.BLOCKSIZE) * tarfile.BLOCKSIZE
+            self._index[info.name] = (self._tar.offset - padded, info.size)
+        return f"{self.path}!{name}/"
+
+    def close(self) -> None:
+        self._tar.close()
+        _write_atomic(tar_index_path(self.path), json.dumps(self._index, separators=(",", ":")).encode())
+
+
+class SqliteSink(ReportSink):
+    """
+    SQLite BLOB store, one row per artifact keyed by (patient_id, timestamp, artifact).
+
+    Rows are inserted in transactions of ``batch_size`` reports, so a batch
+    run costs one commit per batch instead of one per file. Reports of the
+    same patient and timestamp replace each other. ``SqliteReportReader``
+    looks a report up through the primary-key index.
+    """
+
+    def __init__(self, path: Path, batch_size: int = 256) -> None:
+        self.path = Path(path)
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self.batch_size = max(1, batch_size)
+        self._db = sqlite3.connect(str(self.path), timeout=30)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("PRAGMA synchronous=NORMAL")
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS reports ("
+            " patient_id TEXT NOT NULL, timestamp TEXT NOT NULL, artifact TEXT NOT NULL,"
+            " name TEXT NOT NULL, data BLOB NOT NULL,"
+            " PRIMARY KEY (patient_id, timestamp, artifact))"
+        )
+        self._pending = 0
+
+    def write(self, name: str, patient_id: Optional[str], timestamp: Optional[str],
+              artifacts: Dict[str, bytes]) -> str:
+        pid, ts = str(patient_id or name), str(timestamp or "")
+        self._db.executemany(
+            "INSERT OR REPLACE INTO reports(patient_id, timestamp, artifact, name, data) VALUES (?, ?, ?, ?, ?)",
+            [(pid, ts, artifact, name, data) for artifact, data in artifacts.items()],
+        )
+        self._pending += 1
+        if self._pending >= self.batch_size:
+            self._db.commit()
+            self._pending = 0
+        return f"{self.path}#{pid}@{ts}"
+
+    def close(self) -> None:
+        self._db.commit()
+        self._db.close()
+
+
+def tar_index_path(path: Path) -> Path:
+    """Sidecar member index of a tar archive written by ``TarSink``."""
+    return Path(f"{path}.index.json")
+
+
+def _write_atomic(path: Path, data: bytes) -> None:
+    tmp = path.with_name(f"{path.name}.tmp{os.getpid()}")
+    tmp.write_bytes(data)
+    os.replace(tmp, path)
+
+
+def open_sink(target: Path, batch_size: int = 256) -> ReportSink:
+    """Sink for ``target`` chosen by its suffix: ``.zip``, ``.tar``, ``.sqlite``/``.db``, else a directory."""
+    suffix = Path(target).suffix.lower()
+    if suffix == ".zip":
+        return ZipSink(target)
+    if suffix == ".tar":
+        return TarSink(target)
+    if suffix in (".sqlite", ".db"):
+        return SqliteSink(target, batch_size=batch_size)
+    return DirectorySink(target)
+
+
+class ArchiveReader:
+    """
+    Random access to the reports of a ``ZipSink`` or ``TarSink`` archive.
+
+    The index (zip central directory or the tar sidecar) is loaded once; each
+    ``read`` is then a dictionary lookup plus one seek and read.
+    """
+
+    def __init__(self, path: Path) -> None:
+        self.path = Path(path)
+        self._zip: Optional[zipfile.ZipFile] = None
+        self._index: Dict[str, List[int]] = {}
+        if zipfile.is_zipfile(self.path):
+            self._zip = zipfile.ZipFile(self.path)
+        else:
+            self._index = json.loads(tar_index_path(self.path).read_bytes())
+            self._file = self.path.open("rb")
+
+    def names(self) -> Iterator[str]:
+        """Member names, ``<name>/<artifact>``."""
+        if self._zip is not None:
+            return iter(self._zip.namelist())
+        return iter(self._index)
+
+    def read(self, name: str, artifact: str) -> bytes:
+        """
+        Artifact of the report ``name``.
+
+        Raises:
+            KeyError: If the archive has no such member.
+        """
+        member = f"{name}/{artifact}"
+        if self._zip is not None:
+            return self._zip.read(member)
+        offset, size = self._index[member]
+        self._file.seek(offset)
+        return self._file.read(size)
+
+    def close(self) -> None:
+        if self._zip is not None:
+            self._zip.close()
+        else:
+            self._file.close()
+
+    def __enter__(self) -> "ArchiveReader":
+        return self
+
+    def __exit__(self, *exc: Any) -> None:
+        self.close()
+
+
+class SqliteReportReader:
+    """Lookup of stored reports through the (patient_id, timestamp, artifact) primary key."""
+
+    def __init__(self, path: Path) -> None:
+        self._db = sqlite3.connect(f"file:{Path(path)}?mode=ro", uri=True)
+
+    def read(self, patient_id: str, artifact: str, timestamp: Optional[str] = None) -> bytes:
+        """
+        Artifact of the patient's exam at ``timestamp`` (default: the latest exam).
+
+        Raises:
+            KeyError: If no such report is stored.
+        """
+        if timestamp is None:
+            row = self._db.execute(
+                "SELECT data FROM reports WHERE patient_id = ? AND artifact = ? ORDER BY timestamp DESC LIMIT 1",
+                (patient_id, artifact),
+            ).fetchone()
+        else:
+            row = self._db.execute(
+                "SELECT data FROM reports WHERE patient_id = ? AND timestamp = ? AND artifact = ?",
+                (patient_id, timestamp, artifact),
+            ).fetchone()
+        if row is None:
+            raise KeyError(f"{patient_id}@{timestamp or 'latest'}/{artifact}")
+        return row[0]
+
+    def timestamps(self, patient_id: str) -> List[str]:
+        """Exam timestamps stored for ``patient_id``, oldest first."""
+        rows = self._db.execute(
+            "SELECT DISTINCT timestamp FROM reports WHERE patient_id = ? ORDER BY timestamp", (patient_id,)
+        )
+        return [r[0] for r in rows]
+
+    def close(self) -> None:
+        self._db.close()
+
+    def __enter__(self) -> "SqliteReportReader":
+        return self
+
+    def __exit__(self, *exc: Any) -> None:
+        self.close()
@@ -0,0 +1,288 @@
+from __future__ import annotations
+
+import json
+import re
+import sqlite3
+import time
+from dataclasses import asdict, dataclass, field
+from itertools import islice
+from pathlib import Path
+from typing import Any, Dict, Iterable, Iterator, List, Optional, Sequence, Tuple
+
+from batch import BatchRecord, iter_batch_records
+from serialization import loads
+
+# Indexed numeric columns: (column, vessel, metric); vessel None reads a top-level field.
+_METRIC_COLUMNS: Tuple[Tuple[str, Optional[str], str], ...] = (
+    ("cca_psv", "CCA", "psv_cm_s"),
+    ("cca_edv", "CCA", "edv_cm_s"),
+    ("cca_imt", "CCA", "imt_mm"),
+    ("ica_psv", "ICA", "psv_cm_s"),
+    ("ica_edv", "ICA", "edv_cm_s"),
+    ("ica_imt", "ICA", "imt_mm"),
+    ("eca_psv", "ECA", "psv_cm_s"),
+    ("eca_edv", "ECA", "edv_cm_s"),
+    ("eca_imt", "ECA", "imt_mm"),
+    ("ica_cca_ratio", None, "ica_cca_ratio"),
+)
+# Columns a ``--where`` condition may compare, with the SQL operators allowed.
+FILTER_COLUMNS: Tuple[str, ...] = ("age",) + tuple(c for c, _, _ in _METRIC_COLUMNS)
+_OPERATORS = (">=", "<=", "!=", "=", ">", "<")
+_CONDITION = re.compile(r"^\s*([a-z_]+)\s*(>=|<=|!=|=|>|<)\s*([-+]?(?:\d+\.?\d*|\.\d+)(?:[eE][-+]?\d+)?)\s*$")
+# Secondary indexes; dropped around a bulk load into an empty store and built once afterwards.
+_INDEXES: Tuple[Tuple[str, str], ...] = (
+    ("exams_timestamp", "timestamp"),
+    ("exams_ica_psv", "ica_psv"),
+    ("exams_cca_psv", "cca_psv"),
+    ("exams_eca_psv", "eca_psv"),
+    ("exams_ica_cca_ratio", "ica_cca_ratio"),
+)
+_COLUMNS = ("patient_id", "timestamp", "name", "age", "sex") + tuple(c for c, _, _ in _METRIC_COLUMNS) + ("record",)
+_INSERT = (
+    f"INSERT OR REPLACE INTO exams({', '.join(_COLUMNS)}) "
+    f"VALUES ({', '.join('?' for _ in _COLUMNS)})"
+)
+_dumps = json.JSONEncoder(ensure_ascii=False, separators=(",", ":")).encode
+
+
+@dataclass
+class IngestSummary:
+    """Outcome of ``PatientStore.ingest``; ``skipped`` lists the records that were not stored."""
+    inserted: int = 0
+    skipped: List[Dict[str, Any]] = field(default_factory=list)
+    elapsed_s: float = 0.0
+
+    @property
+    def rate(self) -> float:
+        return self.inserted / self.elapsed_s if self.elapsed_s else 0.0
+
+    def to_dict(self) -> Dict[str, Any]:
+        return asdict(self)
+
+
+def _number(value: Any) -> Optional[float]:
+    # bool is an int subclass but no measurement; strings stay out of numeric columns.
+    if type(value) in (int, float):
+        return value
+    return None
+
+
+def exam_row(data: Dict[str, Any]) -> Tuple[Any, ...]:
+    """
+    Row of the ``exams`` table for one record, in ``_COLUMNS`` order.
+
+    Raises:
+        ValueError: If the record has no ``patient_id``.
+    """
+    pid = data.get("patient_id")
+    if pid is None or pid == "":
+        raise ValueError("record has no patient_id")
+    vitals = data.get("vitals")
+    vitals = vitals if isinstance(vitals, dict) else {}
+    context = data.get("context")
+    context = context if isinstance(context, dict) else {}
+    metrics = []
+    for _, vessel, metric in _METRIC_COLUMNS:
+        if vessel is None:
+            metrics.append(_number(vitals.get(metric)))
+        else:
+            values = vitals.get(vessel)
+            metrics.append(_number(values.get(metric)) if isinstance(values, dict) else None)
+    timestamp = data.get("timestamp")
+    return (
+        str(pid),
+        "" if timestamp is None else str(timestamp),
+        data.get("name") if isinstance(data.get("name"), str) else None,
+        _number(context.get("age_years")),
+        context.get("sex") if isinstance(context.get("sex"), str) else None,
+        *metrics,
+        _dumps(data),
+    )
+
+
+def parse_condition(text: str) -> Tuple[str, str, float]:
+    """
+    Parse a filter such as ``"ica_psv>125"`` into ``(column, operator, value)``.
+
+    Raises:
+        ValueError: If the column is not one of ``FILTER_COLUMNS`` or the syntax is invalid.
+    """
+    m = _CONDITION.match(text)
+    if m is None:
+        raise ValueError(f"invalid condition {text!r}; expected <column><op><number>, e.g. ica_psv>125")
+    column, op, value = m.groups()
+    if column not in FILTER_COLUMNS:
+        raise ValueError(f"unknown column {column!r} in {text!r}; use one of {', '.join(FILTER_COLUMNS)}")
+    return column, op, float(value)
+
+
+@dataclass(frozen=True)
+class Selection:
+    """
+    Exams to report on; all given criteria must hold.
+
+    Timestamps compare as strings, so ISO 8601 dates and datetimes order
+    correctly; ``since`` and ``until`` are inclusive (``until="2026-10-18"``
+    excludes later times of that day, use ``"2026-10-18T99"`` to include them).
+    """
+    since: Optional[str] = None
+    until: Optional[str] = None
+    patient_id: Optional[str] = None
+    where: Tuple[Tuple[str, str, float], ...] = ()
+
+    def sql(self) -> Tuple[str, List[Any]]:
+        """``WHERE`` clause (empty if nothing is filtered) and its parameters."""
+        clauses: List[str] = []
+        params: List[Any] = []
+        if self.since is not None:
+            clauses.append("timestamp >= ?")
+            params.append(self.since)
+        if self.until is not None:
+            clauses.append("timestamp <= ?")
+            params.append(self.until)
+        if self.patient_id is not None:
+            clauses.append("patient_id = ?")
+            params.append(self.patient_id)
+        for column, op, value in self.where:
+            # Column and operator were validated by parse_condition; only the value is user data.
+            if column not in FILTER_COLUMNS or op not in _OPERATORS:
+                raise ValueError(f"invalid condition {column}{op}{value}")
+            clauses.append(f"{column} {op} ?")
+            params.append(value)
+        return (" WHERE " + " AND ".join(clauses) if clauses else ""), params
+
+
+class PatientStore:
+    """
+    SQLite store of patient exams with the fields used for report selection
+    (patient id, timestamp, per-vessel PSV/EDV/IMT, ICA/CCA ratio, age)
+    normalized into indexed columns next to the full record.
+
+    A patient has at most one exam per timestamp; ingesting it again replaces
+    the stored exam. ``select`` turns a ``Selection`` into one indexed query
+    and yields ``BatchRecord`` objects, so a selection can be handed to
+    ``batch.run_batch`` or ``consolidated.write_consolidated`` in place of an
+    input file.
+    """
+
+    def __init__(self, path: Path) -> None:
+        self.path = Path(path)
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self._db = sqlite3.connect(str(self.path), timeout=30)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("PRAGMA synchronous=NORMAL")
+        metric_columns = ", ".join(f"{c} REAL" for c, _, _ in _METRIC_COLUMNS)
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS exams ("
+            " id INTEGER PRIMARY KEY, patient_id TEXT NOT NULL, timestamp TEXT NOT NULL,"
+            f" name TEXT, age REAL, sex TEXT, {metric_columns}, record TEXT NOT NULL,"
+            " UNIQUE (patient_id, timestamp))"
+        )
+        self._create_indexes()
+
+    def close(self) -> None:
+        self._db.close()
+
+    def __enter__(self) -> "PatientStore":
+        return self
+
+    def __exit__(self, *exc: Any) -> None:
+        self.close()
+
+    def _create_indexes(self) -> None:
+        for name, column in _INDEXES:
+            self._db.execute(f"CREATE INDEX IF NOT EXISTS {name} ON exams({column})")
+        self._db.commit()
+
+    def __len__(self) -> int:
+        return self._db.execute("SELECT COUNT(*) FROM exams").fetchone()[0]
+
+    def ingest(self, records: Iterable[BatchRecord], batch_size: int = 10000) -> IngestSummary:
+        """
+        Store ``records`` (e.g. ``batch.iter_batch_records(path)``), committing
+        every ``batch_size`` rows.
+
+        Loading into an empty store drops the secondary indexes first and builds
+        them once at the end, which is cheaper than updating them row by row.
+        Records that failed to load or have no ``patient_id`` are skipped and
+        listed in the summary.
+        """
+        started = time.perf_counter()
+        summary = IngestSummary()
+        bulk = self._db.execute("SELECT 1 FROM exams LIMIT 1").fetchone() is None
+        if bulk:
+            for name, _ in _INDEXES:
+                self._db.execute(f"DROP INDEX IF EXISTS {name}")
+        try:
+            rows = self._rows(records, summary)
+            while True:
+                chunk = list(islice(rows, max(1, batch_size)))
+                if not chunk:
+                    break
+                self._db.executemany(_INSERT, chunk)
+                self._db.commit()
+                summary.inserted += len(chunk)
+        finally:
+            self._db.commit()
+            if bulk:
+                self._create_indexes()
+        summary.elapsed_s = round(time.perf_counter() - started, 3)
+        return summary
+
+    def ingest_file(self, source: Path, batch_size: int = 10000) -> IngestSummary:
+        """Store every record of ``source`` (anything ``batch.iter_batch_records`` reads)."""
+        return self.ingest(iter_batch_records(Path(source)), batch_size=batch_size)
+
+    @staticmethod
+    def _rows(records: Iterable[BatchRecord], summary: IngestSummary) -> Iterator[Tuple[Any, ...]]:
+        for record in records:
+            if record.data is None:
+                summary.skipped.append({"source": record.source, "error": record.error})
+                continue
+            try:
+                yield exam_row(record.data)
+            except (TypeError, ValueError) as e:
+                summary.skipped.append({"source": record.source, "error": f"{type(e).__name__}: {e}"})
+
+    def count(self, selection: Selection = Selection()) -> int:
+        """Number of exams matching ``selection``."""
+        where, params = selection.sql()
+        return self._db.execute(f"SELECT COUNT(*) FROM exams{where}", params).fetchone()[0]
+
+    def select(self, selection: Selection = Selection(), limit: Optional[int] = None) -> Iterator[BatchRecord]:
+        """
+        Exams matching ``selection``, oldest first, as ``BatchRecord`` objects
+        numbered from 0 with source ``<store file>#<row id>``.
+
+        Rows are fetched lazily through a dedicated cursor, so a large selection
+        is never held in memory.
+        """
+        where, params = selection.sql()
+        sql = f"SELECT id, record FROM exams{where} ORDER BY timestamp, patient_id"
+        if limit is not None:
+            sql += " LIMIT ?"
+            params.append(int(limit))
+        cursor = self._db.execute(sql, params)
+        for index, (row_id, record) in enumerate(cursor):
+            yield BatchRecord(index, f"{self.path.name}#{row_id}", loads(record))
+
+    def explain(self, selection: Selection = Selection()) -> List[str]:
+        """SQLite's query plan for ``selection`` (to check which index it uses)."""
+        where, params = selection.sql()
+        rows = self._db.execute(f"EXPLAIN QUERY PLAN SELECT id FROM exams{where}", params).fetchall()
+        return [row[-1] for row in rows]
+
+
+def selection_from_args(
+    since: Optional[str] = None,
+    until: Optional[str] = None,
+    patient_id: Optional[str] = None,
+    where: Sequence[str] = (),
+) -> Selection:
+    """
+    ``Selection`` from command-line style arguments.
+
+    Raises:
+        ValueError: If a ``where`` condition is invalid (see ``parse_condition``).
+    """
+    return Selection(since, until, patient_id, tuple(parse_condition(w) for w in where))
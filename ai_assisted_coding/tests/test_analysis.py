@@ -31,3 +31,30 @@ def test_analyze_basic_stats():
     assert a["highest_psv_vessel"] == "ICA"
     assert a["ica_cca_ratio"] == 1.23
     assert any("Highest PSV" in note for note in a["notes"])
+
+
+def test_analyze_batch_matches_analyze():
+    import pytest
+    pytest.importorskip("numpy")
+    from analysis import analyze_batch
+    from data_gen import generate_mock
+
+    records = [generate_mock(seed=s) for s in range(3000)]
+    records += [
+        {"vitals": {}},
+        {},
+        {"vitals": {"ICA": {"psv_cm_s": 120}, "ica_cca_ratio": 2}},
+        {"vitals": {"ECA": {"psv_cm_s": 80.0}, "CCA": {"psv_cm_s": 80.0}}},  # tie, non-standard order
+        {"vitals": {"CCA": {"psv_cm_s": 90.5}, "ICA": {"psv_cm_s": 90.5, "imt_mm": 0.7}}},  # tie
+        {"vitals": {"VA": {"psv_cm_s": 50.0}, "CCA": {"psv_cm_s": 70.0}}},  # unknown vessel
+        {"vitals": {"CCA": {"psv_cm_s": float("inf"), "edv_cm_s": 1e308}, "ICA": {"edv_cm_s": 1e308}}},
+        {"vitals": {"CCA": {"psv_cm_s": "fast", "edv_cm_s": None}, "ICA": "n/a"}},
+        {"vitals": {"CCA": {"psv_cm_s": 1e-3, "edv_cm_s": 0.0}, "ICA": {"psv_cm_s": 250.0, "edv_cm_s": -0.0}}},
+        {"vitals": {"CCA": {"psv_cm_s": True}, "ica_cca_ratio": "1.2"}},
+    ]
+    batch = analyze_batch(records)
+    expected = [analyze(r) for r in records]
+    assert len(batch) == len(records)
+    assert batch == expected
+    assert batch[-1] == expected[-1]
+    assert batch[2:4] == expected[2:4]
@@ -0,0 +1,131 @@
+from __future__ import annotations
+
+import json
+from pathlib import Path
+import sys
+sys.path.append(str(Path(__file__).parent.parent))
+
+import importlib.util
+
+import pytest
+
+import batch
+from batch import BatchResult, iter_batch_records, run_batch
+from data_gen import generate_mock
+
+
+needs_weasyprint = pytest.mark.skipif(importlib.util.find_spec("weasyprint") is None, reason="needs WeasyPrint")
+
+
+def _write_jsonl(path: Path, lines):
+    path.write_text("\n".join(lines) + "\n", encoding="utf-8")
+
+
+def test_iter_batch_records_jsonl_reports_bad_lines(tmp_path: Path):
+    src = tmp_path / "cohort.jsonl"
+    _write_jsonl(src, [
+        json.dumps(generate_mock(seed=1)),
+        "{not json",
+        "",
+        json.dumps([1, 2, 3]),
+        json.dumps(generate_mock(seed=2)),
+    ])
+    records = list(iter_batch_records(src))
+    assert [r.index for r in records] == [0, 1, 2, 3]
+    assert records[0].data is not None and records[0].error is None
+    assert records[1].data is None and records[1].source == "cohort.jsonl:2"
+    assert records[2].error == "record is not a JSON object"
+    assert records[3].data == generate_mock(seed=2)
+
+
+def test_iter_batch_records_directory(tmp_path: Path):
+    for i in range(3):
+        (tmp_path / f"p{i}.json").write_text(json.dumps(generate_mock(seed=i)), encoding="utf-8")
+    (tmp_path / "ignored.txt").write_text("x", encoding="utf-8")
+    records = list(iter_batch_records(tmp_path))
+    assert [r.source for r in records] == ["p0.json", "p1.json", "p2.json"]
+    assert all(r.data is not None for r in records)
+
+
+@needs_weasyprint
+def test_run_batch_writes_outputs_and_summary(tmp_path: Path):
+    src = tmp_path / "cohort.jsonl"
+    good = [generate_mock(seed=i) for i in range(3)]
+    _write_jsonl(src, [json.dumps(r) for r in good] + ["{broken", json.dumps({"patient_id": "x", "vitals": "oops"})])
+
+    out_root = tmp_path / "out"
+    summary = run_batch(src, out_root, Path(__file__).resolve().parents[1], workers=2, progress=None)
+
+    assert summary.total == 5
+    assert summary.succeeded == 3
+    assert [f.source for f in summary.failures] == ["cohort.jsonl:4", "cohort.jsonl:5"]
+    for i, record in enumerate(good):
+        out_dir = out_root / f"{i:06d}_{record['patient_id']}"
+        assert (out_dir / "report.html").stat().st_size > 0
+        assert (out_dir / "report.pdf").stat().st_size > 0
+        assert json.loads((out_dir / "normalized_input.json").read_text(encoding="utf-8")) == record
+
+    written = json.loads((out_root / "batch_summary.json").read_text(encoding="utf-8"))
+    assert written["failed"] == 2
+
+
+@needs_weasyprint
+def test_run_batch_recycles_individual_workers(tmp_path: Path):
+    src = tmp_path / "cohort.jsonl"
+    records = [generate_mock(seed=i) for i in range(6)]
+    _write_jsonl(src, [json.dumps(r) for r in records])
+    template_dir = Path(__file__).resolve().parents[1]
+
+    by_count = run_batch(src, tmp_path / "a", template_dir, workers=1, progress=None, recycle_after=2)
+    assert by_count.succeeded == 6
+    assert by_count.worker_recycles == 3
+
+    by_rss = run_batch(src, tmp_path / "b", template_dir, workers=2, progress=None, max_rss_bytes=1)
+    assert by_rss.succeeded == 6
+    assert by_rss.worker_recycles == 6
+
+
+def test_run_batch_html_format_skips_pdf(tmp_path: Path):
+    src = tmp_path / "cohort.jsonl"
+    records = [generate_mock(seed=i) for i in range(4)]
+    _write_jsonl(src, [json.dumps(r) for r in records])
+
+    summary = run_batch(
+        src, tmp_path / "out", Path(__file__).resolve().parents[1],
+        workers=1, progress=None, recycle_after=2, output_format="html",
+    )
+    assert summary.succeeded == 4
+    assert summary.worker_recycles == 2
+    for i, record in enumerate(records):
+        out_dir = tmp_path / "out" / f"{i:06d}_{record['patient_id']}"
+        assert (out_dir / "report.html").stat().st_size > 0
+        assert not (out_dir / "report.pdf").exists()
+
+
+def test_run_batch_survives_worker_crash(tmp_path: Path, monkeypatch):
+    import multiprocessing
+    import os
+
+    if "fork" not in multiprocessing.get_all_start_methods():
+        pytest.skip("needs the fork start method to patch the worker")
+    real_render = batch.render_record
+
+    def crashing_render(record, out_root, template_dir, *args):
+        if record.data.get("patient_id") == "crash":
+            os._exit(3)
+        return real_render(record, out_root, template_dir, *args)
+
+    monkeypatch.setattr(batch, "render_record", crashing_render)
+    src = tmp_path / "cohort.jsonl"
+    records = [generate_mock(seed=1), {"patient_id": "crash", "vitals": {}}, generate_mock(seed=2)]
+    _write_jsonl(src, [json.dumps(r) for r in records])
+
+    summary = run_batch(
+        src, tmp_path / "out", Path(__file__).resolve().parents[1],
+        workers=1, progress=None, mp_context=multiprocessing.get_context("fork"), output_format="html",
+    )
+    assert summary.total == 3
+    assert summary.succeeded == 2
+    assert summary.worker_crashes == 1
+    assert summary.failures == [BatchResult(1, "cohort.jsonl:2", "crash", None, "WorkerCrashed: worker exited with code 3")]
+    assert (tmp_path / "out" / "batch_summary.json").exists()
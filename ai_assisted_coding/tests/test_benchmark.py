@@ -0,0 +1,49 @@
+from __future__ import annotations
+
+from pathlib import Path
+import sys
+sys.path.append(str(Path(__file__).parent.parent))
+
+import pytest
+
+pytest.importorskip("numpy")
+
+from benchmark import compare, percentile, run_suite
+
+
+def test_percentile_nearest_rank():
+    values = [float(i) for i in range(1, 101)]
+    assert percentile(values, 50) == 50.0
+    assert percentile(values, 99) == 99.0
+    assert percentile([3.0], 99) == 3.0
+
+
+def test_suite_reports_every_case(tmp_path: Path):
+    stages = ["load", "analyze", "analyze_batch", "analyze_columnar"]
+    report = run_suite(sizes=[1, 20], stages=stages, work_dir=tmp_path, isolate=False)
+    rows = {(r["stage"], r["records"]): r for r in report["results"]}
+    assert set(rows) == {(s, n) for s in stages for n in (1, 20)}
+    row = rows[("analyze", 20)]
+    assert row["processed"] == 20 and row["throughput_per_s"] > 0
+    assert 0 < row["p50_ms"] <= row["p99_ms"]
+    assert row["peak_rss_mb"] > 0
+    assert rows[("analyze_batch", 20)]["p50_ms"] is None  # one call for the whole cohort
+
+
+def test_compare_flags_regressions_beyond_threshold():
+    base = {"results": [
+        {"stage": "analyze", "records": 1000, "processed": 1000, "throughput_per_s": 1000.0, "p99_ms": 1.0},
+        {"stage": "pdf", "records": 1, "processed": 1, "throughput_per_s": 10.0, "p99_ms": 100.0},
+    ]}
+    ok = {"results": [
+        {"stage": "analyze", "records": 1000, "processed": 1000, "throughput_per_s": 900.0, "p99_ms": 1.1},
+        {"stage": "pdf", "records": 1, "processed": 1, "throughput_per_s": 9.0, "p99_ms": 500.0},
+    ]}
+    assert compare(ok, base, threshold=0.2) == []
+
+    slow = {"results": [
+        {"stage": "analyze", "records": 1000, "processed": 1000, "throughput_per_s": 700.0, "p99_ms": 1.5},
+        {"stage": "render_html", "records": 1000, "skipped": "ImportError"},
+    ]}
+    problems = compare(slow, base, threshold=0.2)
+    assert len(problems) == 2 and all(p.startswith("analyze@1000") for p in problems)
@@ -0,0 +1,90 @@
+from __future__ import annotations
+
+import json
+import multiprocessing
+from pathlib import Path
+import sys
+sys.path.append(str(Path(__file__).parent.parent))
+
+import numpy as np
+import pytest
+
+from analysis import analyze, analyze_batch
+from cohort_file import NO_TIME, CohortFile, is_cohort_file, write_cohort_file
+from cohort_stats import CohortAggregator, aggregate_sources
+from data_gen import generate_mock
+
+
+def _cohort(n: int = 300) -> list:
+    records = [generate_mock(seed=i) for i in range(n)]
+    for i, record in enumerate(records):
+        record["timestamp"] = f"2024-{i % 12 + 1:02d}-{i % 28 + 1:02d}T{i % 24:02d}:00:00"
+    records[3]["patient_id"] = records[4]["patient_id"]  # two exams of one patient
+    records[5]["vitals"]["XYZ"] = {"psv_cm_s": 1.0}  # unknown vessel
+    records[6]["vitals"]["CCA"]["psv_cm_s"] = float("inf")  # not finite
+    records[7]["vitals"]["ICA"]["psv_cm_s"] = records[7]["vitals"]["CCA"]["psv_cm_s"] = 150  # PSV tie, ints
+    records[8]["timestamp"] = "not a date"
+    records[9]["name"] = None
+    return records
+
+
+def _sum_of_column(path: Path) -> float:
+    with CohortFile(path) as cohort:
+        return float(np.nansum(cohort.columns["ICA.psv_cm_s"]))
+
+
+def test_analysis_matches_the_records(tmp_path: Path):
+    records = _cohort()
+    path = tmp_path / "cohort.cols"
+    assert write_cohort_file(iter(records), path) == len(records)
+    assert is_cohort_file(path) and not is_cohort_file(Path(__file__))
+
+    with CohortFile(path) as cohort:
+        assert len(cohort) == len(records)
+        batch = analyze_batch(records)
+        assert cohort.analyze() == batch == [analyze(r) for r in records]
+        # Exactly the rows analyze_batch analyzes one by one, with their records stored.
+        assert set(np.flatnonzero(cohort.fallback).tolist()) == set(batch._scalar) >= {5, 6, 7}
+        assert not cohort.columns["CCA.psv_cm_s"].flags.writeable  # a view of the read-only map
+        assert cohort.raw_record(7) == records[7]
+
+        pid = records[4]["patient_id"]
+        assert cohort.rows_for(pid).tolist() == [3, 4] and cohort.rows_for("nobody").size == 0
+        assert [cohort.patient_id(i) for i in (0, 4)] == [records[0]["patient_id"], pid]
+        assert cohort.name(0) == records[0]["name"] and cohort.name(9) is None
+        assert cohort.timestamp[8] == NO_TIME
+
+        rows = cohort.rows_between("2024-03-01", "2024-05-31T23")
+        expected = [i for i, r in enumerate(records) if "2024-03-01" <= r["timestamp"] <= "2024-05-31T23"]
+        assert sorted(rows.tolist()) == expected
+        assert cohort.timestamp[rows].tolist() == sorted(cohort.timestamp[rows].tolist())
+        assert cohort.analyze(rows) == [analyze(records[i]) for i in rows]
+        with pytest.raises(ValueError):
+            cohort.rows_between(since="yesterday")
+
+        rebuilt = cohort.record(10)
+        assert analyze(rebuilt) == analyze(records[10])
+        assert rebuilt["timestamp"].startswith(records[10]["timestamp"])
+
+    # Shared read-only by other processes.
+    with multiprocessing.get_context("spawn").Pool(2) as pool:
+        sums = pool.map(_sum_of_column, [path, path])
+    assert sums[0] == sums[1] == _sum_of_column(path)
+
+
+def test_summary_and_empty_cohort(tmp_path: Path):
+    records = [generate_mock(seed=i) for i in range(20_000)]
+    path = tmp_path / "cohort.cols"
+    write_cohort_file(records, path)
+    from_file = aggregate_sources([path], workers=1).summary()
+    assert from_file == CohortAggregator().add_many(records).summary()
+
+    empty = tmp_path / "empty.cols"
+    assert write_cohort_file([], empty) == 0
+    with CohortFile(empty) as cohort:
+        assert len(cohort) == 0 and len(cohort.analyze()) == 0 and cohort.rows_between().size == 0
+    assert not list(tmp_path.glob(".cohort-*")) and not list(tmp_path.glob("*.tmp"))
+
+    path.write_bytes(b"not a cohort file" * 4)
+    with pytest.raises(ValueError):
+        CohortFile(path)
@@ -0,0 +1,113 @@
+from __future__ import annotations
+
+import json
+import math
+from pathlib import Path
+import sys
+sys.path.append(str(Path(__file__).parent.parent))
+
+import numpy as np
+import pytest
+
+from cohort_stats import (
+    CohortAggregator, QuantileSketch, RunningStats, aggregate_sources, summary_rows, write_summary,
+)
+from data_gen import generate_mock
+
+TEMPLATE_DIR = Path(__file__).resolve().parents[1]
+
+
+def test_running_stats_scalar_array_and_merge_agree():
+    rng = np.random.default_rng(1)
+    values = rng.normal(100.0, 15.0, 10_001)
+    scalar = RunningStats()
+    for x in values.tolist():
+        scalar.add(x)
+    parts = [RunningStats() for _ in range(3)]
+    for part, chunk in zip(parts, np.array_split(values, 3)):
+        part.add_array(chunk)
+    merged = RunningStats()
+    for part in parts:
+        merged.merge(part)
+
+    for s in (scalar, merged):
+        assert s.count == values.size
+        assert (s.min, s.max) == (values.min(), values.max())
+        assert s.mean == pytest.approx(values.mean(), rel=1e-12)
+        assert s.variance == pytest.approx(values.var(ddof=1), rel=1e-10)
+    assert RunningStats().variance is None
+
+
+@pytest.mark.parametrize("accuracy", [0.01, 0.05])
+def test_sketch_quantiles_within_relative_accuracy(accuracy: float):
+    rng = np.random.default_rng(2)
+    values = np.concatenate([rng.lognormal(4.0, 1.0, 20_000), -rng.lognormal(1.0, 0.5, 2_000), np.zeros(500)])
+    sketch = QuantileSketch(accuracy)
+    sketch.add_array(values)
+    ordered = np.sort(values)
+    for q in (0.0, 0.01, 0.05, 0.1, 0.5, 0.9, 0.99, 1.0):
+        exact = ordered[int(math.floor(q * (values.size - 1)))]
+        assert sketch.quantile(q) == pytest.approx(exact, rel=accuracy, abs=1e-12)
+
+
+def test_sketch_merge_equals_sketch_of_concatenation():
+    rng = np.random.default_rng(3)
+    a, b = rng.uniform(-5, 500, 3000), rng.uniform(0, 50, 1000)
+    left, right, whole = QuantileSketch(), QuantileSketch(), QuantileSketch()
+    left.add_array(a)
+    for x in b.tolist():
+        right.add(x)
+    whole.add_array(np.concatenate([a, b]))
+    left.merge(right)
+    assert (left.positive, left.negative, left.zeros, left.count) == (
+        whole.positive, whole.negative, whole.zeros, whole.count,
+    )
+    assert QuantileSketch.from_state(json.loads(json.dumps(left.to_state()))) == left
+    with pytest.raises(ValueError):
+        left.merge(QuantileSketch(0.02))
+
+
+def test_sketch_memory_is_bounded():
+    sketch = QuantileSketch(0.01, max_buckets=64)
+    sketch.add_array(np.geomspace(1e-6, 1e6, 50_000))
+    assert len(sketch.positive) + len(sketch.negative) <= 64
+    assert sketch.quantile(0.99) == pytest.approx(np.quantile(np.geomspace(1e-6, 1e6, 50_000), 0.99), rel=0.01)
+
+
+def test_aggregator_split_merge_and_state_round_trip():
+    records = [generate_mock(seed=i) for i in range(300)]
+    records[5]["vitals"]["ICA"]["psv_cm_s"] = "n/a"
+    records[6]["vitals"]["Unknown"] = {"psv_cm_s": 1.0}
+    whole = CohortAggregator().add_many(records)
+    merged = CohortAggregator().add_many(records[:120]).merge(CohortAggregator().add_many(records[120:]))
+    restored = CohortAggregator.from_state(json.loads(json.dumps(merged.to_state())))
+
+    icas = [r["vitals"]["ICA"]["psv_cm_s"] for r in records if isinstance(r["vitals"]["ICA"]["psv_cm_s"], float)]
+    for agg in (whole, merged, restored):
+        m = agg.summary()["metrics"]["ICA.psv_cm_s"]
+        assert agg.records == 300 and m["count"] == len(icas) == 299
+        assert (m["min"], m["max"]) == (min(icas), max(icas))
+        assert m["mean"] == pytest.approx(np.mean(icas), rel=1e-12)
+        assert m["std"] == pytest.approx(np.std(icas, ddof=1), rel=1e-9)
+        assert m["quantiles"]["p50"] == pytest.approx(np.quantile(icas, 0.5), rel=0.02)
+    assert whole.summary()["metrics"]["ECA.imt_mm"]["count"] == 0  # the mock never has an ECA IMT
+
+
+def test_aggregate_sources_in_parallel_and_write_summary(tmp_path: Path):
+    shards = []
+    for k in range(3):
+        path = tmp_path / f"shard-{k}.jsonl"
+        lines = [json.dumps(generate_mock(seed=100 * k + i)) for i in range(40)]
+        path.write_text("\n".join(lines + ["{broken"]) + "\n", encoding="utf-8")
+        shards.append(path)
+    serial = aggregate_sources(shards, workers=1)
+    parallel = aggregate_sources(shards, workers=3)
+    assert serial.records == parallel.records == 120
+    assert parallel.summary() == serial.summary()  # same shards merged in the same order
+
+    summary = write_summary(parallel, tmp_path / "out", TEMPLATE_DIR, output_format="html")
+    html = (tmp_path / "out" / "cohort_summary.html").read_text(encoding="utf-8")
+    assert "Cohort Summary" in html and "p99" in html
+    assert json.loads((tmp_path / "out" / "cohort_summary.json").read_text())["records"] == 120
+    assert [r["metric"] for r in summary_rows(summary)][-1] == "ica_cca_ratio"
+    assert not (tmp_path / "out" / "cohort_summary.pdf").exists()
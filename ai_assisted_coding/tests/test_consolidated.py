@@ -0,0 +1,75 @@
+from __future__ import annotations
+
+import json
+import re
+from pathlib import Path
+import sys
+sys.path.append(str(Path(__file__).parent.parent))
+
+import pytest
+
+from consolidated import _page_ranges, write_consolidated
+from data_gen import generate_mock
+
+TEMPLATE_DIR = Path(__file__).resolve().parents[1]
+
+
+def _cohort(path: Path, count: int) -> list:
+    records = [generate_mock(seed=i) for i in range(count)]
+    lines = [json.dumps(r) for r in records]
+    lines.insert(1, "{broken")
+    path.write_text("\n".join(lines) + "\n", encoding="utf-8")
+    return records
+
+
+def test_consolidated_html_has_one_section_per_patient(tmp_path: Path):
+    records = _cohort(tmp_path / "cohort.jsonl", 5)
+    summary = write_consolidated(tmp_path / "cohort.jsonl", tmp_path / "out", TEMPLATE_DIR, output_format="html")
+
+    html = (tmp_path / "out" / "cohort.html").read_text(encoding="utf-8")
+    assert html.count("<html") == 1 and html.count("<style>") == 2
+    assert re.findall(r'id="patient-(\d+)"', html) == [str(i) for i in range(5)]
+    assert "break-before: page" in html
+    for r in records:
+        assert f"<strong>ID:</strong> {r['patient_id']}" in html
+
+    assert summary.patients == 5 and summary.pages is None
+    assert summary.skipped == [{"source": "cohort.jsonl:2", "error": summary.skipped[0]["error"]}]
+    index = json.loads((tmp_path / "out" / "cohort_index.json").read_text(encoding="utf-8"))
+    assert [e["patient_id"] for e in index["reports"]] == [r["patient_id"] for r in records]
+    assert not (tmp_path / "out" / "cohort.pdf").exists()
+
+
+def test_consolidated_body_matches_single_report(tmp_path: Path):
+    from main import render_html
+
+    record = generate_mock(seed=3)
+    (tmp_path / "one.jsonl").write_text(json.dumps(record) + "\n", encoding="utf-8")
+    write_consolidated(tmp_path / "one.jsonl", tmp_path / "out", TEMPLATE_DIR, output_format="html")
+
+    def body(html: str) -> str:
+        return re.sub(r"\s+", " ", html.split("<h1>", 1)[1].split("</p>", 1)[0])
+
+    single = render_html(record, TEMPLATE_DIR)
+    assert body((tmp_path / "out" / "cohort.html").read_text(encoding="utf-8")) == body(single)
+
+
+class _Page:
+    def __init__(self, *anchors: str) -> None:
+        self.anchors = {a: (0, 0) for a in anchors}
+
+
+def test_page_ranges_from_anchors():
+    pages = [_Page("patient-0"), _Page(), _Page("patient-1", "other"), _Page("patient-2"), _Page()]
+    assert _page_ranges(pages, 4) == [[1, 2], [3, 3], [4, 5], None]
+
+
+def test_consolidated_pdf_index(tmp_path: Path):
+    pytest.importorskip("weasyprint")
+    _cohort(tmp_path / "cohort.jsonl", 3)
+    summary = write_consolidated(tmp_path / "cohort.jsonl", tmp_path / "out", TEMPLATE_DIR)
+
+    assert (tmp_path / "out" / "cohort.pdf").stat().st_size > 0
+    ranges = [e["pages"] for e in summary.reports]
+    assert ranges[0][0] == 1 and ranges[-1][1] == summary.pages
+    assert all(a[1] + 1 == b[0] for a, b in zip(ranges, ranges[1:]))
@@ -0,0 +1,51 @@
+from __future__ import annotations
+
+import json
+from pathlib import Path
+import sys
+sys.path.append(str(Path(__file__).parent.parent))
+
+import pytest
+
+pytest.importorskip("numpy")
+
+import data_gen
+from data_gen import BULK_BLOCK, generate_bulk, iter_mock_records
+from ingest import iter_records
+
+TS = "2025-01-01"
+
+
+def _read(paths):
+    return [r.data for p in paths for r in iter_records(p)]
+
+
+def test_records_are_unique_and_depend_only_on_seed_and_index():
+    start = BULK_BLOCK - 3
+    records = list(iter_mock_records(6, seed=7, start=start, timestamp=TS))
+    assert [r["patient_id"] for r in records] == [f"M{i:09d}" for i in range(start, start + 6)]
+    assert list(iter_mock_records(2, seed=7, start=start + 2, timestamp=TS)) == records[2:4]
+    assert list(iter_mock_records(6, seed=8, start=start, timestamp=TS)) != records
+    vitals = records[0]["vitals"]
+    assert 50 <= vitals["CCA"]["psv_cm_s"] <= 200
+    assert vitals["ica_cca_ratio"] == round(vitals["ICA"]["psv_cm_s"] / vitals["CCA"]["psv_cm_s"], 2)
+
+
+def test_sharded_output_is_independent_of_layout(tmp_path: Path):
+    count = 300
+    one = generate_bulk(count, tmp_path / "one", shards=1, workers=1, seed=3, timestamp=TS)
+    many = generate_bulk(count, tmp_path / "many", shards=3, workers=2, seed=3, compress=True, timestamp=TS)
+    assert [p.name for p in many] == [f"mock-{k:05d}-of-00003.jsonl.gz" for k in range(3)]
+
+    expected = list(iter_mock_records(count, seed=3, timestamp=TS))
+    assert _read(one) == expected
+    assert _read(many) == expected
+    assert len({r["patient_id"] for r in expected}) == count
+
+
+def test_lines_match_json_dumps(tmp_path: Path, monkeypatch: pytest.MonkeyPatch):
+    monkeypatch.setattr(data_gen, "BULK_BLOCK", 4)
+    path = tmp_path / "s.jsonl"
+    data_gen.write_mock_shard(path, 2, 11, seed=1, timestamp=TS)
+    lines = path.read_text(encoding="utf-8").splitlines()
+    assert lines == [json.dumps(r) for r in iter_mock_records(9, seed=1, start=2, timestamp=TS)]
@@ -0,0 +1,83 @@
+from __future__ import annotations
+
+import json
+import zlib
+from pathlib import Path
+import sys
+sys.path.append(str(Path(__file__).parent.parent))
+
+from batch import run_batch
+from data_gen import generate_mock
+from history import ExamHistory
+from main import render_html, report_payload
+from native_pdf import draw_report
+
+TEMPLATE_DIR = Path(__file__).resolve().parents[1]
+
+
+def _exam(seed: int, pid: str, timestamp: str, ica_psv: float) -> dict:
+    data = generate_mock(seed=seed)
+    data.update(patient_id=pid, timestamp=timestamp)
+    data["vitals"]["ICA"]["psv_cm_s"] = ica_psv
+    return data
+
+
+def _ica(trend) -> dict:
+    return next(m for m in trend.to_dict()["metrics"] if m["metric"] == "ica_psv")
+
+
+def test_running_aggregates_match_a_full_recomputation(tmp_path: Path):
+    values = [100.0, 120.0, 90.0, 150.0, 130.0, 110.0, 170.0]
+    with ExamHistory(tmp_path / "history.sqlite", window=3, commit_every=2) as history:
+        for day, value in enumerate(values, 1):
+            trend = history.append(_exam(day, "P1", f"2025-01-{day:02d}", value))
+            assert history.append(_exam(day, "P2", f"2025-01-{day:02d}", 50.0)).exams == day
+            ica = _ica(trend)
+            assert trend.exams == day and trend.last_timestamp == f"2025-01-{day:02d}"
+            assert ica["latest"] == value
+            assert ica["delta"] == (None if day == 1 else round(value - values[day - 2], 4))
+            recent = values[max(0, day - 3):day]
+            assert ica["mean"] == round(sum(recent) / len(recent), 4) and ica["n"] == len(recent)
+        assert history.append({"name": "no id"}) is None
+        assert len(history) == 2 * len(values)
+
+    # the aggregates are persisted and the window stays the one the file was created with
+    with ExamHistory(tmp_path / "history.sqlite", window=10) as history:
+        trend = history.trend("P1")
+        assert trend.window == 3 and trend.first_timestamp == "2025-01-01" and _ica(trend)["latest"] == 170.0
+        assert history.trend("P9") is None
+        assert [ts for ts, _ in history.exams("P1")] == [f"2025-01-{d:02d}" for d in range(1, 8)]
+
+
+def test_backfilled_and_replaced_exams_are_replayed(tmp_path: Path):
+    with ExamHistory(tmp_path / "history.sqlite", window=2) as history:
+        history.append(_exam(1, "P1", "2025-01-01", 100.0))
+        history.append(_exam(2, "P1", "2025-03-01", 160.0))
+        # a late exam gets the trend as of its own date, the latest trend includes it
+        backfilled = history.append(_exam(3, "P1", "2025-02-01", 130.0))
+        assert backfilled.exams == 2 and _ica(backfilled)["delta"] == 30.0
+        latest = history.trend("P1")
+        assert latest.exams == 3 and _ica(latest)["delta"] == 30.0 and _ica(latest)["mean"] == 145.0
+        # the same date again replaces that exam instead of counting twice
+        replaced = history.append(_exam(4, "P1", "2025-03-01", 190.0))
+        assert replaced.exams == 3 and _ica(replaced)["latest"] == 190.0 and _ica(replaced)["mean"] == 160.0
+        assert history.append(_exam(5, "P1", "2025-04-01", 200.0)).exams == 4
+
+
+def test_reports_get_a_trend_section(tmp_path: Path):
+    exams = [_exam(i, "P1", f"2025-0{i + 1}-01", 100.0 + 20 * i) for i in range(3)]
+    src = tmp_path / "cohort.jsonl"
+    src.write_text("".join(json.dumps(e) + "\n" for e in exams), encoding="utf-8")
+    assert "Trend (" not in render_html(exams[0], TEMPLATE_DIR)
+
+    with ExamHistory(tmp_path / "history.sqlite") as history:
+        summary = run_batch(src, tmp_path / "out", TEMPLATE_DIR, workers=1, progress=None,
+                            output_format="html", history=history)
+        assert summary.succeeded == 3 and history.trend("P1").exams == 3
+        pdf = draw_report(report_payload(exams[2], history.trend("P1").to_dict()))
+    html = [(tmp_path / "out" / f"{i:06d}_P1" / "report.html").read_text(encoding="utf-8") for i in range(3)]
+    assert "Trend (1 exams since 2025-01-01)" in html[0]
+    assert "Trend (3 exams since 2025-01-01)" in html[2]
+    assert "<td>+20.00</td>" in html[2] and "<td>120.00</td>" in html[2]
+    stream = zlib.decompress(pdf.split(b"stream\n")[1].split(b"\nendstream")[0])
+    assert b"(Trend \\(3 exams since 2025-01-01\\)) Tj" in stream
@@ -0,0 +1,73 @@
+from __future__ import annotations
+
+import gzip
+import json
+from pathlib import Path
+import sys
+sys.path.append(str(Path(__file__).parent.parent))
+
+import pytest
+import columnar
+import ingest
+from analysis import analyze, analyze_batch
+from data_gen import generate_mock
+from ingest import iter_records, load_record
+
+RECORDS = [generate_mock(seed=i) for i in range(20)]
+
+
+def _summary(path: Path):
+    return [(r.line, r.data, r.error is not None) for r in iter_records(path)]
+
+
+@pytest.mark.parametrize("read_chars", [1 << 20, 7, 1])
+def test_formats_yield_the_same_records(tmp_path: Path, monkeypatch: pytest.MonkeyPatch, read_chars: int):
+    monkeypatch.setattr(ingest, "_READ_CHARS", read_chars)
+    (tmp_path / "c.jsonl").write_text("".join(json.dumps(r) + "\n" for r in RECORDS), encoding="utf-8")
+    (tmp_path / "a.json").write_text(json.dumps(RECORDS, indent=2), encoding="utf-8")
+    with gzip.open(tmp_path / "c.jsonl.gz", "wt", encoding="utf-8") as f:
+        f.write(json.dumps(RECORDS))
+
+    for name in ("c.jsonl", "a.json", "c.jsonl.gz"):
+        assert [r.data for r in iter_records(tmp_path / name)] == RECORDS
+    assert [r.line for r in iter_records(tmp_path / "c.jsonl")] == list(range(1, 21))
+    assert [r.line for r in iter_records(tmp_path / "a.json")][:2] == [2, 2 + json.dumps(RECORDS[0], indent=2).count("\n") + 1]
+
+
+@pytest.mark.parametrize("read_chars", [1 << 20, 5])
+def test_malformed_records_are_reported_with_line_numbers(
+        tmp_path: Path, monkeypatch: pytest.MonkeyPatch, read_chars: int):
+    monkeypatch.setattr(ingest, "_READ_CHARS", read_chars)
+    src = tmp_path / "a.json"
+    src.write_text('[\n {"a": 1},\n {"b": ,},\n 3,\n {"c": "x}]{,\\"y"}\n]', encoding="utf-8")
+    assert _summary(src) == [(2, {"a": 1}, False), (3, None, True), (4, None, True), (5, {"c": 'x}]{,"y'}, False)]
+
+    src = tmp_path / "c.jsonl"
+    src.write_text('{"a": 1}\n{not json\n\n[1]\n{"b": 2}\n', encoding="utf-8")
+    assert _summary(src) == [(1, {"a": 1}, False), (2, None, True), (4, None, True), (5, {"b": 2}, False)]
+
+
+def test_load_record(tmp_path: Path):
+    single = tmp_path / "one.json"
+    single.write_text(json.dumps(RECORDS[0], indent=2), encoding="utf-8")
+    assert load_record(single) == RECORDS[0]
+
+    many = tmp_path / "many.jsonl"
+    many.write_text(json.dumps(RECORDS[0]) + "\n" + json.dumps(RECORDS[1]) + "\n", encoding="utf-8")
+    with pytest.raises(ValueError, match="more than one record"):
+        load_record(many)
+
+    broken = tmp_path / "broken.json"
+    broken.write_text('{\n  "name": \n}', encoding="utf-8")
+    with pytest.raises(ValueError, match="broken.json:1"):
+        load_record(broken)
+
+
+def test_analyze_batch_streams_records(tmp_path: Path, monkeypatch: pytest.MonkeyPatch):
+    pytest.importorskip("numpy")
+    monkeypatch.setattr(columnar, "CHUNK", 7)
+    src = tmp_path / "c.jsonl"
+    src.write_text("".join(json.dumps(r) + "\n" for r in RECORDS), encoding="utf-8")
+    result = analyze_batch(r.data for r in iter_records(src) if r.data is not None)
+    assert result == [analyze(r) for r in RECORDS]
+    assert len(analyze_batch(iter([]))) == 0
@@ -0,0 +1,79 @@
+from __future__ import annotations
+
+import json
+import os
+import pstats
+from pathlib import Path
+import sys
+sys.path.append(str(Path(__file__).parent.parent))
+
+import pytest
+import instrument
+from instrument import Metrics
+
+
+def _lines(path: Path):
+    return [json.loads(line) for line in path.read_text(encoding="utf-8").splitlines()]
+
+
+def test_disabled_spans_are_shared_noops(tmp_path: Path):
+    m = Metrics()
+    assert not m.enabled
+    assert m.span("analyze") is m.span("pdf")
+    with m.span("analyze"):
+        pass
+    m.close()
+    assert list(tmp_path.iterdir()) == []
+
+
+def test_spans_write_json_lines(tmp_path: Path):
+    path = tmp_path / "metrics.jsonl"
+    m = Metrics(path, trace_malloc=True)
+    with m.span("report", patient_id="p1"):
+        with m.span("analyze"):
+            data = [bytearray(1024) for _ in range(100)]
+        del data
+    with pytest.raises(ValueError):
+        with m.span("pdf"):
+            raise ValueError("boom")
+    m.close()
+
+    inner, outer, failed = _lines(path)
+    assert [inner["stage"], outer["stage"], failed["stage"]] == ["analyze", "report", "pdf"]
+    assert outer["patient_id"] == "p1" and outer["pid"] == os.getpid()
+    assert outer["wall_ms"] >= inner["wall_ms"] >= 0
+    assert inner["alloc_blocks"] >= 100
+    assert inner["traced_peak_kb"] >= 100
+    assert failed["error"] == "ValueError"
+
+
+def test_profile_dump_per_stage(tmp_path: Path):
+    m = Metrics(profile_dir=tmp_path / "prof")
+    for _ in range(2):
+        with m.span("outer"):
+            sorted(range(1000))
+            with m.span("inner"):
+                sum(range(1000))
+    m.close()
+    dumps = sorted(p.name for p in (tmp_path / "prof").iterdir())
+    assert dumps == [f"inner.{os.getpid()}.prof", f"outer.{os.getpid()}.prof"]
+    inner = pstats.Stats(str(tmp_path / "prof" / dumps[0])).stats
+    assert not any(func[2] == "<built-in method builtins.sorted>" for func in inner)
+
+
+def test_configure_exports_settings_to_environment(tmp_path: Path, monkeypatch: pytest.MonkeyPatch):
+    for name in (instrument.ENV_METRICS, instrument.ENV_PROFILE_DIR, instrument.ENV_TRACEMALLOC):
+        monkeypatch.delenv(name, raising=False)
+    path = tmp_path / "m.jsonl"
+    try:
+        instrument.configure(path)
+        assert os.environ[instrument.ENV_METRICS] == str(path)
+        instrument.reset()  # what a new worker process does
+        with instrument.span("load"):
+            pass
+        assert _lines(path)[0]["stage"] == "load"
+    finally:
+        instrument.metrics().close()
+        instrument.reset()
+        for name in (instrument.ENV_METRICS, instrument.ENV_PROFILE_DIR, instrument.ENV_TRACEMALLOC):
+            os.environ.pop(name, None)
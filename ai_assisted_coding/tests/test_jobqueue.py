@@ -0,0 +1,94 @@
+from __future__ import annotations
+
+import json
+import time
+from pathlib import Path
+import sys
+sys.path.append(str(Path(__file__).parent.parent))
+
+from batch import BatchRecord, iter_batch_records, run_batch
+from data_gen import generate_mock
+from jobqueue import JobQueue, run_workers, work
+
+TEMPLATE_DIR = Path(__file__).resolve().parents[1]
+
+
+def _records(n: int, bad=()):
+    for i in range(n):
+        if i in bad:
+            yield BatchRecord(i, f"cohort.jsonl:{i + 1}", None, "JSONDecodeError: broken")
+        else:
+            yield BatchRecord(i, f"cohort.jsonl:{i + 1}", generate_mock(seed=i))
+
+
+def _queue(tmp_path: Path, n: int = 10, shard_size: int = 4, **kwargs) -> JobQueue:
+    return JobQueue.create(tmp_path / "q.sqlite", _records(n, **kwargs), tmp_path / "out", output_format="html",
+                           shard_size=shard_size)
+
+
+def test_claims_are_exclusive_and_leases_expire(tmp_path: Path):
+    with _queue(tmp_path) as queue:
+        queue.lease_s = 10
+        assert queue.status().shards == {"pending": 3} and queue.status().records == 10
+        a = queue.claim("a", now=100.0)
+        b = queue.claim("b", now=100.0)
+        c = queue.claim("c", now=100.0)
+        assert (a.shard, b.shard, c.shard) == (1, 2, 3) and queue.claim("d", now=100.0) is None
+        assert queue.next_expiry() == 110.0
+
+        # checkpoints renew the lease; a silent worker's shard is taken over after it expires
+        assert queue.checkpoint(a, 0, "P0", "dir", now=105.0)
+        taken = queue.claim("d", now=112.0)
+        assert taken.shard == 2 and taken.owner == "d"
+        assert not queue.checkpoint(b, 4, "P4", "dir", now=112.0)  # b lost its lease and stops
+        assert queue.checkpointed(2) == {}
+        assert not queue.complete(b) and queue.complete(taken)
+
+        # a worker known to be dead is released at once
+        assert queue.release("c") == 1 and queue.claim("e", now=112.0).shard == 3
+
+        # a shard that keeps losing its workers is given up
+        queue.max_attempts = 2
+        assert queue.claim("f", now=200.0).shard == 1  # its 2nd attempt; shard 3 had its 2nd with e
+        assert queue.claim("g", now=300.0) is None
+        assert queue.status().shards == {"done": 1, "failed": 2}
+        assert {f["shard"] for f in queue.failures()} == {1, 3}
+
+
+def test_resume_renders_only_what_is_left(tmp_path: Path):
+    with _queue(tmp_path, bad={5}) as queue:
+        # a worker renders the first two patients of shard 1 and dies
+        lease = queue.claim("dead", now=0.0)
+        for item in [json.loads(line) for line in (queue.shard_dir / lease.path).open()][:2]:
+            queue.checkpoint(lease, item["index"], "x", "elsewhere", now=0.0)
+
+    assert work(tmp_path / "q.sqlite", TEMPLATE_DIR, lease_s=300) == 8
+    with JobQueue(tmp_path / "q.sqlite") as queue:
+        status = queue.status()
+        assert status.finished and (status.done, status.failed) == (10, 1)
+        assert queue.failures()[0]["error"] == "JSONDecodeError: broken"
+    # the checkpointed patients were not rendered again; the rest has run_batch's layout
+    out = sorted(p.name for p in (tmp_path / "out").iterdir())
+    assert len(out) == 7 and out[0].startswith("000002_") and not any(n.startswith("000005_") for n in out)
+    # a second run finds nothing to do
+    assert work(tmp_path / "q.sqlite", TEMPLATE_DIR) == 0
+
+
+def test_workers_render_the_cohort_like_run_batch(tmp_path: Path):
+    src = tmp_path / "cohort.jsonl"
+    src.write_text("".join(json.dumps(generate_mock(seed=i)) + "\n" for i in range(12)), encoding="utf-8")
+    JobQueue.create(tmp_path / "q.sqlite", iter_batch_records(src), tmp_path / "out", output_format="html",
+                    shard_size=3).close()
+    # a second create resumes the existing queue without reading the records
+    JobQueue.create(tmp_path / "q.sqlite", iter([]), tmp_path / "elsewhere", shard_size=3).close()
+
+    started = time.perf_counter()
+    status = run_workers(tmp_path / "q.sqlite", TEMPLATE_DIR, workers=2)
+    assert status.finished and status.shards == {"done": 4} and (status.done, status.failed) == (12, 0)
+    assert time.perf_counter() - started < 30
+
+    run_batch(src, tmp_path / "batch", TEMPLATE_DIR, workers=1, progress=None, output_format="html")
+    expected = sorted(p.name for p in (tmp_path / "batch").iterdir() if p.is_dir())
+    assert sorted(p.name for p in (tmp_path / "out").iterdir()) == expected
+    name = expected[3]
+    assert (tmp_path / "out" / name / "report.html").read_text() == (tmp_path / "batch" / name / "report.html").read_text()
@@ -0,0 +1,84 @@
+from __future__ import annotations
+
+import re
+import zlib
+from pathlib import Path
+import sys
+sys.path.append(str(Path(__file__).parent.parent))
+
+import pytest
+
+from data_gen import generate_mock
+from main import report_payload, write_report
+from native_pdf import NativePdfEngine, draw_report, text_width
+from pdf_engine import PDF_BACKEND_ENV, create_engine, pdf_backend
+from render_cache import RenderCache
+
+TEMPLATE_DIR = Path(__file__).resolve().parents[1]
+
+
+def _pages_text(pdf: bytes) -> list:
+    """Check the cross-reference table, then return the shown strings of each page."""
+    assert pdf.startswith(b"%PDF-1.4") and pdf.rstrip().endswith(b"%%EOF")
+    xref = int(pdf.rsplit(b"startxref", 1)[1].split()[0])
+    assert pdf[xref:].startswith(b"xref")
+    count = int(pdf[xref:].split()[2])
+    offsets = [int(line[:10]) for line in pdf[xref:].split(b"\n")[3:3 + count - 1]]
+    for number, offset in enumerate(offsets, 1):
+        assert pdf[offset:].startswith(b"%d 0 obj" % number)
+    streams = re.findall(rb"stream\n(.*?)\nendstream", pdf, re.DOTALL)
+    shown = [re.findall(rb"\(((?:\\.|[^\\)])*)\) Tj", zlib.decompress(s)) for s in streams]
+    return [[re.sub(rb"\\(.)", rb"\1", t).decode("cp1252") for t in page] for page in shown]
+
+
+def test_draws_the_report_payload():
+    payload = report_payload(generate_mock(seed=1))
+    pdf = draw_report(payload)
+    [shown] = _pages_text(pdf)
+    text = " ".join(shown)
+    assert b"/Count 1" in pdf and "Cardio Report (Descriptive Only)" in text
+    assert payload["patient_id"] in text and payload["patient_name"] in text
+    for row in payload["vitals_rows"]:
+        assert row["vessel"] in text and str(row["psv"]) in text
+    assert f"{payload['stats']['psv']['mean']:.2f}" in text
+    for note in payload["notes"]:
+        assert note in text
+    assert pdf == draw_report(payload)  # deterministic, so cached and fresh PDFs compare equal
+
+
+def test_long_content_wraps_and_breaks_pages():
+    payload = report_payload(generate_mock(seed=2))
+    payload["notes"] = [f"Note {i} " + "with (parenthesised) words " * 12 for i in range(40)]
+    pages = _pages_text(draw_report(payload))
+    assert len(pages) > 1
+    lines = [line for page in pages for line in page if line != "•"]
+    first = next(i for i, line in enumerate(lines) if line.startswith("Note 0 "))
+    second = next(i for i, line in enumerate(lines) if line.startswith("Note 1 "))
+    assert second - first > 1 and " ".join(lines[first:second]) == payload["notes"][0].strip()
+    notes = [line for line in lines if "parenthesised" in line]
+    assert max(text_width(line, "F1", 12) for line in notes) <= 446.78 - 30  # inside the list's content box
+
+
+def test_backend_selection_and_write_report(tmp_path: Path, monkeypatch):
+    assert pdf_backend() == "weasyprint"
+    with pytest.raises(ValueError):
+        pdf_backend("cairo")
+    with pytest.raises(ValueError):
+        NativePdfEngine().write_pdf("<html></html>")
+
+    monkeypatch.setenv(PDF_BACKEND_ENV, "native")
+    assert isinstance(create_engine(TEMPLATE_DIR / "report_template.html"), NativePdfEngine)
+    record = generate_mock(seed=3)
+    # no engine passed: the run's backend draws the PDF, WeasyPrint is never needed
+    assert not write_report(record, tmp_path / "a", TEMPLATE_DIR)
+    assert (tmp_path / "a" / "report.pdf").read_bytes() == draw_report(report_payload(record))
+
+    cache = RenderCache(tmp_path / "cache")
+    try:
+        native_key = cache.key_for(record, TEMPLATE_DIR / "report_template.html", "native-pdf")
+        assert native_key != cache.key_for(record, TEMPLATE_DIR / "report_template.html")
+        assert not write_report(record, tmp_path / "b", TEMPLATE_DIR, engine=create_engine(), cache=cache)
+        assert write_report(record, tmp_path / "c", TEMPLATE_DIR, engine=create_engine(), cache=cache)
+        assert (tmp_path / "c" / "report.pdf").read_bytes() == (tmp_path / "a" / "report.pdf").read_bytes()
+    finally:
+        cache.close()
@@ -0,0 +1,72 @@
+from __future__ import annotations
+
+from pathlib import Path
+import sys
+sys.path.append(str(Path(__file__).parent.parent))
+
+import pytest
+
+pytest.importorskip("weasyprint")
+
+from main import render_html
+from data_gen import generate_mock
+from pdf_engine import PdfEngine, current_rss_bytes
+
+TEMPLATE_DIR = Path(__file__).resolve().parents[1]
+
+
+def test_engine_strips_preparsed_styles_only():
+    engine = PdfEngine(TEMPLATE_DIR / "report_template.html")
+    html = render_html(generate_mock(seed=1), template_dir=TEMPLATE_DIR)
+    stripped = engine._strip_known_styles(html)
+    assert "<style>" in html
+    assert "<style>" not in stripped
+    custom = "<style>p { color: red; }</style><p>x</p>"
+    assert engine._strip_known_styles(custom) == custom
+
+
+def test_engine_renders_many_documents(tmp_path: Path):
+    engine = PdfEngine(TEMPLATE_DIR / "report_template.html", max_documents=3)
+    for seed in range(3):
+        assert not engine.should_recycle()
+        html = render_html(generate_mock(seed=seed), template_dir=TEMPLATE_DIR)
+        engine.write_pdf(html, tmp_path / f"{seed}.pdf")
+        assert (tmp_path / f"{seed}.pdf").stat().st_size > 0
+    assert engine.documents == 3
+    assert engine.should_recycle()
+    assert engine.write_pdf("<p>bytes</p>").startswith(b"%PDF")
+
+
+def test_rss_budget():
+    rss = current_rss_bytes()
+    if rss is None:
+        pytest.skip("RSS not available on this platform")
+    assert PdfEngine(max_rss_bytes=1).should_recycle()
+    assert not PdfEngine(max_rss_bytes=rss * 100).should_recycle()
+
+
+def _layout(document):
+    """(box type, x, y, width, height, text) for every box on every page."""
+    out = []
+    for page in document.pages:
+        for box in page._page_box.descendants():
+            out.append((
+                type(box).__name__,
+                round(box.position_x, 3), round(box.position_y, 3),
+                round(box.width or 0, 3), round(box.height or 0, 3),
+                getattr(box, "text", None),
+            ))
+    return out
+
+
+def test_engine_layout_matches_plain_weasyprint():
+    from weasyprint import HTML
+
+    engine = PdfEngine(TEMPLATE_DIR / "report_template.html")
+    for seed in range(3):
+        html = render_html(generate_mock(seed=seed), template_dir=TEMPLATE_DIR)
+        baseline = HTML(string=html, base_url=str(TEMPLATE_DIR)).render()
+        amortized = engine.render(html, base_url=str(TEMPLATE_DIR))
+        assert len(amortized.pages) == len(baseline.pages)
+        assert [(p.width, p.height) for p in amortized.pages] == [(p.width, p.height) for p in baseline.pages]
+        assert _layout(amortized) == _layout(baseline)
@@ -0,0 +1,91 @@
+from __future__ import annotations
+
+import json
+import threading
+import time
+from pathlib import Path
+import sys
+sys.path.append(str(Path(__file__).parent.parent))
+
+import pytest
+
+from data_gen import generate_mock
+from pipeline import Pipeline, Stage, parse_stage, run_pipeline, run_sequential
+
+TEMPLATE_DIR = Path(__file__).resolve().parents[1]
+
+
+def _square(x: int) -> int:
+    return x * x
+
+
+def _slow_for_small(x: int) -> int:
+    time.sleep(0.02 if x < 3 else 0.0)
+    return x
+
+
+def _fail_on_five(x: int) -> int:
+    if x == 5:
+        raise KeyError(x)
+    return x
+
+
+def test_order_executors_and_chunks():
+    items = list(range(50))
+    for executor in ("inline", "thread", "process"):
+        for chunk_size in (1, 7):
+            pipeline = Pipeline([Stage("square", _square, executor, workers=2), Stage("add", lambda x: x + 1)],
+                                maxsize=2, chunk_size=chunk_size)
+            assert list(pipeline.run(items)) == [x * x + 1 for x in items]
+
+    unordered = Pipeline([Stage("sleep", _slow_for_small, "thread", workers=4)], ordered=False)
+    out = list(unordered.run(range(8)))
+    assert sorted(out) == list(range(8)) and out != list(range(8))
+
+
+def test_backpressure_bounds_items_in_flight():
+    read = []
+
+    def source():
+        for i in range(1000):
+            read.append(i)
+            yield i
+
+    pipeline = Pipeline([Stage("a", lambda x: x), Stage("b", lambda x: x, "thread", workers=2)], maxsize=2)
+    results = pipeline.run(source())
+    assert next(results) == 0
+    time.sleep(0.2)
+    # two queues of two, two per stage thread, four in flight on the pool: nowhere near the whole input
+    assert len(read) < 20
+    results.close()  # stopping early shuts the stages down
+    assert not any(t.name.startswith("pipeline-") for t in threading.enumerate())
+
+
+def test_stage_errors_reach_the_consumer():
+    with pytest.raises(KeyError):
+        list(Pipeline([Stage("fail", _fail_on_five, "thread", workers=2)]).run(range(20)))
+    with pytest.raises(ValueError):
+        Stage("x", _square, "gpu")
+    assert parse_stage("pdf=process:4") == ("pdf", "process", 4)
+    assert parse_stage("write=thread") == ("write", "thread", None)
+    for bad in ("pdf", "pdf=gpu", "layout=inline", "pdf=process:0"):
+        with pytest.raises(ValueError):
+            parse_stage(bad)
+
+
+def test_report_pipeline_matches_the_sequential_run(tmp_path: Path):
+    src = tmp_path / "cohort.jsonl"
+    lines = [json.dumps(generate_mock(seed=i)) for i in range(12)] + ["{broken"]
+    src.write_text("\n".join(lines) + "\n", encoding="utf-8")
+
+    piped = run_pipeline(src, tmp_path / "piped", TEMPLATE_DIR, output_format="html",
+                         executors={"render": ("process", 2), "write": ("thread", 2)}, chunk_size=5)
+    sequential = run_sequential(src, tmp_path / "sequential", TEMPLATE_DIR, output_format="html")
+    assert (piped.total, piped.succeeded, piped.failed) == (sequential.total, sequential.succeeded, 1) == (13, 12, 1)
+    assert piped.failures[0].source.endswith(":13")
+    for folder in sorted(p.name for p in (tmp_path / "sequential").iterdir()):
+        for name in ("normalized_input.json", "report.html"):
+            assert (tmp_path / "piped" / folder / name).read_bytes() == \
+                (tmp_path / "sequential" / folder / name).read_bytes()
+    summary = json.loads((tmp_path / "piped" / "batch_summary.json").read_text(encoding="utf-8"))
+    assert summary["succeeded"] == 12 and summary["failed"] == 1
@@ -0,0 +1,88 @@
+from __future__ import annotations
+
+import json
+import pickle
+import tracemalloc
+from pathlib import Path
+import sys
+sys.path.append(str(Path(__file__).parent.parent))
+
+import pytest
+
+from analysis import analyze
+from data_gen import generate_mock
+from main import render_html, report_payload
+from record import PatientRecord
+
+TEMPLATE_DIR = Path(__file__).resolve().parents[1]
+
+EDGE_CASES = [
+    {},
+    {"vitals": {}},
+    {"patient_id": None, "vitals": {"ICA": {"psv_cm_s": 120}, "ica_cca_ratio": 2}},
+    {"vitals": {"CCA": {"psv_cm_s": 90.5}, "ICA": {"psv_cm_s": 90.5, "imt_mm": 0.7}, "ECA": {}}},  # tie
+    {"vitals": {"CCA": {"psv_cm_s": None, "edv_cm_s": 10}, "ica_cca_ratio": None}, "extra": [1, 2]},
+    {"vitals": {"CCA": {"psv_cm_s": 1e-3, "edv_cm_s": 0.0}, "ICA": {"psv_cm_s": 250.0, "edv_cm_s": -0.0}}},
+    {"vitals": {"CCA": {"psv_cm_s": 0.1, "edv_cm_s": 0.2}, "ICA": {"psv_cm_s": 0.7, "edv_cm_s": 1e-20}}},
+    # Not compact: kept as the original vitals dict.
+    {"vitals": {"ECA": {"psv_cm_s": 80.0}, "CCA": {"psv_cm_s": 80.0}}},  # tie, non-standard order
+    {"vitals": {"VA": {"psv_cm_s": 50.0}, "CCA": {"psv_cm_s": 70.0}}},
+    {"vitals": {"CCA": {"psv_cm_s": "fast", "edv_cm_s": None}, "ICA": "n/a"}},
+    {"vitals": {"CCA": {"psv_cm_s": True}, "ica_cca_ratio": "1.2"}},
+    {"vitals": {"CCA": {"psv_cm_s": float("inf")}}},
+    {"context": "n/a", "vitals": {"CCA": {"psv_cm_s": 2**60 + 1}}},
+]
+
+
+def _cohort(n: int) -> list:
+    return [generate_mock(seed=s) for s in range(n)] + EDGE_CASES
+
+
+def test_round_trip_and_compactness():
+    for data in _cohort(300):
+        rec = PatientRecord.from_dict(data)
+        assert rec.to_dict() == data
+        assert PatientRecord.from_json(json.dumps(data)) == rec
+        assert pickle.loads(pickle.dumps(rec)) == rec
+        for key in ("patient_id", "name", "timestamp", "context", "vitals", "extra", "missing"):
+            assert (key in rec) == (key in data)
+            assert rec.get(key, "dflt") == data.get(key, "dflt")
+    mock = generate_mock(seed=1)
+    assert PatientRecord.from_dict(mock).compact
+    assert json.dumps(PatientRecord.from_dict(mock).to_dict()) == json.dumps(mock)  # same key order
+    assert [PatientRecord.from_dict(d).compact for d in EDGE_CASES] == [True] * 7 + [False] * 6
+    with pytest.raises(ValueError):
+        PatientRecord.from_json("[1, 2]")
+
+
+def test_analysis_and_rendering_accept_records():
+    cohort = _cohort(2000)
+    records = [PatientRecord.from_dict(d) for d in cohort]
+    assert [analyze(r) for r in records] == [analyze(d) for d in cohort]
+    assert [report_payload(r) for r in records] == [report_payload(d) for d in cohort]
+    assert render_html(records[0], TEMPLATE_DIR) == render_html(cohort[0], TEMPLATE_DIR)
+
+    pytest.importorskip("numpy")
+    from analysis import analyze_batch
+
+    expected = [analyze(d) for d in cohort]
+    assert analyze_batch(records) == expected
+    assert analyze_batch(records[:5] + cohort[5:]) == expected  # mixed chunk
+
+
+def test_records_use_a_fraction_of_the_dict_memory():
+    lines = [json.dumps(generate_mock(seed=s)) for s in range(20000)]
+
+    def traced(build):
+        tracemalloc.stop()  # another test may have left it running
+        tracemalloc.start()
+        before = tracemalloc.get_traced_memory()[0]
+        kept = build()
+        size = tracemalloc.get_traced_memory()[0] - before
+        tracemalloc.stop()
+        assert len(kept) == len(lines)
+        return size
+
+    dict_bytes = traced(lambda: [json.loads(line) for line in lines])
+    record_bytes = traced(lambda: [PatientRecord.from_json(line) for line in lines])
+    assert record_bytes < dict_bytes / 3
@@ -0,0 +1,97 @@
+from __future__ import annotations
+
+import time
+from pathlib import Path
+import sys
+sys.path.append(str(Path(__file__).parent.parent))
+
+import pytest
+from data_gen import generate_mock
+from render_cache import RenderCache
+
+NAMES = ("normalized_input.json", "report.pdf")
+
+
+def _render(out: Path, payload: bytes) -> None:
+    out.mkdir(parents=True, exist_ok=True)
+    (out / "normalized_input.json").write_bytes(b"{}")
+    (out / "report.pdf").write_bytes(payload)
+
+
+def test_key_depends_on_input_and_template(tmp_path: Path):
+    tpl = tmp_path / "t.html"
+    tpl.write_text("a", encoding="utf-8")
+    data = generate_mock(seed=1)
+    with RenderCache(tmp_path / "cache") as cache:
+        key = cache.key_for(data, tpl)
+        assert cache.key_for(dict(reversed(list(data.items()))), tpl) == key
+        assert cache.key_for({**data, "name": "other"}, tpl) != key
+        tpl.write_text("b", encoding="utf-8")
+        assert cache.key_for(data, tpl) != key
+
+
+def test_hit_copies_artifacts_and_counts(tmp_path: Path):
+    with RenderCache(tmp_path / "cache") as cache:
+        assert not cache.get("k1", tmp_path / "a", NAMES)
+        _render(tmp_path / "a", b"pdf-1")
+        cache.put("k1", tmp_path / "a", NAMES)
+
+        assert cache.get("k1", tmp_path / "b", NAMES)
+        assert (tmp_path / "b" / "report.pdf").read_bytes() == b"pdf-1"
+
+        # an output directory that already holds the artifacts is left untouched
+        before = (tmp_path / "b" / "report.pdf").stat().st_mtime_ns
+        time.sleep(0.01)
+        assert cache.get("k1", tmp_path / "b", NAMES)
+        assert (tmp_path / "b" / "report.pdf").stat().st_mtime_ns == before
+        assert (cache.hits, cache.misses) == (2, 1)
+
+    # counters persist across instances
+    with RenderCache(tmp_path / "cache") as cache:
+        stats = cache.stats()
+        assert (stats["total_hits"], stats["total_misses"], stats["entries"]) == (2, 1, 1)
+
+
+def test_lru_eviction_by_size(tmp_path: Path):
+    with RenderCache(tmp_path / "cache", max_bytes=25) as cache:
+        for key in ("k1", "k2"):
+            _render(tmp_path / key, b"x" * 10)
+            cache.put(key, tmp_path / key, NAMES)
+        assert cache.get("k1", tmp_path / "k1", NAMES)  # k2 is now the least recently used
+        _render(tmp_path / "k3", b"x" * 10)
+        cache.put("k3", tmp_path / "k3", NAMES)
+
+        assert cache.evictions == 1
+        assert not cache.get("k2", tmp_path / "k2", NAMES)
+        assert cache.get("k1", tmp_path / "k1", NAMES)
+        assert cache.stats()["bytes"] <= 25
+
+
+def test_write_report_reuses_cached_artifacts(tmp_path: Path, monkeypatch: pytest.MonkeyPatch):
+    pytest.importorskip("weasyprint")
+    import main
+
+    calls = []
+    monkeypatch.setattr(main, "write_pdf_from_html",
+                        lambda html, out_pdf, engine=None: (calls.append(out_pdf), out_pdf.write_bytes(b"%PDF")))
+    template_dir = Path(__file__).parent.parent
+    data = generate_mock(seed=3)
+    with RenderCache(tmp_path / "cache") as cache:
+        assert not main.write_report(data, tmp_path / "out", template_dir, cache=cache)
+        assert main.write_report(data, tmp_path / "out", template_dir, cache=cache)
+        assert main.write_report(data, tmp_path / "copy", template_dir, cache=cache)
+        assert not main.write_report({**data, "name": "x"}, tmp_path / "out", template_dir, cache=cache)
+    assert len(calls) == 2
+    assert (tmp_path / "copy" / "report.pdf").read_bytes() == b"%PDF"
+
+
+def test_entry_gains_artifacts_of_a_later_format(tmp_path: Path):
+    with RenderCache(tmp_path / "cache") as cache:
+        _render(tmp_path / "a", b"pdf-1")
+        cache.put("k1", tmp_path / "a", NAMES[:1])
+        assert not cache.get("k1", tmp_path / "b", NAMES)
+
+        cache.put("k1", tmp_path / "a", NAMES)
+        assert cache.get("k1", tmp_path / "b", NAMES)
+        assert (tmp_path / "b" / "report.pdf").read_bytes() == b"pdf-1"
+        assert cache.stats()["bytes"] == 2 + len(b"pdf-1")
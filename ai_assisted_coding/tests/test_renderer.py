@@ -0,0 +1,54 @@
+from __future__ import annotations
+
+import os
+from pathlib import Path
+import sys
+sys.path.append(str(Path(__file__).parent.parent))
+
+import pytest
+from renderer import ReportRenderer
+
+
+def _write(path: Path, text: str, mtime_ns: int) -> None:
+    path.write_text(text, encoding="utf-8")
+    os.utime(path, ns=(mtime_ns, mtime_ns))
+
+
+def test_template_compiled_once_and_reloaded_on_change(tmp_path: Path):
+    tpl = tmp_path / "t.html"
+    _write(tpl, "<p>{{ name }}</p>", 1_000_000_000)
+    r = ReportRenderer()
+
+    assert r.render(tpl, {"name": "<a>"}) == "<p>&lt;a&gt;</p>"
+    assert r.render(tpl, {"name": "b"}) == "<p>b</p>"
+    assert (r.hits, r.misses) == (1, 1)
+
+    _write(tpl, "<b>{{ name }}</b>", 2_000_000_000)
+    assert r.render(tpl, {"name": "c"}) == "<b>c</b>"
+    assert r.misses == 2
+    assert len(r._templates) == 1
+
+
+def test_cache_is_bounded(tmp_path: Path):
+    r = ReportRenderer(cache_size=2)
+    for i in range(4):
+        folder = tmp_path / str(i)
+        folder.mkdir()
+        tpl = folder / "t.html"
+        tpl.write_text(str(i), encoding="utf-8")
+        assert r.render(tpl, {}) == str(i)
+    assert len(r._templates) == 2
+    assert len(r._envs) == 2
+    r.clear()
+    assert not r._templates and not r._envs
+    with pytest.raises(ValueError):
+        ReportRenderer(cache_size=0)
+
+
+def test_bytecode_cache_is_persisted(tmp_path: Path):
+    tpl = tmp_path / "t.html"
+    tpl.write_text("{{ 1 + 1 }}", encoding="utf-8")
+    cache_dir = tmp_path / "bytecode"
+    assert ReportRenderer(bytecode_cache_dir=cache_dir).render(tpl, {}) == "2"
+    assert any(cache_dir.iterdir())
+    assert ReportRenderer(bytecode_cache_dir=cache_dir).render(tpl, {}) == "2"
@@ -0,0 +1,86 @@
+from __future__ import annotations
+
+import json
+from pathlib import Path
+import sys
+sys.path.append(str(Path(__file__).parent.parent))
+
+import pytest
+
+import serialization
+from batch import iter_batch_records, run_batch
+from data_gen import generate_mock
+from ingest import iter_records, load_record
+from record import PatientRecord, as_dict
+from serialization import JSON_BACKEND_ENV, JSON_STYLE_ENV, dumps, loads, pack_records
+
+TEMPLATE_DIR = Path(__file__).resolve().parents[1]
+RECORDS = [generate_mock(seed=i) for i in range(20)]
+# Everything the input schema allows, plus values orjson hands to the standard library.
+ODD = {"patient_id": "é \"x\"", "name": None, "timestamp": "2024-01-01T00:00:00",
+       "context": {"age_years": 0, "notes": "", "tags": [], "nested": {"k": [1, 2.5, True]}},
+       "vitals": {"CCA": {"psv_cm_s": 1e-05, "edv_cm_s": 1e16, "imt_mm": None}, "ica_cca_ratio": 3},
+       "big": 2 ** 70}
+
+
+@pytest.fixture(params=["orjson", "json"])
+def backend(request: pytest.FixtureRequest, monkeypatch: pytest.MonkeyPatch) -> str:
+    if request.param == "orjson" and serialization.orjson is None:
+        pytest.skip("orjson not installed")
+    monkeypatch.setenv(JSON_BACKEND_ENV, request.param)
+    assert serialization.json_backend() == request.param
+    return request.param
+
+
+def test_json_round_trip(backend: str):
+    for data in RECORDS + [ODD]:
+        for compact in (False, True):
+            raw = dumps(data, compact)
+            assert loads(raw) == json.loads(raw) == data
+            assert (b"\n" in raw) is not compact
+    # The indented output of the schema is the one the standard library always wrote.
+    assert dumps(RECORDS[0], compact=False) == json.dumps(RECORDS[0], indent=2, ensure_ascii=False).encode()
+    assert loads('{"a": NaN}')["a"] != loads('{"a": NaN}')["a"]
+    with pytest.raises(json.JSONDecodeError, match="Expecting property name"):
+        loads("{broken")
+
+
+def test_compact_style_reaches_written_files(tmp_path: Path, monkeypatch: pytest.MonkeyPatch, backend: str):
+    src = tmp_path / "cohort.jsonl"
+    src.write_text("".join(json.dumps(r) + "\n" for r in RECORDS[:3]), encoding="utf-8")
+    monkeypatch.setenv(JSON_STYLE_ENV, "compact")
+    summary = run_batch(src, tmp_path / "out", TEMPLATE_DIR, workers=1, output_format="html")
+    assert summary.succeeded == 3
+    written = sorted((tmp_path / "out").glob("*/normalized_input.json"))
+    assert [json.loads(p.read_bytes()) for p in written] == RECORDS[:3]
+    assert all(b"\n" not in p.read_bytes() for p in written)
+
+
+def test_packed_cohort_round_trip(tmp_path: Path):
+    pytest.importorskip("msgpack")
+    odd = {k: v for k, v in ODD.items() if k != "big"}
+    records = RECORDS + [odd, as_dict(PatientRecord.from_dict(RECORDS[1]))]
+    packed = tmp_path / "cohort.msgpack"
+    skipped = []
+    assert pack_records(iter(records[:5] + [ODD] + records[5:]), packed,
+                        on_error=lambda data, error: skipped.append(error)) == len(records)
+    assert [e.split(":")[0] for e in skipped] == ["OverflowError"]
+    with pytest.raises(ValueError, match="record 1 cannot be packed"):
+        pack_records([ODD], tmp_path / "big.msgpack")
+    assert not list(tmp_path.glob("big.msgpack*"))
+    assert [(r.line, r.data, r.error) for r in iter_records(packed)] == \
+        [(i, r, None) for i, r in enumerate(records, start=1)]
+    assert [type(v) for v in next(iter_records(packed)).data["vitals"]["CCA"].values()] == \
+        [type(v) for v in RECORDS[0]["vitals"]["CCA"].values()]
+    assert [r.source for r in iter_batch_records(packed)][:2] == ["cohort.msgpack:1", "cohort.msgpack:2"]
+
+    single = tmp_path / "one.msgpack"
+    pack_records([RECORDS[3]], single)
+    assert load_record(single) == RECORDS[3]
+
+    # A truncated file keeps the complete records and reports the cut-off one.
+    cut = tmp_path / "cut.msgpack"
+    cut.write_bytes(packed.read_bytes()[:-5])
+    read = list(iter_records(cut))
+    assert [r.data for r in read[:-1]] == records[:-1]
+    assert read[-1].data is None and "truncated" in read[-1].error
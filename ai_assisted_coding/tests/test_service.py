@@ -0,0 +1,109 @@
+from __future__ import annotations
+
+import asyncio
+import json
+import time
+from pathlib import Path
+import sys
+sys.path.append(str(Path(__file__).parent.parent))
+
+import service
+from data_gen import generate_mock
+from main import render_html
+from service import ReportService
+
+TEMPLATE_DIR = Path(__file__).resolve().parents[1]
+
+
+async def _request(reader, writer, method: str, path: str, body: bytes = b"", close: bool = False):
+    head = f"{method} {path} HTTP/1.1\r\nHost: test\r\nContent-Length: {len(body)}\r\n"
+    writer.write((head + ("Connection: close\r\n" if close else "") + "\r\n").encode() + body)
+    await writer.drain()
+    status_line = await reader.readline()
+    headers = {}
+    while True:
+        line = (await reader.readline()).decode().strip()
+        if not line:
+            break
+        name, _, value = line.partition(":")
+        headers[name.lower()] = value.strip()
+    payload = await reader.readexactly(int(headers["content-length"]))
+    return int(status_line.split()[1]), headers, payload
+
+
+async def _call(address, method: str, path: str, body: bytes = b""):
+    reader, writer = await asyncio.open_connection(*address)
+    try:
+        return await _request(reader, writer, method, path, body, close=True)
+    finally:
+        writer.close()
+
+
+def _fake_warm(template_dir: str):
+    return None
+
+
+def _fake_pdf(html: str, template_dir: str, payload=None) -> bytes:
+    time.sleep(0.5)
+    return b"%PDF-fake " + str(len(html)).encode()
+
+
+def test_html_reports_validation_and_endpoints():
+    record = generate_mock(seed=3)
+
+    async def scenario():
+        async with ReportService(TEMPLATE_DIR, workers=1) as svc:
+            address = await svc.start()
+            reader, writer = await asyncio.open_connection(*address)
+            # several requests on one keep-alive connection
+            status, headers, body = await _request(reader, writer, "POST", "/report?format=html",
+                                                   json.dumps(record).encode())
+            assert status == 200 and headers["content-type"].startswith("text/html")
+            assert body.decode() == render_html(record, TEMPLATE_DIR)
+            status, _, body = await _request(reader, writer, "POST", "/report?format=html",
+                                             b'{"patient_id": "x", "vitals": {"ICA": "n/a"}}')
+            assert status == 422
+            assert json.loads(body)["reasons"] == ["$.vitals.ICA: expected an object, got str"]
+            assert (await _request(reader, writer, "POST", "/report?format=html", b"{oops"))[0] == 400
+            assert (await _request(reader, writer, "POST", "/report?format=docx", b"{}"))[0] == 400
+            assert (await _request(reader, writer, "GET", "/report"))[0] == 405
+            assert (await _request(reader, writer, "GET", "/nope"))[0] == 404
+            writer.close()
+
+            status, _, body = await _call(address, "GET", "/health")
+            health = json.loads(body)
+            assert status == 200 and health["status"] == "ok" and health["workers"] == 1
+            if not health["pdf"]:  # WeasyPrint missing: PDF requests are refused, HTML still works
+                assert (await _call(address, "POST", "/report", json.dumps(record).encode()))[0] == 503
+            metrics = json.loads((await _call(address, "GET", "/metrics"))[2])
+            assert metrics["responses"]["200"] == 2 and metrics["responses"]["422"] == 1
+            assert metrics["latency_ms"]["p99"] is not None
+
+            svc.max_body_bytes = 10
+            assert (await _call(address, "POST", "/report", b"x" * 11))[0] == 413
+
+    asyncio.run(scenario())
+
+
+def test_pdf_backpressure_and_coalescing(monkeypatch):
+    monkeypatch.setattr(service, "_warm_worker", _fake_warm)
+    monkeypatch.setattr(service, "_render_pdf", _fake_pdf)
+    bodies = [json.dumps(generate_mock(seed=s)).encode() for s in range(3)]
+
+    async def scenario():
+        async with ReportService(TEMPLATE_DIR, workers=1, max_pending=2) as svc:
+            address = await svc.start()
+            assert svc.pdf_error is None
+            # two distinct renders fill the queue, a copy of the first joins its render
+            # and a third distinct record is refused at once
+            first, second = (asyncio.create_task(_call(address, "POST", "/report?format=pdf", b)) for b in bodies[:2])
+            await asyncio.sleep(0.1)
+            copy = asyncio.create_task(_call(address, "POST", "/report", bodies[0]))
+            refused = await _call(address, "POST", "/report", bodies[2])
+            return await first, await second, await copy, refused, svc.metrics()
+
+    first, second, copy, refused, metrics = asyncio.run(scenario())
+    assert first[0] == second[0] == copy[0] == 200
+    assert first[2].startswith(b"%PDF") and copy[2] == first[2]
+    assert refused[0] == 429 and refused[1]["retry-after"] == "1"
+    assert metrics["coalesced"] == 1 and metrics["rejected"] == 1 and metrics["pdf_renders"] == 2
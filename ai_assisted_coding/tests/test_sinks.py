@@ -0,0 +1,99 @@
+from __future__ import annotations
+
+import json
+import sqlite3
+import tarfile
+import zipfile
+from pathlib import Path
+import sys
+sys.path.append(str(Path(__file__).parent.parent))
+
+import pytest
+
+from batch import run_batch
+from data_gen import generate_mock
+from sinks import ArchiveReader, DirectorySink, SqliteReportReader, SqliteSink, TarSink, ZipSink, open_sink
+
+REPORTS = [
+    ("000000_P1", "P1", "2025-01-01", {"report.html": b"<html>1</html>", "report.pdf": b"%PDF-1" + bytes(1000)}),
+    ("000001_P2", "P2", "2025-01-02", {"report.html": b"<html>2</html>", "report.pdf": b"%PDF-2"}),
+    ("000002_P1", "P1", "2025-02-01", {"report.html": b"<html>3</html>", "report.pdf": b"%PDF-3"}),
+]
+
+
+def _fill(sink) -> list:
+    with sink:
+        return [sink.write(*r) for r in REPORTS]
+
+
+@pytest.mark.parametrize("suffix", [".zip", ".tar"])
+def test_archive_round_trip(tmp_path: Path, suffix: str):
+    path = tmp_path / f"reports{suffix}"
+    locations = _fill(open_sink(path))
+    assert locations[0] == f"{path}!000000_P1/"
+
+    with ArchiveReader(path) as reader:
+        assert sorted(reader.names()) == sorted(f"{n}/{a}" for n, _, _, arts in REPORTS for a in arts)
+        for name, _, _, artifacts in reversed(REPORTS):
+            for artifact, data in artifacts.items():
+                assert reader.read(name, artifact) == data
+        with pytest.raises(KeyError):
+            reader.read("missing", "report.pdf")
+
+
+def test_archives_are_standard_files(tmp_path: Path):
+    _fill(ZipSink(tmp_path / "r.zip"))
+    _fill(TarSink(tmp_path / "r.tar"))
+    with zipfile.ZipFile(tmp_path / "r.zip") as z:
+        assert z.getinfo("000000_P1/report.pdf").compress_type == zipfile.ZIP_STORED
+        assert z.getinfo("000000_P1/report.html").compress_type == zipfile.ZIP_DEFLATED
+        assert z.testzip() is None
+    with tarfile.open(tmp_path / "r.tar") as t:
+        assert t.extractfile("000001_P2/report.pdf").read() == b"%PDF-2"
+
+
+def test_sqlite_sink_keys_and_batches(tmp_path: Path):
+    path = tmp_path / "reports.sqlite"
+    sink = SqliteSink(path, batch_size=2)
+    sink.write(*REPORTS[0])
+    other = sqlite3.connect(str(path))
+    assert other.execute("SELECT COUNT(*) FROM reports").fetchone()[0] == 0  # not committed yet
+    sink.write(*REPORTS[1])
+    assert other.execute("SELECT COUNT(*) FROM reports").fetchone()[0] == 4
+    sink.write(*REPORTS[2])
+    sink.close()
+    other.close()
+
+    with SqliteReportReader(path) as reader:
+        assert reader.read("P1", "report.html", "2025-01-01") == b"<html>1</html>"
+        assert reader.read("P1", "report.html") == b"<html>3</html>"  # latest exam
+        assert reader.timestamps("P1") == ["2025-01-01", "2025-02-01"]
+        with pytest.raises(KeyError):
+            reader.read("P9", "report.pdf")
+
+
+def test_directory_sink_matches_default_layout(tmp_path: Path):
+    _fill(DirectorySink(tmp_path))
+    assert (tmp_path / "000001_P2" / "report.pdf").read_bytes() == b"%PDF-2"
+
+
+@pytest.mark.parametrize("target", ["reports.zip", "reports.tar", "reports.sqlite"])
+def test_run_batch_writes_to_sink(tmp_path: Path, target: str):
+    src = tmp_path / "cohort.jsonl"
+    records = [generate_mock(seed=i) for i in range(4)]
+    src.write_text("\n".join(json.dumps(r) for r in records) + "\n{broken\n", encoding="utf-8")
+
+    with open_sink(tmp_path / target) as sink:
+        summary = run_batch(src, tmp_path / "out", Path(__file__).resolve().parents[1],
+                            workers=2, progress=None, output_format="html", sink=sink)
+    assert summary.succeeded == 4 and summary.failed == 1
+    assert sorted(p.name for p in (tmp_path / "out").iterdir()) == ["batch_summary.json"]
+
+    for i, r in enumerate(records):
+        if target.endswith(".sqlite"):
+            with SqliteReportReader(tmp_path / target) as reader:
+                stored = reader.read(r["patient_id"], "normalized_input.json", r["timestamp"])
+        else:
+            with ArchiveReader(tmp_path / target) as reader:
+                stored = reader.read(f"{i:06d}_{r['patient_id']}", "normalized_input.json")
+        assert json.loads(stored) == r
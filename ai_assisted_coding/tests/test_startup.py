@@ -0,0 +1,47 @@
+from __future__ import annotations
+
+import json
+import subprocess
+import sys
+import time
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parents[1]
+HEAVY = ("weasyprint", "jinja2", "numpy", "sqlite3")
+
+
+def _run(code: str, *args: str):
+    """Run ``code`` in a fresh interpreter; return (seconds, heavy modules it imported, stdout)."""
+    probe = f"import json, sys\n{code}\nprint(json.dumps(sorted(m for m in {HEAVY!r} if m in sys.modules)))"
+    t0 = time.perf_counter()
+    proc = subprocess.run(
+        [sys.executable, "-c", probe, *args], cwd=ROOT, capture_output=True, text=True, timeout=120
+    )
+    elapsed = time.perf_counter() - t0
+    assert proc.returncode == 0, proc.stderr
+    *out, loaded = proc.stdout.splitlines()
+    return elapsed, json.loads(loaded), out
+
+
+def test_analysis_import_is_light(record_property):
+    elapsed, loaded, _ = _run("import main, analysis\nanalysis.analyze({'vitals': {}})")
+    record_property("cold_start_analysis_s", round(elapsed, 3))
+    assert loaded == []
+
+
+def test_help_does_not_load_renderers(record_property):
+    code = "import main\ntry:\n    main.main()\nexcept SystemExit:\n    pass"
+    elapsed, loaded, out = _run(code, "--help")
+    record_property("cold_start_help_s", round(elapsed, 3))
+    assert loaded == []
+    assert any("--format" in line for line in out)
+
+
+def test_html_format_skips_weasyprint(tmp_path: Path, record_property):
+    code = "import main\nmain.main()"
+    elapsed, loaded, out = _run(code, "--generate-mock", "--seed", "1", "--format", "html", "--out", str(tmp_path))
+    record_property("cold_start_html_s", round(elapsed, 3))
+    assert "weasyprint" not in loaded and "jinja2" in loaded
+    assert (tmp_path / "report.html").stat().st_size > 0
+    assert not (tmp_path / "report.pdf").exists()
+    assert out == [f"Wrote: {tmp_path / 'report.html'}"]
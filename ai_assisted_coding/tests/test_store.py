@@ -0,0 +1,106 @@
+from __future__ import annotations
+
+import json
+from pathlib import Path
+import sys
+sys.path.append(str(Path(__file__).parent.parent))
+
+import pytest
+
+from batch import BatchRecord, run_batch
+from consolidated import write_consolidated
+from data_gen import generate_mock
+from store import PatientStore, Selection, exam_row, parse_condition, selection_from_args
+
+TEMPLATE_DIR = Path(__file__).resolve().parents[1]
+
+
+def _exam(seed: int, pid: str, timestamp: str, ica_psv: float) -> dict:
+    data = generate_mock(seed=seed)
+    data.update(patient_id=pid, timestamp=timestamp)
+    data["vitals"]["ICA"]["psv_cm_s"] = ica_psv
+    return data
+
+
+EXAMS = [
+    _exam(0, "P1", "2025-01-10", 90.0),
+    _exam(1, "P2", "2025-02-01", 130.0),
+    _exam(2, "P1", "2025-03-05", 140.0),
+    _exam(3, "P3", "2025-03-06", 125.0),
+]
+
+
+@pytest.fixture
+def cohort(tmp_path: Path) -> Path:
+    src = tmp_path / "cohort.jsonl"
+    lines = [json.dumps(e) for e in EXAMS] + ["{broken", json.dumps({"name": "no id"})]
+    src.write_text("\n".join(lines) + "\n", encoding="utf-8")
+    return src
+
+
+def test_ingest_and_select(tmp_path: Path, cohort: Path):
+    with PatientStore(tmp_path / "patients.sqlite") as store:
+        summary = store.ingest_file(cohort, batch_size=2)
+        assert summary.inserted == 4 and len(summary.skipped) == 2
+        assert len(store) == 4
+
+        hits = list(store.select(selection_from_args(where=["ica_psv>125"])))
+        assert [r.data["patient_id"] for r in hits] == ["P2", "P1"]
+        assert [r.index for r in hits] == [0, 1]
+        assert hits[1].data == EXAMS[2]  # the full record round-trips
+
+        since = selection_from_args(since="2025-02-01", where=["ica_psv<=130"])
+        assert [r.data["timestamp"] for r in store.select(since)] == ["2025-02-01", "2025-03-06"]
+        assert store.count(Selection(patient_id="P1")) == 2
+        assert store.count(Selection(until="2025-01-31")) == 1
+
+
+def test_reingest_replaces_exam_and_keeps_indexes(tmp_path: Path, cohort: Path):
+    with PatientStore(tmp_path / "patients.sqlite") as store:
+        store.ingest_file(cohort)
+        changed = dict(EXAMS[0], name="renamed")
+        store.ingest([BatchRecord(0, "x", changed)])
+        assert len(store) == 4
+        assert next(store.select(Selection(patient_id="P1", until="2025-01-10"))).data["name"] == "renamed"
+        plan = " ".join(store.explain(selection_from_args(where=["ica_psv>125"])))
+        assert "exams_ica_psv" in plan
+
+
+def test_exam_row_normalizes_metrics():
+    data = {"patient_id": 7, "vitals": {"ICA": {"psv_cm_s": "high", "edv_cm_s": 30}, "ica_cca_ratio": True}}
+    row = exam_row(data)
+    assert row[:2] == ("7", "")
+    assert row[8] is None and row[9] == 30  # ica_psv (not a number), ica_edv
+    assert row[-2] is None  # bool is not a ratio
+    with pytest.raises(ValueError):
+        exam_row({"name": "x"})
+
+
+@pytest.mark.parametrize("text, expected", [
+    ("ica_psv>125", ("ica_psv", ">", 125.0)),
+    (" ica_cca_ratio >= 2.5 ", ("ica_cca_ratio", ">=", 2.5)),
+    ("age!=-1e1", ("age", "!=", -10.0)),
+])
+def test_parse_condition(text: str, expected: tuple):
+    assert parse_condition(text) == expected
+
+
+@pytest.mark.parametrize("text", ["ica_psv>", "name=bob", "ica_psv>1; DROP TABLE exams", "ica_psv~3"])
+def test_parse_condition_rejects(text: str):
+    with pytest.raises(ValueError):
+        parse_condition(text)
+
+
+def test_selection_feeds_batch_and_consolidated(tmp_path: Path, cohort: Path):
+    with PatientStore(tmp_path / "patients.sqlite") as store:
+        store.ingest_file(cohort)
+        selection = selection_from_args(where=["ica_psv>=125"])
+        summary = run_batch(store.select(selection), tmp_path / "batch", TEMPLATE_DIR,
+                            workers=1, progress=None, output_format="html")
+        assert summary.succeeded == 3
+        assert sorted(p.name for p in (tmp_path / "batch").iterdir() if p.is_dir()) == [
+            "000000_P2", "000001_P1", "000002_P3",
+        ]
+
+        result = write_consolidated(store.select(selection), tmp_path / "cohort", TEMPLATE_DIR, output_format="html")
+        assert [r["patient_id"] for r in result.reports] == ["P2", "P1", "P3"]
@@ -0,0 +1,88 @@
+from __future__ import annotations
+
+import json
+from pathlib import Path
+import sys
+sys.path.append(str(Path(__file__).parent.parent))
+
+import pytest
+
+from batch import iter_batch_records, run_batch
+from data_gen import generate_bulk, generate_mock
+from store import PatientStore
+from validate import Quarantine, Validator, screen
+
+TEMPLATE_DIR = Path(__file__).resolve().parents[1]
+
+
+def test_validator_reports_every_problem_with_its_path():
+    validate = Validator()
+    assert validate(generate_mock(seed=1)) == []
+    assert validate({"patient_id": 7, "vitals": {"ICA": {"psv_cm_s": 120}, "ica_cca_ratio": None}}) == []
+    assert validate([1, 2]) == ["$: expected an object, got list"]
+    assert validate({"name": "x"}) == ["$.patient_id: required", "$.vitals: required"]
+    bad = {
+        "patient_id": "",
+        "timestamp": "yesterday",
+        "context": {"age_years": True},
+        "vitals": {
+            "CCA": None,
+            "ICA": {"psv_cm_s": "fast", "imt_mm": -0.5, "edv_cm_s": float("nan")},
+            "VA": {"psv_cm_s": float("inf")},
+            "ica_cca_ratio": "1.2",
+        },
+    }
+    assert validate(bad) == [
+        "$.patient_id: shorter than 1",
+        "$.timestamp: does not match ^\\d{4}-\\d{2}-\\d{2}",
+        "$.context.age_years: expected an integer, got bool",
+        "$.vitals.CCA: expected an object, got null",
+        "$.vitals.ICA.psv_cm_s: expected a finite number, got str",
+        "$.vitals.ICA.edv_cm_s: expected a finite number, got nan",
+        "$.vitals.ICA.imt_mm: below 0",
+        "$.vitals.ica_cca_ratio: expected a finite number or null, got str",
+        "$.vitals.VA.psv_cm_s: expected a finite number, got inf",
+    ]
+    # One generated function, no schema walk at validation time.
+    assert validate.source.startswith("def validate(data):") and "schema" not in validate.source
+    with pytest.raises(ValueError):
+        Validator({"type": "date"})
+
+
+def test_bulk_mock_records_are_valid(tmp_path: Path):
+    validate = Validator()
+    (shard,) = generate_bulk(200, tmp_path, shards=1, workers=1)
+    assert all(validate(r.data) == [] for r in iter_batch_records(shard))
+
+
+def test_batch_and_ingest_quarantine_invalid_records(tmp_path: Path):
+    src = tmp_path / "cohort.jsonl"
+    good = [generate_mock(seed=i) for i in range(3)]
+    lines = [json.dumps(good[0]), "{broken", json.dumps({"patient_id": "x", "vitals": {"ICA": "n/a"}})]
+    src.write_text("\n".join(lines + [json.dumps(r) for r in good[1:]]) + "\n", encoding="utf-8")
+
+    with Quarantine(tmp_path / "q.jsonl") as quarantine:
+        summary = run_batch(src, tmp_path / "out", TEMPLATE_DIR, workers=1, progress=None,
+                            output_format="html", quarantine=quarantine)
+    assert (summary.total, summary.succeeded, summary.failed, summary.quarantined) == (5, 3, 0, 2)
+    rejected = [json.loads(line) for line in (tmp_path / "q.jsonl").read_text().splitlines()]
+    assert [r["source"] for r in rejected] == ["cohort.jsonl:2", "cohort.jsonl:3"]
+    assert rejected[0]["record"] is None and rejected[0]["reasons"][0].startswith("JSONDecodeError")
+    assert rejected[1]["reasons"] == ["$.vitals.ICA: expected an object, got str"]
+    assert rejected[1]["record"] == {"patient_id": "x", "vitals": {"ICA": "n/a"}}
+    assert json.loads((tmp_path / "out" / "batch_summary.json").read_text())["quarantined"] == 2
+
+    quarantine = Quarantine(tmp_path / "ingest_q.jsonl")
+    with PatientStore(tmp_path / "p.sqlite") as store:
+        result = store.ingest(screen(iter_batch_records(src), quarantine))
+        assert result.inserted == len(store) == 3
+    quarantine.close()
+    assert quarantine.count == 2
+
+
+def test_no_quarantine_file_without_bad_records(tmp_path: Path):
+    quarantine = Quarantine(tmp_path / "q.jsonl")
+    records = [r for r in iter_batch_records(generate_bulk(10, tmp_path, shards=1, workers=1)[0])]
+    assert list(screen(records, quarantine)) == records
+    quarantine.close()
+    assert quarantine.count == 0 and not quarantine.path.exists()
@@ -0,0 +1,102 @@
+from __future__ import annotations
+
+import json
+import os
+import shutil
+import threading
+import time
+from pathlib import Path
+import sys
+sys.path.append(str(Path(__file__).parent.parent))
+
+from data_gen import generate_mock
+from watch import INDEX_NAME, WatchIndex, Watcher
+
+TEMPLATE_DIR = Path(__file__).resolve().parents[1]
+
+
+def _drop(folder: Path, name: str, data: object, mtime: float = 1_700_000_000.0) -> Path:
+    path = folder / name
+    path.write_text(json.dumps(data) if not isinstance(data, str) else data, encoding="utf-8")
+    os.utime(path, (mtime, mtime))
+    return path
+
+
+def _watch_once(src: Path, out: Path) -> Watcher:
+    with Watcher(src, out, TEMPLATE_DIR, workers=1, output_format="html") as watcher:
+        watcher.run(once=True, log=None)
+    return watcher
+
+
+def test_resume_skips_unchanged_and_renders_changes(tmp_path: Path):
+    src, out = tmp_path / "in", tmp_path / "out"
+    src.mkdir()
+    _drop(src, "a.json", generate_mock(seed=1))
+    _drop(src, "b.json", generate_mock(seed=2))
+    _drop(src, "bad.json", "{broken")
+    (src / "notes.txt").write_text("ignored")
+
+    first = _watch_once(src, out)
+    assert (first.rendered, first.failed) == (2, 1)
+    assert json.loads((out / "a" / "normalized_input.json").read_text()) == generate_mock(seed=1)
+    html_mtime = (out / "b" / "report.html").stat().st_mtime_ns
+
+    # Restart: nothing changed, nothing is rendered (the bad file is not retried either).
+    second = _watch_once(src, out)
+    assert (second.rendered, second.failed, second.unchanged) == (0, 0, 0)
+    assert (out / "b" / "report.html").stat().st_mtime_ns == html_mtime
+
+    # New mtime with the same content only refreshes the index; new content is rendered.
+    os.utime(src / "a.json", (1_700_000_100.0, 1_700_000_100.0))
+    _drop(src, "b.json", generate_mock(seed=3), mtime=1_700_000_100.0)
+    third = _watch_once(src, out)
+    assert (third.rendered, third.unchanged) == (1, 1)
+    assert json.loads((out / "b" / "normalized_input.json").read_text()) == generate_mock(seed=3)
+
+    # Missing outputs are rendered again; deleted inputs leave the index.
+    shutil.rmtree(out / "a")
+    (src / "bad.json").unlink()
+    fourth = _watch_once(src, out)
+    assert fourth.rendered == 1 and (out / "a" / "report.html").exists()
+    index = WatchIndex(out / INDEX_NAME)
+    assert sorted(index.names()) == ["a.json", "b.json"]
+    assert index.get("a.json").mtime_ns == 1_700_000_100 * 10**9
+    index.close()
+
+
+def test_debounce_waits_for_a_quiet_file(tmp_path: Path):
+    src, out = tmp_path / "in", tmp_path / "out"
+    src.mkdir()
+    now = [0.0]
+    with Watcher(src, out, TEMPLATE_DIR, workers=1, output_format="html", debounce_s=2.0,
+                 clock=lambda: now[0]) as watcher:
+        path = _drop(src, "a.json", generate_mock(seed=1))
+        assert watcher.poll() == 0
+        now[0] = 1.5
+        _drop(src, "a.json", generate_mock(seed=2), mtime=1_700_000_001.0)  # still being written
+        assert watcher.poll() == 0
+        now[0] = 3.4
+        assert watcher.poll() == 0  # only 1.9 s since the last change
+        now[0] = 3.6
+        assert watcher.poll() == 1
+        assert watcher.poll() == 0  # in flight, not submitted twice
+        results = watcher.collect(wait=True)
+        assert [r.name for r in results] == ["a.json"] and results[0].ok
+        assert json.loads((out / "a" / "normalized_input.json").read_text()) == generate_mock(seed=2)
+        assert path.exists()
+
+
+def test_run_until_stopped(tmp_path: Path):
+    src, out = tmp_path / "in", tmp_path / "out"
+    src.mkdir()
+    stop = threading.Event()
+    with Watcher(src, out, TEMPLATE_DIR, workers=1, output_format="html", debounce_s=0.0) as watcher:
+        thread = threading.Thread(target=watcher.run, kwargs={"interval_s": 0.05, "stop": stop, "log": None})
+        thread.start()
+        _drop(src, "late.json", generate_mock(seed=4))
+        deadline = time.monotonic() + 30
+        while not (out / "late" / "report.html").exists() and time.monotonic() < deadline:
+            time.sleep(0.05)
+        stop.set()
+        thread.join()
+    assert watcher.rendered == 1
@@ -0,0 +1,296 @@
+from __future__ import annotations
+
+import json
+import math
+import re
+from pathlib import Path
+from typing import TYPE_CHECKING, Any, Callable, Dict, Iterable, Iterator, List, Optional, TextIO, Union
+
+if TYPE_CHECKING:
+    from batch import BatchRecord
+
+# A small JSON Schema subset: "type" (one name or a list of "object", "string",
+# "integer", "number", "null"), "required", "properties", "additionalProperties"
+# (bool or a schema), "minimum", "maximum", "minLength" and "pattern".
+_METRIC: Dict[str, Any] = {"type": "number", "minimum": 0}
+_VESSEL: Dict[str, Any] = {
+    "type": "object",
+    "properties": {"psv_cm_s": _METRIC, "edv_cm_s": _METRIC, "imt_mm": _METRIC},
+}
+RECORD_SCHEMA: Dict[str, Any] = {
+    "type": "object",
+    "required": ["patient_id", "vitals"],
+    "properties": {
+        "patient_id": {"type": ["string", "integer"], "minLength": 1},
+        "name": {"type": "string"},
+        "timestamp": {"type": "string", "pattern": r"^\d{4}-\d{2}-\d{2}"},
+        "context": {
+            "type": "object",
+            "properties": {
+                "age_years": {"type": "integer", "minimum": 0, "maximum": 150},
+                "sex": {"type": "string"},
+                "notes": {"type": "string"},
+            },
+        },
+        "vitals": {
+            "type": "object",
+            "properties": {
+                "CCA": _VESSEL,
+                "ICA": _VESSEL,
+                "ECA": _VESSEL,
+                "ica_cca_ratio": {"type": ["number", "null"], "minimum": 0},
+            },
+            # Vessels other than CCA/ICA/ECA are accepted if they look like one.
+            "additionalProperties": _VESSEL,
+        },
+    },
+}
+
+# Type tests of the generated code; "number" is a finite int or float (not bool):
+# x - x is 0.0 for finite floats and NaN for inf and NaN.
+_TYPE_TESTS = {
+    "object": "type({v}) is dict",
+    "string": "type({v}) is str",
+    "integer": "type({v}) is int",
+    "number": "((type({v}) is float and {v} - {v} == 0.0) or type({v}) is int)",
+    "null": "{v} is None",
+}
+_SEEN_LIMIT = 4096
+_TYPE_NAMES = {"object": "an object", "string": "a string", "integer": "an integer",
+               "number": "a finite number", "null": "null"}
+
+
+class _Compiler:
+    """Turns a schema into the source of one ``validate(data) -> reasons`` function."""
+
+    def __init__(self) -> None:
+        self.lines: List[str] = []
+        self.constants: Dict[str, Any] = {}
+        self._names = 0
+
+    def _name(self, prefix: str) -> str:
+        self._names += 1
+        return f"{prefix}{self._names}"
+
+    def _const(self, value: Any) -> str:
+        name = self._name("_c")
+        self.constants[name] = value
+        return name
+
+    def _emit(self, depth: int, line: str) -> None:
+        self.lines.append("    " * depth + line)
+
+    def compile(self, schema: Dict[str, Any]) -> str:
+        self._emit(0, "def validate(data):")
+        self._emit(1, "errors = []")
+        self._node(schema, "data", "$", 1)
+        self._emit(1, "return errors")
+        return "\n".join(self.lines) + "\n"
+
+    def _node(self, schema: Dict[str, Any], var: str, path: str, depth: int) -> None:
+        types = schema.get("type")
+        if isinstance(types, str):
+            types = [types]
+        if types:
+            unknown = set(types) - set(_TYPE_TESTS)
+            if unknown:
+                raise ValueError(f"unsupported type(s) {sorted(unknown)} at {path}")
+            expected = " or ".join(_TYPE_NAMES[t] for t in types)
+            test = " or ".join(_TYPE_TESTS[t].format(v=var) for t in types)
+            branch = "if"
+            if "number" in types:
+                # Fast path for the common case, a float within bounds: one chained comparison (false for NaN).
+                low = f"{schema['minimum']!r} <= " if "minimum" in schema else ""
+                high = f" <= {schema['maximum']!r}" if "maximum" in schema else " < _INF"
+                self._emit(depth, f"if type({var}) is float and {low}{var}{high}:")
+                self._emit(depth + 1, "pass")
+                branch = "elif"
+            self._emit(depth, f"{branch} not ({test}):")
+            self._emit(depth + 1, f"errors.append({path + f': expected {expected}, got '!r} + _describe({var}))")
+            self._emit(depth, "else:")
+            depth += 1
+        body = len(self.lines)
+        if "minimum" in schema or "maximum" in schema:
+            self._bounds(schema, var, path, depth, types)
+        is_str = "" if types == ["string"] else f"type({var}) is str and "
+        if "minLength" in schema:
+            n = int(schema["minLength"])
+            self._emit(depth, f"if {is_str}len({var}) < {n}:")
+            self._emit(depth + 1, f"errors.append({path + f': shorter than {n}'!r})")
+        if "pattern" in schema:
+            # Values such as exam dates repeat across a cohort: strings that matched are remembered.
+            regex, seen = self._const(re.compile(schema["pattern"])), self._const(set())
+            self._emit(depth, f"if {is_str}{var} not in {seen}:")
+            self._emit(depth + 1, f"if {regex}.search({var}) is None:")
+            self._emit(depth + 2, f"errors.append({path + ': does not match ' + schema['pattern']!r})")
+            self._emit(depth + 1, f"elif len({seen}) < {_SEEN_LIMIT}:")
+            self._emit(depth + 2, f"{seen}.add({var})")
+        if "properties" in schema or "required" in schema or "additionalProperties" in schema:
+            self._object(schema, var, path, depth, guarded=types == ["object"])
+        if types and len(self.lines) == body:
+            self.lines.pop()  # the "else:" of a bare type check
+
+    def _bounds(self, schema: Dict[str, Any], var: str, path: str, depth: int, types: Optional[List[str]]) -> None:
+        if types and set(types) <= {"integer", "number"}:
+            guard = ""
+        elif types and set(types) <= {"integer", "number", "null"}:
+            guard = f"{var} is not None and "
+        else:
+            guard = f"(type({var}) is int or type({var}) is float) and "
+        for key, op, word in (("minimum", "<", "below"), ("maximum", ">", "above")):
+            if key in schema:
+                self._emit(depth, f"if {guard}{var} {op} {schema[key]!r}:")
+                self._emit(depth + 1, f"errors.append({path + f': {word} {schema[key]!r}'!r})")
+
+    def _object(self, schema: Dict[str, Any], var: str, path: str, depth: int, guarded: bool) -> None:
+        if not guarded:
+            self._emit(depth, f"if type({var}) is dict:")
+            depth += 1
+        properties: Dict[str, Any] = schema.get("properties", {})
+        for key in schema.get("required", []):
+            self._emit(depth, f"if {key!r} not in {var}:")
+            self._emit(depth + 1, f"errors.append({_join(path, key) + ': required'!r})")
+        for key, sub in properties.items():
+            # Keys are usually present: a subscript in a try block is cheaper than .get().
+            child = self._name("_v")
+            self._emit(depth, "try:")
+            self._emit(depth + 1, f"{child} = {var}[{key!r}]")
+            self._emit(depth, "except KeyError:")
+            self._emit(depth + 1, "pass")
+            self._emit(depth, "else:")
+            mark = len(self.lines)
+            self._node(sub, child, _join(path, key), depth + 1)
+            if len(self.lines) == mark:
+                del self.lines[-4:]  # nothing to check for this key
+        extra = schema.get("additionalProperties", True)
+        if extra is True:
+            return
+        known = self._const(frozenset(properties))
+        # The common case (no unknown keys) costs one set comparison.
+        self._emit(depth, f"if not {var}.keys() <= {known}:")
+        key_var, child = self._name("_k"), self._name("_v")
+        self._emit(depth + 1, f"for {key_var}, {child} in {var}.items():")
+        self._emit(depth + 2, f"if {key_var} in {known}:")
+        self._emit(depth + 3, "continue")
+        if extra is False:
+            self._emit(depth + 2, f"errors.append({path!r} + '.' + str({key_var}) + ': unexpected key')")
+            return
+        # Paths of additional keys are only known at run time; validate them with a nested function.
+        nested = _Compiler()
+        source = nested.compile(extra)
+        fn = self._const(_build(source, nested.constants))
+        self._emit(depth + 2, f"for _reason in {fn}({child}):")
+        self._emit(depth + 3, f"errors.append({path!r} + '.' + str({key_var}) + _reason[1:])")
+
+
+def _join(path: str, key: str) -> str:
+    return f"{path}.{key}"
+
+
+def _describe(value: Any) -> str:
+    if isinstance(value, float) and not math.isfinite(value):
+        return repr(value)
+    return "null" if value is None else type(value).__name__
+
+
+def _build(source: str, constants: Dict[str, Any]) -> Callable[[Any], List[str]]:
+    namespace: Dict[str, Any] = {"_describe": _describe, "_INF": math.inf}
+    namespace.update(constants)
+    exec(compile(source, "<validator>", "exec"), namespace)  # noqa: S102 - code generated from the schema
+    return namespace["validate"]
+
+
+class Validator:
+    """
+    Record validator compiled once from a schema (default ``RECORD_SCHEMA``).
+
+    The schema is turned into the Python source of a single function with
+    every check inlined (``source``), which is compiled once; validating a
+    record is one call of that function, with no per-record walk over the
+    schema. Calling the validator returns the reasons a record is invalid,
+    e.g. ``["$.vitals.ICA.psv_cm_s: expected a finite number, got str"]``;
+    an empty list means it is valid.
+    """
+
+    def __init__(self, schema: Optional[Dict[str, Any]] = None) -> None:
+        compiler = _Compiler()
+        self.schema = RECORD_SCHEMA if schema is None else schema
+        self.source = compiler.compile(self.schema)
+        self._validate = _build(self.source, compiler.constants)
+
+    def __call__(self, data: Any) -> List[str]:
+        return self._validate(data)
+
+    def is_valid(self, data: Any) -> bool:
+        return not self._validate(data)
+
+
+class Quarantine:
+    """
+    Append-only JSON lines file of rejected records.
+
+    One line per record: ``{"source", "index", "reasons", "record"}``, where
+    ``record`` is the parsed input (null if it could not be parsed). The file
+    is opened lazily, so a run without bad records leaves no file behind.
+    """
+
+    def __init__(self, path: Path) -> None:
+        self.path = Path(path)
+        self.count = 0
+        self._file: Optional[TextIO] = None
+
+    def add(self, record: BatchRecord, reasons: List[str]) -> None:
+        if self._file is None:
+            self.path.parent.mkdir(parents=True, exist_ok=True)
+            self._file = self.path.open("a", encoding="utf-8")
+        line = {"source": record.source, "index": record.index, "reasons": reasons, "record": record.data}
+        self._file.write(json.dumps(line, ensure_ascii=False, default=repr) + "\n")
+        self._file.flush()
+        self.count += 1
+
+    def close(self) -> None:
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+    def __enter__(self) -> "Quarantine":
+        return self
+
+    def __exit__(self, *exc: Any) -> None:
+        self.close()
+
+
+def rejection(record: BatchRecord, validator: Optional[Callable[[Any], List[str]]] = None) -> List[str]:
+    """Why ``record`` must not be processed (it failed to load or to validate); empty if it is fine."""
+    if record.data is None:
+        return [record.error or "could not be read"]
+    return (validator or default_validator())(record.data)
+
+
+def screen(
+    records: Iterable[BatchRecord],
+    quarantine: Quarantine,
+    validator: Optional[Callable[[Any], List[str]]] = None,
+) -> Iterator[BatchRecord]:
+    """
+    Yield the records that loaded and pass ``validator`` (default: ``RECORD_SCHEMA``);
+    records that failed to parse or validate go to ``quarantine`` instead.
+    """
+    validate = validator or default_validator()
+    for record in records:
+        reasons = rejection(record, validate)
+        if reasons:
+            quarantine.add(record, reasons)
+        else:
+            yield record
+
+
+_default: Optional[Validator] = None
+
+
+def default_validator() -> Validator:
+    """The process-wide validator of ``RECORD_SCHEMA``, compiled on first use."""
+    global _default
+    if _default is None:
+        _default = Validator()
+    return _default
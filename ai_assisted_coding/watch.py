@@ -0,0 +1,330 @@
+from __future__ import annotations
+
+import hashlib
+import json
+import os
+import re
+import sqlite3
+import sys
+import threading
+import time
+from concurrent.futures import Future, ProcessPoolExecutor
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Any, Callable, Dict, List, Optional, TextIO, Tuple
+
+from main import FORMATS, TEMPLATE_NAME, write_report
+from validate import default_validator
+
+INDEX_NAME = ".watch_index.sqlite"
+_UNSAFE_CHARS = re.compile(r"[^A-Za-z0-9._-]+")
+
+# Per-process PDF engine of a render worker, created on its first PDF.
+_worker_engine: Any = None
+
+
+@dataclass(frozen=True)
+class IndexEntry:
+    """What the index knows about one watched file."""
+    name: str
+    size: int
+    mtime_ns: int
+    sha256: str
+    out_dir: str
+    error: Optional[str]
+    rendered_at: float
+
+
+@dataclass(frozen=True)
+class WatchResult:
+    """Outcome of rendering one file."""
+    name: str
+    out_dir: str
+    sha256: Optional[str]
+    error: Optional[str] = None
+
+    @property
+    def ok(self) -> bool:
+        return self.error is None
+
+
+class WatchIndex:
+    """
+    Persistent map of watched file to (size, mtime, SHA-256) and its output directory.
+
+    A file whose size and mtime still match its entry is not read again; one
+    whose content hash still matches is not rendered again. Failed renders are
+    recorded with their error and hash, so a broken file is retried only once
+    it changes.
+    """
+
+    def __init__(self, path: Path) -> None:
+        self.path = Path(path)
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        # One watcher uses the index at a time, but it may run in a thread other than its creator's.
+        self._db = sqlite3.connect(str(self.path), timeout=30, isolation_level=None, check_same_thread=False)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("PRAGMA synchronous=NORMAL")
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS files ("
+            " name TEXT PRIMARY KEY, size INTEGER NOT NULL, mtime_ns INTEGER NOT NULL,"
+            " sha256 TEXT NOT NULL, out_dir TEXT NOT NULL, error TEXT, rendered_at REAL NOT NULL)"
+        )
+
+    def close(self) -> None:
+        self._db.close()
+
+    def get(self, name: str) -> Optional[IndexEntry]:
+        row = self._db.execute("SELECT * FROM files WHERE name = ?", (name,)).fetchone()
+        return None if row is None else IndexEntry(*row)
+
+    def names(self) -> List[str]:
+        return [r[0] for r in self._db.execute("SELECT name FROM files")]
+
+    def record(self, name: str, size: int, mtime_ns: int, sha256: str, out_dir: str,
+               error: Optional[str] = None) -> None:
+        self._db.execute(
+            "INSERT OR REPLACE INTO files(name, size, mtime_ns, sha256, out_dir, error, rendered_at)"
+            " VALUES (?, ?, ?, ?, ?, ?, ?)",
+            (name, size, mtime_ns, sha256, out_dir, error, time.time()),
+        )
+
+    def touch(self, name: str, size: int, mtime_ns: int) -> None:
+        """Store a new size/mtime for a file whose content did not change."""
+        self._db.execute("UPDATE files SET size = ?, mtime_ns = ? WHERE name = ?", (size, mtime_ns, name))
+
+    def forget(self, name: str) -> None:
+        self._db.execute("DELETE FROM files WHERE name = ?", (name,))
+
+
+def file_sha256(path: Path) -> str:
+    h = hashlib.sha256()
+    with Path(path).open("rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            h.update(block)
+    return h.hexdigest()
+
+
+def render_file(path: Path, out_dir: Path, template_dir: Path, output_format: str = "pdf") -> WatchResult:
+    """
+    Render one exam file with ``write_report`` (``render_html`` and
+    ``write_pdf_from_html``). The file is read once; the hash returned is
+    that of the bytes actually rendered.
+    """
+    global _worker_engine
+    name = Path(path).name
+    try:
+        raw = Path(path).read_bytes()
+    except OSError as e:
+        return WatchResult(name, str(out_dir), None, f"{type(e).__name__}: {e}")
+    digest = hashlib.sha256(raw).hexdigest()
+    try:
+        data = json.loads(raw)
+        reasons = default_validator()(data)
+        if reasons:
+            raise ValueError("; ".join(reasons))
+        engine = None
+        if output_format == "pdf":
+            if _worker_engine is None:
+                from pdf_engine import create_engine
+
+                _worker_engine = create_engine(Path(template_dir) / TEMPLATE_NAME)
+            engine = _worker_engine
+        out_dir.mkdir(parents=True, exist_ok=True)
+        write_report(data, out_dir, template_dir, engine=engine, output_format=output_format)
+    except Exception as e:  # noqa: BLE001 - a bad file is recorded, the watcher keeps running
+        return WatchResult(name, str(out_dir), digest, f"{type(e).__name__}: {e}")
+    return WatchResult(name, str(out_dir), digest)
+
+
+class Watcher:
+    """
+    Incremental renderer for a folder that exam files (``*.json``) are dropped into.
+
+    Each ``poll`` lists the folder and submits the files that are new or
+    changed to a background process pool; results are recorded in a
+    ``WatchIndex`` (``out_root/.watch_index.sqlite``) as they complete, so a
+    restarted watcher resumes without rendering unchanged files again.
+
+    Changes are debounced: a file is only picked up once its size and mtime
+    have not changed for ``debounce_s`` seconds, so a file still being
+    written, or rewritten several times in a burst, is rendered once. A file
+    whose mtime changed but whose content hash did not is not rendered again,
+    nor is one still being rendered. Once a file is known to be up to date,
+    later polls only ``stat`` it until its size or mtime changes; outputs
+    deleted while the watcher runs are noticed on its next start. Reports of ``<name>.json`` go to
+    ``out_root/<name>/``; deleting a file removes its index entry but keeps
+    its reports.
+
+    Args:
+        watch_dir: Folder to watch (not recursive).
+        out_root: Root of the per-file output directories and of the index.
+        template_dir: Directory containing ``report_template.html``.
+        workers: Render processes (default: ``os.cpu_count()``).
+        output_format: "pdf" (default) or "html".
+        debounce_s: Quiet period before a new or modified file is rendered.
+        clock: Monotonic clock (tests pass a fake one).
+    """
+
+    def __init__(
+        self,
+        watch_dir: Path,
+        out_root: Path,
+        template_dir: Path,
+        workers: Optional[int] = None,
+        output_format: str = "pdf",
+        debounce_s: float = 2.0,
+        clock: Callable[[], float] = time.monotonic,
+    ) -> None:
+        self.watch_dir = Path(watch_dir)
+        self.out_root = Path(out_root)
+        self.template_dir = Path(template_dir)
+        self.output_format = output_format
+        self.debounce_s = debounce_s
+        self._clock = clock
+        self._artifacts = FORMATS[output_format]
+        self.index = WatchIndex(self.out_root / INDEX_NAME)
+        self._pool = ProcessPoolExecutor(max_workers=max(1, workers or os.cpu_count() or 1))
+        # name -> ((size, mtime_ns), first seen with that signature)
+        self._seen: Dict[str, Tuple[Tuple[int, int], float]] = {}
+        # name -> signature at which the file is known to be rendered (or to have failed)
+        self._settled: Dict[str, Tuple[int, int]] = {}
+        self._reconciled = False
+        # name -> (future, signature at submission)
+        self._pending: Dict[str, Tuple["Future[WatchResult]", Tuple[int, int]]] = {}
+        self.rendered = 0
+        self.failed = 0
+        self.unchanged = 0
+
+    def close(self) -> None:
+        """Wait for renders in flight, record them and shut the pool down."""
+        self.collect(wait=True)
+        self._pool.shutdown()
+        self.index.close()
+
+    def __enter__(self) -> "Watcher":
+        return self
+
+    def __exit__(self, *exc: Any) -> None:
+        self.close()
+
+    def out_dir_for(self, name: str) -> Path:
+        stem = name[: -len(".json")] if name.endswith(".json") else name
+        return self.out_root / (_UNSAFE_CHARS.sub("_", stem) or "_")
+
+    def _outputs_exist(self, entry: IndexEntry) -> bool:
+        if entry.error is not None:
+            return True  # a failed file has nothing to keep up to date
+        out_dir = Path(entry.out_dir)
+        return all((out_dir / n).exists() for n in self._artifacts)
+
+    def poll(self) -> int:
+        """Scan the folder once and submit new or changed files; returns how many were submitted."""
+        now = self._clock()
+        present = set()
+        submitted = 0
+        for entry in os.scandir(self.watch_dir):
+            if not entry.name.endswith(".json") or not entry.is_file():
+                continue
+            name = entry.name
+            present.add(name)
+            try:
+                st = entry.stat()
+            except FileNotFoundError:
+                continue
+            signature = (st.st_size, st.st_mtime_ns)
+            seen = self._seen.get(name)
+            if seen is None or seen[0] != signature:
+                self._seen[name] = seen = (signature, now)
+            if now - seen[1] < self.debounce_s or name in self._pending or self._settled.get(name) == signature:
+                continue
+            if self._needs_render(name, Path(entry.path), signature):
+                self._pending[name] = (
+                    self._pool.submit(render_file, Path(entry.path), self.out_dir_for(name),
+                                      self.template_dir, self.output_format),
+                    signature,
+                )
+                submitted += 1
+        gone = set(self._seen) - present
+        for name in gone:
+            del self._seen[name]
+            self._settled.pop(name, None)
+        if not self._reconciled:
+            # Files deleted while no watcher was running.
+            gone = set(self.index.names()) - present
+            self._reconciled = True
+        for name in gone - set(self._pending):
+            self.index.forget(name)
+        return submitted
+
+    def _needs_render(self, name: str, path: Path, signature: Tuple[int, int]) -> bool:
+        indexed = self.index.get(name)
+        if indexed is None:
+            return True
+        if (indexed.size, indexed.mtime_ns) == signature and self._outputs_exist(indexed):
+            self._settled[name] = signature
+            return False
+        try:
+            digest = file_sha256(path)
+        except OSError:
+            return False  # vanished since the scan; the next poll forgets it
+        if digest == indexed.sha256 and self._outputs_exist(indexed):
+            self.index.touch(name, *signature)
+            self._settled[name] = signature
+            self.unchanged += 1
+            return False
+        return True
+
+    def collect(self, wait: bool = False) -> List[WatchResult]:
+        """Record finished renders in the index (all in-flight ones with ``wait``)."""
+        results = []
+        for name, (future, signature) in list(self._pending.items()):
+            if not wait and not future.done():
+                continue
+            del self._pending[name]
+            try:
+                result = future.result()
+            except Exception as e:  # noqa: BLE001 - e.g. a worker process died
+                result = WatchResult(name, str(self.out_dir_for(name)), None, f"{type(e).__name__}: {e}")
+            if result.sha256 is not None:
+                # The signature seen before rendering: if the file changed meanwhile,
+                # the next poll sees a new mtime and compares the hash again.
+                self.index.record(name, *signature, result.sha256, result.out_dir, result.error)
+                self._settled[name] = signature
+            if result.ok:
+                self.rendered += 1
+            else:
+                self.failed += 1
+            results.append(result)
+        return results
+
+    @property
+    def pending(self) -> int:
+        return len(self._pending)
+
+    def run(
+        self,
+        interval_s: float = 1.0,
+        stop: Optional[threading.Event] = None,
+        once: bool = False,
+        log: Optional[TextIO] = sys.stderr,
+    ) -> None:
+        """
+        Poll every ``interval_s`` seconds until ``stop`` is set (or Ctrl-C).
+
+        With ``once``, process what is in the folder now (no debounce) and return.
+        """
+        if once:
+            self.debounce_s = 0.0
+        stop = stop or threading.Event()
+        try:
+            while True:
+                self.poll()
+                for result in self.collect(wait=once):
+                    if log is not None:
+                        status = "ok" if result.ok else f"FAILED {result.error}"
+                        print(f"[watch] {result.name}: {status} -> {result.out_dir}", file=log)
+                if once or stop.wait(interval_s):
+                    break
+        except KeyboardInterrupt:
+            pass
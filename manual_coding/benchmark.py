@@ -0,0 +1,231 @@
+"""
+Benchmark of every report stage at several cohort sizes
+
+    python benchmark.py --sizes 1 1000 100000 --out bench.json
+    python benchmark.py --baseline bench.json --threshold 0.2   (exit 1 on regressions)
+
+stages: load (patient_reader), interpret (interpret_vitals + classify_risk),
+interpret_batch (rule table on columns), interpret_columnar (rule table on the memory mapped
+columns of a cohort_file, converted untimed), html (build_report_model + generate_html_report)
+and pdf (PdfEngine), every case runs in a fresh process so its peak RSS is its own
+"""
+from __future__ import annotations
+import argparse
+import json
+import multiprocessing
+import os
+import platform
+import resource
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+ROOT = Path(__file__).parent
+sys.path[:0] = [str(ROOT / "src"), str(ROOT / "data")]
+
+from data_generator import write_shard  # noqa: E402
+from patient_reader import iter_records  # noqa: E402
+
+STAGES = ("load", "interpret", "interpret_batch", "interpret_columnar", "html", "pdf")
+DEFAULT_SIZES = (1, 1000, 100_000)
+SEED = 20240601
+TIMESTAMP = "2025-01-01T00:00:00Z"
+TEMPLATE = ROOT / "src" / "report_template.html"
+
+
+def percentile(sorted_values: list[float], q: float):
+    """nearest rank percentile (q in 0..100) of a sorted list"""
+    if not sorted_values:
+        return float("nan")
+    rank = max(1, -(-len(sorted_values) * q // 100))
+    return sorted_values[int(min(rank, len(sorted_values))) - 1]
+
+
+def peak_rss_mb():
+    """peak resident memory of this process in MiB"""
+    # VmHWM belongs to this process, ru_maxrss can carry the parent's peak across exec
+    try:
+        with open("/proc/self/status", encoding="ascii") as f:
+            for line in f:
+                if line.startswith("VmHWM:"):
+                    return int(line.split()[1]) / 1024
+    except OSError:
+        pass
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak / 1024 if sys.platform != "darwin" else peak / (1024 * 1024)
+
+
+def _time_each(items, fn):
+    latencies = []
+    clock = time.perf_counter
+    for item in items:
+        t0 = clock()
+        fn(item)
+        latencies.append(clock() - t0)
+    return latencies
+
+
+def run_case(stage: str, cohort: Path, size: int, pdf_limit: int | None = None):
+    """times one stage over the cohort file, loading its input is not timed"""
+    patients = [] if stage == "load" else [r.data for r in iter_records(cohort) if r.data is not None]
+    t0 = time.perf_counter()
+    if stage == "load":
+        it = iter_records(cohort)
+        latencies = _time_each(range(size), lambda _: next(it))
+    elif stage == "interpret":
+        from interpreter import classify_risk, interpret_vitals
+
+        latencies = _time_each(patients, lambda p: classify_risk(interpret_vitals(p)))
+    elif stage == "interpret_batch":
+        from interpreter import DEFAULT_ENGINE, vitals_to_columns
+
+        latencies = _time_each([patients], lambda ps: DEFAULT_ENGINE.evaluate_batch(vitals_to_columns(ps)).risk_levels())
+    elif stage == "interpret_columnar":
+        from cohort_file import CohortFile, write_cohort_file
+        from interpreter import DEFAULT_ENGINE
+
+        columnar = cohort.with_name(cohort.name + ".cols")
+        write_cohort_file(patients, columnar)
+
+        def evaluate(path):
+            with CohortFile(path) as cohort_file:
+                return DEFAULT_ENGINE.evaluate_batch(cohort_file.columns).risk_levels()
+
+        t0 = time.perf_counter()
+        latencies = _time_each([columnar], evaluate)
+    elif stage == "html":
+        from interpreter import classify_risk, interpret_vitals
+        from report_generator import build_report_model, generate_html_report
+
+        def html(p):
+            findings = interpret_vitals(p)
+            return generate_html_report(build_report_model(p, findings, classify_risk(findings)), TEMPLATE)
+
+        latencies = _time_each(patients, html)
+    elif stage == "pdf":
+        from interpreter import classify_risk, interpret_vitals
+        from report_generator import PdfEngine, build_report_model, generate_html_report
+
+        engine = PdfEngine(TEMPLATE)
+        patients = patients[:pdf_limit]
+        htmls = []
+        for p in patients:
+            findings = interpret_vitals(p)
+            htmls.append(generate_html_report(build_report_model(p, findings, classify_risk(findings)), TEMPLATE))
+        t0 = time.perf_counter()
+        latencies = _time_each(htmls, lambda h: engine.write_pdf(h, base_url=str(TEMPLATE.parent)))
+    else:
+        raise ValueError(f"unknown stage {stage!r}")
+    total = time.perf_counter() - t0
+
+    processed = len(patients) if stage == "pdf" else size
+    lat = sorted(latencies)
+    per_record = len(lat) == processed
+    return {
+        "stage": stage,
+        "records": size,
+        "processed": processed,
+        "total_s": round(total, 6),
+        "throughput_per_s": round(processed / total, 2) if total > 0 else None,
+        "p50_ms": round(percentile(lat, 50) * 1000, 4) if per_record else None,
+        "p99_ms": round(percentile(lat, 99) * 1000, 4) if per_record else None,
+        "peak_rss_mb": round(peak_rss_mb(), 1),
+    }
+
+
+def _case_worker(args):
+    stage, cohort, size, pdf_limit = args
+    try:
+        return run_case(stage, cohort, size, pdf_limit)
+    except ImportError as e:
+        return {"stage": stage, "records": size, "skipped": f"{type(e).__name__}: {e}"}
+
+
+def run_suite(sizes=DEFAULT_SIZES, stages=STAGES, pdf_limit: int | None = 200,
+              work_dir: Path | None = None, isolate: bool = True):
+    """
+    runs every (stage, size) case, each in its own spawned process unless isolate is False
+
+    Returns: {"meta": ..., "results": [...]}, stages with missing dependencies are "skipped"
+    """
+    results = []
+    with tempfile.TemporaryDirectory(dir=work_dir) as tmp:
+        ctx = multiprocessing.get_context("spawn")
+        for size in sizes:
+            cohort = Path(tmp) / f"cohort-{size}.jsonl"
+            write_shard(cohort, 0, size, seed=SEED, timestamp=TIMESTAMP)
+            for stage in stages:
+                args = (stage, cohort, size, pdf_limit)
+                if isolate:
+                    with ctx.Pool(1) as pool:
+                        results.append(pool.apply(_case_worker, (args,)))
+                else:
+                    results.append(_case_worker(args))
+    return {
+        "meta": {
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "cpu_count": os.cpu_count(),
+            "seed": SEED,
+            "pdf_limit": pdf_limit,
+            "created": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        },
+        "results": results,
+    }
+
+
+def compare(current: dict, baseline: dict, threshold: float):
+    """
+    regressions against a baseline, throughput down or p99 up by more than threshold (0.2 = 20%)
+    """
+    base = {(r["stage"], r["records"]): r for r in baseline.get("results", []) if "skipped" not in r}
+    problems = []
+    for row in current.get("results", []):
+        old = base.get((row["stage"], row["records"]))
+        if old is None or "skipped" in row:
+            continue
+        name = f"{row['stage']}@{row['records']}"
+        if old.get("throughput_per_s") and row.get("throughput_per_s") is not None:
+            if row["throughput_per_s"] < old["throughput_per_s"] * (1 - threshold):
+                problems.append(f"{name}: throughput {row['throughput_per_s']}/s < baseline {old['throughput_per_s']}/s")
+        # p99 of fewer than 100 samples is only the slowest sample, too noisy to gate on
+        if old.get("p99_ms") and row.get("p99_ms") is not None and row.get("processed", 0) >= 100:
+            if row["p99_ms"] > old["p99_ms"] * (1 + threshold):
+                problems.append(f"{name}: p99 {row['p99_ms']} ms > baseline {old['p99_ms']} ms")
+    return problems
+
+
+def main():
+    parser = argparse.ArgumentParser(description="benchmark of the report stages")
+    parser.add_argument("--sizes", type=int, nargs="+", default=list(DEFAULT_SIZES))
+    parser.add_argument("--stages", nargs="+", choices=STAGES, default=list(STAGES))
+    parser.add_argument("--pdf-limit", type=int, default=200, help="documents per size in the pdf stage")
+    parser.add_argument("--out", default="bench.json")
+    parser.add_argument("--baseline", default=None, help="earlier results to compare against")
+    parser.add_argument("--threshold", type=float, default=0.2)
+    args = parser.parse_args()
+
+    report = run_suite(args.sizes, args.stages, args.pdf_limit)
+    Path(args.out).write_text(json.dumps(report, indent=2), encoding="utf-8")
+    print(f"{'stage':<16}{'records':>9}{'records/s':>14}{'p50 ms':>11}{'p99 ms':>11}{'RSS MB':>10}")
+    for r in report["results"]:
+        if "skipped" in r:
+            print(f"{r['stage']:<16}{r['records']:>9}  skipped ({r['skipped']})")
+            continue
+        p50 = "-" if r["p50_ms"] is None else f"{r['p50_ms']:.3f}"
+        p99 = "-" if r["p99_ms"] is None else f"{r['p99_ms']:.3f}"
+        print(f"{r['stage']:<16}{r['records']:>9}{r['throughput_per_s'] or 0:>14.1f}{p50:>11}{p99:>11}"
+              f"{r['peak_rss_mb']:>10.1f}")
+    print(f"Wrote: {args.out}")
+
+    if args.baseline:
+        problems = compare(report, json.loads(Path(args.baseline).read_text(encoding="utf-8")), args.threshold)
+        for p in problems:
+            print(f"REGRESSION {p}")
+        if problems:
+            raise SystemExit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,49 +1,143 @@
 """Data generation module for patient"""
 from pathlib import Path
-import json, random, datetime
+from concurrent.futures import ProcessPoolExecutor
+import argparse, gzip, json, os, random, datetime
 
-def one_record():
+# records are drawn in blocks, block b is seeded from (seed, b) only so every
+# record depends on the seed and its index and not on sharding or workers
+BLOCK = 65536
+SEXES = ("female", "male", "other", "unknown")
+
+def one_record(rng=random, patient_id="12345"):
     """Generates mock data for the patient"""
     def bounded(v,lo,hi):
         return max(lo, min(hi,v))
 
-    cca_psv = random.uniform(50,150)
-    ica_psv = bounded(cca_psv * random.uniform(0.9,2.5), 20, 300)
-    eca_psv = random.uniform(40,200)
+    cca_psv = rng.uniform(50,150)
+    ica_psv = bounded(cca_psv * rng.uniform(0.9,2.5), 20, 300)
+    eca_psv = rng.uniform(40,200)
 
     patient_data ={
-        "patient_id": "12345",
+        "patient_id": patient_id,
         "name": "adam cook",
         "timestamp": datetime.datetime.utcnow().isoformat() + "Z",
-        "context": {"age_years": random.randint(18,90),
-                    "sex": random.choice(["female", "male", "other", "unknown"]),
+        "context": {"age_years": rng.randint(18,90),
+                    "sex": rng.choice(SEXES),
                     "notes": "Mock record"},
         "vitals": {
             "CCA": {
-                "psv_cm_s": round(cca_psv,1), 
-                "edv_cm_s": round(random.uniform(10,35),1), 
-                "imt_mm": round(random.uniform(0.6,1.2),2)
+                "psv_cm_s": round(cca_psv,1),
+                "edv_cm_s": round(rng.uniform(10,35),1),
+                "imt_mm": round(rng.uniform(0.6,1.2),2)
                 },
 
             "ICA":{
-                "psv_cm_s": round(ica_psv,1), 
-                "edv_cm_s": round(random.uniform(12,35),1), 
-                "imt_mm": round(random.uniform(0.6,1.4),2)
+                "psv_cm_s": round(ica_psv,1),
+                "edv_cm_s": round(rng.uniform(12,35),1),
+                "imt_mm": round(rng.uniform(0.6,1.4),2)
                 },
 
             "ECA": {
-                "psv_cm_s": round(eca_psv,1), 
-                "edv_cm_s": round(random.uniform(8,35),1), 
+                "psv_cm_s": round(eca_psv,1),
+                "edv_cm_s": round(rng.uniform(8,35),1),
                     },
             "ica_cca_ratio": round(ica_psv/cca_psv,2)
         }
     }
     return patient_data
 
+def block_records(seed, block, lo, hi, timestamp):
+    """
+    records lo:hi of a block with all vitals drawn at once with numpy
+
+    same distributions as one_record, ids are P000000000, P000000001, ...
+    """
+    import numpy as np
+
+    rng = np.random.default_rng(np.random.SeedSequence(seed, spawn_key=(block,)))
+    n = BLOCK
+    cca_psv = rng.uniform(50, 150, n)
+    ica_psv = np.clip(cca_psv * rng.uniform(0.9, 2.5, n), 20, 300)
+    eca_psv = rng.uniform(40, 200, n)
+    cols = {
+        "cca_psv": np.round(cca_psv, 1), "cca_edv": np.round(rng.uniform(10, 35, n), 1),
+        "cca_imt": np.round(rng.uniform(0.6, 1.2, n), 2),
+        "ica_psv": np.round(ica_psv, 1), "ica_edv": np.round(rng.uniform(12, 35, n), 1),
+        "ica_imt": np.round(rng.uniform(0.6, 1.4, n), 2),
+        "eca_psv": np.round(eca_psv, 1), "eca_edv": np.round(rng.uniform(8, 35, n), 1),
+        "ratio": np.round(ica_psv / cca_psv, 2),
+        "age": rng.integers(18, 91, n), "sex": np.array(SEXES)[rng.integers(0, len(SEXES), n)],
+    }
+    cols = {k: v[lo:hi].tolist() for k, v in cols.items()}
+    first = block * BLOCK + lo
+    for j in range(hi - lo):
+        yield {
+            "patient_id": f"P{first + j:09d}",
+            "name": "adam cook",
+            "timestamp": timestamp,
+            "context": {"age_years": cols["age"][j], "sex": cols["sex"][j], "notes": "Mock record"},
+            "vitals": {
+                "CCA": {"psv_cm_s": cols["cca_psv"][j], "edv_cm_s": cols["cca_edv"][j], "imt_mm": cols["cca_imt"][j]},
+                "ICA": {"psv_cm_s": cols["ica_psv"][j], "edv_cm_s": cols["ica_edv"][j], "imt_mm": cols["ica_imt"][j]},
+                "ECA": {"psv_cm_s": cols["eca_psv"][j], "edv_cm_s": cols["eca_edv"][j]},
+                "ica_cca_ratio": cols["ratio"][j],
+            },
+        }
+
+def records(start, stop, seed=0, timestamp=None):
+    """yields records start:stop block by block, memory stays bounded"""
+    timestamp = timestamp or datetime.datetime.utcnow().isoformat() + "Z"
+    i = start
+    while i < stop:
+        block, lo = divmod(i, BLOCK)
+        hi = min(BLOCK, lo + stop - i)
+        yield from block_records(seed, block, lo, hi, timestamp)
+        i += hi - lo
+
+def write_shard(path, start, stop, seed=0, timestamp=None):
+    """writes records start:stop as json lines, gzipped if path ends with .gz"""
+    path = Path(path)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    opener = gzip.open if path.suffix == ".gz" else open
+    with opener(path, "wt", encoding="utf-8") as f:
+        f.writelines(json.dumps(r) + "\n" for r in records(start, stop, seed, timestamp))
+    return stop - start
+
+def bulk(count, out_dir, shards=None, workers=None, seed=0, compress=False, timestamp=None):
+    """
+    writes count records with unique ids to sharded json lines files using worker processes
+
+    Returns: list of shard paths, the records are the same for any number of workers
+    """
+    workers = max(1, workers or os.cpu_count() or 1)
+    shards = max(1, min(shards or workers, count or 1))
+    timestamp = timestamp or datetime.datetime.utcnow().isoformat() + "Z"
+    bounds = [count * k // shards for k in range(shards + 1)]
+    suffix = ".jsonl.gz" if compress else ".jsonl"
+    paths = [Path(out_dir) / f"patients-{k:05d}-of-{shards:05d}{suffix}" for k in range(shards)]
+    jobs = [(p, bounds[k], bounds[k + 1], seed, timestamp) for k, p in enumerate(paths)]
+    if workers == 1 or shards == 1:
+        for job in jobs:
+            write_shard(*job)
+    else:
+        with ProcessPoolExecutor(max_workers=min(workers, shards)) as pool:
+            list(pool.map(write_shard, *zip(*jobs)))
+    return paths
+
 def main(out = "mock_patient.json"):
     Path(out).parent.mkdir(parents=True, exist_ok=True)
     with open(out,"w", encoding="utf-8") as f:
         json.dump(one_record(),f, indent=2)
 if __name__ == "__main__":
-    main()
-    
\ No newline at end of file
+    parser = argparse.ArgumentParser(description="mock patient data")
+    parser.add_argument("--count", type=int, default=None, help="bulk mode, number of patients")
+    parser.add_argument("--out", default=None, help="output file (single) or directory (bulk)")
+    parser.add_argument("--shards", type=int, default=None)
+    parser.add_argument("--workers", type=int, default=None)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--gzip", action="store_true")
+    args = parser.parse_args()
+    if args.count is None:
+        main(args.out or "mock_patient.json")
+    else:
+        bulk(args.count, args.out or "bulk", args.shards, args.workers, args.seed, args.gzip)
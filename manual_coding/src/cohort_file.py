@@ -0,0 +1,245 @@
+"""Columnar cohort file, converted once and memory mapped by every later analysis run"""
+from __future__ import annotations
+
+import hashlib
+import json
+import mmap
+import os
+import struct
+import tempfile
+from datetime import datetime, timezone
+from functools import lru_cache
+from itertools import islice
+from pathlib import Path
+
+MAGIC = b"CARDCOL1"
+VERSION = 1
+VESSELS = ("CCA", "ICA", "ECA")
+METRICS = ("psv_cm_s", "edv_cm_s", "imt_mm")
+# float columns in file order, keyed like interpreter.vitals_to_columns and CohortStats
+KEYS = [(v, m) for v in VESSELS for m in METRICS] + [(None, "ica_cca_ratio")]
+NO_TIME = -(1 << 63)
+NO_NAME = (1 << 32) - 1
+CHUNK = 8192
+_ALIGN = 64
+_HEAD = struct.Struct("<8sQ")
+_EPOCH = datetime(1970, 1, 1, tzinfo=timezone.utc)
+
+
+def _align(n: int):
+    return -(-n // _ALIGN) * _ALIGN
+
+
+@lru_cache(maxsize=4096)
+def parse_time(value):
+    """microseconds since 1970 of an iso date or date time (naive is utc), NO_TIME if it is none"""
+    if not isinstance(value, str):
+        return NO_TIME
+    try:
+        dt = datetime.fromisoformat(value)
+    except ValueError:
+        return NO_TIME
+    if dt.tzinfo is None:
+        dt = dt.replace(tzinfo=timezone.utc)
+    return (dt - _EPOCH) // datetime.resolution
+
+
+def id_hash(raw: bytes):
+    """stable 64 bit hash of a utf-8 patient id, the key of the id index"""
+    return int.from_bytes(hashlib.blake2b(raw, digest_size=8).digest(), "little")
+
+
+def _number(value):
+    return float(value) if isinstance(value, (int, float)) and not isinstance(value, bool) else float("nan")
+
+
+def is_cohort_file(path: Path):
+    try:
+        with Path(path).open("rb") as f:
+            return f.read(len(MAGIC)) == MAGIC
+    except OSError:
+        return False
+
+
+def write_cohort_file(patients, path: Path):
+    """
+    converts patients once into a columnar file for CohortFile, returns how many
+
+    after a json header come 64 byte aligned sections: a float64 column per KEYS entry (NaN for
+    missing values and anything that is not a number), the patient ids (utf-8 and offsets) with
+    an index sorted by id hash, int64 timestamps (NO_TIME if missing) with an index sorted by
+    time and the names as codes into a table of the distinct names. Patients are read in chunks
+    and spooled to temporary files next to path, memory grows only with the name table and
+    the indexes sorted at the end (16 bytes a patient)
+    """
+    import numpy as np
+
+    path = Path(path)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    names: dict[str, int] = {}
+    n = 0
+    with tempfile.TemporaryDirectory(prefix=".cohort-", dir=path.parent) as tmp:
+        spool = {name: (Path(tmp) / name).open("wb") for name in
+                 [f"column{i}" for i in range(len(KEYS))] + ["id_lengths", "id_bytes", "id_hash", "timestamp", "name"]}
+        try:
+            it = iter(patients)
+            while chunk := list(islice(it, CHUNK)):
+                vitals = [p.get("vitals") if isinstance(p.get("vitals"), dict) else {} for p in chunk]
+                for i, (vessel, metric) in enumerate(KEYS):
+                    column = [_number(v.get(metric)) if vessel is None else
+                              _number(v[vessel].get(metric)) if isinstance(v.get(vessel), dict) else float("nan")
+                              for v in vitals]
+                    spool[f"column{i}"].write(np.array(column, dtype=np.float64).tobytes())
+                ids = ["" if p.get("patient_id") is None else str(p.get("patient_id")) for p in chunk]
+                ids = [i.encode("utf-8") for i in ids]
+                spool["id_lengths"].write(np.array([len(i) for i in ids], dtype=np.uint64).tobytes())
+                spool["id_bytes"].write(b"".join(ids))
+                spool["id_hash"].write(np.array([id_hash(i) for i in ids], dtype=np.uint64).tobytes())
+                spool["timestamp"].write(np.array([parse_time(p.get("timestamp")) for p in chunk],
+                                                  dtype=np.int64).tobytes())
+                codes = [names.setdefault(p["name"], len(names)) if isinstance(p.get("name"), str) else NO_NAME
+                         for p in chunk]
+                spool["name"].write(np.array(codes, dtype=np.uint32).tobytes())
+                n += len(chunk)
+        finally:
+            for f in spool.values():
+                f.close()
+
+        def spooled(name, dtype):
+            return np.fromfile(Path(tmp) / name, dtype=dtype)
+
+        id_offsets = np.zeros(n + 1, dtype=np.uint64)
+        np.cumsum(spooled("id_lengths", np.uint64), out=id_offsets[1:])
+        hashes = spooled("id_hash", np.uint64)
+        by_id = np.argsort(hashes, kind="stable")
+        times = spooled("timestamp", np.int64)
+        by_time = np.argsort(times, kind="stable")
+        strings = [s.encode("utf-8") for s in names]
+        string_offsets = np.zeros(len(strings) + 1, dtype=np.uint64)
+        np.cumsum([len(s) for s in strings], out=string_offsets[1:])
+        # (name, dtype, shape, spooled files or data)
+        sections = [
+            ("columns", "<f8", (len(KEYS), n), [Path(tmp) / f"column{i}" for i in range(len(KEYS))]),
+            ("id_offsets", "<u8", id_offsets.shape, id_offsets),
+            ("id_bytes", "|u1", (int(id_offsets[-1]),), [Path(tmp) / "id_bytes"]),
+            ("id_hash", "<u8", (n,), hashes[by_id]),
+            ("by_id", "<i8", (n,), by_id),
+            ("timestamp", "<i8", (n,), times),
+            ("time_sorted", "<i8", (n,), times[by_time]),
+            ("by_time", "<i8", (n,), by_time),
+            ("name", "<u4", (n,), [Path(tmp) / "name"]),
+            ("string_offsets", "<u8", string_offsets.shape, string_offsets),
+            ("string_bytes", "|u1", (int(string_offsets[-1]),), b"".join(strings)),
+        ]
+        layout, offset = {}, 0
+        for name, dtype, shape, _ in sections:
+            layout[name] = {"offset": offset, "dtype": dtype, "shape": list(shape)}
+            offset = _align(offset + int(np.prod(shape, dtype=np.int64)) * np.dtype(dtype).itemsize)
+        header = json.dumps({"version": VERSION, "patients": n, "sections": layout}).encode("utf-8")
+
+        partial = path.with_name(path.name + ".tmp")
+        with partial.open("wb") as f:
+            f.write(_HEAD.pack(MAGIC, len(header)) + header)
+            start = _align(f.tell())
+            for name, _, _, source in sections:
+                f.write(b"\0" * (start + layout[name]["offset"] - f.tell()))
+                if isinstance(source, list):
+                    for part in source:
+                        with part.open("rb") as src:
+                            while block := src.read(1 << 20):
+                                f.write(block)
+                else:
+                    f.write(source if isinstance(source, bytes) else source.tobytes())
+            f.write(b"\0" * (start + offset - f.tell()))
+        os.replace(partial, path)
+    return n
+
+
+class CohortFile:
+    """
+    read only memory map of a write_cohort_file file
+
+    opening reads the header only, columns are numpy views of the mapped pages (no object per
+    patient) keyed like KEYS, so they go straight into RuleEngine.evaluate_batch and
+    CohortStats.add_columns, processes opening the same file share its pages
+    """
+    def __init__(self, path: Path):
+        import numpy as np
+
+        self.path = Path(path)
+        with self.path.open("rb") as f:
+            magic, header_len = _HEAD.unpack(f.read(_HEAD.size))
+            if magic != MAGIC:
+                raise ValueError(f"{path} is not a columnar cohort file")
+            header = json.loads(f.read(header_len))
+            if header["version"] != VERSION:
+                raise ValueError(f"{path}: unsupported cohort file version {header['version']}")
+            self._mmap = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        start = _align(_HEAD.size + header_len)
+        data = np.frombuffer(self._mmap, dtype=np.uint8)
+        self.sections = {}
+        for name, s in header["sections"].items():
+            dtype = np.dtype(s["dtype"])
+            begin = start + s["offset"]
+            size = int(np.prod(s["shape"], dtype=np.int64)) * dtype.itemsize
+            self.sections[name] = data[begin:begin + size].view(dtype).reshape(s["shape"])
+        self.patients = header["patients"]
+        self.columns = dict(zip(KEYS, self.sections["columns"]))
+        self.timestamp = self.sections["timestamp"]
+
+    def __len__(self):
+        return self.patients
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def close(self):
+        """drops the views and unmaps the file, it stays mapped while views handed out are alive"""
+        self.sections, self.columns, self.timestamp = {}, {}, None
+        try:
+            self._mmap.close()
+        except BufferError:
+            pass
+
+    def select(self, rows):
+        """the columns of some rows (copies of just those rows)"""
+        return {key: column[rows] for key, column in self.columns.items()}
+
+    def patient_id(self, row: int):
+        begin, end = self.sections["id_offsets"][row:row + 2].tolist()
+        return self.sections["id_bytes"][begin:end].tobytes().decode("utf-8")
+
+    def name(self, row: int):
+        code = int(self.sections["name"][row])
+        if code == NO_NAME:
+            return None
+        begin, end = self.sections["string_offsets"][code:code + 2].tolist()
+        return self.sections["string_bytes"][begin:end].tobytes().decode("utf-8")
+
+    def rows_for(self, patient_id: str):
+        """rows of a patient in file order, binary search of the id index"""
+        import numpy as np
+
+        hashes = self.sections["id_hash"]
+        key = np.uint64(id_hash(patient_id.encode("utf-8")))
+        lo, hi = np.searchsorted(hashes, key, "left"), np.searchsorted(hashes, key, "right")
+        # another id with the same hash is told apart by the id itself
+        return np.array([r for r in self.sections["by_id"][lo:hi].tolist() if self.patient_id(r) == patient_id],
+                        dtype=np.int64)
+
+    def rows_between(self, since: str | None = None, until: str | None = None):
+        """rows with a timestamp from since to until (inclusive iso dates or date times) in time order"""
+        import numpy as np
+
+        bounds = []
+        for value, default in ((since, NO_TIME + 1), (until, (1 << 63) - 1)):
+            stamp = default if value is None else parse_time(value)
+            if stamp == NO_TIME:
+                raise ValueError(f"invalid iso date {value!r}")
+            bounds.append(np.int64(stamp))
+        times = self.sections["time_sorted"]
+        lo, hi = np.searchsorted(times, bounds[0], "left"), np.searchsorted(times, bounds[1], "right")
+        return self.sections["by_time"][lo:hi]
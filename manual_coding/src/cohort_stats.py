@@ -0,0 +1,185 @@
+"""One pass cohort statistics per vessel and metric with mergeable partial states"""
+from __future__ import annotations
+import math
+from itertools import islice
+
+VESSELS = ("CCA", "ICA", "ECA")
+METRICS = ("psv_cm_s", "edv_cm_s", "imt_mm")
+QUANTILES = (0.05, 0.25, 0.5, 0.75, 0.95, 0.99)
+CHUNK = 8192
+
+
+class Moments:
+    """
+    count, min, max, mean and squared deviations of a stream (welford), partial results of
+    other chunks or workers are combined with chan's formula, so the split does not matter
+    """
+    def __init__(self, count=0, mean=0.0, m2=0.0, lo=math.inf, hi=-math.inf):
+        self.count, self.mean, self.m2, self.min, self.max = count, mean, m2, lo, hi
+
+    def add(self, x: float):
+        self.count += 1
+        delta = x - self.mean
+        self.mean += delta / self.count
+        self.m2 += delta * (x - self.mean)
+        self.min = min(self.min, x)
+        self.max = max(self.max, x)
+
+    def add_array(self, values):
+        """adds a numpy array of finite values"""
+        if values.size:
+            mean = float(values.mean())
+            self.merge(Moments(int(values.size), mean, float(((values - mean) ** 2).sum()),
+                               float(values.min()), float(values.max())))
+
+    def merge(self, other: Moments):
+        if other.count == 0:
+            return
+        n = self.count + other.count
+        delta = other.mean - self.mean
+        self.mean += delta * other.count / n
+        self.m2 += other.m2 + delta * delta * self.count * other.count / n
+        self.count = n
+        self.min = min(self.min, other.min)
+        self.max = max(self.max, other.max)
+
+    def std(self):
+        """sample standard deviation, None below two values"""
+        return math.sqrt(self.m2 / (self.count - 1)) if self.count > 1 else None
+
+
+class Sketch:
+    """
+    quantile sketch with relative accuracy, value x > 0 is counted in bucket ceil(log_gamma(x))
+    with gamma = (1 + a) / (1 - a), so every estimate is within a of the true quantile
+
+    merging adds the bucket counts, the result is the sketch of both streams together, memory
+    depends on the range of the values (about log(max / min) / 2a buckets), not their count
+    """
+    def __init__(self, accuracy: float = 0.01):
+        self.accuracy = accuracy
+        self.gamma = (1 + accuracy) / (1 - accuracy)
+        self.buckets: dict[int, int] = {}
+        self.zeros = 0  # zero and negative values, the vitals are never below zero
+        self.count = 0
+
+    def add_array(self, values):
+        import numpy as np
+
+        self.count += int(values.size)
+        positive = values[values > 0]
+        self.zeros += int(values.size - positive.size)
+        if positive.size:
+            keys, counts = np.unique(np.ceil(np.log(positive) / math.log(self.gamma)), return_counts=True)
+            for key, n in zip(keys.astype(np.int64).tolist(), counts.tolist()):
+                self.buckets[key] = self.buckets.get(key, 0) + n
+
+    def merge(self, other: Sketch):
+        if other.accuracy != self.accuracy:
+            raise ValueError("sketches with different accuracy cannot be merged")
+        for key, n in other.buckets.items():
+            self.buckets[key] = self.buckets.get(key, 0) + n
+        self.zeros += other.zeros
+        self.count += other.count
+
+    def quantile(self, q: float):
+        """estimate of the q quantile, None when empty"""
+        if self.count == 0:
+            return None
+        rank = q * (self.count - 1)
+        seen = self.zeros
+        if seen > rank:
+            return 0.0
+        for key in sorted(self.buckets):
+            seen += self.buckets[key]
+            if seen > rank:
+                return 2 * self.gamma ** key / (self.gamma + 1)
+        return 2 * self.gamma ** max(self.buckets) / (self.gamma + 1)
+
+
+class CohortStats:
+    """
+    statistics of every vessel metric and the ica_cca_ratio in one pass over the patients,
+    with constant memory per metric, cohorts split over workers are merged with merge()
+    """
+    def __init__(self, accuracy: float = 0.01):
+        self.accuracy = accuracy
+        self.patients = 0
+        self.keys = [(v, m) for v in VESSELS for m in METRICS] + [(None, "ica_cca_ratio")]
+        self.moments = {key: Moments() for key in self.keys}
+        self.sketches = {key: Sketch(accuracy) for key in self.keys}
+
+    def add_many(self, patients):
+        import numpy as np
+
+        it = iter(patients)
+        while chunk := list(islice(it, CHUNK)):
+            self.patients += len(chunk)
+            if all(hasattr(p, "POSITIONS") for p in chunk):
+                self._add_records(chunk)
+                continue
+            chunk = [p.to_dict() if hasattr(p, "POSITIONS") else p for p in chunk]
+            for vessel, metric in self.keys:
+                column = []
+                for patient in chunk:
+                    vitals = patient.get("vitals") or {}
+                    source = vitals if vessel is None else vitals.get(vessel)
+                    value = source.get(metric) if isinstance(source, dict) else None
+                    if isinstance(value, (int, float)) and not isinstance(value, bool):
+                        column.append(value)
+                values = np.array(column, dtype=np.float64)
+                values = values[np.isfinite(values)]
+                self.moments[(vessel, metric)].add_array(values)
+                self.sketches[(vessel, metric)].add_array(values)
+        return self
+
+    def _add_records(self, records):
+        """PatientRecords keep NaN for missing values, their arrays are copied into one table"""
+        import numpy as np
+
+        table = np.frombuffer(b"".join([r.values.tobytes() for r in records]), dtype=np.float64)
+        table = table.reshape(len(records), -1)
+        positions = records[0].POSITIONS
+        self._add_table({key: table[:, positions[key]] for key in self.keys})
+
+    def add_columns(self, columns: dict):
+        """
+        adds float columns keyed like self.keys with NaN for missing values (a CohortFile's
+        columns), a chunk at a time so only CHUNK values per metric are copied at once
+        """
+        patients = len(columns[self.keys[-1]])
+        self.patients += patients
+        for start in range(0, patients, CHUNK):
+            self._add_table({key: columns[key][start:start + CHUNK] for key in self.keys})
+        return self
+
+    def _add_table(self, table: dict):
+        import numpy as np
+
+        for key in self.keys:
+            values = table[key]
+            values = values[np.isfinite(values)]
+            self.moments[key].add_array(values)
+            self.sketches[key].add_array(values)
+
+    def merge(self, other: CohortStats):
+        self.patients += other.patients
+        for key in self.keys:
+            self.moments[key].merge(other.moments[key])
+            self.sketches[key].merge(other.sketches[key])
+        return self
+
+    def summary(self, quantiles=QUANTILES):
+        """one row per metric with count, min, max, mean, std and the quantile estimates"""
+        rows = []
+        for vessel, metric in self.keys:
+            m, sketch = self.moments[(vessel, metric)], self.sketches[(vessel, metric)]
+            row = {"vessel": vessel or "", "metric": metric, "count": m.count}
+            if m.count:
+                # a bucket value can lie just outside the exact extremes
+                row.update(min=m.min, max=m.max, mean=m.mean, std=m.std(),
+                           quantiles={f"p{q * 100:g}": min(m.max, max(m.min, sketch.quantile(q)))
+                                      for q in quantiles})
+            rows.append(row)
+        return {"patients": self.patients, "accuracy": self.accuracy,
+                "quantile_names": [f"p{q * 100:g}" for q in quantiles], "rows": rows}
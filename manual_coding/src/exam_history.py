@@ -0,0 +1,157 @@
+"""Exams of every patient by patient id, with running trend aggregates updated per exam"""
+from __future__ import annotations
+import json
+import sqlite3
+from pathlib import Path
+
+# (vessel, metric, label), vessel None is a field of vitals itself
+METRICS = (
+    ("CCA", "psv_cm_s", "CCA PSV (cm/s)"), ("CCA", "edv_cm_s", "CCA EDV (cm/s)"), ("CCA", "imt_mm", "CCA IMT (mm)"),
+    ("ICA", "psv_cm_s", "ICA PSV (cm/s)"), ("ICA", "edv_cm_s", "ICA EDV (cm/s)"), ("ICA", "imt_mm", "ICA IMT (mm)"),
+    ("ECA", "psv_cm_s", "ECA PSV (cm/s)"), ("ECA", "edv_cm_s", "ECA EDV (cm/s)"), ("ECA", "imt_mm", "ECA IMT (mm)"),
+    (None, "ica_cca_ratio", "ICA/CCA Ratio"),
+)
+WINDOW = 5
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS exams (patient_id TEXT NOT NULL, timestamp TEXT NOT NULL, metrics TEXT NOT NULL,
+    PRIMARY KEY (patient_id, timestamp)) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS trends (patient_id TEXT PRIMARY KEY, exams INTEGER NOT NULL, first TEXT NOT NULL,
+    last TEXT NOT NULL, window INTEGER NOT NULL, state TEXT NOT NULL);
+"""
+
+
+def exam_metrics(patient: dict):
+    """the METRICS values of one exam, None where missing or not a number"""
+    vitals = patient.get("vitals") if isinstance(patient.get("vitals"), dict) else {}
+    values = []
+    for vessel, metric, _ in METRICS:
+        source = vitals if vessel is None else vitals.get(vessel)
+        value = source.get(metric) if isinstance(source, dict) else None
+        values.append(value if type(value) in (int, float) else None)  # bools are not measurements
+    return values
+
+
+def advance(state: list, values: list, window: int):
+    """folds one exam into the state, [latest, previous, last window values] per metric, a fixed amount of work"""
+    for metric, value in zip(state, values):
+        if value is None:
+            continue
+        metric[1], metric[0] = metric[0], value
+        metric[2].append(value)
+        if len(metric[2]) > window:
+            del metric[2][0]
+
+
+def empty_state():
+    return [[None, None, []] for _ in METRICS]
+
+
+def trend_model(patient_id: str, exams: int, first: str, last: str, window: int, state: list):
+    """the trend section of a report model"""
+    metrics = []
+    for (_, _, label), (latest, previous, recent) in zip(METRICS, state):
+        if latest is None:
+            continue
+        metrics.append({"metric": label, "latest": latest,
+                        "change": None if previous is None else round(latest - previous, 4),
+                        "mean": round(sum(recent) / len(recent), 4)})
+    return {"patient_id": patient_id, "exams": exams, "first": first, "last": last, "window": window,
+            "metrics": metrics}
+
+
+class ExamHistory:
+    """
+    every exam of every patient, one per patient and timestamp, with the trend aggregates of each
+    patient next to them: per metric the latest value, the change from the previous exam and the
+    mean of the last window exams
+
+    append() updates the aggregates from the stored state only, never reads the earlier exams, so an
+    exam costs the same however long the history is. an exam older than the patient's latest, or at
+    the same timestamp (it replaces that one), replays the patient's exams instead and gets the trend
+    as of its own timestamp
+    """
+    def __init__(self, path: Path, window: int = WINDOW, commit_every: int = 1000):
+        self.path = Path(path)
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self.window = window  # of a new file, an existing one keeps its own
+        self.commit_every = max(1, commit_every)
+        self._pending = 0
+        self._db = sqlite3.connect(str(self.path), timeout=30)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("PRAGMA synchronous=NORMAL")
+        self._db.executescript(SCHEMA)
+
+    def close(self):
+        self._db.commit()
+        self._db.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def __len__(self):
+        return self._db.execute("SELECT COUNT(*) FROM exams").fetchone()[0]
+
+    def append(self, patient: dict):
+        """stores one exam, returns the patient's trend including it, None without a patient_id"""
+        pid = patient.get("patient_id")
+        if pid is None or pid == "":
+            return None
+        pid = str(pid)
+        timestamp = "" if patient.get("timestamp") is None else str(patient.get("timestamp"))
+        values = exam_metrics(patient)
+        row = self._db.execute("SELECT exams, first, last, window, state FROM trends WHERE patient_id = ?",
+                               (pid,)).fetchone()
+        self._db.execute("INSERT OR REPLACE INTO exams VALUES (?, ?, ?)", (pid, timestamp, json.dumps(values)))
+        if row is None or timestamp > row[2]:
+            exams, first, _, window, state = row or (0, timestamp, None, self.window, None)
+            state = empty_state() if state is None else json.loads(state)
+            advance(state, values, window)
+            self._save(pid, exams + 1, first, timestamp, window, state)
+            trend = trend_model(pid, exams + 1, first, timestamp, window, state)
+        else:
+            window = row[3]
+            trend = trend_model(pid, *self._replay(pid, window, timestamp))
+            self._save(pid, *self._replay(pid, window))
+        self._pending += 1
+        if self._pending >= self.commit_every:
+            self.commit()
+        return trend
+
+    def _save(self, pid: str, exams: int, first: str, last: str, window: int, state: list):
+        self._db.execute("INSERT OR REPLACE INTO trends VALUES (?, ?, ?, ?, ?, ?)",
+                         (pid, exams, first, last, window, json.dumps(state)))
+
+    def _replay(self, pid: str, window: int, until: str | None = None):
+        """(exams, first, last, window, state) of the patient's exams up to until, in timestamp order"""
+        sql, params = "SELECT timestamp, metrics FROM exams WHERE patient_id = ?", [pid]
+        if until is not None:
+            sql += " AND timestamp <= ?"
+            params.append(until)
+        exams, first, last, state = 0, "", "", empty_state()
+        for timestamp, metrics in self._db.execute(sql + " ORDER BY timestamp", params):
+            advance(state, json.loads(metrics), window)
+            first = first if exams else timestamp
+            exams, last = exams + 1, timestamp
+        return exams, first, last, window, state
+
+    def commit(self):
+        self._db.commit()
+        self._pending = 0
+
+    def trend(self, patient_id: str):
+        """the patient's current trend, None for an unknown patient"""
+        row = self._db.execute("SELECT exams, first, last, window, state FROM trends WHERE patient_id = ?",
+                               (str(patient_id),)).fetchone()
+        if row is None:
+            return None
+        exams, first, last, window, state = row
+        return trend_model(str(patient_id), exams, first, last, window, json.loads(state))
+
+    def exams(self, patient_id: str):
+        """(timestamp, metric values) of the patient's exams, oldest first"""
+        rows = self._db.execute("SELECT timestamp, metrics FROM exams WHERE patient_id = ? ORDER BY timestamp",
+                                (str(patient_id),))
+        return [(timestamp, json.loads(metrics)) for timestamp, metrics in rows]
@@ -0,0 +1,193 @@
+"""Per stage timing and memory instrumentation"""
+from __future__ import annotations
+
+import cProfile
+import json
+import os
+import sys
+import time
+import tracemalloc
+from contextlib import contextmanager, nullcontext
+from pathlib import Path
+from typing import Any, ContextManager, Iterator
+
+ENV_METRICS = "REPORT_METRICS"
+ENV_TRACEMALLOC = "REPORT_METRICS_TRACEMALLOC"
+ENV_PROFILE_DIR = "REPORT_PROFILE_DIR"
+
+_NULL_SPAN: ContextManager[None] = nullcontext()
+
+
+def current_rss_bytes() -> int | None:
+    """resident memory of this process in bytes, None if unknown"""
+    try:
+        import psutil
+    except ImportError:
+        pass
+    else:
+        return int(psutil.Process().memory_info().rss)
+    try:
+        with open("/proc/self/statm", "r", encoding="ascii") as f:
+            pages = int(f.read().split()[1])
+        return pages * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError, IndexError, AttributeError):
+        return None
+
+
+class Metrics:
+    """
+    timing spans for the report stages
+
+    span(stage) is a shared no op when disabled, when enabled every span appends one json
+    line to path with wall and cpu time, allocated block delta, rss and (trace_malloc)
+    the tracemalloc peak, lines are written unbuffered with O_APPEND
+
+    with profile_dir every stage runs under cProfile and close() writes
+    <profile_dir>/<stage>.<pid>.prof, nested spans pause the outer profiler
+
+    Args: path of the json lines file (None disables), trace_malloc, profile_dir
+    """
+
+    def __init__(
+        self,
+        path: Path | None = None,
+        trace_malloc: bool = False,
+        profile_dir: Path | None = None,
+    ) -> None:
+        self.path = Path(path) if path is not None else None
+        self.trace_malloc = trace_malloc
+        self.profile_dir = Path(profile_dir) if profile_dir is not None else None
+        self.enabled = self.path is not None or self.profile_dir is not None
+        self._fd: int | None = None
+        self._fd_pid: int | None = None
+        self._profiles: dict[str, cProfile.Profile] = {}
+        self._active: list[cProfile.Profile] = []
+        if self.trace_malloc and self.enabled and not tracemalloc.is_tracing():
+            tracemalloc.start()
+
+    @classmethod
+    def from_env(cls):
+        """settings from REPORT_METRICS, REPORT_METRICS_TRACEMALLOC and REPORT_PROFILE_DIR"""
+        return cls(
+            path=os.environ.get(ENV_METRICS) or None,
+            trace_malloc=os.environ.get(ENV_TRACEMALLOC, "") not in ("", "0"),
+            profile_dir=os.environ.get(ENV_PROFILE_DIR) or None,
+        )
+
+    def span(self, stage: str, **fields: Any) -> ContextManager[None]:
+        """context manager measuring stage, fields are added to its metrics line"""
+        if not self.enabled:
+            return _NULL_SPAN
+        return self._span(stage, fields)
+
+    @contextmanager
+    def _span(self, stage: str, fields: dict[str, Any]) -> Iterator[None]:
+        profile = None
+        if self.profile_dir is not None:
+            profile = self._profiles.setdefault(stage, cProfile.Profile())
+            if self._active:
+                self._active[-1].disable()
+            self._active.append(profile)
+        if self.trace_malloc:
+            tracemalloc.reset_peak()
+            traced_before = tracemalloc.get_traced_memory()[0]
+        blocks = sys.getallocatedblocks()
+        cpu = time.process_time()
+        t0 = time.perf_counter()
+        error = None
+        if profile is not None:
+            profile.enable()
+        try:
+            yield
+        except BaseException as e:
+            error = type(e).__name__
+            raise
+        finally:
+            if profile is not None:
+                profile.disable()
+                self._active.pop()
+                if self._active:
+                    self._active[-1].enable()
+            record: dict[str, Any] = {
+                "ts": round(time.time(), 6),
+                "pid": os.getpid(),
+                "stage": stage,
+                "wall_ms": round((time.perf_counter() - t0) * 1000, 4),
+                "cpu_ms": round((time.process_time() - cpu) * 1000, 4),
+                "alloc_blocks": sys.getallocatedblocks() - blocks,
+            }
+            rss = current_rss_bytes()
+            if rss is not None:
+                record["rss_mb"] = round(rss / (1024 * 1024), 1)
+            if self.trace_malloc:
+                current, peak = tracemalloc.get_traced_memory()
+                record["traced_kb"] = round((current - traced_before) / 1024, 1)
+                record["traced_peak_kb"] = round((peak - traced_before) / 1024, 1)
+            if error is not None:
+                record["error"] = error
+            record.update(fields)
+            self._emit(record)
+
+    def _emit(self, record: dict[str, Any]) -> None:
+        if self.path is None:
+            return
+        pid = os.getpid()
+        if self._fd is None or self._fd_pid != pid:
+            # a forked process opens its own descriptor
+            self.path.parent.mkdir(parents=True, exist_ok=True)
+            self._fd = os.open(self.path, os.O_WRONLY | os.O_CREAT | os.O_APPEND, 0o644)
+            self._fd_pid = pid
+        os.write(self._fd, (json.dumps(record, default=str) + "\n").encode("utf-8"))
+
+    def close(self) -> None:
+        """writes the cProfile dumps and closes the metrics file"""
+        if self.profile_dir is not None and self._profiles:
+            self.profile_dir.mkdir(parents=True, exist_ok=True)
+            for stage, profile in self._profiles.items():
+                profile.dump_stats(str(self.profile_dir / f"{stage}.{os.getpid()}.prof"))
+            self._profiles.clear()
+        if self._fd is not None and self._fd_pid == os.getpid():
+            os.close(self._fd)
+        self._fd = None
+
+
+_metrics: Metrics | None = None
+
+
+def metrics() -> Metrics:
+    """process wide instrumentation, configured from the environment on first use"""
+    global _metrics
+    if _metrics is None:
+        _metrics = Metrics.from_env()
+    return _metrics
+
+
+def configure(
+    path: Path | None = None,
+    trace_malloc: bool = False,
+    profile_dir: Path | None = None,
+) -> Metrics:
+    """replaces the process wide instrumentation and exports the settings to the environment"""
+    global _metrics
+    if _metrics is not None:
+        _metrics.close()
+    for name, value in ((ENV_METRICS, path), (ENV_PROFILE_DIR, profile_dir)):
+        if value is None:
+            os.environ.pop(name, None)
+        else:
+            os.environ[name] = str(value)
+    os.environ[ENV_TRACEMALLOC] = "1" if trace_malloc else "0"
+    _metrics = Metrics(path, trace_malloc, profile_dir)
+    return _metrics
+
+
+def reset() -> None:
+    """forgets the process wide instance, the next use reads the environment again"""
+    global _metrics
+    _metrics = None
+
+
+def span(stage: str, **fields: Any) -> ContextManager[None]:
+    """metrics().span(stage, **fields)"""
+    m = _metrics if _metrics is not None else metrics()
+    return m.span(stage, **fields)
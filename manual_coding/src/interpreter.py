@@ -1,71 +1,235 @@
 """Interpreter module for patient vitals analysis"""
+from __future__ import annotations
+import operator
+from dataclasses import dataclass
+from enum import IntEnum
+
+
+class Severity(IntEnum):
+    """severity of a finding, higher is worse"""
+    NORMAL = 0
+    MILD = 1
+    ELEVATED = 2
+    MODERATE = 3
+    SEVERE = 4
+
+
+@dataclass(frozen=True)
+class Rule:
+    """
+    one threshold rule, vessel None means a top level vitals value (ica_cca_ratio)
+
+    rules with the same vessel and metric are checked in table order and only the
+    first match gives a finding
+    """
+    vessel: str | None
+    metric: str
+    comparator: str
+    cutoff: float
+    severity: Severity
+    message: str
+
+
+RULES: tuple[Rule, ...] = (
+    Rule("ICA", "psv_cm_s", ">", 200, Severity.SEVERE, "Severe ICA PSV, stenosis (>70%)"),
+    Rule("ICA", "psv_cm_s", ">", 125, Severity.MODERATE, "Moderate ICA PSV, stenosis (50-69%)"),
+    Rule("ICA", "edv_cm_s", ">", 100, Severity.SEVERE, "Severe ICA EDV (>100 cm/s)"),
+    Rule("ICA", "edv_cm_s", ">", 40, Severity.MODERATE, "Moderate ICA EDV (40-100 cm/s)"),
+    Rule("ICA", "imt_mm", ">=", 1.1, Severity.ELEVATED, "Elevated ICA IMT (>1.0 mm)"),
+    Rule("CCA", "psv_cm_s", ">", 125, Severity.ELEVATED, "Elevated CCA PSV (>125 cm/s)"),
+    Rule("CCA", "edv_cm_s", ">", 40, Severity.ELEVATED, "Elevated CCA EDV (>40 cm/s)"),
+    Rule("CCA", "imt_mm", ">=", 1.0, Severity.ELEVATED, "Elevated CCA IMT (>1.0 mm)"),
+    Rule("ECA", "psv_cm_s", ">", 150, Severity.ELEVATED, "Elevated ECA PSV (>150 cm/s)"),
+    Rule("ECA", "edv_cm_s", ">", 40, Severity.ELEVATED, "Elevated ECA EDV (>40 cm/s)"),
+    Rule(None, "ica_cca_ratio", ">", 4.0, Severity.SEVERE, "Severe ICA/CCA suggests stenosis (>70%)."),
+    Rule(None, "ica_cca_ratio", ">", 2.0, Severity.ELEVATED, "Elevated ICA/CCA suggest stenosis (>50%)."),
+    Rule(None, "ica_cca_ratio", ">", 1.5, Severity.MILD, "Mildly elevated ICA/CCA ratio."),
+)
+
+COMPARATORS = {">": operator.gt, ">=": operator.ge, "<": operator.lt, "<=": operator.le}
+
+
+@dataclass(frozen=True)
+class Finding:
+    """a finding produced by a rule"""
+    message: str
+    severity: Severity
+
+
+class RuleEngine:
+    """
+    compiled rule table
+
+    rules are grouped once per (vessel, metric) with their comparator functions
+    resolved, evaluate() works on one patient dict and evaluate_batch() on
+    columns of a whole cohort
+    """
+    def __init__(self, rules: tuple[Rule, ...] = RULES):
+        self.rules = tuple(rules)
+        self.groups: list[tuple[str | None, str, list[tuple]]] = []
+        index: dict[tuple[str | None, str], int] = {}
+        for i, rule in enumerate(self.rules):
+            if rule.comparator not in COMPARATORS:
+                raise ValueError(f"unknown comparator {rule.comparator!r}")
+            key = (rule.vessel, rule.metric)
+            if key not in index:
+                index[key] = len(self.groups)
+                self.groups.append((rule.vessel, rule.metric, []))
+            self.groups[index[key]][2].append(
+                (COMPARATORS[rule.comparator], rule.cutoff, i, Finding(rule.message, rule.severity)))
+        self.severity_of = {rule.message: rule.severity for rule in self.rules}
+
+    def evaluate(self, patient: dict):
+        """
+        returns findings for one patient, a missing or zero value gives no finding
+
+        patient is a dict or a PatientRecord, whose values are read from its array by position
+        """
+        positions = getattr(patient, "POSITIONS", None)
+        if positions is not None:
+            return self._evaluate_values(patient.values, positions)
+        vitals = patient.get("vitals") or {}
+        findings = []
+        for vessel, metric, checks in self.groups:
+            source = vitals if vessel is None else (vitals.get(vessel) or {})
+            value = source.get(metric)
+            if not value:
+                continue
+            for compare, cutoff, _, finding in checks:
+                if compare(value, cutoff):
+                    findings.append(finding)
+                    break
+        return findings
+
+    def _evaluate_values(self, values, positions: dict):
+        findings = []
+        for vessel, metric, checks in self.groups:
+            pos = positions.get((vessel, metric))
+            if pos is None:
+                continue
+            value = values[pos]
+            if not value or value != value:
+                continue
+            for compare, cutoff, _, finding in checks:
+                if compare(value, cutoff):
+                    findings.append(finding)
+                    break
+        return findings
+
+    def evaluate_batch(self, columns: dict):
+        """
+        evaluates the whole table on column arrays at once
+
+        Args: columns keyed by (vessel, metric) with equal length arrays, NaN is missing
+
+        Returns: BatchFindings with the matched rule index per group (-1 is none)
+        """
+        import numpy as np
+
+        n = len(next(iter(columns.values()))) if columns else 0
+        matched = np.full((n, len(self.groups)), -1, dtype=np.int16)
+        for g, (vessel, metric, checks) in enumerate(self.groups):
+            values = columns.get((vessel, metric))
+            if values is None:
+                continue
+            values = np.asarray(values, dtype=np.float64)
+            present = ~np.isnan(values) & (values != 0)
+            with np.errstate(invalid="ignore"):
+                for compare, cutoff, i, _ in reversed(checks):
+                    hit = present & compare(values, cutoff)
+                    matched[:, g] = np.where(hit, i, matched[:, g])
+        return BatchFindings(self, matched)
+
+
+class BatchFindings:
+    """findings of a whole cohort as arrays"""
+    def __init__(self, engine: RuleEngine, matched):
+        import numpy as np
+
+        self.engine = engine
+        self.matched = matched
+        codes = np.array([int(r.severity) for r in engine.rules] + [int(Severity.NORMAL)], dtype=np.int8)
+        # index -1 maps to the trailing NORMAL entry
+        self.severity = codes[matched].max(axis=1) if matched.shape[1] else np.zeros(len(matched), dtype=np.int8)
+
+    def __len__(self):
+        return len(self.matched)
+
+    def findings(self, i: int):
+        """findings of patient i, in the same order as interpret_vitals"""
+        return [self.engine.rules[r].message for r in self.matched[i] if r >= 0]
+
+    def risk_levels(self):
+        """risk level of every patient"""
+        return [risk_from_severity(s) for s in self.severity.tolist()]
+
+
+def vitals_to_columns(patients: list[dict], engine: RuleEngine | None = None):
+    """builds the (vessel, metric) columns used by evaluate_batch from patient dicts or PatientRecords"""
+    import numpy as np
+
+    engine = engine or DEFAULT_ENGINE
+    if patients and all(hasattr(p, "POSITIONS") for p in patients):
+        # records: one copy of all value arrays, the columns are views
+        table = np.frombuffer(b"".join([p.values.tobytes() for p in patients]), dtype=np.float64)
+        table = table.reshape(len(patients), -1)
+        positions = patients[0].POSITIONS
+        return {(vessel, metric): table[:, positions[(vessel, metric)]] if (vessel, metric) in positions
+                else np.full(len(patients), np.nan) for vessel, metric, _ in engine.groups}
+    patients = [p.to_dict() if hasattr(p, "POSITIONS") else p for p in patients]
+    columns = {}
+    for vessel, metric, _ in engine.groups:
+        column = []
+        for patient in patients:
+            vitals = patient.get("vitals") or {}
+            source = vitals if vessel is None else (vitals.get(vessel) or {})
+            value = source.get(metric)
+            column.append(value if isinstance(value, (int, float)) else np.nan)
+        columns[(vessel, metric)] = np.array(column, dtype=np.float64)
+    return columns
+
+
+DEFAULT_ENGINE = RuleEngine()
+
+
 def interpret_vitals(patient:dict):
     """
-    Interprets patient vitals 
-    
+    Interprets patient vitals
+
     Args: Json with patient data
 
     Returns list of findings
     """
-    
-    findings = []
-    vitals = patient.get("vitals")
-
-    cca = vitals.get("CCA")
-    ica = vitals.get("ICA")
-    eca = vitals.get("ECA")
-    ratio = vitals.get("ica_cca_ratio")
-    
-    ica_psv = ica.get("psv_cm_s")
-    if ica_psv:
-        if ica_psv > 200:
-            findings.append("Severe ICA PSV, stenosis (>70%)")
-        elif ica_psv > 125:
-            findings.append("Moderate ICA PSV, stenosis (50-69%)")
-
-    ica_edv = ica.get("edv_cm_s")
-    if ica_edv:
-        if ica_edv > 100:
-            findings.append("Severe ICA EDV (>100 cm/s)")
-        elif ica_edv > 40:
-            findings.append("Moderate ICA EDV (40-100 cm/s)")
-    ica_imt = ica.get("imt_mm")
-    if ica_imt:
-        if ica_imt >= 1.1:
-            findings.append("Elevated ICA IMT (>1.0 mm)")
-    
-    cca_psv = cca.get("psv_cm_s")
-    if cca_psv:
-        if cca_psv > 125:
-            findings.append("Elevated CCA PSV (>125 cm/s)")
-
-    cca_edv = cca.get("edv_cm_s")
-    if cca_edv:
-        if cca_edv > 40:
-            findings.append("Elevated CCA EDV (>40 cm/s)")
-    cca_imt = cca.get("imt_mm")
-    if cca_imt:
-        if cca_imt >= 1.0:
-            findings.append("Elevated CCA IMT (>1.0 mm)")
-
-    eca_psv = eca.get("psv_cm_s")
-    if eca_psv:
-        if eca_psv > 150:
-            findings.append("Elevated ECA PSV (>150 cm/s)")
-    eca_edv = eca.get("edv_cm_s")
-    if eca_edv:
-        if eca_edv > 40:
-            findings.append("Elevated ECA EDV (>40 cm/s)")
-    
-    if ratio:
-        if ratio > 4.0:
-            findings.append("Severe ICA/CCA suggests stenosis (>70%).")
-        elif ratio > 2.0:
-            findings.append("Elevated ICA/CCA suggest stenosis (>50%).")
-        elif ratio > 1.5:
-            findings.append("Mildly elevated ICA/CCA ratio.")
-
-    return findings
+    return [finding.message for finding in DEFAULT_ENGINE.evaluate(patient)]
+
+
+def risk_from_severity(severity: int):
+    """maps the highest severity to a risk level"""
+    if severity >= Severity.SEVERE:
+        return "High"
+    if severity >= Severity.MILD:
+        return "Moderate"
+    return "Normal"
+
+
+def classify_severity(findings: list[Finding]):
+    """risk level from structured findings, max over severity codes"""
+    return risk_from_severity(max((f.severity for f in findings), default=Severity.NORMAL))
+
+
+def _severity_from_text(finding: str):
+    """keyword fallback for findings that do not come from the rule table"""
+    text = finding.lower()
+    if "severe" in text:
+        return Severity.SEVERE
+    if "moderate" in text:
+        return Severity.MODERATE
+    if "elevated" in text:
+        return Severity.ELEVATED
+    if "mildly" in text:
+        return Severity.MILD
+    return Severity.NORMAL
+
 
 def classify_risk(findings:list[str]):
     """
@@ -76,12 +240,7 @@ def classify_risk(findings:list[str]):
     Returns: risk level
 
     """
-    text = " ".join(findings).lower()
-    if "severe" in text:
-        return "High"
-    if "moderate" in text or "elevated" in text or "mildly" in text:
-        return "Moderate"
-    return "Normal"
-
-
-
+    severity_of = DEFAULT_ENGINE.severity_of
+    return risk_from_severity(max(
+        (severity_of[f] if f in severity_of else _severity_from_text(f) for f in findings),
+        default=Severity.NORMAL))
@@ -0,0 +1,198 @@
+"""Resumable cohort rendering, shards of patients leased to workers from a sqlite queue"""
+from __future__ import annotations
+import json
+import multiprocessing
+import os
+import socket
+import sqlite3
+import time
+from pathlib import Path
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT NOT NULL);
+CREATE TABLE IF NOT EXISTS shards (id INTEGER PRIMARY KEY, size INTEGER NOT NULL, state TEXT NOT NULL DEFAULT 'pending',
+    owner TEXT, lease_until REAL, attempts INTEGER NOT NULL DEFAULT 0, error TEXT);
+CREATE TABLE IF NOT EXISTS patients (shard INTEGER NOT NULL, idx INTEGER PRIMARY KEY, data TEXT NOT NULL,
+    done INTEGER NOT NULL DEFAULT 0, output TEXT, error TEXT);
+CREATE INDEX IF NOT EXISTS patients_shard ON patients (shard, done);
+"""
+
+
+def worker_id():
+    return f"{socket.gethostname()}:{os.getpid()}"
+
+
+class JobQueue:
+    """
+    a cohort split into shards of shard_size patients, a worker leases a whole shard, renders its
+    patients and marks every one done in the transaction that also extends its lease (checkpoint),
+    so a crashed run resumes at the next patient, and a worker that stops checkpointing for lease_s
+    seconds loses the shard to the next claim. a shard leased max_attempts times without finishing
+    is given up as failed
+
+    the queue is one sqlite file, workers on other hosts can share it over a network drive (no wal,
+    it needs shared memory), claims and checkpoints are short BEGIN IMMEDIATE transactions
+    """
+    def __init__(self, path: Path, lease_s: float = 300.0, max_attempts: int = 3):
+        self.path = Path(path)
+        self.lease_s = lease_s
+        self.max_attempts = max_attempts
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self._db = sqlite3.connect(str(self.path), timeout=60, isolation_level=None)
+        self._db.execute("PRAGMA journal_mode=PERSIST")
+        self._db.execute("PRAGMA synchronous=NORMAL")
+        self._db.executescript(SCHEMA)
+
+    def close(self):
+        self._db.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    @property
+    def ready(self):
+        return self.meta().get("ready") == "1"
+
+    def meta(self):
+        return dict(self._db.execute("SELECT key, value FROM meta"))
+
+    def fill(self, patients, shard_size: int = 1000, **meta):
+        """stores the patients in shards once, a queue already filled is left as it is, returns the patient count"""
+        if self.ready:
+            return self._db.execute("SELECT COUNT(*) FROM patients").fetchone()[0]
+        self._db.execute("BEGIN IMMEDIATE")
+        try:
+            self._db.execute("DELETE FROM patients")
+            self._db.execute("DELETE FROM shards")
+            count = 0
+            for count, patient in enumerate(patients, 1):
+                self._db.execute("INSERT INTO patients (shard, idx, data) VALUES (?, ?, ?)",
+                                 ((count - 1) // shard_size + 1, count - 1, json.dumps(patient)))
+            self._db.execute("INSERT INTO shards (id, size) SELECT shard, COUNT(*) FROM patients GROUP BY shard")
+            self._db.executemany("INSERT OR REPLACE INTO meta VALUES (?, ?)",
+                                 [(k, str(v)) for k, v in meta.items()] + [("ready", "1")])
+        except BaseException:
+            self._db.execute("ROLLBACK")
+            raise
+        self._db.execute("COMMIT")
+        return count
+
+    def claim(self, owner: str, now: float | None = None):
+        """leases the next pending or expired shard to owner, returns its id or None"""
+        now = time.time() if now is None else now
+        self._db.execute("BEGIN IMMEDIATE")
+        try:
+            for shard, attempts in self._db.execute(
+                    "SELECT id, attempts FROM shards WHERE state = 'pending' OR (state = 'leased' AND lease_until < ?)"
+                    " ORDER BY id", (now,)).fetchall():
+                if attempts < self.max_attempts:
+                    self._db.execute("UPDATE shards SET state = 'leased', owner = ?, lease_until = ?,"
+                                     " attempts = attempts + 1 WHERE id = ?", (owner, now + self.lease_s, shard))
+                    return shard
+                self._db.execute("UPDATE shards SET state = 'failed', owner = NULL, error = ? WHERE id = ?",
+                                 (f"given up after {attempts} attempts", shard))
+            return None
+        finally:
+            self._db.execute("COMMIT")
+
+    def pending(self, shard: int):
+        """(idx, patient) of the shard not done yet"""
+        rows = self._db.execute("SELECT idx, data FROM patients WHERE shard = ? AND done = 0 ORDER BY idx", (shard,))
+        return [(idx, json.loads(data)) for idx, data in rows.fetchall()]
+
+    def checkpoint(self, shard: int, owner: str, idx: int, output: str | None = None, error: str | None = None,
+                   now: float | None = None):
+        """marks a patient done and extends the lease, False when owner lost the shard (nothing is marked)"""
+        now = time.time() if now is None else now
+        self._db.execute("BEGIN IMMEDIATE")
+        try:
+            leased = self._db.execute("UPDATE shards SET lease_until = ? WHERE id = ? AND owner = ? AND state = 'leased'",
+                                      (now + self.lease_s, shard, owner)).rowcount
+            if leased:
+                self._db.execute("UPDATE patients SET done = 1, output = ?, error = ? WHERE idx = ?", (output, error, idx))
+            return bool(leased)
+        finally:
+            self._db.execute("COMMIT")
+
+    def complete(self, shard: int, owner: str):
+        """marks the shard done, False when owner lost it"""
+        return bool(self._db.execute("UPDATE shards SET state = 'done', owner = NULL WHERE id = ? AND owner = ?"
+                                     " AND state = 'leased'", (shard, owner)).rowcount)
+
+    def release(self, owner: str):
+        """returns the shards of a worker known to be dead to the queue, how many"""
+        return self._db.execute("UPDATE shards SET state = 'pending', owner = NULL WHERE owner = ? AND state = 'leased'",
+                                (owner,)).rowcount
+
+    def next_expiry(self):
+        """when the first lease of another worker runs out, None without leases"""
+        return self._db.execute("SELECT MIN(lease_until) FROM shards WHERE state = 'leased'").fetchone()[0]
+
+    def status(self):
+        shards = dict(self._db.execute("SELECT state, COUNT(*) FROM shards GROUP BY state"))
+        patients, done, failed = self._db.execute(
+            "SELECT COUNT(*), COALESCE(SUM(done), 0), COUNT(error) FROM patients").fetchone()
+        return {"shards": shards, "patients": patients, "done": done, "failed": failed,
+                "finished": set(shards) <= {"done", "failed"}}
+
+    def failures(self):
+        """(shard or patient, error) of everything that failed"""
+        rows = self._db.execute("SELECT 'shard ' || id, error FROM shards WHERE state = 'failed' UNION ALL"
+                                " SELECT 'patient ' || idx, error FROM patients WHERE error IS NOT NULL")
+        return rows.fetchall()
+
+
+def work(queue_path: Path, render, lease_s: float = 300.0, max_attempts: int = 3, wait: bool = True,
+         poll_s: float = 1.0):
+    """
+    one worker: claims shards until the queue is finished and renders their patients with
+    render(idx, patient) -> output path, an exception fails only that patient. with wait it also
+    waits for the leases of other workers, to take over their shards if they die. returns how
+    many patients it rendered
+    """
+    owner = worker_id()
+    rendered = 0
+    with JobQueue(queue_path, lease_s, max_attempts) as queue:
+        while True:
+            shard = queue.claim(owner)
+            if shard is None:
+                expiry = queue.next_expiry()
+                if not wait or expiry is None:
+                    return rendered
+                time.sleep(min(poll_s, max(0.0, expiry - time.time())))
+                continue
+            for idx, patient in queue.pending(shard):
+                try:
+                    output, error = str(render(idx, patient)), None
+                except Exception as e:  # one broken patient must not stop the shard
+                    output, error = None, f"{type(e).__name__}: {e}"
+                if not queue.checkpoint(shard, owner, idx, output, error):
+                    break  # the lease ran out and another worker has the shard
+                rendered += error is None
+            else:
+                queue.complete(shard, owner)
+
+
+def run_workers(queue_path: Path, render, workers: int = 1, lease_s: float = 300.0, max_attempts: int = 3):
+    """
+    runs work in worker processes until the queue is finished, render must be picklable, returns
+    the status. the processes do not wait for leases, the parent hands back the shards of those
+    that died (oom, kill) at once and then waits out the leases of other hosts itself
+    """
+    if workers > 1:
+        processes = [multiprocessing.Process(target=work, args=(queue_path, render, lease_s, max_attempts, False))
+                     for _ in range(workers)]
+        for process in processes:
+            process.start()
+        for process in processes:
+            process.join()
+        with JobQueue(queue_path) as queue:
+            for process in processes:
+                if process.exitcode:
+                    queue.release(f"{socket.gethostname()}:{process.pid}")
+    work(queue_path, render, lease_s, max_attempts)
+    with JobQueue(queue_path) as queue:
+        return queue.status()
@@ -1,30 +1,506 @@
 
+import argparse
+import asyncio
+import contextlib
+import functools
 import json
+import os
 from pathlib import Path
-from report_generator import build_report_model, generate_html_report, save_pdf
+from report_generator import (build_report_model, generate_html_report, save_cohort_report,
+                              save_cohort_summary, save_pdf)
 from interpreter import interpret_vitals, classify_risk
+from patient_reader import iter_records, load_patient, write_packed
+from patient_store import PatientStore, parse_condition
+from cohort_stats import CohortStats
+from cohort_file import CohortFile, is_cohort_file, write_cohort_file
+from watch_folder import FolderWatcher
+from render_cache import RenderCache
+from record_validator import Quarantine, validate_record
+from report_service import ReportService
+from job_queue import JobQueue, run_workers
+from exam_history import ExamHistory
+from pipeline import Pipeline, Stage, parse_stage
+from native_pdf import ENV_BACKEND, draw_report, pdf_backend, save_native_pdf
+import instrument
+from instrument import span
 
 
 def load_patient_data(file_path: Path):
-    """Loads patient data from Json"""
-    with open(file_path, 'r') as f:
-        return json.load(f)
+    """Loads patient data from Json (plain or gzipped)"""
+    return load_patient(file_path)
 
-def main():
+def iter_patient_data(file_path: Path, quarantine: Quarantine | None = None):
+    """
+    Yields patients of a cohort file (json lines, json array, optionally gzipped) one at a time
+
+    malformed records are reported with their line number and skipped, with a quarantine
+    records failing validate_record are skipped too and every rejected record goes to it
+    """
+    for record in iter_records(file_path):
+        if record.data is None:
+            reasons = [record.error]
+        elif quarantine is None:
+            yield record.data
+            continue
+        else:
+            reasons = validate_record(record.data)
+            if not reasons:
+                yield record.data
+                continue
+        if quarantine is None:
+            print(f"{file_path}:{record.line}: skipped, {record.error}")
+        else:
+            quarantine.add(file_path, record.line, reasons, record.data)
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="cardiovascular report of the mock patient")
+    parser.add_argument("--format", choices=("pdf", "html"), default="pdf",
+                        help="html writes only the html report and never loads weasyprint")
+    parser.add_argument("--pdf-backend", choices=("weasyprint", "native"), default=None,
+                        help="native draws the report layout straight into the pdf without weasyprint, ~1 ms a report "
+                             "(also REPORT_PDF_BACKEND), weasyprint lays out the html and stays the default, "
+                             "edits to the templates only show with it")
+    parser.add_argument("--cohort", default=None,
+                        help="cohort file (json lines or json array), all patients go into one cohort.pdf")
+    parser.add_argument("--pack", default=None,
+                        help="with --cohort: writes its patients (validated unless --no-validate) into this file as "
+                             "msgpack and exits, --cohort reads the packed file back faster than json (needs msgpack)")
+    parser.add_argument("--columnar", default=None,
+                        help="with --cohort: converts its patients (validated unless --no-validate) once into this "
+                             "memory mapped columnar file and exits, --cohort <file> --summary then reads the "
+                             "columns in place without parsing a record")
+    parser.add_argument("--watch", default=None,
+                        help="keeps rendering new or changed *.json exams of this folder into output/watch/, "
+                             "unchanged ones are skipped, also after a restart")
+    parser.add_argument("--watch-once", action="store_true", help="with --watch: renders the folder once and exits")
+    parser.add_argument("--debounce", type=float, default=2.0,
+                        help="with --watch: seconds a file must stay unchanged before it is rendered")
+    parser.add_argument("--summary", action="store_true",
+                        help="with --cohort or --db: statistics and percentiles per vessel and metric in "
+                             "output/cohort_summary.pdf instead of a page per patient")
+    parser.add_argument("--db", default=None,
+                        help="sqlite patient store, filled by --ingest, its selected exams go into one cohort.pdf")
+    parser.add_argument("--ingest", default=None, help="stores the patients of a cohort file in --db and exits")
+    parser.add_argument("--since", default=None, help="with --db: exams at or after this iso date")
+    parser.add_argument("--until", default=None, help="with --db: exams at or before this iso date")
+    parser.add_argument("--patient-id", default=None, help="with --db: exams of this patient")
+    parser.add_argument("--where", action="append", default=[],
+                        help="with --db: condition like ica_psv>125 or ica_cca_ratio>=2, repeatable")
+    parser.add_argument("--serve", action="store_true",
+                        help="http service until ctrl-c: POST a patient json to /report?format=html|pdf, "
+                             "GET /health and /metrics")
+    parser.add_argument("--port", type=int, default=8080, help="with --serve: port on 127.0.0.1")
+    parser.add_argument("--workers", type=int, default=None,
+                        help="with --serve: pdf processes (default cpu count), with --queue: worker processes (default 1)")
+    parser.add_argument("--max-pending", type=int, default=None,
+                        help="with --serve: pdf renders queued or running before requests get 429 (default 4 per worker)")
+    parser.add_argument("--queue", default=None,
+                        help="sqlite job queue that renders a report per patient into output/queue/, filled once "
+                             "from --cohort, a rerun or another host with the same file resumes where it stopped")
+    parser.add_argument("--shard-size", type=int, default=1000, help="with --queue: patients leased at a time")
+    parser.add_argument("--lease-s", type=float, default=300.0,
+                        help="with --queue: seconds without progress before a shard goes to another worker")
+    parser.add_argument("--pipeline", action="store_true",
+                        help="with --cohort: a report per patient into output/pipeline/ instead of one document, "
+                             "interpret, render, pdf and write run as stages connected by bounded queues so the "
+                             "steps of different patients overlap")
+    parser.add_argument("--stage", action="append", default=[],
+                        help="with --pipeline: executor of a stage, <stage>=<inline|thread|process>[:<workers>] "
+                             "like pdf=process:4 (default interpret and render inline, pdf on a process per cpu, "
+                             "write=thread:2)")
+    parser.add_argument("--unordered", action="store_true",
+                        help="with --pipeline: patients finish in any order instead of the cohort order")
+    parser.add_argument("--history", default=None,
+                        help="sqlite exam history the rendered exams are added to by patient id, every report gets "
+                             "the patient's trend (latest, change, rolling mean per metric), single report, "
+                             "--cohort and --db")
+    parser.add_argument("--quarantine", default=None,
+                        help="with --cohort or --ingest: where invalid records go with their reasons "
+                             "(default output/quarantine.jsonl)")
+    parser.add_argument("--no-validate", dest="validate", action="store_false",
+                        help="with --cohort or --ingest: skips the record validation")
+    args = parser.parse_args(argv)
+    if (args.ingest or args.db) and not args.db:
+        parser.error("--ingest needs --db")
+    for spec in args.stage:
+        try:
+            parse_stage(spec, PIPELINE_STAGES)
+        except ValueError as e:
+            parser.error(str(e))
+    for condition in args.where:
+        try:
+            parse_condition(condition)
+        except ValueError as e:
+            parser.error(str(e))
+    if args.pdf_backend:
+        os.environ[ENV_BACKEND] = args.pdf_backend  # the environment reaches every worker process
+    # REPORT_METRICS=<file> writes per stage timings, see instrument.py
+    try:
+        if args.serve:
+            serve(args.port, args.workers, args.max_pending)
+        elif args.queue:
+            run_queue(Path(args.queue), args.cohort and Path(args.cohort), args.format, args.workers or 1,
+                      args.shard_size, args.lease_s, args.validate, args.quarantine)
+        elif args.watch:
+            watch(Path(args.watch), args.format, args.debounce, args.watch_once)
+        elif args.ingest:
+            ingest(Path(args.ingest), Path(args.db), args.validate, args.quarantine)
+        elif args.db:
+            run_query(Path(args.db), args.format, args.summary, args.history, since=args.since, until=args.until,
+                      patient_id=args.patient_id, where=args.where)
+        elif args.cohort and args.columnar:
+            convert_columnar(Path(args.cohort), Path(args.columnar), args.validate, args.quarantine)
+        elif args.cohort and args.pack:
+            pack(Path(args.cohort), Path(args.pack), args.validate, args.quarantine)
+        elif args.cohort and args.pipeline:
+            run_pipeline(Path(args.cohort), args.format, pipeline_executors(args.stage, args.workers),
+                         not args.unordered, args.validate, args.quarantine)
+        elif args.cohort:
+            run_cohort(Path(args.cohort), args.format, args.summary, args.validate, args.quarantine, args.history)
+        else:
+            run(args.format, args.history)
+    finally:
+        instrument.metrics().close()
+
+def run(output_format: str = "pdf", history_path: str | None = None):
     project_root = Path(__file__).parent.parent
-    
-    patient_data = load_patient_data(project_root / "data" / "mock_patient.json")
-    
+
+    with span("load"):
+        patient_data = load_patient_data(project_root / "data" / "mock_patient.json")
+    trend = None
+    if history_path:
+        with span("history"), ExamHistory(Path(history_path)) as history:
+            trend = history.append(patient_data)
+    template_path = project_root / "src" / "report_template.html"
+    output_path = project_root / "output" / f"patient_report.{output_format}"
+
+    # unchanged input, template and code reuse the last report
+    with RenderCache(project_root / "output" / ".render_cache") as cache:
+        with span("cache_lookup"):
+            native = output_format == "pdf" and pdf_backend() == "native"
+            variant = "native-pdf" if native else ""
+            if trend:  # the trend section is part of the report
+                variant += "\0trend:" + json.dumps(trend, sort_keys=True)
+            key = cache.key_for(patient_data, template_path, variant)
+            hit = cache.get(key, output_path.parent, (output_path.name,))
+        if hit:
+            print(f"Up to date (cached): {output_path}")
+            return
+        render_report(patient_data, template_path, output_path, trend)
+        with span("cache_store"):
+            cache.put(key, output_path.parent, (output_path.name,))
+    print(f"Wrote: {output_path}")
+
+def run_cohort(cohort_path: Path, output_format: str = "pdf", summary: bool = False, validate: bool = True,
+               quarantine_path: str | None = None, history_path: str | None = None):
+    """one consolidated report with a page for every patient of the cohort file, or its summary"""
+    if is_cohort_file(cohort_path):
+        if not summary:
+            raise SystemExit(f"{cohort_path} is a columnar file and holds only the vitals, use it with --summary")
+        return write_columnar_summary(cohort_path, output_format)
+    with quarantined(validate, quarantine_path) as quarantine:
+        patients = iter_patient_data(cohort_path, quarantine)
+        if summary:
+            write_summary(patients, output_format)
+        else:
+            write_cohort(patients, output_format, history_path)
+
+def run_queue(queue_path: Path, cohort_path: Path | None = None, output_format: str = "pdf", workers: int = 1,
+              shard_size: int = 1000, lease_s: float = 300.0, validate: bool = True, quarantine_path: str | None = None):
+    """renders every patient of the queue to output/queue/, see JobQueue, fills it from the cohort file first"""
+    with JobQueue(queue_path) as queue:
+        if not queue.ready:
+            if cohort_path is None:
+                raise SystemExit(f"the queue {queue_path} is empty, fill it with --cohort")
+            with quarantined(validate, quarantine_path) as quarantine:
+                queue.fill(iter_patient_data(cohort_path, quarantine), shard_size, format=output_format)
+        output_format = queue.meta()["format"]  # every worker renders what the queue was made for
+    output_dir = Path(__file__).parent.parent / "output" / "queue"
+    render = functools.partial(render_queue_patient, output_dir=output_dir, suffix="." + output_format)
+    with span("queue"):
+        status = run_workers(queue_path, render, workers, lease_s)
+    print(f"Queue {queue_path}: {status['done']}/{status['patients']} patients done, {status['failed']} failed, "
+          f"shards {status['shards']}: {output_dir}")
+    if status["failed"] or status["shards"].get("failed"):
+        with JobQueue(queue_path) as queue:
+            for what, error in queue.failures():
+                print(f"FAILED {what}: {error}")
+        raise SystemExit(1)
+
+def patient_file(idx: int, patient_data: dict, output_dir: Path, suffix: str):
+    """output_dir/<index>_<patient_id><suffix>, the patient id made safe for a file name"""
+    name = "".join(c if c.isalnum() or c in "-_" else "_" for c in str(patient_data.get("patient_id") or "unknown"))
+    return output_dir / f"{idx:06d}_{name}{suffix}"
+
+def render_queue_patient(idx: int, patient_data: dict, output_dir: Path, suffix: str):
+    """renders one patient of the queue, runs in the queue workers"""
+    output_path = patient_file(idx, patient_data, output_dir, suffix)
+    render_report(patient_data, Path(__file__).parent / "report_template.html", output_path)
+    return output_path
+
+def pack(cohort_path: Path, packed_path: Path, validate: bool = True, quarantine_path: str | None = None):
+    """converts a cohort file once into a packed msgpack file, read back by --cohort like json"""
+    failed = []
+    with quarantined(validate, quarantine_path) as quarantine, span("pack"):
+        try:
+            count = write_packed(iter_patient_data(cohort_path, quarantine), packed_path,
+                                 on_error=lambda patient, error: failed.append((patient.get("patient_id"), error)))
+        except ImportError as e:
+            raise SystemExit(str(e))
+    print(f"Packed {count} patients ({len(failed)} failed): {packed_path}")
+    for patient_id, error in failed:
+        print(f"FAILED {patient_id}: {error}")
+
+def convert_columnar(cohort_path: Path, columnar_path: Path, validate: bool = True,
+                     quarantine_path: str | None = None):
+    """converts a cohort file once into a columnar file, see cohort_file"""
+    with quarantined(validate, quarantine_path) as quarantine, span("columnar"):
+        count = write_cohort_file(iter_patient_data(cohort_path, quarantine), columnar_path)
+    print(f"Converted {count} patients: {columnar_path}")
+
+PIPELINE_STAGES = ("interpret", "render", "pdf", "write")
+
+def run_pipeline(cohort_path: Path, output_format: str = "pdf", executors: dict | None = None, ordered: bool = True,
+                 validate: bool = True, quarantine_path: str | None = None):
+    """a report per patient of the cohort file into output/pipeline/, see render_patients"""
+    output_dir = Path(__file__).parent.parent / "output" / "pipeline"
+    with quarantined(validate, quarantine_path) as quarantine, span("pipeline"):
+        rendered, failures = render_patients(iter_patient_data(cohort_path, quarantine), output_dir, output_format,
+                                             executors, ordered)
+    print(f"Wrote {rendered} reports ({len(failures)} failed): {output_dir}")
+    for path, error in failures:
+        print(f"FAILED {path.name}: {error}")
+    if failures:
+        raise SystemExit(1)
+
+def pipeline_executors(specs: list, workers: int | None = None):
+    """{stage: (executor, workers)} of --stage specs, pooled stages without a count get --workers or a worker per cpu"""
+    executors = {"pdf": ("process", workers)} if workers else {}
+    for spec in specs:
+        name, executor, count = parse_stage(spec, PIPELINE_STAGES)
+        executors[name] = (executor, 1 if executor == "inline" else count or workers or os.cpu_count() or 1)
+    return executors
+
+def render_patients(patients, output_dir: Path, output_format: str = "pdf", executors: dict | None = None,
+                    ordered: bool = True, pipelined: bool = True):
+    """
+    renders every patient to output_dir/<index>_<patient_id>.<format> in four stages, interpret (report
+    model), render (html), pdf (bytes) and write, pipelined they run at the same time on different patients,
+    otherwise one patient after another (the baseline)
+
+    executors maps stage names to (executor, workers), default interpret and render inline, pdf on a process
+    per cpu (inline with one cpu, a process would only add the cost of sending every report to it) and
+    write on 2 threads. Returns: (rendered, [(path, error)])
+    """
+    cpus = os.cpu_count() or 1
+    chosen = {"interpret": ("inline", 1), "render": ("inline", 1), "write": ("thread", 2),
+              "pdf": ("process", cpus) if cpus > 1 else ("inline", 1)}
+    chosen.update(executors or {})
+    steps = {"interpret": pipeline_interpret, "render": pipeline_render, "pdf": pipeline_pdf, "write": pipeline_write}
+    stages = [Stage(name, functools.partial(pipeline_step, steps[name]), *chosen[name]) for name in PIPELINE_STAGES]
+    suffix = "." + output_format
+    jobs = ({"path": patient_file(idx, patient, output_dir, suffix), "patient": patient, "native": pdf_backend() == "native"}
+            for idx, patient in enumerate(patients))
+    if pipelined:
+        done = Pipeline(stages, ordered=ordered, chunk_size=16).run(jobs)
+    else:
+        done = (functools.reduce(lambda job, stage: stage.fn(job), stages, job) for job in jobs)
+    rendered, failures = 0, []
+    for job in done:
+        if "error" in job:
+            failures.append((job["path"], job["error"]))
+        else:
+            rendered += 1
+    return rendered, failures
+
+def pipeline_step(fn, job: dict):
+    """runs one stage on a patient, an error is kept in the job and skips the later stages"""
+    if "error" in job:
+        return job
+    try:
+        return fn(job)
+    except Exception as e:
+        return {"path": job["path"], "error": f"{type(e).__name__}: {e}"}
+
+def pipeline_interpret(job: dict):
+    return {**job, "model": report_model(job["patient"])}
+
+def pipeline_render(job: dict):
+    """the html, not needed for a pdf drawn by the native backend"""
+    if job["path"].suffix != ".html" and job["native"]:
+        return job
+    return {**job, "html": generate_html_report(job["model"], TEMPLATE_PATH)}
+
+def pipeline_pdf(job: dict):
+    """lays out the pdf, the bytes go to the write stage"""
+    if job["path"].suffix == ".html":
+        return job
+    document = draw_report(job["model"]) if job["native"] else report_pdf(job["html"])
+    return {"path": job["path"], "document": document}
+
+def pipeline_write(job: dict):
+    job["path"].parent.mkdir(parents=True, exist_ok=True)
+    if "document" in job:
+        job["path"].write_bytes(job["document"])
+    else:
+        job["path"].write_text(job["html"], encoding="utf-8")
+    return {"path": job["path"]}
+
+@contextlib.contextmanager
+def quarantined(validate: bool, quarantine_path: str | None):
+    """the quarantine for invalid records (None without validation), reports how many it got"""
+    if not validate:
+        yield None
+        return
+    path = Path(quarantine_path) if quarantine_path else Path(__file__).parent.parent / "output" / "quarantine.jsonl"
+    with Quarantine(path) as quarantine:
+        yield quarantine
+    if quarantine.count:
+        print(f"Quarantined {quarantine.count} invalid records: {path}")
+
+def watch(watch_dir: Path, output_format: str = "pdf", debounce_s: float = 2.0, once: bool = False):
+    """renders the exams dropped into watch_dir to output/watch/<name>.<format> as they arrive"""
+    project_root = Path(__file__).parent.parent
+    render = functools.partial(render_exam_file, template_path=project_root / "src" / "report_template.html")
+    with FolderWatcher(watch_dir, project_root / "output" / "watch", render, suffix="." + output_format,
+                       debounce_s=debounce_s) as watcher:
+        if not once:
+            print(f"Watching {watch_dir} (ctrl-c stops)")
+        watcher.run(once=once)
+    print(f"Rendered {watcher.rendered}, failed {watcher.failed}, unchanged {watcher.unchanged}")
+
+def render_exam_file(exam_path: Path, output_path: Path, template_path: Path):
+    """renders one exam file, runs in the watch worker processes"""
+    render_report(load_patient_data(exam_path), template_path, output_path)
+
+def ingest(cohort_path: Path, db_path: Path, validate: bool = True, quarantine_path: str | None = None):
+    """stores the patients of a cohort file in the patient store"""
+    with quarantined(validate, quarantine_path) as quarantine, span("ingest"), PatientStore(db_path) as store:
+        stored, skipped = store.ingest(iter_patient_data(cohort_path, quarantine))
+        total = len(store)
+    print(f"Stored {stored} patients ({skipped} without patient_id skipped), {total} exams in {db_path}")
+
+def run_query(db_path: Path, output_format: str = "pdf", summary: bool = False, history_path: str | None = None,
+              **selection):
+    """one consolidated report (or summary) of the exams selected from the patient store"""
+    if not db_path.exists():
+        raise SystemExit(f"no patient store at {db_path}, create it with --ingest")
+    with PatientStore(db_path) as store:
+        if summary:
+            write_summary(store.select(**selection), output_format)
+        else:
+            write_cohort(store.select(**selection), output_format, history_path)
+
+def write_cohort(patients, output_format: str = "pdf", history_path: str | None = None):
+    """one page per patient, with a history every patient is added to it and the page gets its trend"""
+    project_root = Path(__file__).parent.parent
+    output_dir = project_root / "output"
+
+    def models(history):
+        for patient_data in patients:
+            findings = interpret_vitals(patient_data)
+            trend = history.append(patient_data) if history is not None else None
+            yield build_report_model(patient_data, findings, classify_risk(findings), trend)
+
+    with span("cohort"), contextlib.ExitStack() as stack:
+        history = stack.enter_context(ExamHistory(Path(history_path))) if history_path else None
+        result = save_cohort_report(models(history), project_root / "src", output_dir, output_format)
+    pages = f", {result['pages']} pages" if result["pages"] is not None else ""
+    print(f"Wrote {result['patients']} patients{pages}: {output_dir / ('cohort.' + output_format)}")
+
+def write_summary(patients, output_format: str = "pdf"):
+    """statistics of all patients in one pass, see CohortStats"""
+    project_root = Path(__file__).parent.parent
+    output_dir = project_root / "output"
+    with span("summary"):
+        summary = CohortStats().add_many(patients).summary()
+        save_cohort_summary(summary, project_root / "src", output_dir, output_format)
+    print(f"Wrote summary of {summary['patients']} patients: {output_dir / ('cohort_summary.' + output_format)}")
+
+def write_columnar_summary(columnar_path: Path, output_format: str = "pdf"):
+    """statistics of a columnar file, its mapped columns go into CohortStats without a record object"""
+    project_root = Path(__file__).parent.parent
+    output_dir = project_root / "output"
+    with span("summary"), CohortFile(columnar_path) as cohort:
+        summary = CohortStats().add_columns(cohort.columns).summary()
+        save_cohort_summary(summary, project_root / "src", output_dir, output_format)
+    print(f"Wrote summary of {summary['patients']} patients: {output_dir / ('cohort_summary.' + output_format)}")
+
+TEMPLATE_PATH = Path(__file__).parent / "report_template.html"
+_pdf_engine = None  # weasyprint engine of a service worker
+
+def serve(port: int = 8080, workers: int | None = None, max_pending: int | None = None):
+    """renders reports over http on 127.0.0.1, see ReportService"""
+    if pdf_backend() == "native":
+        service = ReportService(report_html, draw_report, warm_native, validate_record, workers, max_pending,
+                                pdf_input=report_model)
+    else:
+        service = ReportService(report_html, report_pdf, warm_pdf_worker, validate_record, workers, max_pending)
+
+    async def run():
+        host, bound = await service.start("127.0.0.1", port)
+        formats = "pdf and html" if service.pdf_error is None else f"html only, {service.pdf_error}"
+        print(f"Serving reports on http://{host}:{bound} ({service.workers} pdf workers, {formats})")
+        try:
+            await service.server.serve_forever()
+        finally:
+            await service.close()
+
+    try:
+        asyncio.run(run())
+    except KeyboardInterrupt:
+        pass
+
+def report_model(patient_data: dict):
     findings = interpret_vitals(patient_data)
-    risk_level = classify_risk(findings)
+    return build_report_model(patient_data, findings, classify_risk(findings))
 
-    report_model = build_report_model(patient_data, findings, risk_level)
+def report_html(patient_data: dict):
+    """the html report of one patient, the service renders it inline"""
+    return generate_html_report(report_model(patient_data), TEMPLATE_PATH)
 
-    template_path = project_root / "src" / "report_template.html"
-    html_report = generate_html_report(report_model, template_path)
+def warm_native():
+    """the native pdf backend needs no setup"""
+    return None
+
+def warm_pdf_worker():
+    """sets up weasyprint in a service worker, returns why it cannot or None"""
+    global _pdf_engine
+    if _pdf_engine is None:
+        try:
+            from report_generator import PdfEngine
+            _pdf_engine = PdfEngine(TEMPLATE_PATH)
+        except Exception as e:
+            return f"{type(e).__name__}: {e}"
+    return None
+
+def report_pdf(html: str):
+    """pdf bytes of a rendered report, runs in the service workers"""
+    error = warm_pdf_worker()
+    if error:
+        raise RuntimeError(error)
+    return _pdf_engine.write_pdf(html, base_url=str(TEMPLATE_PATH.parent))
+
+def render_report(patient_data: dict, template_path: Path, output_path: Path, trend: dict | None = None):
+    """interprets the patient data and writes the report, html or pdf by the suffix of output_path"""
+    with span("report", patient_id=patient_data.get("patient_id")):
+        with span("interpret"):
+            findings = interpret_vitals(patient_data)
+            risk_level = classify_risk(findings)
 
-    output_path = project_root / "output" / "patient_report.pdf"
-    save_pdf(html_report, output_path, template_path.parent)
+        report_model = build_report_model(patient_data, findings, risk_level, trend)
+        if output_path.suffix != ".html" and pdf_backend() == "native":
+            with span("pdf"):  # drawn from the model, no html needed
+                save_native_pdf(report_model, output_path)
+            return
+        with span("html"):
+            html_report = generate_html_report(report_model, template_path)
+        if output_path.suffix == ".html":
+            output_path.parent.mkdir(parents=True, exist_ok=True)
+            output_path.write_text(html_report, encoding="utf-8")
+            return
+        with span("pdf"):
+            save_pdf(html_report, output_path, template_path.parent)
 
 if __name__ == "__main__":
     main()
\ No newline at end of file
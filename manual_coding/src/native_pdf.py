@@ -0,0 +1,196 @@
+"""Draws the fixed report layout of report_body.html straight into pdf, without html layout"""
+from __future__ import annotations
+import os
+import zlib
+from functools import lru_cache
+from pathlib import Path
+
+BACKENDS = ("weasyprint", "native")
+ENV_BACKEND = "REPORT_PDF_BACKEND"
+
+# A4 in points, css px are 0.75 pt, the margin is the template's @page margin of 1cm
+PX = 0.75
+PAGE_W, PAGE_H = 595.28, 841.89
+MARGIN = 28.35
+CONTENT_W = PAGE_W - 2 * MARGIN
+
+# advance widths (1/1000 em) of ascii 32..126 from the adobe core font metrics
+HELVETICA = (
+    278, 278, 355, 556, 556, 889, 667, 191, 333, 333, 389, 584, 278, 333, 278, 278,
+    556, 556, 556, 556, 556, 556, 556, 556, 556, 556, 278, 278, 584, 584, 584, 556,
+    1015, 667, 667, 722, 722, 667, 611, 778, 722, 278, 500, 667, 556, 833, 722, 778,
+    667, 778, 722, 667, 611, 722, 667, 944, 667, 667, 611, 278, 278, 278, 469, 556,
+    333, 556, 556, 500, 556, 556, 278, 556, 556, 222, 222, 500, 222, 833, 556, 556,
+    556, 556, 333, 500, 278, 556, 500, 722, 500, 500, 500, 334, 260, 334, 584,
+)
+HELVETICA_BOLD = (
+    278, 333, 474, 556, 556, 889, 722, 238, 333, 333, 389, 584, 278, 333, 278, 278,
+    556, 556, 556, 556, 556, 556, 556, 556, 556, 556, 333, 333, 584, 584, 584, 611,
+    975, 722, 722, 722, 722, 667, 611, 778, 722, 278, 556, 722, 611, 833, 722, 778,
+    667, 778, 722, 667, 611, 722, 667, 944, 667, 667, 611, 333, 278, 333, 584, 556,
+    333, 556, 611, 556, 611, 556, 333, 611, 611, 278, 278, 556, 278, 889, 611, 611,
+    611, 611, 389, 556, 333, 611, 556, 778, 556, 556, 500, 389, 280, 389, 584,
+)
+FONTS = {"F1": "Helvetica", "F2": "Helvetica-Bold"}
+# widths by winansi byte, bytes outside ascii count as a digit
+WIDTHS = {"F1": (556,) * 32 + HELVETICA + (556,) * 129, "F2": (556,) * 32 + HELVETICA_BOLD + (556,) * 129}
+
+BLACK, HEADING, BORDER, HEADER_BG = (0, 0, 0), (0x33, 0x33, 0x33), (0xDD, 0xDD, 0xDD), (0xF2, 0xF2, 0xF2)
+
+
+def pdf_backend(backend: str | None = None):
+    """backend or the one in REPORT_PDF_BACKEND, weasyprint by default"""
+    backend = backend or os.environ.get(ENV_BACKEND) or "weasyprint"
+    if backend not in BACKENDS:
+        raise ValueError(f"unknown pdf backend {backend!r}, one of {', '.join(BACKENDS)}")
+    return backend
+
+
+def text_width(text: str, font: str, size: float):
+    return sum(map(WIDTHS[font].__getitem__, text.encode("cp1252", errors="replace"))) * size / 1000
+
+
+@lru_cache(maxsize=None)
+def color(rgb: tuple):
+    return " ".join(f"{c / 255:.3f}" for c in rgb)
+
+
+def pdf_string(text: str):
+    raw = text.encode("cp1252", errors="replace")
+    return b"(" + raw.replace(b"\\", b"\\\\").replace(b"(", b"\\(").replace(b")", b"\\)") + b")"
+
+
+def wrap(text: str, font: str, size: float, width: float):
+    """lines of text no wider than width, broken at spaces, whitespace collapsed like html"""
+    lines, line = [], ""
+    for word in text.split():
+        candidate = f"{line} {word}" if line else word
+        if line and text_width(candidate, font, size) > width:
+            lines.append(line)
+            candidate = word
+        line = candidate
+    return lines + [line] if line or not lines else lines
+
+
+class Canvas:
+    """pages of pdf operators, y is the cursor in points from the top, a new page starts when content does not fit"""
+    def __init__(self):
+        self.pages = []
+        self.new_page()
+
+    def new_page(self):
+        self.pages.append([])
+        self.y = MARGIN
+
+    def ensure(self, height: float):
+        if self.y + height > PAGE_H - MARGIN and self.y > MARGIN:
+            self.new_page()
+
+    def text(self, x: float, baseline: float, text: str, font: str, size: float, rgb: tuple = BLACK):
+        self.pages[-1].append(f"BT /{font} {size:g} Tf {color(rgb)} rg {x:.2f} {PAGE_H - baseline:.2f} Td ".encode()
+                              + pdf_string(text) + b" Tj ET")
+
+    def rect(self, x: float, top: float, w: float, h: float, fill: tuple | None = None, stroke: tuple | None = None):
+        ops = []
+        if fill:
+            ops.append(f"{color(fill)} rg")
+        if stroke:
+            ops.append(f"{color(stroke)} RG {PX:g} w")
+        ops.append(f"{x:.2f} {PAGE_H - top - h:.2f} {w:.2f} {h:.2f} re " + ("B" if fill and stroke else "f" if fill else "S"))
+        self.pages[-1].append(" ".join(ops).encode())
+
+    def block(self, text: str, font: str, size: float, margin: float, rgb: tuple = BLACK, keep: float = 0.0):
+        """a wrapped block with vertical margins, keep is room to leave for what follows it on the same page"""
+        self.y += margin
+        lines = wrap(text, font, size, CONTENT_W)
+        self.ensure(len(lines) * size * 1.2 + keep)
+        for line in lines:
+            self.ensure(size * 1.2)
+            self.text(MARGIN, self.y + size * 0.95, line, font, size, rgb)
+            self.y += size * 1.2
+        self.y += margin
+
+
+def table(canvas: Canvas, rows: list):
+    """rows of cells, the first is the header, columns sized like an auto table layout"""
+    size, pad = 10 * PX, 4 * PX
+    row_h = size * 1.2 + 2 * pad
+    columns = len(rows[0])
+    natural = [max(text_width(str(r[c]), "F2" if i == 0 else "F1", size) for i, r in enumerate(rows)) + 2 * pad
+               for c in range(columns)]
+    extra = max(0.0, CONTENT_W - sum(natural)) / columns
+    widths = [w + extra for w in natural]
+    canvas.y += 10 * PX
+    for i, cells in enumerate(rows):
+        canvas.ensure(row_h * (2 if i == 0 else 1))  # a header is never alone at the bottom
+        x = MARGIN
+        for value, w in zip(cells, widths):
+            canvas.rect(x, canvas.y, w, row_h, HEADER_BG if i == 0 else None, BORDER)
+            value = str(value)
+            if i == 0:  # th is bold and centered
+                canvas.text(x + (w - text_width(value, "F2", size)) / 2, canvas.y + pad + size * 0.95, value, "F2", size)
+            else:
+                canvas.text(x + pad, canvas.y + pad + size * 0.95, value, "F1", size)
+            x += w
+        canvas.y += row_h
+    canvas.y += 10 * PX
+
+
+def draw_report(model: dict):
+    """pdf bytes of a build_report_model model, same content and styles as report_template.html"""
+    canvas = Canvas()
+    canvas.block(f"Patient Report for {model.get('patient_name')}", "F2", 16 * PX, 10 * PX, HEADING)
+    canvas.block(f"Patient ID: {model.get('patient_id')} | Exam Date: {model.get('exam_date')}", "F1", 11 * PX, 5 * PX)
+    canvas.block("Vital Signs", "F2", 14 * PX, 8 * PX)
+    header = ("Metric", "Value", "Unit")
+    for section in model["vital_sections"]:
+        canvas.block(section["section"], "F2", 12 * PX, 6 * PX, keep=60)
+        table(canvas, [header] + [(r["metric"], r["value"], r["unit"]) for r in section["rows"]])
+    canvas.block("Derived Metrics", "F2", 14 * PX, 8 * PX, keep=60)
+    table(canvas, [header] + [(m["metric"], m["value"], m["unit"]) for m in model["derived_metrics"]])
+    trend = model.get("trend")
+    if trend:
+        canvas.block(f"Trend ({trend['exams']} exams since {trend['first']})", "F2", 14 * PX, 8 * PX, keep=60)
+        table(canvas, [("Metric", "Latest", "Change", f"Mean (last {trend['window']})")]
+              + [(m["metric"], m["latest"], "n/a" if m["change"] is None else f"{m['change']:+.2f}",
+                  f"{m['mean']:.2f}") for m in trend["metrics"]])
+    canvas.block("Findings & Risk Level", "F2", 14 * PX, 8 * PX, keep=30)
+    canvas.block(", ".join(model["findings"]), "F1", 11 * PX, 5 * PX)
+    canvas.block(f"Risk Level: {model.get('risk_level')}", "F1", 11 * PX, 5 * PX)
+    return document(canvas.pages, "Patient Report")
+
+
+def document(pages: list, title: str):
+    """a pdf 1.4 file: catalog, page tree, the core fonts, then every page with its compressed stream"""
+    objects = [b"", b""]
+    fonts = []
+    for name, base in FONTS.items():
+        objects.append(f"<< /Type /Font /Subtype /Type1 /BaseFont /{base} /Encoding /WinAnsiEncoding >>".encode())
+        fonts.append(f"/{name} {len(objects)} 0 R")
+    objects.append(b"<< /Title " + pdf_string(title) + b" /Producer (native_pdf) >>")
+    info = len(objects)
+    kids = []
+    for ops in pages:
+        stream = zlib.compress(b"\n".join(ops), 6)
+        objects.append(b"<< /Length %d /Filter /FlateDecode >>\nstream\n" % len(stream) + stream + b"\nendstream")
+        objects.append(f"<< /Type /Page /Parent 2 0 R /MediaBox [0 0 {PAGE_W:g} {PAGE_H:g}] "
+                       f"/Resources << /Font << {' '.join(fonts)} >> >> /Contents {len(objects)} 0 R >>".encode())
+        kids.append(f"{len(objects)} 0 R")
+    objects[0] = b"<< /Type /Catalog /Pages 2 0 R >>"
+    objects[1] = f"<< /Type /Pages /Kids [{' '.join(kids)}] /Count {len(kids)} >>".encode()
+
+    out = bytearray(b"%PDF-1.4\n%\xe2\xe3\xcf\xd3\n")
+    offsets = []
+    for number, body in enumerate(objects, 1):
+        offsets.append(len(out))
+        out += b"%d 0 obj\n" % number + body + b"\nendobj\n"
+    xref = len(out)
+    out += b"xref\n0 %d\n0000000000 65535 f \n" % (len(objects) + 1)
+    out += b"".join(b"%010d 00000 n \n" % offset for offset in offsets)
+    out += b"trailer\n<< /Size %d /Root 1 0 R /Info %d 0 R >>\nstartxref\n%d\n%%%%EOF\n" % (len(objects) + 1, info, xref)
+    return bytes(out)
+
+
+def save_native_pdf(model: dict, output: Path):
+    output.parent.mkdir(parents=True, exist_ok=True)
+    output.write_bytes(draw_report(model))
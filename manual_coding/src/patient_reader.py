@@ -0,0 +1,279 @@
+"""Streaming reader for patient records (JSON, JSON lines, JSON arrays, gzip, packed msgpack)"""
+from __future__ import annotations
+
+import gzip
+import io
+import json
+import os
+import re
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Iterable, Iterator, TextIO
+
+try:
+    import orjson
+except ImportError:  # optional, json of the standard library otherwise
+    orjson = None
+
+# json forces the standard library even with orjson installed
+JSON_BACKEND_ENV = "REPORT_JSON_BACKEND"
+_GZIP_MAGIC = b"\x1f\x8b"
+# first byte of a msgpack map (fixmap, map 16, map 32), never the start of json or gzip
+_PACKED_FIRST = frozenset(range(0x80, 0x90)) | {0xDE, 0xDF}
+_READ_CHARS = 1 << 20
+# records larger than this are reported as malformed instead of buffered further
+MAX_RECORD_CHARS = 64 << 20
+# a json string (group 1 is its closing quote, missing if the buffer cuts it off)
+# or a structural character
+_TOKEN = re.compile(r'"(?:[^"\\]|\\.)*(?:(")|\\?\Z)|[\[\]{},]', re.DOTALL)
+_WHITESPACE = re.compile(r"[ \t\n\r]*")
+_decode = json.JSONDecoder().raw_decode
+
+
+@dataclass(frozen=True)
+class Record:
+    """one input record, data is None and error is set for a malformed one"""
+    line: int
+    data: dict | None
+    error: str | None = None
+
+
+def open_text(path: Path) -> TextIO:
+    """opens path as text, gzip input is decompressed transparently"""
+    with Path(path).open("rb") as f:
+        magic = f.read(2)
+    if magic == _GZIP_MAGIC:
+        return io.TextIOWrapper(gzip.open(path, "rb"), encoding="utf-8")
+    return Path(path).open("r", encoding="utf-8")
+
+
+def json_backend():
+    """orjson when installed and not turned off with REPORT_JSON_BACKEND=json, else json"""
+    return "orjson" if orjson is not None and os.environ.get(JSON_BACKEND_ENV) != "json" else "json"
+
+
+def loads(text: str | bytes):
+    """
+    parses json with orjson when available, what orjson rejects (NaN, integers over 64 bits,
+    malformed text) goes through json again so the accepted input and the errors stay the same
+    """
+    if json_backend() == "orjson":
+        try:
+            return orjson.loads(text)
+        except orjson.JSONDecodeError:
+            pass
+    return json.loads(text)
+
+
+def _msgpack():
+    try:
+        import msgpack
+    except ImportError as e:
+        raise ImportError("packed cohorts need the msgpack package (pip install msgpack)") from e
+    return msgpack
+
+
+def write_packed(patients: Iterable[dict], path: Path, on_error=None):
+    """
+    writes patients as a stream of msgpack maps that iter_records reads back faster than json,
+    values keep their types. A patient msgpack cannot hold (integers over 64 bits) goes to
+    on_error(patient, reason) and is left out, without on_error it raises ValueError
+
+    Returns: number of patients written
+    """
+    packer = _msgpack().Packer(use_bin_type=True)
+    path = Path(path)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    tmp = path.with_name(path.name + ".tmp")
+    count = 0
+    with tmp.open("wb") as f:
+        for patient in patients:
+            try:
+                f.write(packer.pack(patient))
+            except (OverflowError, TypeError, ValueError) as e:
+                if on_error is None:
+                    tmp.unlink()
+                    raise ValueError(f"patient {count + 1} cannot be packed: {e}") from e
+                on_error(patient, f"{type(e).__name__}: {e}")
+                continue
+            count += 1
+    os.replace(tmp, path)
+    return count
+
+
+def _iter_packed(path: Path) -> Iterator[Record]:
+    """records of a packed file numbered from 1, a corrupt or cut off end is one error"""
+    msgpack = _msgpack()
+    unpacker = msgpack.Unpacker(raw=False, strict_map_key=False, max_buffer_size=MAX_RECORD_CHARS)
+    number = 0
+    with Path(path).open("rb") as f:
+        while True:
+            chunk = f.read(_READ_CHARS)
+            if chunk:
+                unpacker.feed(chunk)
+            try:
+                for value in unpacker:
+                    number += 1
+                    yield Record(number, value) if isinstance(value, dict) else Record(
+                        number, None, "record is not a map")
+            except ValueError as e:  # the msgpack format errors are ValueErrors
+                yield Record(number + 1, None, f"{type(e).__name__}: {e}")
+                return
+            if not chunk:
+                if unpacker.tell() < f.tell():
+                    yield Record(number + 1, None, "truncated record at the end of the file")
+                return
+
+
+def _record(line: int, text: str) -> Record:
+    try:
+        data = loads(text)
+    except ValueError as e:
+        return Record(line, None, f"{type(e).__name__}: {e}")
+    if not isinstance(data, dict):
+        return Record(line, None, "record is not a JSON object")
+    return Record(line, data)
+
+
+def _iter_lines(head: str, f: TextIO) -> Iterator[Record]:
+    """json lines, one record per non empty line"""
+    lines = head.splitlines(keepends=True)
+    if lines and not lines[-1].endswith("\n"):
+        lines[-1] += f.readline()
+    for lineno, line in enumerate(_chain(lines, f), start=1):
+        if line.strip():
+            yield _record(lineno, line)
+
+
+def _chain(lines: list, f: TextIO) -> Iterator[str]:
+    yield from lines
+    yield from f
+
+
+def _scan_end(buf: str, start: int, in_array: bool) -> int | None:
+    """
+    end of the record starting at start found from the json structure alone (works for
+    malformed records), None if the buffer ends before the record
+    """
+    depth = 0
+    for m in _TOKEN.finditer(buf, start):
+        tok = m.group(0)
+        if tok[0] == '"':
+            if m.group(1) is None:
+                return None
+            continue
+        if tok in "[{":
+            depth += 1
+        elif tok in "]}":
+            depth -= 1
+            if in_array and depth < 0:
+                return m.start()
+            if not in_array and depth <= 0:
+                return m.end()
+        elif in_array and depth == 0:
+            return m.start()
+    return None
+
+
+def _iter_values(head: str, f: TextIO) -> Iterator[Record]:
+    """
+    top level json values or elements of top level arrays, decoded one at a time so only
+    the current record is buffered, a malformed record is cut out with _scan_end and
+    reported without losing the rest
+    """
+    buf = head
+    line, counted = 1, 0  # ``line`` is the line number at buffer offset ``counted``
+    pos = 0
+    in_array = False
+    eof = False
+    while True:
+        pos = _WHITESPACE.match(buf, pos).end()
+        complete = None
+        if pos < len(buf):
+            c = buf[pos]
+            if c == "[" and not in_array:
+                in_array, pos = True, pos + 1
+                continue
+            if in_array and c in ",]":
+                in_array, pos = c == ",", pos + 1
+                continue
+            line += buf.count("\n", counted, pos)
+            counted = pos
+            try:
+                value, end = _decode(buf, pos)
+            except ValueError:
+                end = _scan_end(buf, pos, in_array)
+                if end is None and eof:
+                    end = len(buf)
+                if end is not None:
+                    yield _record(line, buf[pos:end])
+                    pos = end
+                    continue
+            else:
+                # a value ending right at the buffer end may be a cut off number
+                if end < len(buf) or eof:
+                    yield Record(line, value) if isinstance(value, dict) else Record(
+                        line, None, "record is not a JSON object")
+                    pos = end
+                    continue
+            complete = False
+        elif eof:
+            return
+
+        # need more input, drop what was consumed and read the next chunk
+        line += buf.count("\n", counted, pos)
+        buf, counted = buf[pos:], 0
+        pos = 0
+        if complete is False and len(buf) > MAX_RECORD_CHARS:
+            yield Record(line, None, f"record exceeds {MAX_RECORD_CHARS} characters")
+            return
+        chunk = f.read(_READ_CHARS)
+        eof = not chunk
+        buf += chunk
+
+
+def iter_records(path: Path) -> Iterator[Record]:
+    """
+    yields the patient records of a file one at a time with bounded memory
+
+    Args: path to json lines, a json array or (pretty printed) json objects, optionally gzipped,
+        or a packed file of write_packed, told apart by the first byte
+
+    Returns: generator of Record, malformed records have data None, an error and their line
+        (their number in a packed file)
+    """
+    with Path(path).open("rb") as f:
+        first = f.read(1)
+    if first and first[0] in _PACKED_FIRST:
+        yield from _iter_packed(path)
+        return
+    with open_text(path) as f:
+        head = f.read(_READ_CHARS)
+        body = head.lstrip()
+        if body[:1] == "{" and "\n" not in body:
+            # decide on the whole first line, it holds at most the first record
+            head += f.readline()
+            body = head.lstrip()
+        # json lines start with a complete object on the first line
+        if body[:1] == "{" and body.split("\n", 1)[0].rstrip().endswith("}"):
+            yield from _iter_lines(head, f)
+        else:
+            yield from _iter_values(head, f)
+
+
+def load_patient(path: Path) -> dict:
+    """
+    loads the only patient record of a file
+
+    raises ValueError if the file holds no record, a malformed one or more than one
+    """
+    found: dict | None = None
+    for record in iter_records(path):
+        if record.data is None:
+            raise ValueError(f"{path}:{record.line}: {record.error}")
+        if found is not None:
+            raise ValueError(f"{path} holds more than one record")
+        found = record.data
+    if found is None:
+        raise ValueError(f"{path} holds no record")
+    return found
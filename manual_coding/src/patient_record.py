@@ -0,0 +1,122 @@
+"""Compact patient record, one float array per patient instead of nested vitals dicts"""
+from __future__ import annotations
+import json
+import math
+import sys
+from array import array
+
+VESSELS = ("CCA", "ICA", "ECA")
+METRICS = ("psv_cm_s", "edv_cm_s", "imt_mm")
+RATIO = len(VESSELS) * len(METRICS)  # position of the ica_cca_ratio in values
+POSITIONS = {(vessel, metric): v * len(METRICS) + m for v, vessel in enumerate(VESSELS)
+             for m, metric in enumerate(METRICS)}
+POSITIONS[(None, "ica_cca_ratio")] = RATIO
+_EMPTY = array("d", [math.nan] * (RATIO + 1))
+
+
+def _float(value):
+    """finite int or float as float, anything else is NaN (missing)"""
+    if type(value) is float or type(value) is int:
+        value = float(value)
+        if math.isfinite(value):
+            return value
+    return math.nan
+
+
+class PatientRecord:
+    """
+    one patient in a few slots, the vessel metrics and the ica_cca_ratio live in one array('d')
+    (vessel major, see POSITIONS) with NaN for missing or non numeric values
+
+    interpret_vitals, vitals_to_columns, build_report_model and CohortStats.add_many take it
+    in place of the patient dict, get() reads it like the dict, to_dict() converts it back
+    (known vessels, metrics and context keys only, numbers as floats)
+    """
+    __slots__ = ("patient_id", "name", "timestamp", "age_years", "sex", "notes", "values")
+    POSITIONS = POSITIONS
+
+    def __init__(self, patient_id=None, name=None, timestamp=None, age_years=None, sex=None, notes=None,
+                 values: array | None = None):
+        self.patient_id = patient_id
+        self.name = name
+        self.timestamp = timestamp
+        self.age_years = age_years
+        self.sex = sex
+        self.notes = notes
+        self.values = array("d", _EMPTY) if values is None else values
+
+    @classmethod
+    def from_dict(cls, patient: dict):
+        context = patient.get("context")
+        if not isinstance(context, dict):
+            context = {}
+        values = array("d", _EMPTY)
+        vitals = patient.get("vitals")
+        if isinstance(vitals, dict):
+            for v, vessel in enumerate(VESSELS):
+                source = vitals.get(vessel)
+                if isinstance(source, dict):
+                    for m, metric in enumerate(METRICS):
+                        values[v * len(METRICS) + m] = _float(source.get(metric))
+            values[RATIO] = _float(vitals.get("ica_cca_ratio"))
+        # dates and sex repeat across a cohort, interning keeps one copy of each
+        timestamp, sex, notes = patient.get("timestamp"), context.get("sex"), context.get("notes")
+        return cls(patient.get("patient_id"), patient.get("name"),
+                   sys.intern(timestamp) if isinstance(timestamp, str) else timestamp,
+                   context.get("age_years"),
+                   sys.intern(sex) if isinstance(sex, str) else sex,
+                   sys.intern(notes) if isinstance(notes, str) and len(notes) <= 64 else notes,
+                   values)
+
+    @classmethod
+    def from_json(cls, text: str | bytes):
+        return cls.from_dict(json.loads(text))
+
+    def value(self, vessel: str | None, metric: str):
+        """the metric of a vessel (vessel None for the ica_cca_ratio), None if missing"""
+        v = self.values[POSITIONS[(vessel, metric)]]
+        return None if math.isnan(v) else v
+
+    def vessel(self, vessel: str):
+        """{metric: value} of the metrics a vessel has"""
+        base = VESSELS.index(vessel) * len(METRICS)
+        return {metric: v for metric, v in zip(METRICS, self.values[base:base + len(METRICS)]) if v == v}
+
+    def vitals(self):
+        vitals = {vessel: self.vessel(vessel) for vessel in VESSELS}
+        vitals = {vessel: metrics for vessel, metrics in vitals.items() if metrics}
+        ratio = self.values[RATIO]
+        if ratio == ratio:
+            vitals["ica_cca_ratio"] = ratio
+        return vitals
+
+    def context(self):
+        return {key: value for key, value in (("age_years", self.age_years), ("sex", self.sex),
+                                              ("notes", self.notes)) if value is not None}
+
+    def get(self, key: str, default=None):
+        """dict like access to the top level fields"""
+        if key == "vitals":
+            return self.vitals()
+        if key == "context":
+            return self.context()
+        value = getattr(self, key, None) if key in ("patient_id", "name", "timestamp") else None
+        return default if value is None else value
+
+    def to_dict(self):
+        patient = {key: getattr(self, key) for key in ("patient_id", "name", "timestamp")
+                   if getattr(self, key) is not None}
+        patient["context"] = self.context()
+        patient["vitals"] = self.vitals()
+        return patient
+
+    def __eq__(self, other):
+        if not isinstance(other, PatientRecord):
+            return NotImplemented
+        return all(getattr(self, s) == getattr(other, s) for s in self.__slots__ if s != "values") and \
+            self.values.tobytes() == other.values.tobytes()
+
+    __hash__ = None
+
+    def __repr__(self):
+        return f"PatientRecord(patient_id={self.patient_id!r}, timestamp={self.timestamp!r})"
@@ -0,0 +1,151 @@
+"""Sqlite store of patient exams with the vitals in indexed columns, for selecting patients by query"""
+from __future__ import annotations
+import json
+import re
+import sqlite3
+from itertools import islice
+from pathlib import Path
+from typing import Iterable, Iterator
+
+# (column, vessel, metric), vessel None is a field of vitals itself
+METRIC_COLUMNS = (
+    ("cca_psv", "CCA", "psv_cm_s"), ("cca_edv", "CCA", "edv_cm_s"), ("cca_imt", "CCA", "imt_mm"),
+    ("ica_psv", "ICA", "psv_cm_s"), ("ica_edv", "ICA", "edv_cm_s"), ("ica_imt", "ICA", "imt_mm"),
+    ("eca_psv", "ECA", "psv_cm_s"), ("eca_edv", "ECA", "edv_cm_s"), ("eca_imt", "ECA", "imt_mm"),
+    ("ica_cca_ratio", None, "ica_cca_ratio"),
+)
+FILTER_COLUMNS = ("age",) + tuple(c for c, _, _ in METRIC_COLUMNS)
+CONDITION = re.compile(r"^\s*([a-z_]+)\s*(>=|<=|!=|=|>|<)\s*([-+]?(?:\d+\.?\d*|\.\d+)(?:[eE][-+]?\d+)?)\s*$")
+# built once after a load into an empty store, cheaper than updating them on every insert
+INDEXES = (("exams_timestamp", "timestamp"), ("exams_ica_psv", "ica_psv"), ("exams_cca_psv", "cca_psv"),
+           ("exams_eca_psv", "eca_psv"), ("exams_ica_cca_ratio", "ica_cca_ratio"))
+COLUMNS = ("patient_id", "timestamp", "age") + tuple(c for c, _, _ in METRIC_COLUMNS) + ("record",)
+INSERT = f"INSERT OR REPLACE INTO exams({', '.join(COLUMNS)}) VALUES ({', '.join('?' * len(COLUMNS))})"
+
+
+def _number(value):
+    # bools are ints but not measurements
+    return value if type(value) in (int, float) else None
+
+
+def exam_row(patient: dict):
+    """row of the exams table for one patient record, raises ValueError without a patient_id"""
+    pid = patient.get("patient_id")
+    if pid is None or pid == "":
+        raise ValueError("record has no patient_id")
+    vitals = patient.get("vitals") if isinstance(patient.get("vitals"), dict) else {}
+    context = patient.get("context") if isinstance(patient.get("context"), dict) else {}
+    metrics = []
+    for _, vessel, metric in METRIC_COLUMNS:
+        values = vitals if vessel is None else vitals.get(vessel)
+        metrics.append(_number(values.get(metric)) if isinstance(values, dict) else None)
+    timestamp = patient.get("timestamp")
+    return (str(pid), "" if timestamp is None else str(timestamp), _number(context.get("age_years")),
+            *metrics, json.dumps(patient, separators=(",", ":")))
+
+
+def parse_condition(text: str):
+    """'ica_psv>125' -> ("ica_psv", ">", 125.0), raises ValueError for unknown columns or bad syntax"""
+    m = CONDITION.match(text)
+    if m is None:
+        raise ValueError(f"invalid condition {text!r}, expected <column><op><number> like ica_psv>125")
+    column, op, value = m.groups()
+    if column not in FILTER_COLUMNS:
+        raise ValueError(f"unknown column {column!r} in {text!r}, use one of {', '.join(FILTER_COLUMNS)}")
+    return column, op, float(value)
+
+
+def where_clause(since=None, until=None, patient_id=None, where: Iterable[str] = ()):
+    """sql where clause and parameters, timestamps are iso strings compared inclusively"""
+    clauses, params = [], []
+    for clause, value in (("timestamp >= ?", since), ("timestamp <= ?", until), ("patient_id = ?", patient_id)):
+        if value is not None:
+            clauses.append(clause)
+            params.append(value)
+    for condition in where:
+        # column and operator come from the whitelist, only the number is a parameter
+        column, op, value = parse_condition(condition)
+        clauses.append(f"{column} {op} ?")
+        params.append(value)
+    return (" WHERE " + " AND ".join(clauses) if clauses else ""), params
+
+
+class PatientStore:
+    """
+    exams of all patients, one per patient and timestamp (ingesting it again replaces it)
+
+    the selection fields are indexed columns next to the full record, select() runs one
+    indexed query instead of scanning the json
+    """
+    def __init__(self, path: Path):
+        self.path = Path(path)
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self._db = sqlite3.connect(str(self.path), timeout=30)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("PRAGMA synchronous=NORMAL")
+        metrics = ", ".join(f"{c} REAL" for c, _, _ in METRIC_COLUMNS)
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS exams (id INTEGER PRIMARY KEY, patient_id TEXT NOT NULL,"
+            f" timestamp TEXT NOT NULL, age REAL, {metrics}, record TEXT NOT NULL, UNIQUE (patient_id, timestamp))")
+        self._create_indexes()
+
+    def close(self):
+        self._db.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def __len__(self):
+        return self._db.execute("SELECT COUNT(*) FROM exams").fetchone()[0]
+
+    def _create_indexes(self):
+        for name, column in INDEXES:
+            self._db.execute(f"CREATE INDEX IF NOT EXISTS {name} ON exams({column})")
+        self._db.commit()
+
+    def ingest(self, patients: Iterable[dict], batch_size: int = 10000):
+        """
+        stores the patients with one commit per batch_size rows
+
+        Returns: (stored, skipped) counts, records without a patient_id are skipped
+        """
+        skipped = 0
+
+        def rows():
+            nonlocal skipped
+            for patient in patients:
+                try:
+                    yield exam_row(patient)
+                except (TypeError, ValueError):
+                    skipped += 1
+
+        bulk = self._db.execute("SELECT 1 FROM exams LIMIT 1").fetchone() is None
+        if bulk:
+            for name, _ in INDEXES:
+                self._db.execute(f"DROP INDEX IF EXISTS {name}")
+        stored = 0
+        try:
+            it = rows()
+            while chunk := list(islice(it, max(1, batch_size))):
+                self._db.executemany(INSERT, chunk)
+                self._db.commit()
+                stored += len(chunk)
+        finally:
+            self._db.commit()
+            if bulk:
+                self._create_indexes()
+        return stored, skipped
+
+    def count(self, since=None, until=None, patient_id=None, where: Iterable[str] = ()):
+        """number of exams matching the selection, see where_clause"""
+        sql, params = where_clause(since, until, patient_id, where)
+        return self._db.execute(f"SELECT COUNT(*) FROM exams{sql}", params).fetchone()[0]
+
+    def select(self, since=None, until=None, patient_id=None, where: Iterable[str] = ()) -> Iterator[dict]:
+        """patient records matching the selection, oldest exam first, fetched lazily"""
+        sql, params = where_clause(since, until, patient_id, where)
+        for (record,) in self._db.execute(f"SELECT record FROM exams{sql} ORDER BY timestamp, patient_id", params):
+            yield json.loads(record)
@@ -0,0 +1,195 @@
+"""Stages connected by bounded queues, so the steps of different items run at the same time"""
+from __future__ import annotations
+import collections
+import itertools
+import multiprocessing
+import queue
+import threading
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, ThreadPoolExecutor, wait
+from dataclasses import dataclass
+from typing import Callable
+
+EXECUTORS = ("inline", "thread", "process")
+DONE = object()
+
+
+@dataclass(frozen=True)
+class Stage:
+    """
+    one step, fn maps an item to the item of the next stage
+
+    inline runs fn in the stage's own thread, thread and process on a pool of workers,
+    a process stage needs a picklable fn (module level function or a partial of one)
+    """
+    name: str
+    fn: Callable
+    executor: str = "inline"
+    workers: int = 1
+
+    def __post_init__(self):
+        if self.executor not in EXECUTORS:
+            raise ValueError(f"unknown executor {self.executor!r} of stage {self.name!r}, "
+                             f"one of {', '.join(EXECUTORS)}")
+        if self.workers < 1:
+            raise ValueError(f"stage {self.name!r} needs at least one worker")
+
+
+class Failed:
+    """an exception of a stage on its way to the consumer"""
+    def __init__(self, stage: str, error: BaseException):
+        self.stage = stage
+        self.error = error
+
+
+def parse_stage(spec: str, names):
+    """'pdf=process:4' -> ("pdf", "process", 4), the worker count is optional (None)"""
+    name, sep, rest = spec.partition("=")
+    executor, _, workers = rest.partition(":")
+    valid_workers = workers == "" or workers.isdigit() and int(workers) > 0
+    if not sep or name not in names or executor not in EXECUTORS or not valid_workers:
+        raise ValueError(f"invalid stage {spec!r}, expected <stage>=<executor>[:<workers>] with a stage of "
+                         f"{', '.join(names)} and an executor of {', '.join(EXECUTORS)}")
+    return name, executor, int(workers) if workers else None
+
+
+def apply(fn, chunk: list):
+    return [fn(item) for item in chunk]
+
+
+class Pipeline:
+    """
+    runs items through the stages, the queues between them hold at most maxsize chunks of chunk_size
+    items, so a slow stage blocks the ones before it (backpressure) and memory stays bounded
+
+    a pooled stage keeps twice its workers in flight, ordered output keeps the input order, unordered
+    passes chunks on as they finish. an exception of a stage stops the pipeline and is raised in the
+    consumer, stages that must not stop a run return their errors as values
+    """
+    def __init__(self, stages: list[Stage], maxsize: int = 8, ordered: bool = True, chunk_size: int = 1):
+        if not stages:
+            raise ValueError("a pipeline needs at least one stage")
+        self.stages = list(stages)
+        self.maxsize = max(1, maxsize)
+        self.ordered = ordered
+        self.chunk_size = max(1, chunk_size)
+
+    def run(self, items):
+        """yields the result of the last stage for every item, items are read in a thread of their own"""
+        stop = threading.Event()
+        queues = [queue.Queue(self.maxsize) for _ in range(len(self.stages) + 1)]
+        pools = [self.pool(stage) for stage in self.stages]
+        threads = [threading.Thread(target=self.feed, args=(items, queues[0], stop), name="pipeline-source",
+                                    daemon=True)]
+        threads += [threading.Thread(target=self.drive, args=(stage, pool, queues[i], queues[i + 1], stop),
+                                     name=f"pipeline-{stage.name}", daemon=True)
+                    for i, (stage, pool) in enumerate(zip(self.stages, pools))]
+        for thread in threads:
+            thread.start()
+        try:
+            while (item := get(queues[-1], stop)) is not DONE:
+                if isinstance(item, Failed):
+                    raise item.error
+                yield from item[1]
+        finally:
+            stop.set()
+            for thread in threads:
+                thread.join()
+            for pool in pools:
+                if pool is not None:
+                    pool.shutdown(wait=True, cancel_futures=True)
+
+    @staticmethod
+    def pool(stage: Stage):
+        if stage.executor == "thread":
+            return ThreadPoolExecutor(stage.workers, thread_name_prefix=f"pipeline-{stage.name}")
+        if stage.executor == "process":
+            return ProcessPoolExecutor(stage.workers, mp_context=multiprocessing.get_context())
+        return None
+
+    def feed(self, items, out: queue.Queue, stop: threading.Event):
+        it = iter(items)
+        try:
+            for seq in itertools.count():
+                chunk = list(itertools.islice(it, self.chunk_size))
+                if not chunk:
+                    break
+                if not put(out, (seq, chunk), stop):
+                    return
+        except BaseException as e:  # reading the input failed, the consumer raises it
+            put(out, Failed("source", e), stop)
+            return
+        put(out, DONE, stop)
+
+    def drive(self, stage: Stage, pool, inbox: queue.Queue, out: queue.Queue, stop: threading.Event):
+        try:
+            self.run_stage(stage, pool, inbox, out, stop)
+        except BaseException as e:  # e.g. a pool that cannot start
+            put(out, Failed(stage.name, e), stop)
+
+    def run_stage(self, stage: Stage, pool, inbox: queue.Queue, out: queue.Queue, stop: threading.Event):
+        """moves chunks from inbox through the stage to out until the input ends or the run stops"""
+        in_order = collections.deque()  # (seq, future) in input order
+        pending = {}  # future -> seq
+
+        def emit(seq, future):
+            try:
+                return put(out, (seq, future.result()), stop)
+            except BaseException as e:
+                put(out, Failed(stage.name, e), stop)
+                return False
+
+        def drain(keep: int):
+            """passes finished chunks on until at most keep are in flight"""
+            while self.ordered and len(in_order) > keep:
+                if not emit(*in_order.popleft()):
+                    return False
+            while not self.ordered and len(pending) > keep:
+                done, _ = wait(pending, return_when=FIRST_COMPLETED)
+                for future in done:
+                    if not emit(pending.pop(future), future):
+                        return False
+            return True
+
+        while True:
+            item = get(inbox, stop)
+            if item is DONE or isinstance(item, Failed):
+                if item is not DONE or drain(0):
+                    put(out, item, stop)
+                return
+            seq, chunk = item
+            if pool is None:
+                try:
+                    results = apply(stage.fn, chunk)
+                except BaseException as e:
+                    put(out, Failed(stage.name, e), stop)
+                    return
+                if not put(out, (seq, results), stop):
+                    return
+                continue
+            future = pool.submit(apply, stage.fn, chunk)
+            if self.ordered:
+                in_order.append((seq, future))
+            else:
+                pending[future] = seq
+            if not drain(2 * stage.workers - 1):
+                return
+
+
+def put(q: queue.Queue, item, stop: threading.Event):
+    """waits for room in the bounded queue, False when the run stopped first"""
+    while not stop.is_set():
+        try:
+            q.put(item, timeout=0.1)
+            return True
+        except queue.Full:
+            pass
+    return False
+
+
+def get(q: queue.Queue, stop: threading.Event):
+    while not stop.is_set():
+        try:
+            return q.get(timeout=0.1)
+        except queue.Empty:
+            pass
+    return DONE
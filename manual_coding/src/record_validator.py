@@ -0,0 +1,119 @@
+"""Patient record validation, the checks are generated into one python function once"""
+from __future__ import annotations
+import json
+import math
+import re
+from pathlib import Path
+
+VESSELS = ("CCA", "ICA", "ECA")
+METRICS = ("psv_cm_s", "edv_cm_s", "imt_mm")
+DATE = re.compile(r"\d{4}-\d{2}-\d{2}")
+
+# field path -> (kind, required), kinds: id, str, date, age, dict, number
+# optional fields may be missing or null
+FIELDS = {
+    ("patient_id",): ("id", True),
+    ("name",): ("str", False),
+    ("timestamp",): ("date", False),
+    ("context",): ("dict", False),
+    ("context", "age_years"): ("age", False),
+    ("context", "sex"): ("str", False),
+    ("vitals",): ("dict", True),
+    ("vitals", "ica_cca_ratio"): ("number", False),
+}
+for _vessel in VESSELS:
+    FIELDS[("vitals", _vessel)] = ("dict", False)
+    for _metric in METRICS:
+        FIELDS[("vitals", _vessel, _metric)] = ("number", False)
+
+# the test each kind has to pass, a float in [0, inf) is checked by one chained comparison (false for nan)
+_NUMBER = "(type({v}) is float and 0.0 <= {v} < _inf) or (type({v}) is int and {v} >= 0)"
+_TESTS = {
+    "id": ("(type({v}) is str and {v} != '') or type({v}) is int", "a non empty string or integer"),
+    "str": ("type({v}) is str", "a string"),
+    "date": ("type({v}) is str and _date({v}) is not None", "an iso date"),
+    "age": ("type({v}) is int and 0 <= {v} <= 150", "an integer age"),
+    "dict": ("type({v}) is dict", "an object"),
+    "number": (_NUMBER, "a finite number >= 0"),
+}
+
+
+def _describe(value):
+    if isinstance(value, float) and not math.isfinite(value):
+        return repr(value)
+    return "null" if value is None else type(value).__name__
+
+
+def compile_validator(fields: dict = FIELDS):
+    """
+    validate(patient) -> list of reasons, empty for a valid record
+
+    the field table is turned into the source of a single function with every check inlined,
+    nothing is looked up in the table while validating
+    """
+    lines = ["def validate(patient):", "    errors = []",
+             "    if type(patient) is not dict:",
+             "        return ['record: expected an object, got ' + _describe(patient)]"]
+
+    def emit(parent, var, depth):
+        for path, (kind, required) in fields.items():
+            if path[:-1] != parent:
+                continue
+            child = "v%d" % len(lines)
+            name = ".".join(path)
+            test, expected = _TESTS[kind]
+            pad = "    " * depth
+            lines.append(f"{pad}{child} = {var}.get({path[-1]!r})")
+            if required:
+                lines.append(f"{pad}if {child} is None:")
+                lines.append(f"{pad}    errors.append({name + ': required'!r})")
+                lines.append(f"{pad}elif not ({test.format(v=child)}):")
+            else:
+                lines.append(f"{pad}if {child} is not None and not ({test.format(v=child)}):")
+            lines.append(f"{pad}    errors.append({name + ': expected ' + expected + ', got '!r} + _describe({child}))")
+            if kind == "dict":
+                lines.append(f"{pad}elif {child} is not None:")
+                size = len(lines)
+                emit(path, child, depth + 1)
+                if len(lines) == size:
+                    lines.append(f"{pad}    pass")
+
+    emit((), "patient", 1)
+    lines.append("    return errors")
+    source = "\n".join(lines) + "\n"
+    namespace = {"_inf": math.inf, "_describe": _describe, "_date": DATE.match}
+    exec(compile(source, "<record_validator>", "exec"), namespace)
+    validate = namespace["validate"]
+    validate.source = source
+    return validate
+
+
+validate_record = compile_validator()
+
+
+class Quarantine:
+    """json lines file of the rejected records with their reasons, created on the first one"""
+
+    def __init__(self, path: Path):
+        self.path = Path(path)
+        self.count = 0
+        self._file = None
+
+    def add(self, source, line: int, reasons: list[str], data=None):
+        if self._file is None:
+            self.path.parent.mkdir(parents=True, exist_ok=True)
+            self._file = self.path.open("a", encoding="utf-8")
+        entry = {"source": str(source), "line": line, "reasons": reasons, "record": data}
+        self._file.write(json.dumps(entry, default=repr) + "\n")
+        self.count += 1
+
+    def close(self):
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
@@ -0,0 +1,181 @@
+"""Content addressed cache of rendered reports"""
+from __future__ import annotations
+import hashlib
+import json
+import os
+import shutil
+import sqlite3
+import time
+from pathlib import Path
+
+# editing any of these modules invalidates every cached report
+CODE_MODULES = ("interpreter.py", "report_generator.py", "main.py", "render_cache.py")
+MARKER = ".render_key"
+
+_code_version: str | None = None
+
+
+def code_version():
+    """hash of the report code, computed once per process"""
+    global _code_version
+    if _code_version is None:
+        h = hashlib.sha256()
+        here = Path(__file__).parent
+        for name in CODE_MODULES:
+            path = here / name
+            if path.exists():
+                h.update(name.encode())
+                h.update(path.read_bytes())
+        _code_version = h.hexdigest()
+    return _code_version
+
+
+def canonical_json(data: dict):
+    """stable serialization of a record used for hashing"""
+    return json.dumps(data, sort_keys=True, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+
+
+class RenderCache:
+    """
+    on disk cache of rendered artifacts keyed by a hash of the input, the template and the code
+
+    artifacts are stored in root/objects/<key[:2]>/<key>/, a sqlite index keeps their size and
+    last access time for size based LRU eviction and the hit/miss counters of all runs
+
+    on a hit the artifacts are copied to the output directory, unless it already has them
+    (recorded in a .render_key marker), then nothing is written
+    """
+    def __init__(self, root: Path, max_bytes: int = 1 << 30):
+        self.root = Path(root)
+        self.max_bytes = max_bytes
+        self.root.mkdir(parents=True, exist_ok=True)
+        self._db = sqlite3.connect(str(self.root / "index.sqlite"), timeout=30, isolation_level=None)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        # losing the last few index updates on power loss only costs a re-render
+        self._db.execute("PRAGMA synchronous=NORMAL")
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS entries ("
+            " key TEXT PRIMARY KEY, size INTEGER NOT NULL, last_access REAL NOT NULL)")
+        self._db.execute("CREATE INDEX IF NOT EXISTS entries_lru ON entries(last_access)")
+        self._db.execute("CREATE TABLE IF NOT EXISTS counters (name TEXT PRIMARY KEY, value INTEGER NOT NULL)")
+        self._templates: dict[tuple, bytes] = {}
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def close(self):
+        self._db.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def _template_digest(self, template_path: Path):
+        # the template includes and extends its siblings, all of them are part of the key
+        path = Path(template_path).resolve()
+        files = [path] + sorted(p for p in path.parent.glob("*.html") if p != path)
+        key = tuple((p, p.stat().st_mtime_ns) for p in files)
+        digest = self._templates.get(key)
+        if digest is None:
+            h = hashlib.sha256()
+            for p in files:
+                h.update(p.name.encode())
+                h.update(p.read_bytes())
+            digest = h.digest()
+            self._templates = {key: digest}
+        return digest
+
+    def key_for(self, data: dict, template_path: Path, variant: str = ""):
+        """cache key for rendering data with template_path under the current code, variant keys other outputs apart"""
+        h = hashlib.sha256()
+        h.update(code_version().encode())
+        h.update(self._template_digest(template_path))
+        h.update(canonical_json(data))
+        if variant:
+            h.update(b"\0" + variant.encode())
+        return h.hexdigest()
+
+    def _entry_dir(self, key: str):
+        return self.root / "objects" / key[:2] / key
+
+    def _count(self, name: str):
+        self._db.execute(
+            "INSERT INTO counters(name, value) VALUES (?, 1)"
+            " ON CONFLICT(name) DO UPDATE SET value = value + 1", (name,))
+
+    def get(self, key: str, out_dir: Path, names: tuple[str, ...]):
+        """
+        puts the cached artifacts names of key in out_dir
+
+        Returns: True on a hit, False on a miss (nothing is written)
+        """
+        row = self._db.execute("SELECT size FROM entries WHERE key = ?", (key,)).fetchone()
+        entry = self._entry_dir(key)
+        if row is None or not all((entry / n).exists() for n in names):
+            self.misses += 1
+            self._count("misses")
+            return False
+
+        marker = out_dir / MARKER
+        up_to_date = (marker.exists() and marker.read_text(encoding="ascii") == key
+                      and all((out_dir / n).exists() for n in names))
+        if not up_to_date:
+            out_dir.mkdir(parents=True, exist_ok=True)
+            for n in names:
+                shutil.copyfile(entry / n, out_dir / n)
+            marker.write_text(key, encoding="ascii")
+        self._db.execute("UPDATE entries SET last_access = ? WHERE key = ?", (time.time(), key))
+        self.hits += 1
+        self._count("hits")
+        return True
+
+    def put(self, key: str, out_dir: Path, names: tuple[str, ...]):
+        """stores the freshly rendered artifacts names from out_dir under key"""
+        entry = self._entry_dir(key)
+        tmp = entry.with_name(f"{key}.tmp{os.getpid()}")
+        tmp.mkdir(parents=True, exist_ok=True)
+        for n in names:
+            shutil.copyfile(out_dir / n, tmp / n)
+        if entry.exists():
+            # an entry stored with other artifacts (html only run) gets the new ones added
+            for n in names:
+                if not (entry / n).exists():
+                    os.replace(tmp / n, entry / n)
+            shutil.rmtree(tmp, ignore_errors=True)
+        else:
+            os.replace(tmp, entry)
+        size = sum(f.stat().st_size for f in entry.iterdir())
+        self._db.execute("INSERT OR REPLACE INTO entries(key, size, last_access) VALUES (?, ?, ?)",
+                         (key, size, time.time()))
+        (out_dir / MARKER).write_text(key, encoding="ascii")
+        self._evict()
+
+    def _evict(self):
+        total = self._db.execute("SELECT COALESCE(SUM(size), 0) FROM entries").fetchone()[0]
+        if total <= self.max_bytes:
+            return
+        for key, size in self._db.execute("SELECT key, size FROM entries ORDER BY last_access").fetchall():
+            if total <= self.max_bytes:
+                break
+            self._db.execute("DELETE FROM entries WHERE key = ?", (key,))
+            shutil.rmtree(self._entry_dir(key), ignore_errors=True)
+            total -= size
+            self.evictions += 1
+            self._count("evictions")
+
+    def stats(self):
+        """counters of this instance, the persisted totals and the current size"""
+        persisted = dict(self._db.execute("SELECT name, value FROM counters").fetchall())
+        entries, size = self._db.execute("SELECT COUNT(*), COALESCE(SUM(size), 0) FROM entries").fetchone()
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "total_hits": persisted.get("hits", 0),
+            "total_misses": persisted.get("misses", 0),
+            "total_evictions": persisted.get("evictions", 0),
+            "entries": entries,
+            "bytes": size,
+        }
@@ -1,13 +1,22 @@
 """PDF HTML Report generation module for patient report"""
 from __future__ import annotations
+import json
+import os
+import re
+import threading
+from collections import OrderedDict
 from pathlib import Path
-from typing import Any
-from weasyprint import HTML
+from typing import TYPE_CHECKING, Any
 
-from jinja2 import Environment, FileSystemLoader, select_autoescape
+# jinja2 and weasyprint are imported on first use, interpreting or html only runs never load weasyprint
+if TYPE_CHECKING:
+    from jinja2 import Environment
+    from weasyprint import CSS
 
 def _fmt(v : Any):
-    """Formats float numbers to string"""
+    """Formats float numbers to string, n/a for missing or non numeric values"""
+    if type(v) not in (int, float) or v != v:
+        return "n/a"
     return f"{v:.2f}".rstrip('0').rstrip('.')
 
 def _unit_for(metric: str):
@@ -25,19 +34,33 @@ def _section_from_vitals(vitals: dict):
     out_sections = []
     for section in sections:
         val = vitals.get(section)
+        if not isinstance(val, dict):
+            val = {}
         rows = []
         for k, v in val.items():
             rows.append({"metric": k, "value": _fmt(v), "unit": _unit_for(k)})
         out_sections.append({"section": section, "rows": rows})
 
-    derived = [ {"metric": "ICA/CCA Ratio","value": _fmt(vitals["ica_cca_ratio"]),"unit": ""}]
+    derived = [ {"metric": "ICA/CCA Ratio","value": _fmt(vitals.get("ica_cca_ratio")),"unit": ""}]
    
     return out_sections, derived
 
-def build_report_model(patient:dict, findings:list[str], risk_level:str):
-    """Builds report model for the template"""
-    vitals = patient.get("vitals")
-    sections, derived = _section_from_vitals(vitals)
+def _section_from_record(record):
+    """sections of a PatientRecord, read from its value array"""
+    out_sections = []
+    for section in ["ICA", "CCA", "ECA"]:
+        rows = [{"metric": k, "value": _fmt(v), "unit": _unit_for(k)} for k, v in record.vessel(section).items()]
+        out_sections.append({"section": section, "rows": rows})
+    ratio = record.value(None, "ica_cca_ratio")
+    derived = [{"metric": "ICA/CCA Ratio", "value": _fmt(ratio), "unit": ""}]
+    return out_sections, derived
+
+def build_report_model(patient:dict, findings:list[str], risk_level:str, trend: dict | None = None):
+    """Builds report model for the template, patient is a dict or a PatientRecord, trend from ExamHistory"""
+    if hasattr(patient, "POSITIONS"):
+        sections, derived = _section_from_record(patient)
+    else:
+        sections, derived = _section_from_vitals(patient.get("vitals") or {})
     return {
         "patient_id": patient.get("patient_id"),
         "patient_name": patient.get("name"),
@@ -45,19 +68,228 @@ def build_report_model(patient:dict, findings:list[str], risk_level:str):
         "vital_sections": sections,
         "derived_metrics": derived,
         "findings": findings,
-        "risk_level": risk_level
+        "risk_level": risk_level,
+        "trend": trend
     }
-def generate_html_report(model:dict, template_path:Path):
+class ReportRenderer:
+    """
+    reusable renderer, compiles each template once
+
+    templates are kept in a bounded LRU keyed by (path, mtime) so edited templates
+    are recompiled, one environment is kept per folder that still has cached templates,
+    bytecode_cache_dir persists compiled templates between processes
+    """
+    def __init__(self, cache_size: int = 32, bytecode_cache_dir: Path | None = None):
+        if cache_size < 1:
+            raise ValueError("cache_size must be >= 1")
+        self.cache_size = cache_size
+        self._bytecode_cache = None
+        if bytecode_cache_dir is not None:
+            from jinja2 import FileSystemBytecodeCache
+
+            Path(bytecode_cache_dir).mkdir(parents=True, exist_ok=True)
+            self._bytecode_cache = FileSystemBytecodeCache(str(bytecode_cache_dir))
+        self._envs: dict[Path, Environment] = {}
+        self._templates: OrderedDict = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def _environment(self, template_dir: Path):
+        """one environment per template folder"""
+        if template_dir not in self._envs:
+            from jinja2 import Environment, FileSystemLoader, select_autoescape
+
+            self._envs[template_dir] = Environment(
+                loader=FileSystemLoader(template_dir),
+                autoescape=select_autoescape(['html', 'xml']),
+                trim_blocks=True,
+                lstrip_blocks=True,
+                bytecode_cache=self._bytecode_cache,
+                # jinja's own cache only serves included templates (report_body.html), auto reloaded when edited
+                cache_size=self.cache_size,
+                auto_reload=True
+            )
+        return self._envs[template_dir]
+
+    def get_template(self, template_path: Path):
+        """returns compiled template, compiles only new or modified files"""
+        path = Path(template_path).resolve()
+        key = (path, path.stat().st_mtime_ns)
+        with self._lock:
+            if key in self._templates:
+                self._templates.move_to_end(key)
+                self.hits += 1
+                return self._templates[key]
+            self.misses += 1
+            template = self._environment(path.parent).get_template(path.name)
+            for old in [k for k in self._templates if k[0] == path]:
+                del self._templates[old]
+            self._templates[key] = template
+            while len(self._templates) > self.cache_size:
+                self._templates.popitem(last=False)
+            live_dirs = {k[0].parent for k in self._templates}
+            for template_dir in [d for d in self._envs if d not in live_dirs]:
+                del self._envs[template_dir]
+            return template
+
+    def render(self, template_path: Path, model: dict):
+        """renders the template with the model"""
+        return self.get_template(template_path).render(model)
+
+    def clear(self):
+        """forgets compiled templates, the bytecode cache on disk is kept"""
+        with self._lock:
+            self._templates.clear()
+            self._envs.clear()
+
+_shared_renderer = ReportRenderer()
+
+def generate_html_report(model:dict, template_path:Path, renderer: ReportRenderer | None = None):
     """generates HTML report based on model and template"""
-    env = Environment(
-        loader=FileSystemLoader(template_path.parent),
-        autoescape=select_autoescape(['html', 'xml']),
-        trim_blocks=True,
-        lstrip_blocks=True
-    )
-    return env.get_template(template_path.name).render(model)
-
-def save_pdf(html:str, output:Path, template_dir: Path):
-    """saves the PDF"""
+    return (renderer or _shared_renderer).render(template_path, model)
+
+STYLE_BLOCK = re.compile(r"<style[^>]*>(.*?)</style>", re.IGNORECASE | re.DOTALL)
+
+def current_rss_bytes():
+    """returns resident memory of this process or None"""
+    try:
+        import psutil
+        return int(psutil.Process().memory_info().rss)
+    except ImportError:
+        pass
+    try:
+        with open("/proc/self/statm", "r", encoding="ascii") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError, IndexError, AttributeError):
+        return None
+
+class PdfEngine:
+    """
+    reusable WeasyPrint engine for many reports from one template
+
+    one FontConfiguration is shared by all documents and the template <style> blocks
+    are parsed once, identical <style> blocks are stripped from the HTML and the
+    parsed CSS is passed as stylesheets instead (user origin instead of author origin,
+    same result because the template has no other author css)
+    should_recycle() turns true after max_documents or when RSS is over max_rss_bytes
+    """
+    def __init__(self, template_path: Path | None = None, max_documents: int | None = None,
+                 max_rss_bytes: int | None = None):
+        from weasyprint import CSS
+        from weasyprint.text.fonts import FontConfiguration
+
+        self.font_config = FontConfiguration()
+        self.max_documents = max_documents
+        self.max_rss_bytes = max_rss_bytes
+        self.documents = 0
+        self._style_sources: set[str] = set()
+        self._stylesheets: list[CSS] = []
+        if template_path is not None:
+            for block in STYLE_BLOCK.findall(Path(template_path).read_text(encoding="utf-8")):
+                if block not in self._style_sources:
+                    self._style_sources.add(block)
+                    self._stylesheets.append(CSS(string=block, base_url=str(Path(template_path).parent),
+                                                 font_config=self.font_config))
+
+    def _strip_known_styles(self, html: str):
+        """removes the <style> blocks that are already parsed"""
+        if not self._style_sources:
+            return html
+        return STYLE_BLOCK.sub(lambda m: "" if m.group(1) in self._style_sources else m.group(0), html)
+
+    def render(self, html: str, base_url: str | None = None):
+        """lays out the html with shared fonts and stylesheets"""
+        from weasyprint import HTML
+
+        doc = HTML(string=self._strip_known_styles(html), base_url=base_url)
+        return doc.render(stylesheets=self._stylesheets, font_config=self.font_config)
+
+    def write_pdf(self, html: str, output: Path | None = None, base_url: str | None = None):
+        """writes the PDF to output or returns the bytes"""
+        if output is not None:
+            output.parent.mkdir(parents=True, exist_ok=True)
+        result = self.render(html, base_url).write_pdf(None if output is None else str(output))
+        self.documents += 1
+        return result
+
+    def should_recycle(self):
+        """true when the document or memory budget is used up"""
+        if self.max_documents is not None and self.documents >= self.max_documents:
+            return True
+        if self.max_rss_bytes is not None:
+            rss = current_rss_bytes()
+            return rss is not None and rss > self.max_rss_bytes
+        return False
+
+def save_pdf(html:str, output:Path, template_dir: Path, engine: PdfEngine | None = None):
+    """saves the PDF, pass an engine to reuse fonts and stylesheets between reports"""
+    if engine is not None:
+        engine.write_pdf(html, output, base_url=str(template_dir))
+        return
+    from weasyprint import HTML
+
     output.parent.mkdir(parents=True, exist_ok=True)
     HTML(string=html, base_url=str(template_dir)).write_pdf(str(output))
+
+def _page_ranges(pages, count: int):
+    """first and last page (1-based) of each patient, found from the patient-<n> anchors"""
+    first = [None] * count
+    for number, page in enumerate(pages, start=1):
+        for anchor in page.anchors:
+            if anchor.startswith("patient-"):
+                i = int(anchor[len("patient-"):])
+                if 0 <= i < count and first[i] is None:
+                    first[i] = number
+    ranges = [None] * count
+    next_start = len(pages) + 1
+    for i in range(count - 1, -1, -1):
+        if first[i] is not None:
+            ranges[i] = [first[i], max(first[i], next_start - 1)]
+            next_start = first[i]
+    return ranges
+
+def save_cohort_report(models, template_dir: Path, output_dir: Path, output_format: str = "pdf",
+                       renderer: ReportRenderer | None = None):
+    """
+    renders many report models into one document, cohort.html and cohort.pdf (pdf format)
+
+    every patient is a section starting on a new page so weasyprint lays out and embeds fonts once,
+    the html is streamed to disk with jinja generate() and never held as one string, the index
+    (also written to cohort_index.json) has the first and last page of every patient
+    """
+    output_dir.mkdir(parents=True, exist_ok=True)
+    index = []
+
+    def numbered():
+        for model in models:
+            index.append({"index": len(index), "patient_id": model.get("patient_id")})
+            yield {**model, "index": len(index) - 1}
+
+    template = (renderer or _shared_renderer).get_template(Path(template_dir) / "cohort_template.html")
+    html_path = output_dir / "cohort.html"
+    with open(html_path, "w", encoding="utf-8") as f:
+        f.writelines(template.generate(reports=numbered()))
+
+    pages = None
+    if output_format == "pdf":
+        from weasyprint import HTML
+
+        document = HTML(filename=str(html_path)).render()
+        pages = len(document.pages)
+        for entry, page_range in zip(index, _page_ranges(document.pages, len(index))):
+            entry["pages"] = page_range
+        document.write_pdf(str(output_dir / "cohort.pdf"))
+    result = {"patients": len(index), "pages": pages, "reports": index}
+    (output_dir / "cohort_index.json").write_text(json.dumps(result, indent=2), encoding="utf-8")
+    return result
+
+def save_cohort_summary(summary: dict, template_dir: Path, output_dir: Path, output_format: str = "pdf",
+                        renderer: ReportRenderer | None = None):
+    """writes a CohortStats summary as cohort_summary.json, .html and .pdf (pdf format)"""
+    output_dir.mkdir(parents=True, exist_ok=True)
+    (output_dir / "cohort_summary.json").write_text(json.dumps(summary, indent=2), encoding="utf-8")
+    html = generate_html_report(summary, Path(template_dir) / "cohort_summary_template.html", renderer)
+    (output_dir / "cohort_summary.html").write_text(html, encoding="utf-8")
+    if output_format == "pdf":
+        save_pdf(html, output_dir / "cohort_summary.pdf", Path(template_dir))
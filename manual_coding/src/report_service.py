@@ -0,0 +1,209 @@
+"""Local http service that renders reports, asyncio streams in front of a warmed pdf process pool"""
+from __future__ import annotations
+import asyncio
+import hashlib
+import json
+import os
+import time
+from collections import Counter, deque
+from concurrent.futures import ProcessPoolExecutor
+from urllib.parse import parse_qs, urlsplit
+
+MAX_BODY_BYTES = 1 << 20
+CONTENT_TYPES = {"html": "text/html; charset=utf-8", "pdf": "application/pdf"}
+REASONS = {200: "OK", 400: "Bad Request", 404: "Not Found", 405: "Method Not Allowed", 413: "Payload Too Large",
+           422: "Unprocessable Entity", 429: "Too Many Requests", 500: "Internal Server Error",
+           503: "Service Unavailable"}
+
+
+class BadRequest(Exception):
+    """a request that cannot be parsed, answered with status and the connection is closed"""
+    def __init__(self, status: int, message: str):
+        super().__init__(message)
+        self.status = status
+
+
+async def read_request(reader: asyncio.StreamReader, max_body_bytes: int = MAX_BODY_BYTES):
+    """(method, path, query, body, keep_alive) of the next request, None when the client is done"""
+    try:
+        head = await reader.readuntil(b"\r\n\r\n")
+    except asyncio.IncompleteReadError as e:
+        if e.partial.strip():
+            raise BadRequest(400, "incomplete request") from e
+        return None
+    except asyncio.LimitOverrunError as e:
+        raise BadRequest(400, "request head too large") from e
+    request_line, *lines = head.decode("latin-1").split("\r\n")
+    parts = request_line.split(" ")
+    if len(parts) != 3:
+        raise BadRequest(400, "malformed request line")
+    method, target, version = parts
+    headers = {}
+    for line in lines:
+        name, _, value = line.partition(":")
+        headers[name.strip().lower()] = value.strip()
+    if "transfer-encoding" in headers:
+        raise BadRequest(400, "send the body with content-length")
+    length = headers.get("content-length", "0")
+    if not length.isdigit():
+        raise BadRequest(400, "invalid content-length")
+    if int(length) > max_body_bytes:
+        raise BadRequest(413, f"body larger than {max_body_bytes} bytes")
+    body = await reader.readexactly(int(length))
+    connection = headers.get("connection", "").lower()
+    keep_alive = connection != "close" if version == "HTTP/1.1" else connection == "keep-alive"
+    url = urlsplit(target)
+    query = {k: v[-1] for k, v in parse_qs(url.query).items()}
+    return method, url.path, query, body, keep_alive
+
+
+def response_bytes(status: int, body: bytes, content_type: str, keep_alive: bool, headers: dict | None = None):
+    head = [f"HTTP/1.1 {status} {REASONS.get(status, 'Unknown')}", f"Content-Type: {content_type}",
+            f"Content-Length: {len(body)}", "Connection: " + ("keep-alive" if keep_alive else "close")]
+    head += [f"{k}: {v}" for k, v in (headers or {}).items()]
+    return ("\r\n".join(head) + "\r\n\r\n").encode("latin-1") + body
+
+
+def json_reply(status: int, obj, headers: dict | None = None):
+    return status, json.dumps(obj).encode("utf-8"), "application/json", headers
+
+
+def percentile(sorted_values: list, q: float):
+    """nearest rank percentile, q in 0..100"""
+    if not sorted_values:
+        return None
+    return sorted_values[max(0, min(len(sorted_values), -(-len(sorted_values) * q // 100)) - 1)]
+
+
+class ReportService:
+    """
+    POST /report?format=html|pdf with a patient json renders its report, GET /health and GET /metrics
+    give the state as json
+
+    render_html(patient) -> str runs inline on the event loop (interpretation and template), the pdf
+    layout goes to a process pool: pdf_job(html) -> bytes and warm() -> error or None must be picklable
+    top level functions, warm runs in every worker before the first request (weasyprint import, fonts,
+    stylesheets), an error it returns turns pdf requests into 503 while html keeps working. pdf_input
+    (default render_html) makes what pdf_job gets from the patient, e.g. the report model for a job
+    that draws the pdf itself
+
+    backpressure: more than max_pending pdf jobs queued or running are answered 429 with Retry-After
+    right away, so a burst never builds an unbounded queue, a pdf request with the same body as a
+    job in flight waits for that job instead (coalescing), validate(patient) -> reasons gives 422
+    """
+    def __init__(self, render_html, pdf_job, warm, validate=None, workers: int | None = None,
+                 max_pending: int | None = None, max_body_bytes: int = MAX_BODY_BYTES, pdf_input=None):
+        self.render_html = render_html
+        self.pdf_input = pdf_input or render_html
+        self.pdf_job = pdf_job
+        self.warm = warm
+        self.validate = validate
+        self.workers = workers or os.cpu_count() or 1
+        self.max_pending = max_pending or 4 * self.workers
+        self.max_body_bytes = max_body_bytes
+        self.pool = None
+        self.server = None
+        self.pdf_error = None
+        self.inflight = {}  # sha256 of the body -> future of its pdf
+        self.counts = Counter()
+        self.latencies = deque(maxlen=4096)
+        self.started = time.monotonic()
+
+    async def start(self, host: str = "127.0.0.1", port: int = 0):
+        """starts and warms the pool, then listens, returns (host, port)"""
+        self.pool = ProcessPoolExecutor(max_workers=self.workers, initializer=self.warm)
+        loop = asyncio.get_running_loop()
+        errors = await asyncio.gather(*(loop.run_in_executor(self.pool, self.warm) for _ in range(self.workers)))
+        self.pdf_error = next((e for e in errors if e), None)
+        self.started = time.monotonic()
+        self.server = await asyncio.start_server(self.handle, host, port)
+        return self.server.sockets[0].getsockname()[:2]
+
+    async def close(self):
+        if self.server is not None:
+            self.server.close()
+            await self.server.wait_closed()
+        if self.pool is not None:
+            self.pool.shutdown(cancel_futures=True)
+
+    async def handle(self, reader, writer):
+        try:
+            while True:
+                try:
+                    request = await read_request(reader, self.max_body_bytes)
+                except BadRequest as e:
+                    self.counts[e.status] += 1
+                    writer.write(response_bytes(*json_reply(e.status, {"error": str(e)})[:3], keep_alive=False))
+                    await writer.drain()
+                    return
+                if request is None:
+                    return
+                method, path, query, body, keep_alive = request
+                start = time.perf_counter()
+                try:
+                    status, payload, content_type, headers = await self.dispatch(method, path, query, body)
+                except Exception as e:  # one broken request must not stop the service
+                    status, payload, content_type, headers = json_reply(500, {"error": f"{type(e).__name__}: {e}"})
+                writer.write(response_bytes(status, payload, content_type, keep_alive, headers))
+                await writer.drain()
+                self.counts[status] += 1
+                self.latencies.append(time.perf_counter() - start)
+                if not keep_alive:
+                    return
+        except ConnectionError:
+            pass
+        finally:
+            writer.close()
+
+    async def dispatch(self, method: str, path: str, query: dict, body: bytes):
+        if path in ("/health", "/metrics"):
+            if method != "GET":
+                return json_reply(405, {"error": "use GET"})
+            return json_reply(200, self.health() if path == "/health" else self.metrics())
+        if path != "/report":
+            return json_reply(404, {"error": f"no such endpoint {path}"})
+        if method != "POST":
+            return json_reply(405, {"error": "use POST"})
+        output_format = query.get("format", "pdf")
+        if output_format not in CONTENT_TYPES:
+            return json_reply(400, {"error": "format is html or pdf"})
+        try:
+            patient = json.loads(body)
+        except ValueError as e:
+            return json_reply(400, {"error": f"invalid json: {e}"})
+        if not isinstance(patient, dict):
+            return json_reply(400, {"error": "the body must be a json object"})
+        reasons = self.validate(patient) if self.validate else []
+        if reasons:
+            return json_reply(422, {"error": "invalid record", "reasons": reasons})
+        if output_format == "html":
+            return 200, self.render_html(patient).encode("utf-8"), CONTENT_TYPES["html"], None
+        if self.pdf_error:
+            return json_reply(503, {"error": f"pdf rendering unavailable: {self.pdf_error}"})
+
+        key = hashlib.sha256(body).digest()
+        job = self.inflight.get(key)
+        if job is not None:
+            self.counts["coalesced"] += 1
+        elif len(self.inflight) >= self.max_pending:
+            self.counts["rejected"] += 1
+            return json_reply(429, {"error": "too many pdf renders pending"}, {"Retry-After": "1"})
+        else:
+            job = asyncio.get_running_loop().run_in_executor(self.pool, self.pdf_job, self.pdf_input(patient))
+            self.inflight[key] = job
+            job.add_done_callback(lambda _: self.inflight.pop(key, None))
+        # shielded, a client that goes away does not cancel a job others wait for
+        return 200, await asyncio.shield(job), CONTENT_TYPES["pdf"], None
+
+    def health(self):
+        return {"status": "ok", "workers": self.workers, "pdf": self.pdf_error is None, "pdf_error": self.pdf_error,
+                "pending": len(self.inflight), "max_pending": self.max_pending}
+
+    def metrics(self):
+        latencies = sorted(self.latencies)
+        return {"uptime_s": round(time.monotonic() - self.started, 3),
+                "responses": {str(k): v for k, v in self.counts.items() if isinstance(k, int)},
+                "coalesced": self.counts["coalesced"], "rejected": self.counts["rejected"],
+                "pending": len(self.inflight),
+                "latency_ms": {f"p{q}": None if not latencies else round(percentile(latencies, q) * 1000, 3)
+                               for q in (50, 90, 99)}}
@@ -0,0 +1,179 @@
+"""Watches a folder of exam json files and renders only the new or changed ones"""
+from __future__ import annotations
+import hashlib
+import os
+import sqlite3
+import sys
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+
+INDEX_NAME = ".watch_index.sqlite"
+
+
+def file_sha256(path: Path):
+    h = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            h.update(block)
+    return h.hexdigest()
+
+
+class WatchIndex:
+    """
+    file name -> size, mtime, sha256, output and error of its last render, kept in sqlite so a
+    restarted watcher knows what is already rendered
+    """
+    def __init__(self, path: Path):
+        Path(path).parent.mkdir(parents=True, exist_ok=True)
+        # the watcher may run in another thread than the one that created it
+        self._db = sqlite3.connect(str(path), timeout=30, isolation_level=None, check_same_thread=False)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS files (name TEXT PRIMARY KEY, size INTEGER NOT NULL,"
+            " mtime_ns INTEGER NOT NULL, sha256 TEXT NOT NULL, output TEXT NOT NULL, error TEXT)")
+
+    def close(self):
+        self._db.close()
+
+    def get(self, name: str):
+        """(size, mtime_ns, sha256, output, error) or None"""
+        return self._db.execute("SELECT size, mtime_ns, sha256, output, error FROM files WHERE name = ?",
+                                (name,)).fetchone()
+
+    def names(self):
+        return {row[0] for row in self._db.execute("SELECT name FROM files")}
+
+    def record(self, name: str, size: int, mtime_ns: int, sha256: str, output: str, error: str | None = None):
+        self._db.execute("INSERT OR REPLACE INTO files VALUES (?, ?, ?, ?, ?, ?)",
+                         (name, size, mtime_ns, sha256, output, error))
+
+    def touch(self, name: str, size: int, mtime_ns: int):
+        self._db.execute("UPDATE files SET size = ?, mtime_ns = ? WHERE name = ?", (size, mtime_ns, name))
+
+    def forget(self, name: str):
+        self._db.execute("DELETE FROM files WHERE name = ?", (name,))
+
+
+class FolderWatcher:
+    """
+    polls watch_dir for *.json exams and renders new or changed ones on a process pool
+
+    render(exam_path, output_path) must be a picklable top level function, the output of
+    <name>.json is output_dir/<name>.<suffix>. a file is rendered once its size and mtime did not
+    change for debounce_s seconds (no half written files, one render per burst of writes), a new
+    mtime with the same sha256 only updates the index, failed files are retried when they change,
+    a file known to be up to date is only stat'ed until it changes (deleted outputs are noticed at start)
+    """
+    def __init__(self, watch_dir: Path, output_dir: Path, render, suffix: str = ".pdf", workers: int | None = None,
+                 debounce_s: float = 2.0, clock=time.monotonic):
+        self.watch_dir = Path(watch_dir)
+        self.output_dir = Path(output_dir)
+        self.render = render
+        self.suffix = suffix
+        self.debounce_s = debounce_s
+        self.clock = clock
+        self.index = WatchIndex(self.output_dir / INDEX_NAME)
+        self.pool = ProcessPoolExecutor(max_workers=workers or os.cpu_count() or 1)
+        self.seen: dict[str, tuple] = {}     # name -> ((size, mtime_ns), since)
+        self.pending: dict[str, tuple] = {}  # name -> (future, (size, mtime_ns), sha256, output)
+        self.settled: dict[str, tuple] = {}  # name -> (size, mtime_ns) it is known to be rendered at
+        self.reconciled = False
+        self.rendered = self.failed = self.unchanged = 0
+
+    def close(self):
+        self.collect(wait=True)
+        self.pool.shutdown()
+        self.index.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def poll(self):
+        """one scan of the folder, returns the number of files sent to the pool"""
+        now = self.clock()
+        present = set()
+        submitted = 0
+        for entry in os.scandir(self.watch_dir):
+            if not entry.name.endswith(".json") or not entry.is_file():
+                continue
+            present.add(entry.name)
+            try:
+                st = entry.stat()
+            except FileNotFoundError:
+                continue
+            signature = (st.st_size, st.st_mtime_ns)
+            if self.seen.get(entry.name, (None,))[0] != signature:
+                self.seen[entry.name] = (signature, now)
+            if (now - self.seen[entry.name][1] < self.debounce_s or entry.name in self.pending
+                    or self.settled.get(entry.name) == signature):
+                continue
+            output = self.output_dir / (entry.name[:-len(".json")] + self.suffix)
+            indexed = self.index.get(entry.name)
+            done = indexed is not None and (indexed[4] is not None or Path(indexed[3]).exists())
+            if done and indexed[:2] == signature:
+                self.settled[entry.name] = signature
+                continue
+            try:
+                sha = file_sha256(entry.path)
+            except OSError:
+                continue
+            if done and indexed[2] == sha:
+                self.index.touch(entry.name, *signature)
+                self.settled[entry.name] = signature
+                self.unchanged += 1
+                continue
+            future = self.pool.submit(self.render, Path(entry.path), output)
+            self.pending[entry.name] = (future, signature, sha, str(output))
+            submitted += 1
+        gone = set(self.seen) - present
+        for name in gone:
+            del self.seen[name]
+            self.settled.pop(name, None)
+        if not self.reconciled:
+            # files deleted while no watcher was running
+            gone = self.index.names() - present
+            self.reconciled = True
+        for name in gone - set(self.pending):
+            self.index.forget(name)
+        return submitted
+
+    def collect(self, wait: bool = False):
+        """records finished renders in the index, returns [(name, output, error)]"""
+        finished = []
+        for name, (future, signature, sha, output) in list(self.pending.items()):
+            if not wait and not future.done():
+                continue
+            del self.pending[name]
+            try:
+                future.result()
+                error = None
+                self.rendered += 1
+            except Exception as e:
+                error = f"{type(e).__name__}: {e}"
+                self.failed += 1
+            # a file changed during its render gets a new mtime, the next poll compares its hash again
+            self.index.record(name, *signature, sha, output, error)
+            self.settled[name] = signature
+            finished.append((name, output, error))
+        return finished
+
+    def run(self, interval_s: float = 1.0, stop: threading.Event | None = None, once: bool = False, log=sys.stderr):
+        """polls until stop is set or ctrl-c, once renders what is in the folder now and returns"""
+        if once:
+            self.debounce_s = 0.0
+        stop = stop or threading.Event()
+        try:
+            while True:
+                self.poll()
+                for name, output, error in self.collect(wait=once):
+                    if log is not None:
+                        print(f"[watch] {name}: {error or 'ok'} -> {output}", file=log)
+                if once or stop.wait(interval_s):
+                    break
+        except KeyboardInterrupt:
+            pass
@@ -0,0 +1,28 @@
+"""tests for the benchmark script"""
+import pytest
+from pathlib import Path
+import sys
+
+sys.path.append(str(Path(__file__).parent.parent))
+
+pytest.importorskip("numpy")
+
+from benchmark import compare, percentile, run_suite
+
+
+def test_percentile():
+    values = [float(i) for i in range(1, 101)]
+    assert percentile(values, 50) == 50.0
+    assert percentile(values, 99) == 99.0
+
+
+def test_suite_and_regression_check(tmp_path):
+    report = run_suite(sizes=[10], stages=["load", "interpret", "interpret_batch", "interpret_columnar"], work_dir=tmp_path, isolate=False)
+    rows = {r["stage"]: r for r in report["results"]}
+    assert set(rows) == {"load", "interpret", "interpret_batch", "interpret_columnar"}
+    assert rows["interpret"]["processed"] == 10 and rows["interpret"]["throughput_per_s"] > 0
+    assert rows["interpret"]["p50_ms"] <= rows["interpret"]["p99_ms"]
+
+    slower = {"results": [dict(r, throughput_per_s=r["throughput_per_s"] / 2) for r in report["results"]]}
+    assert compare(report, report, 0.2) == []
+    assert len(compare(slower, report, 0.2)) == 4
@@ -0,0 +1,85 @@
+"""tests for cohort_file module"""
+import json
+import multiprocessing
+import pytest
+from pathlib import Path
+import sys
+
+sys.path.append(str(Path(__file__).parent.parent))
+sys.path.append(str(Path(__file__).parent.parent / "data"))
+
+from src.cohort_file import KEYS, CohortFile, is_cohort_file, write_cohort_file
+from src.cohort_stats import CohortStats
+from src.interpreter import DEFAULT_ENGINE, vitals_to_columns
+from data_generator import records
+
+np = pytest.importorskip("numpy")
+
+PATIENTS = list(records(0, 20000, seed=3, timestamp="2025-01-01T00:00:00Z"))
+for i, patient in enumerate(PATIENTS):
+    patient["patient_id"] = f"P{i % 5000}"
+    patient["timestamp"] = f"2024-{1 + i % 12:02d}-{1 + i % 28:02d}T08:00:00"
+# missing values, strings, a missing vessel and patients without id, name or time
+PATIENTS[1]["vitals"]["ICA"]["psv_cm_s"] = None
+PATIENTS[2]["vitals"]["CCA"]["imt_mm"] = "thick"
+del PATIENTS[3]["vitals"]["ECA"]
+PATIENTS[4] = {"vitals": {"ica_cca_ratio": 1.5}}
+PATIENTS[5]["name"] = "zoë ü"
+
+
+def _column_sum(args):
+    path, key = args
+    with CohortFile(path) as cohort:
+        return float(np.nansum(cohort.columns[key]))
+
+
+def test_columns_and_indexes_match_the_patients(tmp_path):
+    path = tmp_path / "cohort.cols"
+    assert write_cohort_file(iter(PATIENTS), path) == len(PATIENTS)
+    assert is_cohort_file(path) and not list(tmp_path.glob(".cohort-*")) and not list(tmp_path.glob("*.tmp"))
+    with CohortFile(path) as cohort:
+        assert len(cohort) == len(PATIENTS) and list(cohort.columns) == KEYS
+        expected = vitals_to_columns(PATIENTS)
+        for key in expected:
+            np.testing.assert_array_equal(cohort.columns[key], expected[key])
+        assert not cohort.columns[("ICA", "psv_cm_s")].flags.writeable
+        assert DEFAULT_ENGINE.evaluate_batch(cohort.columns).risk_levels() == \
+            DEFAULT_ENGINE.evaluate_batch(expected).risk_levels()
+
+        assert cohort.patient_id(4) == "" and cohort.name(4) is None and cohort.timestamp[4] < 0
+        assert (cohort.patient_id(5), cohort.name(5), cohort.name(6)) == ("P5", "zoë ü", PATIENTS[6]["name"])
+        assert cohort.rows_for("P17").tolist() == [17, 5017, 10017, 15017]
+        assert cohort.rows_for("nobody").tolist() == []
+
+        rows = cohort.rows_between("2024-03-01", "2024-03-31T23:59:59")
+        assert sorted(rows.tolist()) == [i for i, p in enumerate(PATIENTS) if p.get("timestamp", "")[:7] == "2024-03"]
+        assert np.all(np.diff(cohort.timestamp[rows]) >= 0)
+        assert len(cohort.rows_between(since="2024-12-01")) == sum(p.get("timestamp", "") >= "2024-12" for p in PATIENTS)
+        with pytest.raises(ValueError, match="invalid iso date"):
+            cohort.rows_between("March")
+        selected = cohort.select(cohort.rows_for("P17"))
+        assert selected[(None, "ica_cca_ratio")].tolist() == [PATIENTS[i]["vitals"]["ica_cca_ratio"]
+                                                             for i in (17, 5017, 10017, 15017)]
+
+        # the same summary as from the patients
+        from_file = CohortStats().add_columns(cohort.columns).summary()
+    assert from_file == CohortStats().add_many(PATIENTS).summary()
+
+    # other processes map the same file
+    with multiprocessing.get_context("spawn").Pool(2) as pool:
+        sums = pool.map(_column_sum, [(path, key) for key in KEYS[:2]])
+    assert sums == [float(np.nansum(expected[key])) for key in KEYS[:2]]
+
+
+def test_empty_and_foreign_files(tmp_path):
+    path = tmp_path / "empty.cols"
+    assert write_cohort_file([], path) == 0
+    with CohortFile(path) as cohort:
+        assert len(cohort) == 0 and cohort.rows_for("P1").tolist() == []
+        assert CohortStats().add_columns(cohort.columns).summary()["patients"] == 0
+
+    other = tmp_path / "cohort.jsonl"
+    other.write_text(json.dumps(PATIENTS[0]) + "\n", encoding="utf-8")
+    assert not is_cohort_file(other) and not is_cohort_file(tmp_path / "missing.cols")
+    with pytest.raises(ValueError, match="not a columnar cohort file"):
+        CohortFile(other)
@@ -0,0 +1,64 @@
+"""tests for cohort_stats module"""
+import json
+import statistics
+import pytest
+from pathlib import Path
+import sys
+
+sys.path.append(str(Path(__file__).parent.parent))
+
+from src.cohort_stats import CohortStats, Moments, Sketch
+from src.report_generator import save_cohort_summary
+
+np = pytest.importorskip("numpy")
+
+PATIENTS = [{"patient_id": f"P{i}", "vitals": {"ICA": {"psv_cm_s": 50.0 + (i * 37) % 200},
+                                               "ica_cca_ratio": 0.5 + i % 7 / 2}} for i in range(1000)]
+
+
+def test_moments_merge_matches_one_pass():
+    values = np.random.default_rng(0).normal(120, 30, 5001)
+    one = Moments()
+    for x in values.tolist():
+        one.add(x)
+    merged = Moments()
+    for part in np.array_split(values, 4):
+        chunk = Moments()
+        chunk.add_array(part)
+        merged.merge(chunk)
+    for m in (one, merged):
+        assert m.count == 5001 and (m.min, m.max) == (values.min(), values.max())
+        assert m.mean == pytest.approx(values.mean(), rel=1e-12)
+        assert m.std() == pytest.approx(values.std(ddof=1), rel=1e-10)
+
+
+def test_sketch_quantiles_within_accuracy_and_merge():
+    values = np.random.default_rng(1).lognormal(4, 0.8, 20000)
+    whole, left, right = Sketch(), Sketch(), Sketch()
+    whole.add_array(values)
+    left.add_array(values[:7000])
+    right.add_array(values[7000:])
+    left.merge(right)
+    assert left.buckets == whole.buckets and left.count == whole.count
+    ordered = np.sort(values)
+    for q in (0.01, 0.5, 0.9, 0.99):
+        assert whole.quantile(q) == pytest.approx(ordered[int(q * (values.size - 1))], rel=0.01)
+    with pytest.raises(ValueError):
+        whole.merge(Sketch(0.05))
+
+
+def test_cohort_stats_split_and_summary(tmp_path):
+    whole = CohortStats().add_many(PATIENTS)
+    merged = CohortStats().add_many(PATIENTS[:300]).merge(CohortStats().add_many(PATIENTS[300:]))
+    ica = [p["vitals"]["ICA"]["psv_cm_s"] for p in PATIENTS]
+    for stats in (whole, merged):
+        row = stats.summary()["rows"][3]
+        assert (row["vessel"], row["metric"], row["count"]) == ("ICA", "psv_cm_s", 1000)
+        assert row["mean"] == pytest.approx(statistics.mean(ica), rel=1e-12)
+        assert row["quantiles"]["p50"] == pytest.approx(statistics.median(ica), rel=0.02)
+    summary = whole.summary()
+    assert summary["rows"][0]["count"] == 0 and summary["rows"][-1]["metric"] == "ica_cca_ratio"
+
+    save_cohort_summary(summary, Path(__file__).parent.parent / "src", tmp_path, output_format="html")
+    assert "Cohort Summary" in (tmp_path / "cohort_summary.html").read_text(encoding="utf-8")
+    assert json.loads((tmp_path / "cohort_summary.json").read_text())["patients"] == 1000
@@ -52,6 +52,7 @@ def test_end_to_end(sample_patient):
     template_path = Path(__file__).parent.parent / "src" / "report_template.html"
     html = generate_html_report(model, template_path)
 
+    pytest.importorskip("weasyprint")
     output_path = Path(__file__).parent.parent / "tests" / "test_report.pdf"
     save_pdf(html, output_path, template_path.parent)
 
@@ -60,3 +61,26 @@ def test_end_to_end(sample_patient):
 
     output_path.unlink()
     assert not output_path.exists()
+
+def test_pdf_engine_matches_plain_weasyprint(sample_patient, tmp_path):
+    pytest.importorskip("weasyprint")
+    from weasyprint import HTML
+    from src.report_generator import PdfEngine
+
+    findings = interpret_vitals(sample_patient)
+    model = build_report_model(sample_patient, findings, classify_risk(findings))
+    template_path = Path(__file__).parent.parent / "src" / "report_template.html"
+    html = generate_html_report(model, template_path)
+
+    engine = PdfEngine(template_path, max_documents=2)
+    baseline = HTML(string=html, base_url=str(template_path.parent)).render()
+    amortized = engine.render(html, base_url=str(template_path.parent))
+    assert len(amortized.pages) == len(baseline.pages)
+    assert [(p.width, p.height) for p in amortized.pages] == [(p.width, p.height) for p in baseline.pages]
+    texts = lambda doc: [b.text for p in doc.pages for b in p._page_box.descendants() if hasattr(b, "text")]
+    assert texts(amortized) == texts(baseline)
+
+    for i in range(2):
+        save_pdf(html, tmp_path / f"{i}.pdf", template_path.parent, engine=engine)
+        assert (tmp_path / f"{i}.pdf").stat().st_size > 0
+    assert engine.should_recycle()
@@ -0,0 +1,67 @@
+"""tests for exam_history module"""
+import json
+from pathlib import Path
+import sys
+
+sys.path.append(str(Path(__file__).parent.parent))
+sys.path.append(str(Path(__file__).parent.parent / "src"))
+
+from src.exam_history import ExamHistory
+from src.report_generator import generate_html_report
+import main
+
+MOCK = json.loads((Path(__file__).parent.parent / "data" / "mock_patient.json").read_text())
+
+
+def exam(pid, timestamp, ica_psv):
+    patient = json.loads(json.dumps(MOCK))
+    patient.update(patient_id=pid, timestamp=timestamp)
+    patient["vitals"]["ICA"]["psv_cm_s"] = ica_psv
+    return patient
+
+
+def ica(trend):
+    return next(m for m in trend["metrics"] if m["metric"] == "ICA PSV (cm/s)")
+
+
+def test_trend_per_exam(tmp_path):
+    values = [100.0, 120.0, 90.0, 150.0, 130.0, 110.0]
+    with ExamHistory(tmp_path / "history.sqlite", window=3, commit_every=2) as history:
+        for day, value in enumerate(values, 1):
+            trend = history.append(exam("P1", f"2025-01-{day:02d}", value))
+            history.append(exam("P2", f"2025-01-{day:02d}", 50.0))
+            recent = values[max(0, day - 3):day]
+            assert trend["exams"] == day and ica(trend)["latest"] == value
+            assert ica(trend)["change"] == (None if day == 1 else round(value - values[day - 2], 4))
+            assert ica(trend)["mean"] == round(sum(recent) / len(recent), 4)
+        assert history.append({"name": "no id"}) is None
+        assert len(history) == 12
+
+    with ExamHistory(tmp_path / "history.sqlite", window=10) as history:
+        assert history.trend("P1")["window"] == 3 and ica(history.trend("P1"))["latest"] == 110.0
+        assert history.trend("P9") is None
+
+
+def test_late_and_repeated_exams(tmp_path):
+    with ExamHistory(tmp_path / "history.sqlite", window=2) as history:
+        history.append(exam("P1", "2025-01-01", 100.0))
+        history.append(exam("P1", "2025-03-01", 160.0))
+        late = history.append(exam("P1", "2025-02-01", 130.0))
+        assert late["exams"] == 2 and late["last"] == "2025-02-01" and ica(late)["change"] == 30.0
+        assert history.trend("P1")["exams"] == 3 and ica(history.trend("P1"))["mean"] == 145.0
+        again = history.append(exam("P1", "2025-03-01", 190.0))
+        assert again["exams"] == 3 and ica(again)["mean"] == 160.0
+        assert [ts for ts, _ in history.exams("P1")] == ["2025-01-01", "2025-02-01", "2025-03-01"]
+
+
+def test_report_trend_section(tmp_path):
+    with ExamHistory(tmp_path / "history.sqlite") as history:
+        history.append(exam("P1", "2025-01-01", 100.0))
+        trend = history.append(exam("P1", "2025-02-01", 125.0))
+    model = main.report_model(exam("P1", "2025-02-01", 125.0))
+    assert "Trend (" not in generate_html_report(model, main.TEMPLATE_PATH)
+    html = generate_html_report(dict(model, trend=trend), main.TEMPLATE_PATH)
+    assert "Trend (2 exams since 2025-01-01)" in html and "<td>+25.00</td>" in html and "<td>112.50</td>" in html
+
+    main.render_report(exam("P1", "2025-02-01", 125.0), main.TEMPLATE_PATH, tmp_path / "report.html", trend)
+    assert (tmp_path / "report.html").read_text(encoding="utf-8") == html
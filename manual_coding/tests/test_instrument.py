@@ -0,0 +1,49 @@
+import json
+import os
+
+from src import instrument
+
+
+def test_disabled_span_is_a_no_op(tmp_path):
+    m = instrument.Metrics()
+    with m.span("interpret"):
+        pass
+    m.close()
+    assert not m.enabled
+    assert list(tmp_path.iterdir()) == []
+
+
+def test_span_writes_one_line_per_stage(tmp_path):
+    path = tmp_path / "metrics.jsonl"
+    m = instrument.Metrics(path, trace_malloc=True, profile_dir=tmp_path / "prof")
+    with m.span("report", patient_id="p1"):
+        with m.span("interpret"):
+            sum(range(1000))
+    m.close()
+
+    lines = [json.loads(l) for l in path.read_text().splitlines()]
+    assert [l["stage"] for l in lines] == ["interpret", "report"]
+    assert lines[1]["patient_id"] == "p1"
+    assert lines[1]["wall_ms"] >= lines[0]["wall_ms"] >= 0
+    assert "traced_peak_kb" in lines[0] and "alloc_blocks" in lines[0]
+    assert sorted(p.name.split(".")[0] for p in (tmp_path / "prof").iterdir()) == ["interpret", "report"]
+
+
+def test_configure_reads_and_exports_environment(tmp_path):
+    saved = {k: os.environ.get(k) for k in (instrument.ENV_METRICS, instrument.ENV_TRACEMALLOC, instrument.ENV_PROFILE_DIR)}
+    try:
+        instrument.configure(tmp_path / "m.jsonl")
+        assert os.environ[instrument.ENV_METRICS] == str(tmp_path / "m.jsonl")
+        instrument.reset()
+        assert instrument.metrics().enabled
+        with instrument.span("load"):
+            pass
+        instrument.metrics().close()
+        assert json.loads((tmp_path / "m.jsonl").read_text())["stage"] == "load"
+    finally:
+        for k, v in saved.items():
+            if v is None:
+                os.environ.pop(k, None)
+            else:
+                os.environ[k] = v
+        instrument.reset()
@@ -1,11 +1,13 @@
 """tests fr interpreter module"""
 import pytest
+import random
 import sys
 from pathlib import Path
 
 sys.path.append(str(Path(__file__).parent.parent))
 
-from src.interpreter import interpret_vitals, classify_risk
+from src.interpreter import (interpret_vitals, classify_risk, classify_severity, vitals_to_columns,
+                             DEFAULT_ENGINE, Severity)
 
 @pytest.fixture
 def normal_vitals():
@@ -58,3 +60,67 @@ def test_classify_risk_high():
     findings = ["Severe ICA PSV, stenosis (>70%)"]
     risk = classify_risk(findings)
     assert risk == "High", f"Expected High risk level, but got: {risk}"
+
+def _legacy_interpret(vitals):
+    """the hand written threshold chain the rule table replaced"""
+    findings = []
+    def first(value, checks):
+        if value:
+            for hit, message in checks:
+                if hit(value):
+                    findings.append(message)
+                    break
+    first(vitals["ICA"].get("psv_cm_s"), [(lambda v: v > 200, "Severe ICA PSV, stenosis (>70%)"),
+                                          (lambda v: v > 125, "Moderate ICA PSV, stenosis (50-69%)")])
+    first(vitals["ICA"].get("edv_cm_s"), [(lambda v: v > 100, "Severe ICA EDV (>100 cm/s)"),
+                                          (lambda v: v > 40, "Moderate ICA EDV (40-100 cm/s)")])
+    first(vitals["ICA"].get("imt_mm"), [(lambda v: v >= 1.1, "Elevated ICA IMT (>1.0 mm)")])
+    first(vitals["CCA"].get("psv_cm_s"), [(lambda v: v > 125, "Elevated CCA PSV (>125 cm/s)")])
+    first(vitals["CCA"].get("edv_cm_s"), [(lambda v: v > 40, "Elevated CCA EDV (>40 cm/s)")])
+    first(vitals["CCA"].get("imt_mm"), [(lambda v: v >= 1.0, "Elevated CCA IMT (>1.0 mm)")])
+    first(vitals["ECA"].get("psv_cm_s"), [(lambda v: v > 150, "Elevated ECA PSV (>150 cm/s)")])
+    first(vitals["ECA"].get("edv_cm_s"), [(lambda v: v > 40, "Elevated ECA EDV (>40 cm/s)")])
+    first(vitals.get("ica_cca_ratio"), [(lambda v: v > 4.0, "Severe ICA/CCA suggests stenosis (>70%)."),
+                                        (lambda v: v > 2.0, "Elevated ICA/CCA suggest stenosis (>50%)."),
+                                        (lambda v: v > 1.5, "Mildly elevated ICA/CCA ratio.")])
+    return findings
+
+@pytest.fixture
+def random_patients():
+    rng = random.Random(7)
+    patients = []
+    for _ in range(500):
+        vitals = {
+            "CCA": {"psv_cm_s": rng.choice([0, 125, 125.1, rng.uniform(40, 220)]),
+                    "edv_cm_s": rng.uniform(5, 120), "imt_mm": rng.choice([1.0, rng.uniform(0.4, 1.5)])},
+            "ICA": {"psv_cm_s": rng.choice([200, 200.1, rng.uniform(40, 300)]),
+                    "edv_cm_s": rng.choice([40, 100, rng.uniform(5, 130)]), "imt_mm": rng.uniform(0.4, 1.5)},
+            "ECA": {"psv_cm_s": rng.uniform(40, 220), "edv_cm_s": rng.uniform(5, 60)},
+            "ica_cca_ratio": rng.choice([None, 1.5, 2.0, 4.0, rng.uniform(0.5, 5)]),
+        }
+        if rng.random() < 0.2:
+            del vitals["ICA"]["imt_mm"]
+        patients.append({"vitals": vitals})
+    return patients
+
+def test_rule_table_matches_legacy_chain(random_patients):
+    for patient in random_patients:
+        findings = interpret_vitals(patient)
+        assert findings == _legacy_interpret(patient["vitals"])
+        structured = DEFAULT_ENGINE.evaluate(patient)
+        assert classify_severity(structured) == classify_risk(findings)
+
+def test_evaluate_batch_matches_single(random_patients):
+    pytest.importorskip("numpy")
+    batch = DEFAULT_ENGINE.evaluate_batch(vitals_to_columns(random_patients))
+    assert len(batch) == len(random_patients)
+    risks = batch.risk_levels()
+    for i, patient in enumerate(random_patients):
+        assert batch.findings(i) == interpret_vitals(patient)
+        assert risks[i] == classify_risk(interpret_vitals(patient))
+
+def test_severity_is_structured():
+    findings = DEFAULT_ENGINE.evaluate({"vitals": {"ICA": {"psv_cm_s": 150}, "ica_cca_ratio": 1.6}})
+    assert [f.severity for f in findings] == [Severity.MODERATE, Severity.MILD]
+    assert classify_severity(findings) == "Moderate"
+    assert classify_severity([]) == "Normal"
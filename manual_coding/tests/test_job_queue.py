@@ -0,0 +1,80 @@
+"""tests for job_queue module"""
+import json
+from pathlib import Path
+import sys
+
+sys.path.append(str(Path(__file__).parent.parent))
+sys.path.append(str(Path(__file__).parent.parent / "src"))
+
+from src.job_queue import JobQueue, run_workers, work
+import main
+
+PATIENT = json.loads((Path(__file__).parent.parent / "data" / "mock_patient.json").read_text())
+
+
+def patients(n):
+    return [dict(PATIENT, patient_id=f"P{i}") for i in range(n)]
+
+
+def marker_render(idx, patient, output_dir):
+    if patient["patient_id"] == "P5":
+        raise ValueError("broken exam")
+    path = Path(output_dir) / f"{idx}.txt"
+    path.write_text("x" if not path.exists() else path.read_text() + "x")  # counts renders
+    return path
+
+
+class Render:
+    """picklable render into a folder"""
+    def __init__(self, output_dir):
+        self.output_dir = output_dir
+
+    def __call__(self, idx, patient):
+        return marker_render(idx, patient, self.output_dir)
+
+
+def test_leases_expire_and_shards_are_given_up(tmp_path):
+    with JobQueue(tmp_path / "q.sqlite", lease_s=10, max_attempts=2) as queue:
+        assert queue.fill(patients(10), shard_size=4) == 10
+        assert queue.fill(patients(99), shard_size=4) == 10  # filled once
+        assert [queue.claim(w, now=100) for w in "abc"] == [1, 2, 3] and queue.claim("d", now=100) is None
+        assert queue.checkpoint(1, "a", 0, now=105)  # renews a's lease to 115
+        assert queue.claim("d", now=112) == 2  # b went silent
+        assert not queue.checkpoint(2, "b", 4, now=112) and not queue.complete(2, "b")
+        assert [idx for idx, _ in queue.pending(1)] == [1, 2, 3]
+        assert queue.release("c") == 1 and queue.claim("e", now=112) == 3
+        assert queue.claim("f", now=200) == 1  # second attempt of shard 1
+        assert queue.complete(2, "d")
+        assert queue.claim("g", now=300) is None  # shards 1 and 3 ran out of attempts
+        assert queue.status()["shards"] == {"done": 1, "failed": 2}
+        assert queue.failures() == [("shard 1", "given up after 2 attempts"), ("shard 3", "given up after 2 attempts")]
+
+
+def test_resume_renders_every_patient_once(tmp_path):
+    with JobQueue(tmp_path / "q.sqlite") as queue:
+        queue.fill(patients(10), shard_size=4)
+        assert queue.claim("dead") == 1
+        for idx, patient in queue.pending(1)[:2]:  # the worker rendered two patients and died
+            queue.checkpoint(1, "dead", idx, str(marker_render(idx, patient, tmp_path)))
+        queue.release("dead")
+
+    assert work(tmp_path / "q.sqlite", Render(tmp_path)) == 7
+    assert work(tmp_path / "q.sqlite", Render(tmp_path)) == 0
+    assert sorted(p.read_text() for p in tmp_path.glob("*.txt")) == ["x"] * 9
+    with JobQueue(tmp_path / "q.sqlite") as queue:
+        status = queue.status()
+        assert status["finished"] and (status["done"], status["failed"]) == (10, 1)
+        assert queue.failures() == [("patient 5", "ValueError: broken exam")]
+
+
+def test_workers_and_run_queue(tmp_path, monkeypatch):
+    with JobQueue(tmp_path / "q.sqlite") as queue:
+        queue.fill(patients(9), shard_size=2)
+    out = tmp_path / "out"
+    out.mkdir()
+    status = run_workers(tmp_path / "q.sqlite", Render(out), workers=2)
+    assert status["shards"] == {"done": 5} and (status["done"], status["failed"]) == (9, 1)
+    assert sorted(p.read_text() for p in out.glob("*.txt")) == ["x"] * 8
+
+    output = main.render_queue_patient(3, PATIENT, tmp_path / "reports", ".html")
+    assert output.name == "000003_12345.html" and output.read_text().startswith("<!DOCTYPE")
@@ -0,0 +1,85 @@
+"""tests for native_pdf module"""
+import asyncio
+import json
+import re
+import zlib
+from pathlib import Path
+import sys
+
+import pytest
+
+sys.path.append(str(Path(__file__).parent.parent))
+sys.path.append(str(Path(__file__).parent.parent / "src"))
+
+from src.native_pdf import draw_report, pdf_backend, text_width, CONTENT_W, ENV_BACKEND
+from src.report_service import ReportService
+import main
+
+PATIENT = json.loads((Path(__file__).parent.parent / "data" / "mock_patient.json").read_text())
+
+
+def shown_text(pdf):
+    """checks the xref offsets, returns the strings drawn on every page"""
+    assert pdf.startswith(b"%PDF-1.4") and pdf.rstrip().endswith(b"%%EOF")
+    xref = int(pdf.rsplit(b"startxref", 1)[1].split()[0])
+    offsets = [int(line[:10]) for line in pdf[xref:].split(b"\n")[3:] if line.endswith(b" n ")]
+    assert all(pdf[offset:].startswith(b"%d 0 obj" % n) for n, offset in enumerate(offsets, 1))
+    streams = re.findall(rb"stream\n(.*?)\nendstream", pdf, re.DOTALL)
+    pages = [re.findall(rb"\(((?:\\.|[^\\)])*)\) Tj", zlib.decompress(s)) for s in streams]
+    return [[re.sub(rb"\\(.)", rb"\1", t).decode("cp1252") for t in page] for page in pages]
+
+
+def test_report_model_is_drawn():
+    model = main.report_model(PATIENT)
+    pdf = draw_report(model)
+    [page] = shown_text(pdf)
+    assert page[0] == "Patient Report for adam cook" and "Risk Level: Moderate" in page
+    assert "Patient ID: 12345 | Exam Date: 2025-10-29" in page
+    assert page.count("Metric") == 4 and "195.5" in page and "ICA/CCA Ratio" in page
+    assert ", ".join(model["findings"]) in page
+    assert pdf == draw_report(model)
+
+
+def test_long_findings_wrap_and_break_pages():
+    model = dict(main.report_model(PATIENT), findings=[f"finding {i} (long)" for i in range(400)])
+    pages = shown_text(draw_report(model))
+    assert len(pages) > 1
+    lines = [line for page in pages for line in page]
+    lines = lines[lines.index("Findings & Risk Level") + 1:-1]
+    assert " ".join(lines) == ", ".join(model["findings"])
+    assert max(text_width(line, "F1", 11 * 0.75) for line in lines) <= CONTENT_W
+
+
+def test_backend_is_selected_per_run(tmp_path, monkeypatch):
+    assert pdf_backend() == "weasyprint"
+    with pytest.raises(ValueError):
+        pdf_backend("cairo")
+    monkeypatch.setenv(ENV_BACKEND, "native")
+    main.render_report(PATIENT, main.TEMPLATE_PATH, tmp_path / "report.pdf")
+    assert (tmp_path / "report.pdf").read_bytes() == draw_report(main.report_model(PATIENT))
+
+
+def test_service_draws_native_pdfs():
+    async def scenario():
+        service = ReportService(main.report_html, draw_report, main.warm_native, workers=1,
+                                pdf_input=main.report_model)
+        reader, writer = await asyncio.open_connection(*await service.start())
+        body = json.dumps(PATIENT).encode()
+        writer.write(f"POST /report HTTP/1.1\r\nContent-Length: {len(body)}\r\nConnection: close\r\n\r\n".encode() + body)
+        response = await reader.read()
+        writer.close()
+        await service.close()
+        return response
+
+    head, _, pdf = asyncio.run(scenario()).partition(b"\r\n\r\n")
+    assert head.startswith(b"HTTP/1.1 200") and pdf == draw_report(main.report_model(PATIENT))
+
+
+def test_trend_table():
+    trend = {"exams": 2, "first": "2025-01-01", "window": 5,
+             "metrics": [{"metric": "ICA PSV (cm/s)", "latest": 125.0, "change": 25.0, "mean": 112.5}]}
+    [page] = shown_text(draw_report(dict(main.report_model(PATIENT), trend=trend)))
+    start = page.index("Trend (2 exams since 2025-01-01)")
+    assert page[start + 1:start + 9] == ["Metric", "Latest", "Change", "Mean (last 5)",
+                                         "ICA PSV (cm/s)", "125.0", "+25.00", "112.50"]
+    assert "Trend (" not in " ".join(shown_text(draw_report(main.report_model(PATIENT)))[0])
@@ -0,0 +1,82 @@
+"""tests for patient_reader module"""
+import gzip
+import json
+import pytest
+from pathlib import Path
+import sys
+
+sys.path.append(str(Path(__file__).parent.parent))
+
+import src.patient_reader as patient_reader
+from src.patient_reader import iter_records, load_patient
+
+PATIENTS = [{"patient_id": f"P{i}", "vitals": {"CCA": {"psv_cm_s": 100 + i}}} for i in range(5)]
+
+
+@pytest.mark.parametrize("read_chars", [1 << 20, 3])
+def test_jsonl_array_and_gzip(tmp_path, monkeypatch, read_chars):
+    monkeypatch.setattr(patient_reader, "_READ_CHARS", read_chars)
+    (tmp_path / "cohort.jsonl").write_text("".join(json.dumps(p) + "\n" for p in PATIENTS))
+    (tmp_path / "cohort.json").write_text(json.dumps(PATIENTS, indent=2))
+    with gzip.open(tmp_path / "cohort.jsonl.gz", "wt") as f:
+        f.write("".join(json.dumps(p) + "\n" for p in PATIENTS))
+
+    for name in ("cohort.jsonl", "cohort.json", "cohort.jsonl.gz"):
+        assert [r.data for r in iter_records(tmp_path / name)] == PATIENTS
+
+
+def test_bad_records_have_line_numbers(tmp_path):
+    path = tmp_path / "cohort.jsonl"
+    path.write_text(json.dumps(PATIENTS[0]) + "\n{broken\n" + json.dumps(PATIENTS[1]) + "\n")
+    records = list(iter_records(path))
+    assert [(r.line, r.error is None) for r in records] == [(1, True), (2, False), (3, True)]
+
+
+def test_load_patient_single_record_only(tmp_path):
+    path = tmp_path / "patient.json"
+    path.write_text(json.dumps(PATIENTS[0], indent=4))
+    assert load_patient(path) == PATIENTS[0]
+    path.write_text(json.dumps(PATIENTS))
+    with pytest.raises(ValueError):
+        load_patient(path)
+
+
+@pytest.mark.parametrize("backend", ["orjson", "json"])
+def test_json_backends_read_the_same(tmp_path, monkeypatch, backend):
+    if backend == "orjson" and patient_reader.orjson is None:
+        pytest.skip("orjson not installed")
+    monkeypatch.setenv(patient_reader.JSON_BACKEND_ENV, backend)
+    assert patient_reader.json_backend() == backend
+    odd = {"patient_id": "é \"x\"", "age": 2 ** 70, "vitals": {"CCA": {"psv_cm_s": 1e-05, "imt_mm": None}},
+           "context": {"tags": [], "nested": {"k": [1, 2.5, True]}}}
+    path = tmp_path / "cohort.jsonl"
+    path.write_text("".join(json.dumps(p) + "\n" for p in PATIENTS + [odd]) + '{"a": NaN}\n{broken\n')
+    records = list(iter_records(path))
+    assert [r.data for r in records[:-2]] == PATIENTS + [odd]
+    assert records[-2].data["a"] != records[-2].data["a"]  # NaN, as json reads it
+    assert records[-1].error.startswith("JSONDecodeError: Expecting property name")
+
+
+def test_packed_round_trip(tmp_path, monkeypatch):
+    pytest.importorskip("msgpack")
+    mock = json.loads((Path(__file__).parent.parent / "data" / "mock_patient.json").read_text())
+    patients = PATIENTS + [mock, {"patient_id": "é", "age": 2 ** 70}]
+    path = tmp_path / "cohort.msgpack"
+    failed = []
+    assert patient_reader.write_packed(iter(patients), path, on_error=lambda p, e: failed.append(p)) == 6
+    assert failed == [patients[-1]]
+    with pytest.raises(ValueError):
+        patient_reader.write_packed(patients[-1:], tmp_path / "big.msgpack")
+    assert not list(tmp_path.glob("big*"))
+
+    monkeypatch.setattr(patient_reader, "_READ_CHARS", 7)
+    records = list(iter_records(path))
+    assert [(r.line, r.data) for r in records] == list(enumerate(patients[:-1], start=1))
+    assert [type(v) for v in records[5].data["vitals"]["ICA"].values()] == \
+        [type(v) for v in mock["vitals"]["ICA"].values()]
+    patient_reader.write_packed([mock], tmp_path / "one.msgpack")
+    assert load_patient(tmp_path / "one.msgpack") == mock
+
+    path.write_bytes(path.read_bytes()[:-3])
+    records = list(iter_records(path))
+    assert [r.data for r in records[:-1]] == patients[:5] and "truncated" in records[-1].error
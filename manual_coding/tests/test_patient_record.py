@@ -0,0 +1,81 @@
+"""tests for patient_record module"""
+import json
+import pickle
+import random
+import tracemalloc
+import pytest
+from pathlib import Path
+import sys
+
+sys.path.append(str(Path(__file__).parent.parent))
+
+from src.patient_record import PatientRecord
+from src.interpreter import interpret_vitals, vitals_to_columns, DEFAULT_ENGINE
+from src.report_generator import build_report_model
+from src.cohort_stats import CohortStats
+
+
+def patients(n, seed=3):
+    rng = random.Random(seed)
+    out = []
+    for i in range(n):
+        vitals = {
+            "CCA": {"psv_cm_s": rng.choice([0, 125, rng.uniform(40, 220)]), "edv_cm_s": rng.uniform(5, 60),
+                    "imt_mm": rng.uniform(0.4, 1.5)},
+            "ICA": {"psv_cm_s": rng.choice([200, rng.uniform(40, 300)]), "edv_cm_s": rng.uniform(5, 130),
+                    "imt_mm": rng.uniform(0.4, 1.5)},
+            "ECA": {"psv_cm_s": rng.uniform(40, 220), "edv_cm_s": rng.uniform(5, 60)},
+            "ica_cca_ratio": rng.choice([1.5, 4.0, rng.uniform(0.5, 5)]),
+        }
+        if rng.random() < 0.2:
+            del vitals["ICA"]["imt_mm"]
+        out.append({"patient_id": f"P{i}", "name": "alex martin", "timestamp": "2025-10-29",
+                    "context": {"age_years": rng.randint(20, 85), "sex": rng.choice(["female", "male"]),
+                                "notes": "Mock record"},
+                    "vitals": vitals})
+    return out
+
+
+def test_round_trip():
+    for patient in patients(200):
+        record = PatientRecord.from_json(json.dumps(patient))
+        assert record.to_dict() == patient
+        assert pickle.loads(pickle.dumps(record)) == record
+        assert record.get("patient_id") == patient["patient_id"]
+        assert record.value("ICA", "imt_mm") == patient["vitals"]["ICA"].get("imt_mm")
+    odd = PatientRecord.from_dict({"vitals": {"ICA": {"psv_cm_s": "fast", "edv_cm_s": 50}, "VA": {}}})
+    assert odd.to_dict() == {"context": {}, "vitals": {"ICA": {"edv_cm_s": 50.0}}}
+    assert odd.value("ICA", "psv_cm_s") is None and odd.get("name", "n/a") == "n/a"
+
+
+def test_interpretation_and_report_model_match_dicts():
+    cohort = patients(500)
+    records = [PatientRecord.from_dict(p) for p in cohort]
+    for patient, record in zip(cohort, records):
+        findings = interpret_vitals(patient)
+        assert interpret_vitals(record) == findings
+        assert build_report_model(record, findings, "Normal") == build_report_model(patient, findings, "Normal")
+
+    np = pytest.importorskip("numpy")
+    expected = vitals_to_columns(cohort)
+    columns = vitals_to_columns(records)
+    for key, column in expected.items():
+        np.testing.assert_array_equal(columns[key], column)
+    assert DEFAULT_ENGINE.evaluate_batch(columns).risk_levels() == DEFAULT_ENGINE.evaluate_batch(expected).risk_levels()
+    assert CohortStats().add_many(records).summary() == CohortStats().add_many(cohort).summary()
+
+
+def test_records_are_smaller_than_dicts():
+    lines = [json.dumps(p) for p in patients(10000)]
+
+    def traced(parse):
+        tracemalloc.stop()  # another test may have left it running
+        tracemalloc.start()
+        before = tracemalloc.get_traced_memory()[0]
+        kept = [parse(line) for line in lines]
+        size = tracemalloc.get_traced_memory()[0] - before
+        tracemalloc.stop()
+        assert len(kept) == len(lines)
+        return size
+
+    assert traced(PatientRecord.from_json) < traced(json.loads) / 3
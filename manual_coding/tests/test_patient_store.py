@@ -0,0 +1,53 @@
+"""tests for patient_store module"""
+import json
+import pytest
+from pathlib import Path
+import sys
+
+sys.path.append(str(Path(__file__).parent.parent))
+
+from src.patient_store import PatientStore, exam_row, parse_condition
+
+MOCK = json.loads((Path(__file__).parent.parent / "data" / "mock_patient.json").read_text())
+
+
+def exam(pid, timestamp, ica_psv):
+    patient = json.loads(json.dumps(MOCK))
+    patient.update(patient_id=pid, timestamp=timestamp)
+    patient["vitals"]["ICA"]["psv_cm_s"] = ica_psv
+    return patient
+
+
+EXAMS = [exam("P1", "2025-01-10", 90.0), exam("P2", "2025-02-01", 130.0),
+         exam("P1", "2025-03-05", 140.0), exam("P3", "2025-03-06", 125.0)]
+
+
+def test_ingest_and_select(tmp_path):
+    with PatientStore(tmp_path / "patients.sqlite") as store:
+        assert store.ingest(EXAMS + [{"name": "no id"}], batch_size=3) == (4, 1)
+        assert [p["patient_id"] for p in store.select(where=["ica_psv>125"])] == ["P2", "P1"]
+        assert list(store.select(patient_id="P1", since="2025-02-01")) == [EXAMS[2]]
+        assert store.count(since="2025-02-01", where=["ica_psv<=130", "ica_cca_ratio>1"]) == 2
+        assert store.count(until="2025-01-31") == 1
+
+        # same patient and timestamp replaces the exam, the indexes survive a second ingest
+        store.ingest([exam("P1", "2025-01-10", 300.0)])
+        assert len(store) == 4
+        assert store.count(where=["ica_psv>=300"]) == 1
+        plan = store._db.execute("EXPLAIN QUERY PLAN SELECT id FROM exams WHERE ica_psv > 1").fetchall()
+        assert "exams_ica_psv" in plan[0][-1]
+
+
+def test_exam_row_skips_non_numbers():
+    row = exam_row({"patient_id": 7, "vitals": {"ICA": {"psv_cm_s": "high"}, "ica_cca_ratio": True}})
+    assert row[:3] == ("7", "", None)
+    assert row[6] is None and row[-2] is None
+    with pytest.raises(ValueError):
+        exam_row({"name": "x"})
+
+
+def test_parse_condition():
+    assert parse_condition(" ica_cca_ratio >= 2.5") == ("ica_cca_ratio", ">=", 2.5)
+    for bad in ("ica_psv>", "name=bob", "ica_psv>1; DROP TABLE exams"):
+        with pytest.raises(ValueError):
+            parse_condition(bad)
@@ -0,0 +1,89 @@
+"""tests for pipeline module"""
+import json
+import threading
+import time
+from pathlib import Path
+import sys
+
+import pytest
+
+sys.path.append(str(Path(__file__).parent.parent))
+sys.path.append(str(Path(__file__).parent.parent / "src"))
+
+from src.pipeline import Pipeline, Stage, parse_stage
+import main
+
+PATIENT = json.loads((Path(__file__).parent.parent / "data" / "mock_patient.json").read_text())
+
+
+def square(x):
+    return x * x
+
+
+def slow_for_small(x):
+    time.sleep(0.02 if x < 3 else 0.0)
+    return x
+
+
+def fail_on_five(x):
+    if x == 5:
+        raise KeyError(x)
+    return x
+
+
+def test_order_executors_and_chunks():
+    items = list(range(50))
+    for executor in ("inline", "thread", "process"):
+        for chunk_size in (1, 7):
+            pipeline = Pipeline([Stage("square", square, executor, 2), Stage("add", lambda x: x + 1)],
+                                maxsize=2, chunk_size=chunk_size)
+            assert list(pipeline.run(items)) == [x * x + 1 for x in items]
+
+    out = list(Pipeline([Stage("sleep", slow_for_small, "thread", 4)], ordered=False).run(range(8)))
+    assert sorted(out) == list(range(8)) and out != list(range(8))
+
+
+def test_backpressure_and_early_stop():
+    read = []
+
+    def source():
+        for i in range(1000):
+            read.append(i)
+            yield i
+
+    results = Pipeline([Stage("a", lambda x: x), Stage("b", lambda x: x, "thread", 2)], maxsize=2).run(source())
+    assert next(results) == 0
+    time.sleep(0.2)
+    assert len(read) < 20  # the queues and the pool hold a few items, not the whole input
+    results.close()
+    assert not any(t.name.startswith("pipeline-") for t in threading.enumerate())
+
+
+def test_errors_and_stage_specs():
+    with pytest.raises(KeyError):
+        list(Pipeline([Stage("fail", fail_on_five, "thread", 2)]).run(range(20)))
+    with pytest.raises(ValueError):
+        Stage("x", square, "gpu")
+    assert parse_stage("pdf=process:4", main.PIPELINE_STAGES) == ("pdf", "process", 4)
+    assert parse_stage("write=thread", main.PIPELINE_STAGES) == ("write", "thread", None)
+    for bad in ("pdf", "pdf=gpu", "layout=inline", "pdf=process:0"):
+        with pytest.raises(ValueError):
+            parse_stage(bad, main.PIPELINE_STAGES)
+    assert main.pipeline_executors(["render=thread", "interpret=inline:3"], workers=3) == {
+        "pdf": ("process", 3), "render": ("thread", 3), "interpret": ("inline", 1)}
+
+
+@pytest.mark.parametrize("suffix", ["html", "pdf"])
+def test_pipelined_reports_match_the_sequential_ones(tmp_path, monkeypatch, suffix):
+    monkeypatch.setenv("REPORT_PDF_BACKEND", "native")
+    patients = [dict(PATIENT, patient_id=f"P{i}") for i in range(20)]
+    patients[7] = dict(PATIENT, patient_id="P7", vitals="broken")  # fails to interpret
+    executors = {"render": ("thread", 2), "pdf": ("process", 2)}
+    piped = main.render_patients(patients, tmp_path / "piped", suffix, executors)
+    sequential = main.render_patients(patients, tmp_path / "seq", suffix, pipelined=False)
+    assert piped[0] == sequential[0] == 19
+    assert [path.name for path, _ in piped[1]] == ["000007_P7." + suffix]
+    names = sorted(p.name for p in (tmp_path / "seq").iterdir())
+    assert len(names) == 19
+    for name in names:
+        assert (tmp_path / "piped" / name).read_bytes() == (tmp_path / "seq" / name).read_bytes()
@@ -0,0 +1,71 @@
+"""tests for record_validator module"""
+import json
+import timeit
+from pathlib import Path
+import sys
+
+sys.path.append(str(Path(__file__).parent.parent))
+sys.path.append(str(Path(__file__).parent.parent / "src"))
+
+from src.record_validator import Quarantine, compile_validator, validate_record
+from src.report_generator import build_report_model
+import main
+
+DATA = Path(__file__).parent.parent / "data" / "mock_patient.json"
+
+
+def test_reasons():
+    patient = json.loads(DATA.read_text())
+    assert validate_record(patient) == []
+    assert validate_record({"patient_id": 7, "vitals": {"ICA": {"psv_cm_s": 120}, "ica_cca_ratio": None}}) == []
+    assert validate_record([1]) == ["record: expected an object, got list"]
+    assert validate_record({"patient_id": None}) == ["patient_id: required", "vitals: required"]
+    bad = {"patient_id": "", "timestamp": "today", "context": {"age_years": True},
+           "vitals": {"CCA": [], "ICA": {"psv_cm_s": "fast", "imt_mm": -1.0, "edv_cm_s": float("inf")}}}
+    assert validate_record(bad) == [
+        "patient_id: expected a non empty string or integer, got str",
+        "timestamp: expected an iso date, got str",
+        "context.age_years: expected an integer age, got bool",
+        "vitals.CCA: expected an object, got list",
+        "vitals.ICA.psv_cm_s: expected a finite number >= 0, got str",
+        "vitals.ICA.edv_cm_s: expected a finite number >= 0, got inf",
+        "vitals.ICA.imt_mm: expected a finite number >= 0, got float",
+    ]
+    # checks are inlined, the field table is not read while validating
+    assert "FIELDS" not in validate_record.source
+    assert compile_validator({("patient_id",): ("id", True)})({"patient_id": 1}) == []
+
+
+def test_report_model_without_vessels():
+    model = build_report_model({"patient_id": "P1", "vitals": {"ICA": {"psv_cm_s": None}}}, [], "Normal")
+    assert [s["rows"] for s in model["vital_sections"]] == [[{"metric": "psv_cm_s", "value": "n/a", "unit": "cm/s"}], [], []]
+    assert model["derived_metrics"][0]["value"] == "n/a"
+
+
+def test_cohort_quarantines_invalid_records(tmp_path):
+    patient = json.loads(DATA.read_text())
+    cohort = tmp_path / "cohort.jsonl"
+    lines = [json.dumps(patient), "{broken", json.dumps({"patient_id": "X", "vitals": {"ICA": "n/a"}}),
+             json.dumps(dict(patient, patient_id="P2"))]
+    cohort.write_text("\n".join(lines) + "\n")
+    with Quarantine(tmp_path / "q.jsonl") as quarantine:
+        kept = [p["patient_id"] for p in main.iter_patient_data(cohort, quarantine)]
+    assert kept == [patient["patient_id"], "P2"] and quarantine.count == 2
+    rejected = [json.loads(line) for line in (tmp_path / "q.jsonl").read_text().splitlines()]
+    assert [r["line"] for r in rejected] == [2, 3]
+    assert rejected[0]["record"] is None
+    assert rejected[1]["reasons"] == ["vitals.ICA: expected an object, got str"]
+    # without a quarantine only unparsable records are dropped
+    assert len(list(main.iter_patient_data(cohort))) == 3
+
+    db = tmp_path / "p.sqlite"
+    main.ingest(cohort, db, quarantine_path=str(tmp_path / "ingest_q.jsonl"))
+    assert len((tmp_path / "ingest_q.jsonl").read_text().splitlines()) == 2
+
+
+def test_validation_is_cheap_next_to_parsing():
+    text = DATA.read_text()
+    patient = json.loads(text)
+    parse = min(timeit.repeat(lambda: json.loads(text), number=2000, repeat=5))
+    check = min(timeit.repeat(lambda: validate_record(patient), number=2000, repeat=5))
+    assert check < parse * 3
@@ -0,0 +1,41 @@
+"""tests for render_cache module"""
+from pathlib import Path
+import sys
+
+sys.path.append(str(Path(__file__).parent.parent))
+
+from src.render_cache import RenderCache
+
+
+def _render(out: Path, payload: bytes):
+    out.mkdir(parents=True, exist_ok=True)
+    (out / "patient_report.pdf").write_bytes(payload)
+
+
+def test_key_changes_with_input_and_template(tmp_path):
+    template = tmp_path / "t.html"
+    template.write_text("a")
+    with RenderCache(tmp_path / "cache") as cache:
+        key = cache.key_for({"patient_id": "1", "name": "x"}, template)
+        assert cache.key_for({"name": "x", "patient_id": "1"}, template) == key
+        assert cache.key_for({"patient_id": "2", "name": "x"}, template) != key
+        template.write_text("b")
+        assert cache.key_for({"patient_id": "1", "name": "x"}, template) != key
+
+
+def test_hit_miss_and_lru_eviction(tmp_path):
+    names = ("patient_report.pdf",)
+    with RenderCache(tmp_path / "cache", max_bytes=25) as cache:
+        assert not cache.get("k1", tmp_path / "k1", names)
+        for key in ("k1", "k2"):
+            _render(tmp_path / key, b"x" * 10)
+            cache.put(key, tmp_path / key, names)
+        assert cache.get("k1", tmp_path / "copy", names)
+        assert (tmp_path / "copy" / "patient_report.pdf").read_bytes() == b"x" * 10
+
+        _render(tmp_path / "k3", b"x" * 10)
+        cache.put("k3", tmp_path / "k3", names)
+        assert not cache.get("k2", tmp_path / "k2", names)
+        assert cache.stats() == {
+            "hits": 1, "misses": 2, "evictions": 1, "total_hits": 1, "total_misses": 2,
+            "total_evictions": 1, "entries": 2, "bytes": 20}
@@ -1,11 +1,12 @@
 """tests for report_generator module"""
+import os
 import pytest
 from pathlib import Path
 import sys
 
 sys.path.append(str(Path(__file__).parent.parent))
 
-from src.report_generator import (_fmt, _unit_for, _section_from_vitals, build_report_model, generate_html_report)
+from src.report_generator import (_fmt, _unit_for, _section_from_vitals, build_report_model, generate_html_report, ReportRenderer)
 
 @pytest.fixture
 def sample_patient():
@@ -102,3 +103,61 @@ def test_generate_html_report(sample_patient, mock_findings):
     template_path.unlink()
     assert not template_path.exists()
 
+
+def test_report_renderer_caches_template(tmp_path, sample_patient, mock_findings):
+    template_path = tmp_path / "report_template.html"
+    template_path.write_text("<h1>{{ patient_id }}</h1>")
+    renderer = ReportRenderer(cache_size=2)
+    model = build_report_model(sample_patient, mock_findings, "Moderate")
+
+    assert generate_html_report(model, template_path, renderer) == "<h1>Test123</h1>"
+    assert generate_html_report(model, template_path, renderer) == "<h1>Test123</h1>"
+    assert renderer.hits == 1
+    assert renderer.misses == 1
+
+def test_report_renderer_reloads_edited_template(tmp_path):
+    template_path = tmp_path / "t.html"
+    template_path.write_text("<p>{{ patient_id }}</p>")
+    os.utime(template_path, ns=(1_000_000_000, 1_000_000_000))
+    renderer = ReportRenderer()
+    assert renderer.render(template_path, {"patient_id": "A"}) == "<p>A</p>"
+
+    template_path.write_text("<b>{{ patient_id }}</b>")
+    os.utime(template_path, ns=(2_000_000_000, 2_000_000_000))
+    assert renderer.render(template_path, {"patient_id": "A"}) == "<b>A</b>"
+    assert renderer.misses == 2
+    assert len(renderer._templates) == 1
+
+def test_report_renderer_caches_are_bounded(tmp_path):
+    renderer = ReportRenderer(cache_size=2)
+    for i in range(4):
+        folder = tmp_path / str(i)
+        folder.mkdir()
+        (folder / "t.html").write_text(str(i))
+        assert renderer.render(folder / "t.html", {}) == str(i)
+    assert len(renderer._templates) == 2
+    assert len(renderer._envs) == 2
+    renderer.clear()
+    assert not renderer._templates and not renderer._envs
+    with pytest.raises(ValueError):
+        ReportRenderer(cache_size=0)
+
+def test_save_cohort_report_streams_one_section_per_patient(tmp_path, sample_patient, mock_findings):
+    from src.report_generator import save_cohort_report, _page_ranges
+
+    models = (build_report_model({**sample_patient, "patient_id": f"P{i}"}, mock_findings, "Low") for i in range(4))
+    template_dir = Path(__file__).parent.parent / "src"
+    result = save_cohort_report(models, template_dir, tmp_path, output_format="html")
+
+    html = (tmp_path / "cohort.html").read_text(encoding="utf-8")
+    assert html.count("<html") == 1
+    assert [f'id="patient-{i}"' in html for i in range(4)] == [True] * 4
+    assert "break-before: page" in html
+    assert [r["patient_id"] for r in result["reports"]] == ["P0", "P1", "P2", "P3"]
+    assert not (tmp_path / "cohort.pdf").exists()
+
+    class Page:
+        def __init__(self, *anchors):
+            self.anchors = dict.fromkeys(anchors)
+    pages = [Page("patient-0"), Page(), Page("patient-1"), Page("patient-2")]
+    assert _page_ranges(pages, 3) == [[1, 2], [3, 3], [4, 4]]
@@ -0,0 +1,80 @@
+"""tests for report_service module"""
+import asyncio
+import json
+import time
+from pathlib import Path
+import sys
+
+sys.path.append(str(Path(__file__).parent.parent))
+sys.path.append(str(Path(__file__).parent.parent / "src"))
+
+from src.report_service import ReportService
+import main
+
+PATIENT = json.loads((Path(__file__).parent.parent / "data" / "mock_patient.json").read_text())
+
+
+async def call(address, method, path, body=b""):
+    reader, writer = await asyncio.open_connection(*address)
+    writer.write(f"{method} {path} HTTP/1.1\r\nContent-Length: {len(body)}\r\nConnection: close\r\n\r\n".encode() + body)
+    await writer.drain()
+    response = await reader.read()
+    writer.close()
+    head, _, payload = response.partition(b"\r\n\r\n")
+    lines = head.decode().split("\r\n")
+    headers = dict(line.split(": ", 1) for line in lines[1:])
+    return int(lines[0].split()[1]), headers, payload
+
+
+def no_warm():
+    return None
+
+
+def slow_pdf(html):
+    time.sleep(0.5)
+    return b"%PDF " + str(len(html)).encode()
+
+
+def test_html_validation_and_endpoints():
+    async def scenario():
+        service = ReportService(main.report_html, main.report_pdf, main.warm_pdf_worker, main.validate_record, workers=1)
+        address = await service.start()
+        try:
+            status, headers, body = await call(address, "POST", "/report?format=html", json.dumps(PATIENT).encode())
+            assert status == 200 and headers["Content-Type"].startswith("text/html")
+            assert body.decode() == main.report_html(PATIENT)
+            status, _, body = await call(address, "POST", "/report?format=html", b'{"vitals": {}}')
+            assert status == 422 and json.loads(body)["reasons"] == ["patient_id: required"]
+            assert (await call(address, "POST", "/report", b"[1"))[0] == 400
+            assert (await call(address, "GET", "/report"))[0] == 405
+            assert (await call(address, "GET", "/other"))[0] == 404
+            health = json.loads((await call(address, "GET", "/health"))[2])
+            if not health["pdf"]:
+                assert (await call(address, "POST", "/report", json.dumps(PATIENT).encode()))[0] == 503
+            metrics = json.loads((await call(address, "GET", "/metrics"))[2])
+            assert metrics["responses"]["200"] == 2 and metrics["latency_ms"]["p99"] is not None
+        finally:
+            await service.close()
+
+    asyncio.run(scenario())
+
+
+def test_backpressure_and_coalescing():
+    bodies = [json.dumps(dict(PATIENT, patient_id=f"P{i}")).encode() for i in range(3)]
+
+    async def scenario():
+        service = ReportService(main.report_html, slow_pdf, no_warm, workers=1, max_pending=2)
+        address = await service.start()
+        try:
+            first, second = (asyncio.create_task(call(address, "POST", "/report", b)) for b in bodies[:2])
+            await asyncio.sleep(0.1)
+            copy = asyncio.create_task(call(address, "POST", "/report", bodies[0]))
+            refused = await call(address, "POST", "/report", bodies[2])
+            return await first, await second, await copy, refused, service.metrics()
+        finally:
+            await service.close()
+
+    first, second, copy, refused, metrics = asyncio.run(scenario())
+    assert first[0] == second[0] == copy[0] == 200 and copy[2] == first[2]
+    assert refused[0] == 429 and refused[1]["Retry-After"] == "1"
+    assert metrics["coalesced"] == 1 and metrics["rejected"] == 1
@@ -0,0 +1,39 @@
+"""tests for cold start, heavy libraries are only imported when needed"""
+import json
+import subprocess
+import sys
+import time
+from pathlib import Path
+
+ROOT = Path(__file__).parent.parent
+HEAVY = ("weasyprint", "jinja2", "numpy")
+
+
+def run_probe(code: str, *args: str):
+    """runs code in a new interpreter from src, returns seconds and the heavy modules it loaded"""
+    probe = f"import json, sys\n{code}\nprint(json.dumps(sorted(m for m in {HEAVY!r} if m in sys.modules)))"
+    t0 = time.perf_counter()
+    proc = subprocess.run([sys.executable, "-c", probe, *args], cwd=ROOT / "src",
+                          capture_output=True, text=True, timeout=120)
+    elapsed = time.perf_counter() - t0
+    assert proc.returncode == 0, proc.stderr
+    return elapsed, json.loads(proc.stdout.splitlines()[-1])
+
+
+def test_interpret_only_loads_no_renderer(record_property):
+    code = ("import main, report_generator\n"
+            "from interpreter import interpret_vitals\n"
+            "report_generator.build_report_model({'vitals': {'ICA': {}, 'CCA': {}, 'ECA': {}, 'ica_cca_ratio': 1}}, [], 'low')")
+    elapsed, loaded = run_probe(code)
+    record_property("cold_start_interpret_s", round(elapsed, 3))
+    assert loaded == []
+
+
+def test_html_report_without_weasyprint(tmp_path, record_property):
+    code = (f"import main\nfrom pathlib import Path\n"
+            f"main.render_report(main.load_patient_data(Path('../data/mock_patient.json')), "
+            f"Path('report_template.html'), Path({str(tmp_path / 'r.html')!r}))")
+    elapsed, loaded = run_probe(code)
+    record_property("cold_start_html_s", round(elapsed, 3))
+    assert loaded == ["jinja2"]
+    assert "<html" in (tmp_path / "r.html").read_text(encoding="utf-8").lower()
@@ -0,0 +1,67 @@
+"""tests for watch_folder module"""
+import os
+from pathlib import Path
+import sys
+
+sys.path.append(str(Path(__file__).parent.parent))
+
+from src.watch_folder import FolderWatcher, WatchIndex, INDEX_NAME
+
+
+def copy_render(exam_path, output_path):
+    text = Path(exam_path).read_text()
+    if "broken" in text:
+        raise ValueError("broken exam")
+    Path(output_path).write_text(text.upper())
+
+
+def drop(folder, name, text, mtime=1_700_000_000):
+    path = folder / name
+    path.write_text(text)
+    os.utime(path, (mtime, mtime))
+
+
+def run_once(src, out):
+    with FolderWatcher(src, out, copy_render, suffix=".txt", workers=1) as watcher:
+        watcher.run(once=True, log=None)
+    return watcher.rendered, watcher.failed, watcher.unchanged
+
+
+def test_only_new_or_changed_files_are_rendered(tmp_path):
+    src, out = tmp_path / "in", tmp_path / "out"
+    src.mkdir()
+    drop(src, "a.json", '{"id": "a"}')
+    drop(src, "b.json", '{"id": "b"}')
+    drop(src, "c.json", "broken")
+    assert run_once(src, out) == (2, 1, 0)
+    assert (out / "a.txt").read_text() == '{"ID": "A"}'
+
+    assert run_once(src, out) == (0, 0, 0)  # restart, nothing changed
+
+    os.utime(src / "a.json", (1_700_000_500, 1_700_000_500))  # touched only
+    drop(src, "b.json", '{"id": "b2"}', mtime=1_700_000_500)
+    (src / "c.json").unlink()
+    assert run_once(src, out) == (1, 0, 1)
+    assert (out / "b.txt").read_text() == '{"ID": "B2"}'
+    index = WatchIndex(out / INDEX_NAME)
+    assert index.names() == {"a.json", "b.json"}
+    index.close()
+
+
+def test_debounce(tmp_path):
+    src, out = tmp_path / "in", tmp_path / "out"
+    src.mkdir()
+    now = [0.0]
+    with FolderWatcher(src, out, copy_render, suffix=".txt", workers=1, debounce_s=2.0,
+                       clock=lambda: now[0]) as watcher:
+        drop(src, "a.json", "1")
+        assert watcher.poll() == 0
+        now[0] = 1.0
+        drop(src, "a.json", "12", mtime=1_700_000_001)
+        assert watcher.poll() == 0  # changed again, the quiet period restarts
+        now[0] = 2.5
+        assert watcher.poll() == 0
+        now[0] = 3.1
+        assert watcher.poll() == 1
+        assert watcher.collect(wait=True) == [("a.json", str(out / "a.txt"), None)]
+    assert (out / "a.txt").read_text() == "12"